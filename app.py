@@ -1,9 +1,29 @@
-import firebase_admin
-from firebase_admin import credentials, db as firebase_rtdb
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, render_template, request, redirect, url_for, jsonify, Response, g, has_request_context
 import os
 import logging
+import math
+import functools
+import hmac
 from flask_cors import CORS
+from models.storage import create_storage, AD_TYPES
+from models.ad_types import AD_TYPE_REGISTRY, get_ad_type
+from services.inventory_cache import InventoryCache, PUBLIC_FIELDS
+from services.counter_buffer import CounterBuffer
+from services.counter_compactor import CounterCompactor
+from services.selection import AdSelector
+from services.ingestion import TrackingGuard, TokenBucketLimiter, client_ip, valid_client_id
+from services.frequency_cap import FrequencyCapper
+from services.assets import AssetStore, AssetError, ASSET_CACHE_CONTROL
+from services.metrics import Instrumentation
+from services.lifecycle import WorkerLifecycle
+from services.export import export_report, EXPORT_FORMATS
+from services.bulk_import import ImportAssetProcessor, import_ads, detect_format, BulkImportError
+from services.scheduling import parse_schedule
+from services.targeting import TARGETING_FIELDS, parse_targeting, request_context
+from services.tenants import GamePartition, GameRegistry
+from models.events import EventStore, GRANULARITIES
+import time
+from zoneinfo import ZoneInfo
 
 # --- CONFIGURAÇÃO INICIAL DA APLICAÇÃO E LOGGING ---
 app = Flask(__name__)
@@ -19,40 +39,348 @@ CORS(app, resources={r"/*": {"origins": "*"}}) # Ajuste para produção se neces
 FIREBASE_CRED_FILE_PATH = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "/etc/secrets/firebase_credentials.json")
 FIREBASE_DB_URL = os.getenv("FIREBASE_DB_URL")
 
-firebase_initialized_successfully = False
+# --- BACKEND DE ARMAZENAMENTO ---
+# 'firebase' (produção), 'sqlite' (arquivo local) ou 'memory' (testes de carga sem rede)
+ADS_STORAGE_BACKEND = os.getenv("ADS_STORAGE_BACKEND", "firebase")
+ADS_SQLITE_PATH = os.getenv("ADS_SQLITE_PATH", "data/ads.db")
+# Latência simulada por operação do backend 'memory' (benchmarks)
+ADS_MEMORY_LATENCY_MS = float(os.getenv("ADS_MEMORY_LATENCY_MS", "0"))
+# Contadores fragmentados no Firebase: número de shards por anúncio (0 desativa; use >= número de workers)
+ADS_COUNTER_SHARDS = int(os.getenv("ADS_COUNTER_SHARDS", "0"))
+# Inventários por jogo em ads/<game_id>/, escolhidos pelo parâmetro game_id das rotas do jogo
+ADS_MULTI_GAME = os.getenv("ADS_MULTI_GAME", "false").lower() in ("1", "true", "yes")
 
-def init_firebase():
-    global firebase_initialized_successfully
-    if firebase_initialized_successfully:
-        return True
+storage = create_storage(
+    ADS_STORAGE_BACKEND,
+    cred_file_path=FIREBASE_CRED_FILE_PATH,
+    db_url=FIREBASE_DB_URL,
+    counter_shards=ADS_COUNTER_SHARDS,
+    multi_game=ADS_MULTI_GAME,
+    db_path=ADS_SQLITE_PATH,
+    latency=ADS_MEMORY_LATENCY_MS / 1000.0
+)
 
-    if not FIREBASE_DB_URL:
-        app.logger.error("🔥 ERRO Firebase: FIREBASE_DB_URL não configurada nas variáveis de ambiente.")
-        firebase_initialized_successfully = False
-        return False
-    
-    if not os.path.exists(FIREBASE_CRED_FILE_PATH):
-        app.logger.error(f"🔥 ERRO Firebase: Arquivo de credenciais não encontrado em {FIREBASE_CRED_FILE_PATH}.")
-        firebase_initialized_successfully = False
-        return False
+def init_storage():
+    # Conexão, aquecimento do cache e serviços são iniciados uma vez por worker (ver lifecycle)
+    return lifecycle.ensure_started()
+
+# --- INSTRUMENTAÇÃO (GET /metrics) ---
+# Perfila 1 a cada N requisições com cProfile (0 desativa) e grava os .prof neste diretório
+ADS_PROFILE_EVERY = int(os.getenv("ADS_PROFILE_EVERY", "0"))
+ADS_PROFILE_DIR = os.getenv("ADS_PROFILE_DIR", "data/profiles")
+
+instrumentation = Instrumentation(profile_every=ADS_PROFILE_EVERY, profile_dir=ADS_PROFILE_DIR)
+# Antes de qualquer referência aos métodos do backend (ex: storage.list_all_ads no cache)
+instrumentation.instrument_storage(storage)
+
+@app.before_request
+def start_request_metrics():
+    g.request_metrics = instrumentation.start_request()
+
+def finish_request_metrics(status):
+    context = g.pop('request_metrics', None)
+    if context is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        instrumentation.finish_request(context, route, request.method, status)
+
+@app.after_request
+def record_request_metrics(response):
+    finish_request_metrics(response.status_code)
+    return response
+
+@app.teardown_request
+def record_failed_request_metrics(exc):
+    # Só resta contexto aqui quando a rota lançou exceção sem resposta
+    finish_request_metrics(500)
+
+# --- CACHE DE INVENTÁRIO DE ANÚNCIOS ---
+# Idade máxima (segundos) do inventário servido pela API antes de uma nova leitura do armazenamento
+ADS_CACHE_MAX_STALENESS = float(os.getenv("ADS_CACHE_MAX_STALENESS", "30"))
+# Intervalo (segundos) da recarga em segundo plano; 0 desativa
+ADS_CACHE_REFRESH_INTERVAL = float(os.getenv("ADS_CACHE_REFRESH_INTERVAL", "0"))
+# Ativa o listener do RTDB em 'ads/' para invalidar o cache a cada alteração (apenas Firebase)
+ADS_CACHE_LISTEN = os.getenv("ADS_CACHE_LISTEN", "false").lower() in ("1", "true", "yes")
+# Serve o inventário obsoleto enquanto recarrega em segundo plano (sempre ativo no asgi.py)
+ADS_CACHE_STALE_WHILE_REVALIDATE = os.getenv("ADS_CACHE_STALE_WHILE_REVALIDATE", "false").lower() in ("1", "true", "yes")
+
+# Uma leitura de todos os formatos por recarga (no Firebase, um único get em 'ads/')
+inventory_cache = InventoryCache(
+    storage.list_all_ads,
+    max_staleness=ADS_CACHE_MAX_STALENESS,
+    stale_while_revalidate=ADS_CACHE_STALE_WHILE_REVALIDATE
+)
+
+# Estratégia de seleção padrão: newest, round_robin, weighted, least_impressions ou thompson
+ADS_SELECTION_STRATEGY = os.getenv("ADS_SELECTION_STRATEGY", "round_robin")
+# Estratégia própria de cada formato: ADS_SELECTION_STRATEGY_<TIPO> (ex: ADS_SELECTION_STRATEGY_REWARDED)
+# ou, sem a variável, a política declarada no registro (models/ad_types.py), se houver
+AD_TYPE_STRATEGIES = {
+    ad_type.name: os.getenv(f"ADS_SELECTION_STRATEGY_{ad_type.name.upper()}", ad_type.selection or ADS_SELECTION_STRATEGY)
+    for ad_type in AD_TYPE_REGISTRY.values()
+}
 
-    if not firebase_admin._apps:
+ad_selector = AdSelector(inventory_cache, strategy=ADS_SELECTION_STRATEGY, type_strategies=AD_TYPE_STRATEGIES)
+
+# --- BUFFER DE CONTADORES (IMPRESSÕES/CLIQUES) ---
+# Intervalo (segundos) entre gravações em lote dos contadores
+ADS_COUNTER_FLUSH_INTERVAL = float(os.getenv("ADS_COUNTER_FLUSH_INTERVAL", "2"))
+# Número máximo de contadores distintos aguardando gravação
+ADS_COUNTER_MAX_PENDING = int(os.getenv("ADS_COUNTER_MAX_PENDING", "10000"))
+# Horários de eventos guardados por contador pendente (acima disso, agrupados por minuto/hora/dia)
+ADS_COUNTER_MAX_EVENT_TIMES = int(os.getenv("ADS_COUNTER_MAX_EVENT_TIMES", "120"))
+# Intervalo (segundos) entre compactações dos shards de contadores (com ADS_COUNTER_SHARDS)
+ADS_COUNTER_COMPACT_INTERVAL = float(os.getenv("ADS_COUNTER_COMPACT_INTERVAL", "60"))
+
+# --- LOG DE EVENTOS COM AGREGAÇÃO POR MINUTO/HORA/DIA ---
+ADS_EVENTS_ENABLED = os.getenv("ADS_EVENTS_ENABLED", "true").lower() in ("1", "true", "yes")
+ADS_EVENTS_DB = os.getenv("ADS_EVENTS_DB", "data/events.db")
+# Dias de retenção dos eventos brutos (0 mantém tudo); as agregações não expiram
+ADS_EVENTS_RETENTION_DAYS = float(os.getenv("ADS_EVENTS_RETENTION_DAYS", "30"))
+
+event_store = None
+if ADS_EVENTS_ENABLED:
+    try:
+        event_store = EventStore(
+            ADS_EVENTS_DB,
+            retention=ADS_EVENTS_RETENTION_DAYS * 86400 if ADS_EVENTS_RETENTION_DAYS > 0 else None
+        )
+    except Exception as e:
+        app.logger.error(f"Erro ao abrir o log de eventos em {ADS_EVENTS_DB}: {e}", exc_info=True)
+
+def write_counter_increments(increments, event_times=None, target=None, cache=None):
+    # Anúncios removidos desde o incremento são descartados: no Firebase o incremento
+    # recriaria o nó do anúncio e somaria de novo nos totais já descontados pela remoção
+    increments = (cache or inventory_cache).known_increments(increments)
+    if not increments:
+        return
+
+    # Um único update em lote no backend (no Firebase, multi-caminho com incremento no servidor)
+    target = target or storage
+    target.increment_counters(increments)
+
+    # O log local é gravado só depois do backend, para que um lote reenfileirado não seja contado duas vezes;
+    # cada evento fica com o horário em que chegou (não o do flush) e o jogo da partição
+    if event_store is not None:
         try:
-            cred = credentials.Certificate(FIREBASE_CRED_FILE_PATH)
-            firebase_admin.initialize_app(cred, {
-                'databaseURL': FIREBASE_DB_URL
-            })
-            app.logger.info("✅ Firebase Admin SDK inicializado com sucesso usando Secret File!")
-            firebase_initialized_successfully = True
-            return True
+            event_store.record_increments(
+                increments,
+                game_id=getattr(target, 'game_id', None),
+                event_times=event_times
+            )
         except Exception as e:
-            app.logger.error(f"🔥 ERRO Firebase ao inicializar com Secret File: {str(e)}", exc_info=True)
-            firebase_initialized_successfully = False
-            return False
-    else:
-        app.logger.info("✅ Firebase Admin SDK já estava inicializado (app default existente).")
-        firebase_initialized_successfully = True 
-        return True
+            app.logger.error(f"Erro ao gravar {len(increments)} contadores no log de eventos: {e}", exc_info=True)
+
+counter_buffer = CounterBuffer(
+    write_counter_increments,
+    flush_interval=ADS_COUNTER_FLUSH_INTERVAL,
+    max_pending=ADS_COUNTER_MAX_PENDING,
+    max_event_times=ADS_COUNTER_MAX_EVENT_TIMES,
+)
+
+counter_compactor = CounterCompactor(storage, interval=ADS_COUNTER_COMPACT_INTERVAL)
+
+# --- INVENTÁRIOS POR JOGO (MULTI-TENANT, COM ADS_MULTI_GAME) ---
+# IDs de jogo aceitos, separados por vírgula (vazio aceita qualquer ID válido)
+ADS_GAME_IDS = [game_id.strip() for game_id in os.getenv("ADS_GAME_IDS", "").split(",") if game_id.strip()]
+# Partições de jogos mantidas por worker e inatividade (segundos) após a qual são despejadas
+ADS_MAX_GAMES = int(os.getenv("ADS_MAX_GAMES", "32"))
+ADS_GAME_IDLE_TTL = float(os.getenv("ADS_GAME_IDLE_TTL", "900"))
+
+def create_game_partition(game_id):
+    # Cache, seletor e buffer próprios: o tráfego de um jogo não recarrega nem atrasa os demais
+    game_storage = instrumentation.instrument_storage(storage.for_game(game_id))
+    game_cache = InventoryCache(
+        game_storage.list_all_ads,
+        max_staleness=ADS_CACHE_MAX_STALENESS,
+        stale_while_revalidate=inventory_cache.stale_while_revalidate
+    )
+    game_buffer = CounterBuffer(
+        functools.partial(write_counter_increments, target=game_storage, cache=game_cache),
+        flush_interval=ADS_COUNTER_FLUSH_INTERVAL,
+        max_pending=ADS_COUNTER_MAX_PENDING,
+    max_event_times=ADS_COUNTER_MAX_EVENT_TIMES,
+    )
+    return GamePartition(
+        game_id,
+        game_storage,
+        game_cache,
+        AdSelector(game_cache, strategy=ADS_SELECTION_STRATEGY, type_strategies=AD_TYPE_STRATEGIES),
+        game_buffer,
+        refresh_interval=ADS_CACHE_REFRESH_INTERVAL,
+        listen=ADS_CACHE_LISTEN,
+    )
+
+games = GameRegistry(
+    GamePartition(None, storage, inventory_cache, ad_selector, counter_buffer),
+    create_game_partition,
+    enabled=ADS_MULTI_GAME,
+    max_games=ADS_MAX_GAMES,
+    idle_ttl=ADS_GAME_IDLE_TTL,
+    allowed=ADS_GAME_IDS,
+)
+
+def request_game():
+    # Partição do jogo do parâmetro game_id (sem o parâmetro, o inventário padrão)
+    return games.get(request.args.get('game_id'))
+
+def unknown_game_response():
+    return jsonify({"error": "Jogo inválido ou não habilitado"}), 404
+
+# --- SEGMENTAÇÃO (PAÍS, IDIOMA, DISPOSITIVO E VERSÃO DO JOGO) ---
+# Cabeçalho com o país do cliente definido pelo proxy ou CDN (vazio desativa)
+ADS_GEO_HEADER = os.getenv("ADS_GEO_HEADER", "CF-IPCountry")
+
+def targeting_context(use_headers=True):
+    # Parâmetros country, lang, device e version; respostas cacheáveis por URL não usam os cabeçalhos
+    header = request.headers.get if use_headers else None
+    return request_context(request.args, header, ADS_GEO_HEADER)
+
+# --- CAMPANHAS AGENDADAS (startAt/endAt) ---
+# Fuso IANA das datas ISO 8601 sem deslocamento (ex: America/Sao_Paulo); o formulário envia milissegundos
+ADS_SCHEDULE_TIMEZONE = os.getenv("ADS_SCHEDULE_TIMEZONE", "UTC")
+schedule_tz = ZoneInfo(ADS_SCHEDULE_TIMEZONE)
+
+# --- INGESTÃO DE EVENTOS (DEDUPLICAÇÃO E LIMITE DE TAXA) ---
+# Tempo (segundos) em que o ID de um evento é lembrado e máximo de IDs lembrados por worker
+ADS_DEDUP_TTL = float(os.getenv("ADS_DEDUP_TTL", "600"))
+ADS_DEDUP_MAX_EVENTS = int(os.getenv("ADS_DEDUP_MAX_EVENTS", "100000"))
+# Eventos por segundo e rajada máxima por IP e por sessão (taxa 0 desativa o limite)
+ADS_RATE_LIMIT_IP_RATE = float(os.getenv("ADS_RATE_LIMIT_IP_RATE", "50"))
+ADS_RATE_LIMIT_IP_BURST = float(os.getenv("ADS_RATE_LIMIT_IP_BURST", "500"))
+ADS_RATE_LIMIT_SESSION_RATE = float(os.getenv("ADS_RATE_LIMIT_SESSION_RATE", "10"))
+ADS_RATE_LIMIT_SESSION_BURST = float(os.getenv("ADS_RATE_LIMIT_SESSION_BURST", "200"))
+# Proxies confiáveis na frente do servidor: o IP do cliente é a entrada do X-Forwarded-For anexada
+# pelo mais externo (0 ignora o cabeçalho; use 1 no Render). ADS_TRUST_FORWARDED_FOR=true equivale a 1
+ADS_TRUSTED_PROXY_HOPS = int(os.getenv(
+    "ADS_TRUSTED_PROXY_HOPS",
+    "1" if os.getenv("ADS_TRUST_FORWARDED_FOR", "false").lower() in ("1", "true", "yes") else "0"
+))
+
+tracking_guard = TrackingGuard(
+    dedup_ttl=ADS_DEDUP_TTL,
+    dedup_max=ADS_DEDUP_MAX_EVENTS,
+    ip_rate=ADS_RATE_LIMIT_IP_RATE,
+    ip_burst=ADS_RATE_LIMIT_IP_BURST,
+    session_rate=ADS_RATE_LIMIT_SESSION_RATE,
+    session_burst=ADS_RATE_LIMIT_SESSION_BURST,
+)
+
+# --- LIMITE DE FREQUÊNCIA DOS ANÚNCIOS DE TELA CHEIA (POST /api/fullscreen/next) ---
+# Game overs entre duas exibições para a mesma sessão
+ADS_FULLSCREEN_EVERY = int(os.getenv("ADS_FULLSCREEN_EVERY", "5"))
+# Exibições máximas por sessão na janela deslizante (0 desativa) e tamanho da janela em segundos
+ADS_FULLSCREEN_MAX_PER_WINDOW = int(os.getenv("ADS_FULLSCREEN_MAX_PER_WINDOW", "10"))
+ADS_FULLSCREEN_WINDOW = float(os.getenv("ADS_FULLSCREEN_WINDOW", "3600"))
+# Intervalo mínimo (segundos) entre duas exibições para a mesma sessão
+ADS_FULLSCREEN_MIN_INTERVAL = float(os.getenv("ADS_FULLSCREEN_MIN_INTERVAL", "30"))
+# Inatividade (segundos) após a qual a sessão é esquecida e máximo de sessões por worker
+ADS_FULLSCREEN_SESSION_TTL = float(os.getenv("ADS_FULLSCREEN_SESSION_TTL", "86400"))
+ADS_FULLSCREEN_MAX_SESSIONS = int(os.getenv("ADS_FULLSCREEN_MAX_SESSIONS", "100000"))
+# Banco SQLite do estado compartilhado entre os workers (padrão: o log de eventos). Vazio mantém
+# o estado na memória de cada worker, o que exige um único worker ou roteamento fixo das sessões
+ADS_FULLSCREEN_STATE_DB = os.getenv("ADS_FULLSCREEN_STATE_DB", ADS_EVENTS_DB)
+# Snapshot do estado em memória (vazio desativa) e intervalo entre gravações (ou entre
+# limpezas do estado compartilhado) em segundos
+ADS_FULLSCREEN_SNAPSHOT_PATH = os.getenv("ADS_FULLSCREEN_SNAPSHOT_PATH", "data/frequency_caps.json")
+ADS_FULLSCREEN_SNAPSHOT_INTERVAL = float(os.getenv("ADS_FULLSCREEN_SNAPSHOT_INTERVAL", "30"))
+
+def create_frequency_capper(shared_db):
+    return FrequencyCapper(
+        every=ADS_FULLSCREEN_EVERY,
+        max_per_window=ADS_FULLSCREEN_MAX_PER_WINDOW,
+        window=ADS_FULLSCREEN_WINDOW,
+        min_interval=ADS_FULLSCREEN_MIN_INTERVAL,
+        ttl=ADS_FULLSCREEN_SESSION_TTL,
+        max_sessions=ADS_FULLSCREEN_MAX_SESSIONS,
+        snapshot_path=ADS_FULLSCREEN_SNAPSHOT_PATH or None,
+        snapshot_interval=ADS_FULLSCREEN_SNAPSHOT_INTERVAL,
+        shared_db=shared_db,
+    )
+
+try:
+    frequency_capper = create_frequency_capper(ADS_FULLSCREEN_STATE_DB or None)
+except Exception as e:
+    app.logger.error(
+        f"Erro ao abrir o estado compartilhado de frequência em {ADS_FULLSCREEN_STATE_DB}; "
+        f"usando o estado em memória do worker: {e}",
+        exc_info=True,
+    )
+    frequency_capper = create_frequency_capper(None)
+
+# --- PIPELINE DE CRIATIVOS (GET /assets/<nome>) ---
+# Diretório do cache de variantes redimensionadas (vazio desativa; o jogo usa a imageUrl original)
+ADS_ASSET_CACHE_DIR = os.getenv("ADS_ASSET_CACHE_DIR", "data/assets")
+# Tamanho total máximo do cache em MB (despejo LRU)
+ADS_ASSET_CACHE_MAX_MB = float(os.getenv("ADS_ASSET_CACHE_MAX_MB", "512"))
+# Download do original: timeout em segundos e tamanho máximo em MB
+ADS_ASSET_FETCH_TIMEOUT = float(os.getenv("ADS_ASSET_FETCH_TIMEOUT", "10"))
+ADS_ASSET_MAX_SOURCE_MB = float(os.getenv("ADS_ASSET_MAX_SOURCE_MB", "10"))
+# Formato ('webp' ou 'jpeg') e qualidade das variantes
+ADS_ASSET_FORMAT = os.getenv("ADS_ASSET_FORMAT", "webp")
+ADS_ASSET_QUALITY = int(os.getenv("ADS_ASSET_QUALITY", "80"))
+
+asset_store = AssetStore(
+    ADS_ASSET_CACHE_DIR or None,
+    max_bytes=int(ADS_ASSET_CACHE_MAX_MB * 1024 * 1024),
+    fetch_timeout=ADS_ASSET_FETCH_TIMEOUT,
+    max_source_bytes=int(ADS_ASSET_MAX_SOURCE_MB * 1024 * 1024),
+    output_format=ADS_ASSET_FORMAT,
+    quality=ADS_ASSET_QUALITY,
+)
+
+# Criativos da importação em lote, processados depois da escrita: downloads simultâneos por
+# worker e prazo total (segundos) para os criativos de uma importação
+ADS_IMPORT_ASSET_WORKERS = int(os.getenv("ADS_IMPORT_ASSET_WORKERS", "4"))
+ADS_IMPORT_ASSET_DEADLINE = float(os.getenv("ADS_IMPORT_ASSET_DEADLINE", "600"))
+
+import_asset_processor = ImportAssetProcessor(
+    asset_store,
+    max_workers=ADS_IMPORT_ASSET_WORKERS,
+    deadline=ADS_IMPORT_ASSET_DEADLINE,
+)
+
+instrumentation.add_gauges('ads_inventory_cache', 'Cache de inventário do worker', inventory_cache.stats)
+instrumentation.add_gauges('ads_counter_buffer', 'Buffer de contadores de impressões/cliques', counter_buffer.stats)
+instrumentation.add_gauges('ads_counter_compactor', 'Compactação dos shards de contadores', counter_compactor.stats)
+instrumentation.add_gauges('ads_ingestion', 'Deduplicação e limite de taxa do tracking', tracking_guard.stats)
+instrumentation.add_gauges('ads_fullscreen_cap', 'Limite de frequência dos anúncios de tela cheia', frequency_capper.stats)
+instrumentation.add_gauges('ads_assets', 'Pipeline de criativos redimensionados', asset_store.stats)
+instrumentation.add_gauges('ads_import_assets', 'Criativos das importações em lote', import_asset_processor.stats)
+instrumentation.add_gauges('ads_games', 'Partições de inventários por jogo', games.stats)
+
+def start_background_services():
+    inventory_cache.start_background_refresh(ADS_CACHE_REFRESH_INTERVAL)
+    if ADS_CACHE_LISTEN:
+        inventory_cache.start_listener(storage)
+    if ADS_COUNTER_SHARDS > 0:
+        # Antes do buffer: no encerramento o flush final acontece antes da última compactação
+        counter_compactor.start()
+    counter_buffer.start()
+    frequency_capper.start()
+
+# --- CICLO DE VIDA DO WORKER (INICIALIZAÇÃO APÓS O FORK) ---
+# Intervalo (segundos) entre tentativas de inicialização depois de uma falha
+ADS_INIT_RETRY_INTERVAL = float(os.getenv("ADS_INIT_RETRY_INTERVAL", "5"))
+
+fork_resets = [
+    inventory_cache.reset_after_fork,
+    counter_buffer.reset_after_fork,
+    counter_compactor.reset_after_fork,
+    frequency_capper.reset_after_fork,
+    asset_store.reset_after_fork,
+    import_asset_processor.reset_after_fork,
+    games.reset_after_fork,
+]
+if event_store is not None:
+    fork_resets.append(event_store.reset_after_fork)
+
+lifecycle = WorkerLifecycle(
+    storage,
+    warmup=inventory_cache.warm,
+    start_services=start_background_services,
+    fork_resets=fork_resets,
+    retry_interval=ADS_INIT_RETRY_INTERVAL,
+)
 
 def calculate_ctr(clicks, impressions):
     if impressions == 0:
@@ -61,262 +389,302 @@ def calculate_ctr(clicks, impressions):
 
 # --- ROTAS DO DASHBOARD DE ANÚNCIOS ---
 
-@app.route('/')
-def dashboard():
-    app.logger.info("Acessando a rota do Dashboard ('/')")
-    if not init_firebase():
-        return render_template('error.html', message="Falha crítica ao conectar com o Firebase. Verifique os logs do servidor."), 500
+# Views do dashboard que atendem o inventário de um jogo com ?game_id= (como a API) e
+# propagam o parâmetro nos links, formulários e redirecionamentos gerados por url_for
+DASHBOARD_ENDPOINTS = frozenset({'dashboard', 'api_dashboard_ads', 'add_ad', 'edit_ad', 'delete_ad'})
 
-    banner_ads_list = []
-    fullscreen_ads_list = []
-    try:
-        banners_ref = firebase_rtdb.reference('ads/banners')
-        all_banners_data = banners_ref.order_by_child('created_at').get()
-        if all_banners_data:
-            for ad_id, ad_data_item in all_banners_data.items():
-                if isinstance(ad_data_item, dict):
-                    ad_data_item['id'] = ad_id
-                    banner_ads_list.append(ad_data_item)
-            banner_ads_list.reverse()
-        app.logger.debug(f"Banners carregados do Firebase: {len(banner_ads_list)} itens.")
-
-        fullscreen_ref = firebase_rtdb.reference('ads/fullscreen_ads')
-        all_fullscreen_data = fullscreen_ref.order_by_child('created_at').get()
-        if all_fullscreen_data:
-            for ad_id, ad_data_item in all_fullscreen_data.items():
-                if isinstance(ad_data_item, dict):
-                    ad_data_item['id'] = ad_id
-                    fullscreen_ads_list.append(ad_data_item)
-            fullscreen_ads_list.reverse()
-        app.logger.debug(f"Anúncios de tela cheia carregados do Firebase: {len(fullscreen_ads_list)} itens.")
+@app.url_defaults
+def add_dashboard_game(endpoint, values):
+    if endpoint in DASHBOARD_ENDPOINTS and 'game_id' not in values and has_request_context():
+        game_id = request.args.get('game_id')
+        if game_id:
+            values['game_id'] = game_id
 
-    except Exception as e:
-        app.logger.error(f"Erro ao buscar dados do Firebase para o dashboard: {e}", exc_info=True)
-        # Não retorna erro aqui, apenas loga, para que o dashboard ainda possa ser renderizado (vazio)
-
-    total_banner_impressions = sum(ad.get('impressions', 0) for ad in banner_ads_list)
-    total_banner_clicks = sum(ad.get('clicks', 0) for ad in banner_ads_list)
-    banner_ctr = calculate_ctr(total_banner_clicks, total_banner_impressions)
-
-    metrics_banner = {
-        "ads_count": len(banner_ads_list),
-        "total_impressions": total_banner_impressions,
-        "ctr": banner_ctr,
-        "ads": banner_ads_list
-    }
+# Tamanho padrão e máximo das páginas de anúncios do dashboard
+DASHBOARD_PAGE_SIZE = int(os.getenv("ADS_DASHBOARD_PAGE_SIZE", "20"))
+DASHBOARD_MAX_PAGE_SIZE = 100
 
-    total_fullscreen_impressions = sum(ad.get('impressions', 0) for ad in fullscreen_ads_list)
-    total_fullscreen_clicks = sum(ad.get('clicks', 0) for ad in fullscreen_ads_list)
-    fullscreen_ctr = calculate_ctr(total_fullscreen_clicks, total_fullscreen_impressions)
+def get_page_size():
+    try:
+        limit = int(request.args.get('limit', DASHBOARD_PAGE_SIZE))
+    except ValueError:
+        limit = DASHBOARD_PAGE_SIZE
+    return min(max(limit, 1), DASHBOARD_MAX_PAGE_SIZE)
 
-    metrics_fullscreen = {
-        "ads_count": len(fullscreen_ads_list),
-        "total_impressions": total_fullscreen_impressions,
-        "ctr": fullscreen_ctr,
-        "ads": fullscreen_ads_list
+def empty_type_metrics():
+    return {
+        "ads_count": 0, "total_impressions": 0, "total_clicks": 0, "ctr": 0.0,
+        "ads": [], "cursor": None, "next_cursor": None
     }
 
-    metrics_data = {
-        "banner": metrics_banner,
-        "fullscreen": metrics_fullscreen
+def build_type_metrics(storage, ad_type, totals, limit, cursor):
+    # Totais lidos do agregado mantido pelo backend (O(1)); só a página atual é buscada,
+    # e formatos sem anúncios não custam nenhuma leitura
+    if not totals['ads_count'] and not cursor:
+        return empty_type_metrics()
+    try:
+        ads, next_cursor = storage.list_ads_page(ad_type, limit, cursor)
+    except ValueError:
+        app.logger.warning(f"Cursor de paginação inválido para '{ad_type}': {cursor}")
+        ads, next_cursor = storage.list_ads_page(ad_type, limit)
+        cursor = None
+    return {
+        "ads_count": totals['ads_count'],
+        "total_impressions": totals['impressions'],
+        "total_clicks": totals['clicks'],
+        "ctr": calculate_ctr(totals['clicks'], totals['impressions']),
+        "ads": ads,
+        "cursor": cursor,
+        "next_cursor": next_cursor
     }
-    app.logger.info(f"Dados finais enviados para o template dashboard.html: {len(banner_ads_list)} banners, {len(fullscreen_ads_list)} fullscreen.")
-    return render_template('dashboard.html', metrics=metrics_data)
 
-@app.route('/add-banner', methods=['GET', 'POST'])
-def add_banner():
-    app.logger.info(f"Acessando a rota '/add-banner' com o método: {request.method}")
-    if not init_firebase():
-        return render_template('error.html', message="Falha crítica ao conectar com o Firebase."), 500
+@app.route('/')
+def dashboard():
+    app.logger.info("Acessando a rota do Dashboard ('/')")
+    if not init_storage():
+        return render_template('error.html', message="Falha crítica ao conectar com o Firebase. Verifique os logs do servidor."), 500
+    game = request_game()
+    if game is None:
+        return render_template('error.html', message="Jogo inválido ou não habilitado."), 404
 
-    if request.method == 'POST':
-        try:
-            title = request.form['title']
-            imageUrl = request.form['imageUrl']
-            targetUrl = request.form['targetUrl']
-            app.logger.info(f"Formulário de banner recebido: Título='{title}'")
-
-            ads_ref = firebase_rtdb.reference('ads/banners')
-            new_ad_ref = ads_ref.push({
-                'title': title,
-                'imageUrl': imageUrl,
-                'targetUrl': targetUrl,
-                'impressions': 0,
-                'clicks': 0,
-                'created_at': {".sv": "timestamp"} # CORREÇÃO APLICADA
-            })
-            app.logger.info(f"Novo banner adicionado ao Firebase RTDB com ID: {new_ad_ref.key}")
-            return redirect(url_for('dashboard'))
-        except Exception as e:
-            app.logger.error(f"Erro ao adicionar banner ao Firebase RTDB: {e}", exc_info=True)
-            return render_template('error.html', message="Erro ao adicionar o banner.")
-    return render_template('add_banner.html')
-
-@app.route('/edit-banner/<string:ad_id>', methods=['GET', 'POST'])
-def edit_banner(ad_id):
-    app.logger.info(f"Acessando a rota '/edit-banner/{ad_id}' com o método: {request.method}")
-    if not init_firebase():
-        return render_template('error.html', message="Falha crítica ao conectar com o Firebase."), 500
+    limit = get_page_size()
+    try:
+        # Totais de todos os formatos em uma única leitura
+        all_totals = game.storage.get_all_totals()
+    except Exception as e:
+        app.logger.error(f"Erro ao buscar os totais para o dashboard: {e}", exc_info=True)
+        all_totals = None
 
-    banner_ref = firebase_rtdb.reference(f'ads/banners/{ad_id}')
-    
-    if request.method == 'POST':
+    metrics_data = {}
+    for ad_type in AD_TYPES:
+        if all_totals is None:
+            metrics_data[ad_type] = empty_type_metrics()
+            continue
         try:
-            title = request.form['title']
-            imageUrl = request.form['imageUrl']
-            targetUrl = request.form['targetUrl']
-            
-            banner_ref.update({
-                'title': title,
-                'imageUrl': imageUrl,
-                'targetUrl': targetUrl
-            })
-            app.logger.info(f"Banner ID {ad_id} atualizado no Firebase RTDB.")
-            return redirect(url_for('dashboard'))
+            metrics_data[ad_type] = build_type_metrics(game.storage, ad_type, all_totals[ad_type], limit, request.args.get(f'{ad_type}_cursor'))
         except Exception as e:
-            app.logger.error(f"Erro ao editar banner ID {ad_id} no Firebase RTDB: {e}", exc_info=True)
-            return render_template('error.html', message="Erro ao salvar as alterações do banner.")
+            app.logger.error(f"Erro ao buscar dados de '{ad_type}' para o dashboard: {e}", exc_info=True)
+            # Não retorna erro aqui, apenas loga, para que o dashboard ainda possa ser renderizado (vazio)
+            metrics_data[ad_type] = empty_type_metrics()
 
-    # GET request
-    try:
-        banner_data = banner_ref.get()
-        if not banner_data or not isinstance(banner_data, dict):
-            app.logger.warning(f"Banner com ID {ad_id} não encontrado ou dados inválidos no Firebase RTDB.")
-            return render_template('error.html', message=f"Banner com ID {ad_id} não encontrado."), 404
-        
-        banner_data['id'] = ad_id 
-        app.logger.debug(f"Renderizando formulário de edição para o banner: {banner_data.get('title')}")
-        return render_template('edit_banner.html', banner=banner_data)
-    except Exception as e:
-        app.logger.error(f"Erro ao buscar banner ID {ad_id} para edição: {e}", exc_info=True)
-        return render_template('error.html', message="Erro ao carregar dados do banner para edição."), 500
+    # Links de paginação de cada formato mantendo a página atual dos demais
+    cursors = {f'{ad_type}_cursor': data['cursor'] for ad_type, data in metrics_data.items() if data['cursor']}
+    for ad_type, data in metrics_data.items():
+        other_cursors = {key: value for key, value in cursors.items() if key != f'{ad_type}_cursor'}
+        data['newer_url'] = url_for('dashboard', limit=limit, **other_cursors) if data['cursor'] else None
+        data['older_url'] = (
+            url_for('dashboard', limit=limit, **other_cursors, **{f'{ad_type}_cursor': data['next_cursor']})
+            if data['next_cursor'] else None
+        )
 
-@app.route('/delete-banner/<string:ad_id>', methods=['POST'])
-def delete_banner(ad_id):
-    app.logger.info(f"Acessando a rota POST '/delete-banner/{ad_id}'")
-    if not init_firebase():
-        return render_template('error.html', message="Falha crítica ao conectar com o Firebase."), 500
+    app.logger.info("Dados finais enviados para o template dashboard.html: " + ", ".join(
+        f"{len(data['ads'])} {ad_type}" for ad_type, data in metrics_data.items()
+    ) + " (página).")
+    return render_template('dashboard.html', metrics=metrics_data, ad_types=AD_TYPE_REGISTRY.values(), page_limit=limit,
+                           game_id=game.game_id)
+
+@app.route('/api/dashboard/ads/<string:ad_type>', methods=['GET'])
+def api_dashboard_ads(ad_type):
+    # Dados dos gráficos do dashboard, carregados pelo navegador depois da página
+    if ad_type not in AD_TYPES:
+        return jsonify({"error": "Tipo de anúncio inválido"}), 404
+    if not init_storage():
+        return jsonify({"error": "Firebase connection failed", "message": "Não foi possível conectar ao servidor de dados."}), 500
+    game = request_game()
+    if game is None:
+        return unknown_game_response()
     try:
-        banner_ref = firebase_rtdb.reference(f'ads/banners/{ad_id}')
-        banner_ref.delete()
-        app.logger.info(f"Banner com ID {ad_id} deletado do Firebase RTDB com sucesso.")
+        ads, next_cursor = game.storage.list_ads_page(ad_type, get_page_size(), request.args.get('cursor'))
+    except ValueError:
+        return jsonify({"error": "Cursor inválido"}), 400
     except Exception as e:
-        app.logger.error(f"Erro ao deletar banner ID {ad_id} no Firebase RTDB: {e}", exc_info=True)
-        return render_template('error.html', message=f"Erro ao deletar banner ID {ad_id}.")
-    return redirect(url_for('dashboard'))
+        app.logger.error(f"Erro na API /api/dashboard/ads/{ad_type}: {e}", exc_info=True)
+        return jsonify({"error": "Erro interno ao buscar anúncios"}), 500
+    return jsonify({
+        "ads": [
+            {
+                "id": ad['id'],
+                "title": ad.get('title'),
+                "impressions": ad.get('impressions', 0),
+                "clicks": ad.get('clicks', 0)
+            }
+            for ad in ads
+        ],
+        "next_cursor": next_cursor
+    })
 
-@app.route('/add-fullscreen', methods=['GET', 'POST'])
-def add_fullscreen():
-    app.logger.info(f"Acessando a rota '/add-fullscreen' com o método: {request.method}")
-    if not init_firebase():
+def ad_form_fields(ad_type_info, editing=False):
+    fields = {
+        'title': request.form['title'],
+        'imageUrl': request.form['imageUrl'],
+        'targetUrl': request.form['targetUrl']
+    }
+    if ad_type_info.scheduling:
+        # Campos vazios na edição removem o agendamento (None apaga o campo no datastore)
+        for field, value in parse_schedule(request.form, schedule_tz).items():
+            if value is not None or editing:
+                fields[field] = value
+    if ad_type_info.targeting:
+        # Dispositivos chegam como caixas de seleção (um valor por caixa marcada)
+        rules = {field: ','.join(request.form.getlist(field)) for field in TARGETING_FIELDS}
+        for field, value in parse_targeting(rules).items():
+            if value is not None or editing:
+                fields[field] = value
+    return fields
+
+def attach_assets(ad_type_info, fields, previous=None):
+    # Baixa e processa o criativo só quando a imagem é nova; as variantes ficam gravadas no anúncio
+    if previous and previous.get('imageUrl') == fields['imageUrl'] and previous.get('assets'):
+        return fields
+    assets = asset_store.ingest(ad_type_info, fields['imageUrl'])
+    if assets is not None or previous:
+        # Imagem trocada com o pipeline desativado: descarta as variantes da imagem anterior
+        fields['assets'] = assets
+    return fields
+
+# As URLs antigas de banners e anúncios de tela cheia continuam válidas e caem nas mesmas views
+@app.route('/add-banner', defaults={'ad_type': 'banner'}, methods=['GET', 'POST'])
+@app.route('/add-fullscreen', defaults={'ad_type': 'fullscreen'}, methods=['GET', 'POST'])
+@app.route('/ads/<string:ad_type>/add', methods=['GET', 'POST'])
+def add_ad(ad_type):
+    app.logger.info(f"Acessando a rota '{request.path}' com o método: {request.method}")
+    ad_type_info = get_ad_type(ad_type)
+    if ad_type_info is None:
+        return render_template('error.html', message=f"Tipo de anúncio inválido: {ad_type}"), 404
+    if not init_storage():
         return render_template('error.html', message="Falha crítica ao conectar com o Firebase."), 500
+    game = request_game()
+    if game is None:
+        return render_template('error.html', message="Jogo inválido ou não habilitado."), 404
 
     if request.method == 'POST':
         try:
-            title = request.form['title']
-            imageUrl = request.form['imageUrl']
-            targetUrl = request.form['targetUrl']
-            app.logger.info(f"Formulário de tela cheia recebido: Título='{title}'")
-
-            ads_ref = firebase_rtdb.reference('ads/fullscreen_ads')
-            new_ad_ref = ads_ref.push({
-                'title': title,
-                'imageUrl': imageUrl,
-                'targetUrl': targetUrl,
-                'impressions': 0,
-                'clicks': 0,
-                'created_at': {".sv": "timestamp"} # CORREÇÃO APLICADA
-            })
-            app.logger.info(f"Novo anúncio de tela cheia adicionado ao Firebase RTDB com ID: {new_ad_ref.key}")
+            fields = ad_form_fields(ad_type_info)
+            app.logger.info(f"Formulário de '{ad_type}' recebido: Título='{fields['title']}'")
+
+            attach_assets(ad_type_info, fields)
+            new_ad_id = game.storage.add_ad(ad_type, fields)
+            game.inventory_cache.invalidate()
+            app.logger.info(f"Novo anúncio '{ad_type}' adicionado ao armazenamento com ID: {new_ad_id}")
             return redirect(url_for('dashboard'))
+        except AssetError as e:
+            app.logger.warning(f"Criativo recusado para o anúncio '{ad_type}': {e}")
+            return render_template('ad_form.html', ad_type=ad_type_info, ad=None, ad_types=AD_TYPE_REGISTRY.values(),
+                                   error=f"Imagem recusada: {e}"), 400
+        except ValueError as e:
+            app.logger.warning(f"Agendamento ou segmentação inválidos para o anúncio '{ad_type}': {e}")
+            return render_template('ad_form.html', ad_type=ad_type_info, ad=None, ad_types=AD_TYPE_REGISTRY.values(),
+                                   error=str(e)), 400
         except Exception as e:
-            app.logger.error(f"Erro ao adicionar anúncio de tela cheia ao Firebase RTDB: {e}", exc_info=True)
-            return render_template('error.html', message="Erro ao adicionar o anúncio de tela cheia.")
-    return render_template('add_fullscreen.html')
-
-@app.route('/edit-fullscreen/<string:ad_id>', methods=['GET', 'POST'])
-def edit_fullscreen(ad_id):
-    app.logger.info(f"Acessando a rota '/edit-fullscreen/{ad_id}' com o método: {request.method}")
-    if not init_firebase():
+            app.logger.error(f"Erro ao adicionar anúncio '{ad_type}' ao armazenamento: {e}", exc_info=True)
+            return render_template('error.html', message=f"Erro ao adicionar o {ad_type_info.noun}.")
+    return render_template('ad_form.html', ad_type=ad_type_info, ad=None, ad_types=AD_TYPE_REGISTRY.values())
+
+@app.route('/edit-banner/<string:ad_id>', defaults={'ad_type': 'banner'}, methods=['GET', 'POST'])
+@app.route('/edit-fullscreen/<string:ad_id>', defaults={'ad_type': 'fullscreen'}, methods=['GET', 'POST'])
+@app.route('/ads/<string:ad_type>/<string:ad_id>/edit', methods=['GET', 'POST'])
+def edit_ad(ad_type, ad_id):
+    app.logger.info(f"Acessando a rota '{request.path}' com o método: {request.method}")
+    ad_type_info = get_ad_type(ad_type)
+    if ad_type_info is None:
+        return render_template('error.html', message=f"Tipo de anúncio inválido: {ad_type}"), 404
+    if not init_storage():
         return render_template('error.html', message="Falha crítica ao conectar com o Firebase."), 500
-    
-    ad_ref = firebase_rtdb.reference(f'ads/fullscreen_ads/{ad_id}')
+    game = request_game()
+    if game is None:
+        return render_template('error.html', message="Jogo inválido ou não habilitado."), 404
 
     if request.method == 'POST':
+        previous = None
         try:
-            title = request.form['title']
-            imageUrl = request.form['imageUrl']
-            targetUrl = request.form['targetUrl']
-            
-            ad_ref.update({
-                'title': title,
-                'imageUrl': imageUrl,
-                'targetUrl': targetUrl
-            })
-            app.logger.info(f"Anúncio de tela cheia ID {ad_id} atualizado no Firebase RTDB.")
+            previous = game.storage.get_ad(ad_type, ad_id)
+            fields = ad_form_fields(ad_type_info, editing=True)
+            attach_assets(ad_type_info, fields, previous)
+            game.storage.update_ad(ad_type, ad_id, fields)
+            game.inventory_cache.invalidate()
+            app.logger.info(f"Anúncio '{ad_type}' ID {ad_id} atualizado no armazenamento.")
             return redirect(url_for('dashboard'))
+        except AssetError as e:
+            app.logger.warning(f"Criativo recusado para o anúncio '{ad_type}' ID {ad_id}: {e}")
+            ad_data = {**(previous or {}), **fields, 'id': ad_id}
+            return render_template('ad_form.html', ad_type=ad_type_info, ad=ad_data, ad_types=AD_TYPE_REGISTRY.values(),
+                                   error=f"Imagem recusada: {e}"), 400
+        except ValueError as e:
+            app.logger.warning(f"Agendamento ou segmentação inválidos para o anúncio '{ad_type}' ID {ad_id}: {e}")
+            ad_data = {**(previous or {}), 'id': ad_id}
+            return render_template('ad_form.html', ad_type=ad_type_info, ad=ad_data, ad_types=AD_TYPE_REGISTRY.values(),
+                                   error=str(e)), 400
         except Exception as e:
-            app.logger.error(f"Erro ao editar anúncio de tela cheia ID {ad_id} no Firebase RTDB: {e}", exc_info=True)
-            return render_template('error.html', message="Erro ao salvar as alterações do anúncio.")
+            app.logger.error(f"Erro ao editar anúncio '{ad_type}' ID {ad_id} no armazenamento: {e}", exc_info=True)
+            return render_template('error.html', message=f"Erro ao salvar as alterações do {ad_type_info.noun}.")
 
     # GET request
     try:
-        ad_data = ad_ref.get()
-        if not ad_data or not isinstance(ad_data, dict):
-            app.logger.warning(f"Anúncio de tela cheia com ID {ad_id} não encontrado ou dados inválidos no Firebase RTDB.")
-            return render_template('error.html', message=f"Anúncio de tela cheia com ID {ad_id} não encontrado."), 404
-        
+        ad_data = game.storage.get_ad(ad_type, ad_id)
+        if not ad_data:
+            app.logger.warning(f"Anúncio '{ad_type}' com ID {ad_id} não encontrado ou dados inválidos no armazenamento.")
+            return render_template('error.html', message=f"{ad_type_info.label} com ID {ad_id} não encontrado."), 404
+
         ad_data['id'] = ad_id
-        app.logger.debug(f"Renderizando formulário de edição para o anúncio de tela cheia: {ad_data.get('title')}")
-        return render_template('edit_fullscreen.html', ad=ad_data)
+        app.logger.debug(f"Renderizando formulário de edição para o anúncio '{ad_type}': {ad_data.get('title')}")
+        return render_template('ad_form.html', ad_type=ad_type_info, ad=ad_data, ad_types=AD_TYPE_REGISTRY.values())
     except Exception as e:
-        app.logger.error(f"Erro ao buscar anúncio de tela cheia ID {ad_id} para edição: {e}", exc_info=True)
-        return render_template('error.html', message="Erro ao carregar dados do anúncio para edição."), 500
+        app.logger.error(f"Erro ao buscar anúncio '{ad_type}' ID {ad_id} para edição: {e}", exc_info=True)
+        return render_template('error.html', message=f"Erro ao carregar dados do {ad_type_info.noun} para edição."), 500
 
-@app.route('/delete-fullscreen/<string:ad_id>', methods=['POST'])
-def delete_fullscreen(ad_id):
-    app.logger.info(f"Acessando a rota POST '/delete-fullscreen/{ad_id}'")
-    if not init_firebase():
+@app.route('/delete-banner/<string:ad_id>', defaults={'ad_type': 'banner'}, methods=['POST'])
+@app.route('/delete-fullscreen/<string:ad_id>', defaults={'ad_type': 'fullscreen'}, methods=['POST'])
+@app.route('/ads/<string:ad_type>/<string:ad_id>/delete', methods=['POST'])
+def delete_ad(ad_type, ad_id):
+    app.logger.info(f"Acessando a rota POST '{request.path}'")
+    ad_type_info = get_ad_type(ad_type)
+    if ad_type_info is None:
+        return render_template('error.html', message=f"Tipo de anúncio inválido: {ad_type}"), 404
+    if not init_storage():
         return render_template('error.html', message="Falha crítica ao conectar com o Firebase."), 500
+    game = request_game()
+    if game is None:
+        return render_template('error.html', message="Jogo inválido ou não habilitado."), 404
     try:
-        ad_ref = firebase_rtdb.reference(f'ads/fullscreen_ads/{ad_id}')
-        ad_ref.delete()
-        app.logger.info(f"Anúncio de tela cheia com ID {ad_id} deletado do Firebase RTDB com sucesso.")
+        game.storage.delete_ad(ad_type, ad_id)
+        game.inventory_cache.invalidate()
+        app.logger.info(f"Anúncio '{ad_type}' com ID {ad_id} deletado do armazenamento com sucesso.")
     except Exception as e:
-        app.logger.error(f"Erro ao deletar anúncio de tela cheia ID {ad_id} no Firebase RTDB: {e}", exc_info=True)
-        return render_template('error.html', message=f"Erro ao deletar anúncio de tela cheia ID {ad_id}.")
+        app.logger.error(f"Erro ao deletar anúncio '{ad_type}' ID {ad_id} no armazenamento: {e}", exc_info=True)
+        return render_template('error.html', message=f"Erro ao deletar {ad_type_info.noun} ID {ad_id}.")
     return redirect(url_for('dashboard'))
 
 # --- ROTAS DE API PARA O JOGO UNITY (Exemplos) ---
+def serve_banner(game=None, context=None):
+    # Escolha feita sobre o inventário em cache do worker (ver ADS_SELECTION_STRATEGY),
+    # restrito aos anúncios cujas regras de segmentação aceitam o contexto
+    game = game or games.default
+    active_banner_data = game.ad_selector.pick('banner', context)
+    if active_banner_data:
+        # Impressão acumulada no buffer; a gravação no Firebase acontece em lote
+        game.counter_buffer.increment('banner', active_banner_data['id'], 'impressions')
+        game.ad_selector.record_impression('banner', active_banner_data['id'])
+    return active_banner_data
+
 @app.route('/api/get-banner', methods=['GET'])
 def api_get_banner():
-    if not init_firebase():
+    if not init_storage():
         return jsonify({"error": "Firebase connection failed", "message": "Não foi possível conectar ao servidor de dados."}), 500
     
+    game = request_game()
+    if game is None:
+        return unknown_game_response()
     try:
-        banners_ref = firebase_rtdb.reference('ads/banners')
-        all_banners = banners_ref.order_by_child('created_at').get()
-        
-        active_banner_data = None
-        if all_banners:
-            # Itera de forma reversa (já que o get ordenou por created_at ascendente) para pegar os mais recentes primeiro
-            # Ou, se a lista for grande, buscar com limit_to_last(N) e escolher
-            valid_banners = [
-                {**data, 'id': id_} for id_, data in all_banners.items() 
-                if isinstance(data, dict) and data.get('imageUrl') and data.get('targetUrl')
-            ]
-            if valid_banners:
-                # Lógica de seleção pode ser mais complexa (ex: aleatório, rotação, menos impressions)
-                # Por agora, pegamos o mais recente dos válidos
-                active_banner_data = sorted(valid_banners, key=lambda x: x.get('created_at', 0), reverse=True)[0]
-        
+        active_banner_data = serve_banner(game, targeting_context())
+
         if active_banner_data:
-            impression_ref = firebase_rtdb.reference(f'ads/banners/{active_banner_data["id"]}/impressions')
-            impression_ref.transaction(lambda current_value: (current_value or 0) + 1)
-            app.logger.info(f"Banner ID {active_banner_data['id']} servido via API e impressão registrada.")
-            return jsonify(active_banner_data)
+            app.logger.debug("Banner ID %s servido via API e impressão registrada.", active_banner_data['id'])
+            response = jsonify(active_banner_data)
+            # Cada resposta registra uma impressão: não pode ser reaproveitada por caches
+            response.headers['Cache-Control'] = 'no-store'
+            return response
         else:
-            app.logger.info("API: Nenhum banner ativo encontrado para servir.")
+            app.logger.debug("API: Nenhum banner ativo encontrado para servir.")
             return jsonify({"message": "Nenhum banner ativo encontrado"}), 404
             
     except Exception as e:
@@ -325,23 +693,403 @@ def api_get_banner():
 
 @app.route('/api/register-click/banner/<string:ad_id>', methods=['POST'])
 def api_register_banner_click(ad_id):
-    if not init_firebase():
+    if not init_storage():
         return jsonify({"error": "Firebase connection failed", "message": "Não foi possível conectar ao servidor de dados."}), 500
+    game = request_game()
+    if game is None:
+        return unknown_game_response()
+    retry_after = tracking_guard.admit(request_client_ip())
+    if retry_after:
+        return rate_limited_response(retry_after)
     try:
-        # Verifica se o banner existe antes de tentar registrar o clique
-        banner_check_ref = firebase_rtdb.reference(f'ads/banners/{ad_id}')
-        if not banner_check_ref.get():
-            app.logger.warning(f"API: Tentativa de registrar clique para banner inexistente ID {ad_id}")
+        # Existência verificada no inventário em cache, sem leitura no datastore
+        if apply_tracking_events([{'adId': ad_id, 'type': 'banner'}], 'clicks', game) == 0:
+            app.logger.debug("API: Tentativa de registrar clique para banner inexistente ID %s", ad_id)
             return jsonify({"error": "Banner não encontrado"}), 404
 
-        click_ref = firebase_rtdb.reference(f'ads/banners/{ad_id}/clicks')
-        click_ref.transaction(lambda current_value: (current_value or 0) + 1)
-        app.logger.info(f"API: Clique registrado para banner ID {ad_id}")
+        app.logger.debug("API: Clique registrado para banner ID %s", ad_id)
         return jsonify({"success": True, "message": "Clique registrado"})
     except Exception as e:
         app.logger.error(f"Erro ao registrar clique para banner {ad_id} via API: {e}", exc_info=True)
         return jsonify({"error": "Erro ao registrar clique"}), 500
 
+# --- ROTAS DE API USADAS PELO CLIENTE WEBGL (static/ads_final.js) ---
+# Número máximo de eventos aceitos em uma única requisição de tracking
+MAX_EVENTS_PER_REQUEST = int(os.getenv("ADS_MAX_EVENTS_PER_REQUEST", "100"))
+
+def ads_list_response(ad_type):
+    if not init_storage():
+        return jsonify({"error": "Firebase connection failed", "message": "Não foi possível conectar ao servidor de dados."}), 500
+    game = request_game()
+    if game is None:
+        return unknown_game_response()
+    try:
+        body, etag = game.inventory_cache.get_payload(ad_type, targeting_context(use_headers=False))
+    except Exception as e:
+        app.logger.error(f"Erro ao montar lista de anúncios '{ad_type}' para a API: {e}", exc_info=True)
+        return jsonify({"error": "Erro interno ao buscar anúncios"}), 500
+
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # O cliente sempre revalida; com o ETag a resposta costuma ser um 304 sem corpo
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/banners', methods=['GET'])
+def api_banners():
+    return ads_list_response('banner')
+
+@app.route('/api/fullscreen', methods=['GET'])
+def api_fullscreen():
+    return ads_list_response('fullscreen')
+
+def fullscreen_cap_key(session_id, ip, game_id=None):
+    # Sem sessão válida o limite vale para o IP do cliente; cada jogo tem o próprio limite
+    key = session_id if valid_client_id(session_id) else f"ip:{ip}"
+    return f"{game_id}:{key}" if game_id else key
+
+def next_fullscreen_ad(cap_key, game=None, context=None):
+    # Decisão e exibição registradas juntas (uma transação no estado compartilhado), com o
+    # anúncio escolhido do inventário em cache, sem leitura no datastore
+    game = game or games.default
+    ad, reason, game_overs = frequency_capper.next_show(
+        cap_key, lambda: game.ad_selector.pick('fullscreen', context)
+    )
+    if ad is not None:
+        # Impressão contada aqui: o cliente não envia /api/impression para este anúncio
+        game.counter_buffer.increment('fullscreen', ad['id'], 'impressions')
+        game.ad_selector.record_impression('fullscreen', ad['id'])
+    return {
+        "show": ad is not None,
+        "reason": reason,
+        "gameOvers": game_overs,
+        "every": frequency_capper.every,
+        "ad": {field: ad.get(field) for field in PUBLIC_FIELDS} if ad is not None else None
+    }
+
+@app.route('/api/fullscreen/next', methods=['POST'])
+def api_fullscreen_next():
+    if not init_storage():
+        return jsonify({"error": "Firebase connection failed", "message": "Não foi possível conectar ao servidor de dados."}), 500
+
+    game = request_game()
+    if game is None:
+        return unknown_game_response()
+    payload = request.get_json(force=True, silent=True)
+    session_id = tracking_session_id(payload)
+    ip = request_client_ip()
+    retry_after = tracking_guard.admit(ip, session_id)
+    if retry_after:
+        return rate_limited_response(retry_after)
+    try:
+        result = next_fullscreen_ad(fullscreen_cap_key(session_id, ip, game.game_id), game, targeting_context())
+    except Exception as e:
+        app.logger.error(f"Erro na API /api/fullscreen/next: {e}", exc_info=True)
+        return jsonify({"error": "Erro interno ao decidir o anúncio de tela cheia"}), 500
+
+    response = jsonify(result)
+    # Cada resposta avança o contador de game overs da sessão
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/ads/<string:ad_type>', methods=['GET'])
+def api_ads(ad_type):
+    # Lista de qualquer formato registrado, do mesmo cache das rotas acima
+    if ad_type not in AD_TYPES:
+        return jsonify({"error": "Tipo de anúncio inválido"}), 404
+    return ads_list_response(ad_type)
+
+# Tempo (segundos) em que navegadores e CDNs podem reutilizar o manifesto sem revalidar,
+# e a janela em que uma cópia vencida ainda pode ser servida enquanto revalidam
+ADS_MANIFEST_MAX_AGE = int(os.getenv("ADS_MANIFEST_MAX_AGE", "60"))
+ADS_MANIFEST_STALE_WHILE_REVALIDATE = int(os.getenv("ADS_MANIFEST_STALE_WHILE_REVALIDATE", "300"))
+MANIFEST_CACHE_CONTROL = (
+    f"public, max-age={ADS_MANIFEST_MAX_AGE}, "
+    f"stale-while-revalidate={ADS_MANIFEST_STALE_WHILE_REVALIDATE}"
+)
+
+@app.route('/api/manifest', methods=['GET'])
+def api_manifest():
+    if not init_storage():
+        return jsonify({"error": "Firebase connection failed", "message": "Não foi possível conectar ao servidor de dados."}), 500
+    game = request_game()
+    if game is None:
+        return unknown_game_response()
+    try:
+        body, etag = game.inventory_cache.get_manifest(targeting_context(use_headers=False))
+    except Exception as e:
+        app.logger.error(f"Erro ao montar o manifesto de rotação: {e}", exc_info=True)
+        return jsonify({"error": "Erro interno ao montar o manifesto"}), 500
+
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = MANIFEST_CACHE_CONTROL
+    return response.make_conditional(request)
+
+def normalize_tracking_payload(payload):
+    # Aceita um evento {adId, type}, uma lista de eventos ou {"events": [...]}
+    if isinstance(payload, dict):
+        payload = payload.get('events', [payload])
+    if not isinstance(payload, list):
+        return None
+    return payload
+
+def tracking_session_id(payload):
+    # Sessão opcional enviada pelo cliente em {"sessionId": "...", "events": [...]}
+    if isinstance(payload, dict):
+        return payload.get('sessionId')
+    return None
+
+def request_client_ip():
+    return client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'), ADS_TRUSTED_PROXY_HOPS)
+
+def rate_limited_response(retry_after):
+    response = jsonify({"error": "Muitas requisições"})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def apply_tracking_events(events, field, game=None):
+    game = game or games.default
+    accepted = 0
+    for event in events:
+        if not isinstance(event, dict):
+            continue
+        ad_type = event.get('type')
+        ad_id = event.get('adId')
+        if ad_type not in AD_TYPES or not isinstance(ad_id, str):
+            continue
+        # Existência verificada no cache do inventário, sem leitura no Firebase
+        if game.inventory_cache.get_ad(ad_type, ad_id) is None:
+            continue
+        # Retentativas do cliente reenviam o mesmo eventId: só a primeira cópia é contada
+        event_id = event.get('eventId')
+        if not tracking_guard.claim_event(field, event_id):
+            continue
+        if game.counter_buffer.increment(ad_type, ad_id, field):
+            accepted += 1
+            if field == 'clicks':
+                game.ad_selector.record_click(ad_type, ad_id)
+            else:
+                game.ad_selector.record_impression(ad_type, ad_id)
+        else:
+            # Buffer cheio: o evento não foi contado e pode ser reenviado
+            tracking_guard.release_event(field, event_id)
+    return accepted
+
+def record_tracking_events(field):
+    if not init_storage():
+        return jsonify({"error": "Firebase connection failed", "message": "Não foi possível conectar ao servidor de dados."}), 500
+
+    game = request_game()
+    if game is None:
+        return unknown_game_response()
+    # force=True porque navigator.sendBeacon não envia Content-Type JSON
+    payload = request.get_json(force=True, silent=True)
+    events = normalize_tracking_payload(payload)
+    if events is None:
+        return jsonify({"error": "Payload inválido"}), 400
+    if len(events) > MAX_EVENTS_PER_REQUEST:
+        return jsonify({"error": f"Máximo de {MAX_EVENTS_PER_REQUEST} eventos por requisição"}), 413
+
+    # Rejeição antecipada: rajadas acima do limite não chegam ao inventário nem ao buffer
+    retry_after = tracking_guard.admit(request_client_ip(), tracking_session_id(payload), cost=max(1, len(events)))
+    if retry_after:
+        return rate_limited_response(retry_after)
+
+    try:
+        accepted = apply_tracking_events(events, field, game)
+    except Exception as e:
+        app.logger.error(f"Erro ao registrar eventos de '{field}' via API: {e}", exc_info=True)
+        return jsonify({"error": "Erro ao registrar eventos"}), 500
+
+    app.logger.debug("API: %s/%s eventos de '%s' registrados.", accepted, len(events), field)
+    return jsonify({"success": True, "accepted": accepted, "rejected": len(events) - accepted})
+
+@app.route('/api/impression', methods=['POST'])
+def api_impression():
+    return record_tracking_events('impressions')
+
+@app.route('/api/click', methods=['POST'])
+def api_click():
+    return record_tracking_events('clicks')
+
+# Janela padrão (segundos) de cada granularidade quando 'start' não é informado
+TIMESERIES_DEFAULT_WINDOW = {
+    'minute': 2 * 3600,
+    'hour': 48 * 3600,
+    'day': 90 * 86400,
+}
+
+@app.route('/api/stats/timeseries', methods=['GET'])
+def api_stats_timeseries():
+    if event_store is None:
+        return jsonify({"error": "Log de eventos desativado"}), 503
+
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in GRANULARITIES:
+        return jsonify({"error": f"Granularidade inválida: {granularity}"}), 400
+    try:
+        end = request.args.get('end', type=int)
+        start = request.args.get('start', type=int)
+        if start is None:
+            start = (end or int(time.time())) - TIMESERIES_DEFAULT_WINDOW[granularity]
+        series = event_store.get_series(
+            granularity,
+            ad_type=request.args.get('type'),
+            ad_id=request.args.get('ad_id'),
+            start=start,
+            end=end
+        )
+    except Exception as e:
+        app.logger.error(f"Erro na API /api/stats/timeseries: {e}", exc_info=True)
+        return jsonify({"error": "Erro interno ao buscar série temporal"}), 500
+    return jsonify({"granularity": granularity, "start": start, "end": end, "series": series})
+
+@app.route('/export', methods=['GET'])
+def export():
+    if not init_storage():
+        return jsonify({"error": "Firebase connection failed", "message": "Não foi possível conectar ao servidor de dados."}), 500
+
+    game = request_game()
+    if game is None:
+        return unknown_game_response()
+
+    report = request.args.get('report', 'ads')
+    export_format = request.args.get('format', 'csv')
+    try:
+        chunks = export_report(
+            game.storage,
+            event_store,
+            report,
+            export_format,
+            ad_type=request.args.get('type') or None,
+            ad_id=request.args.get('ad_id') or None,
+            granularity=request.args.get('granularity', 'hour'),
+            start=request.args.get('start', type=int),
+            end=request.args.get('end', type=int)
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Resposta em streaming (chunked): as linhas são lidas e enviadas em blocos
+    response = Response(chunks, content_type=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="{report}.{export_format}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# --- IMPORTAÇÃO EM LOTE (POST /api/ads/import) ---
+# Linhas aceitas em uma importação em lote
+ADS_IMPORT_MAX_ROWS = int(os.getenv("ADS_IMPORT_MAX_ROWS", "5000"))
+# Chave exigida no cabeçalho Authorization: Bearer <chave> (ou X-API-Key); vazia desativa a rota
+ADS_IMPORT_API_KEY = os.getenv("ADS_IMPORT_API_KEY", "")
+# Importações por minuto e rajada máxima por IP (taxa 0 desativa o limite)
+ADS_IMPORT_RATE_PER_MINUTE = float(os.getenv("ADS_IMPORT_RATE_PER_MINUTE", "6"))
+ADS_IMPORT_RATE_BURST = float(os.getenv("ADS_IMPORT_RATE_BURST", "3"))
+
+import_rate_limiter = TokenBucketLimiter(ADS_IMPORT_RATE_PER_MINUTE / 60.0, ADS_IMPORT_RATE_BURST)
+
+def import_authorized():
+    # Comparação em tempo constante com a chave configurada
+    authorization = request.headers.get('Authorization', '')
+    key = authorization[7:] if authorization.startswith('Bearer ') else request.headers.get('X-API-Key', '')
+    return hmac.compare_digest(key.encode('utf-8'), ADS_IMPORT_API_KEY.encode('utf-8'))
+
+@app.route('/api/ads/import', methods=['POST'])
+def api_import_ads():
+    retry_after = import_rate_limiter.consume(request_client_ip())
+    if retry_after:
+        return rate_limited_response(retry_after)
+    if not ADS_IMPORT_API_KEY:
+        return jsonify({"error": "Importação pela API desativada (defina ADS_IMPORT_API_KEY)"}), 403
+    if not import_authorized():
+        return jsonify({"error": "Chave de API inválida"}), 401
+    if not init_storage():
+        return jsonify({"error": "Firebase connection failed", "message": "Não foi possível conectar ao servidor de dados."}), 500
+
+    game = request_game()
+    if game is None:
+        return unknown_game_response()
+    # Arquivo enviado como multipart (campo 'file') ou direto no corpo (text/csv, application/json)
+    upload = request.files.get('file')
+    if upload is not None:
+        data = upload.read()
+        import_format = request.args.get('format') or detect_format(upload.filename, upload.mimetype)
+    else:
+        data = request.get_data()
+        import_format = request.args.get('format') or detect_format(content_type=request.content_type)
+    dry_run = request.args.get('dry_run', 'false').lower() in ('1', 'true', 'yes')
+    try:
+        result = import_ads(
+            game.storage,
+            data,
+            import_format or 'json',
+            default_type=request.args.get('type') or None,
+            asset_processor=import_asset_processor,
+            dry_run=dry_run,
+            max_rows=ADS_IMPORT_MAX_ROWS,
+            # As variantes chegam depois da resposta: nova invalidação quando forem gravadas
+            on_assets=game.inventory_cache.invalidate,
+            schedule_tz=schedule_tz
+        )
+    except BulkImportError as e:
+        return jsonify({"error": str(e), "errors": e.errors}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Erro na importação em lote de anúncios: {e}", exc_info=True)
+        return jsonify({"error": "Erro interno ao importar anúncios"}), 500
+
+    if not dry_run:
+        # Uma invalidação para o lote inteiro
+        game.inventory_cache.invalidate()
+        app.logger.info(f"Importação em lote: {result['created']} anúncios criados, {result['updated']} atualizados")
+    return jsonify(result)
+
+@app.route('/assets/<string:name>', methods=['GET'])
+def asset(name):
+    result = asset_store.read(name)
+    if result is None:
+        # Variante despejada ou perdida: o original atende enquanto ela é regenerada
+        source_url = asset_store.recover(name)
+        if source_url is None:
+            return jsonify({"error": "Criativo não encontrado"}), 404
+        response = redirect(source_url)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    data, content_type = result
+    response = Response(data, mimetype=content_type)
+    response.set_etag(name.split('.', 1)[0])
+    response.headers['Cache-Control'] = ASSET_CACHE_CONTROL
+    return response.make_conditional(request)
+
+@app.route('/api/cache-stats', methods=['GET'])
+def api_cache_stats():
+    return jsonify({
+        "inventory": inventory_cache.stats(),
+        "counters": counter_buffer.stats(),
+        "counter_compactor": counter_compactor.stats(),
+        "ingestion": tracking_guard.stats(),
+        "fullscreen_cap": frequency_capper.stats(),
+        "games": games.stats(),
+        "assets": asset_store.stats()
+    })
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    # Prontidão do worker: inicializa se ainda não foi feito (servidores sem o gancho do gunicorn)
+    is_ready = lifecycle.ensure_started()
+    status = lifecycle.status()
+    status['inventory_version'] = inventory_cache.version
+    response = jsonify(status)
+    response.status_code = 200 if is_ready else 503
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 # --- INICIALIZAÇÃO DA APLICAÇÃO (Bloco Principal) ---
 if __name__ == '__main__':
     # Para desenvolvimento local, pode ser útil carregar python-dotenv
@@ -349,11 +1097,10 @@ if __name__ == '__main__':
     # load_dotenv()
     # app.logger.info("Variáveis de ambiente .env carregadas (se existentes).")
 
-    if not init_firebase():
-        app.logger.critical("❌ INICIALIZAÇÃO LOCAL FALHOU: Firebase não pôde ser inicializado.")
+    if not lifecycle.start():
+        app.logger.critical(f"❌ INICIALIZAÇÃO LOCAL FALHOU: armazenamento '{storage.name}' não pôde ser inicializado.")
     
     app.run(host='0.0.0.0', port=int(os.getenv('PORT', 5000)), debug=True)
-else:
-    # Gunicorn (Render) load
-    if not init_firebase():
-        logging.getLogger().critical("❌ (GUNICORN LOAD) INICIALIZAÇÃO FALHOU: Firebase não pôde ser inicializado.")
+# Gunicorn (Render): nada é conectado na importação, que pode acontecer no processo
+# mestre (--preload). Cada worker inicializa após o fork, no post_worker_init do
+# gunicorn.conf.py ou, em outros servidores, na primeira requisição.
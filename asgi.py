@@ -0,0 +1,576 @@
+"""
+Entrada ASGI do servidor de anúncios.
+
+As rotas usadas pelo jogo (/api/get-banner, /api/manifest, /api/banners,
+/api/fullscreen, /api/fullscreen/next, /api/ads/<tipo>, /api/impression, /api/click, o clique
+legado e as variantes de criativos em /assets/<nome>) são atendidas diretamente no
+loop asyncio a partir do inventário em cache e do buffer de contadores: o
+caminho da requisição nunca espera pelo datastore. A leitura do inventário e
+a gravação dos contadores acontecem em threads (pool do executor e flush do
+CounterBuffer), reaproveitando a sessão HTTP do firebase-admin. Com
+ADS_MULTI_GAME, o parâmetro game_id escolhe a partição do jogo (cache e
+buffer próprios, ver services/tenants.py).
+
+As demais rotas (dashboard, formulários, estatísticas, exportação) continuam no Flask,
+executado em um pool de threads próprio (ADS_ASGI_WSGI_THREADS).
+
+Uso:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import math
+import os
+import sys
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qs
+
+import app as ads_app
+from services.assets import ASSET_CACHE_CONTROL, ASSET_URL_PREFIX
+from services.targeting import request_context
+
+logger = logging.getLogger(__name__)
+
+# Tamanho máximo do corpo aceito nas rotas de tracking
+MAX_BODY_BYTES = int(os.getenv("ADS_MAX_BODY_BYTES", str(64 * 1024)))
+
+# Threads que executam as rotas do Flask (dashboard) fora do loop
+ADS_ASGI_WSGI_THREADS = int(os.getenv("ADS_ASGI_WSGI_THREADS", "8"))
+
+# No caminho assíncrono uma recarga do inventário nunca bloqueia o loop
+ads_app.inventory_cache.stale_while_revalidate = True
+
+wsgi_executor = ThreadPoolExecutor(max_workers=ADS_ASGI_WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+
+# Cabeçalhos CORS equivalentes aos do flask_cors para as rotas atendidas aqui
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+
+# Uma trava de primeira carga por cache de inventário: a carga de um jogo não espera a de outro
+_inventory_locks = weakref.WeakKeyDictionary()
+
+
+def get_header(scope, name):
+    """
+    Obtém um cabeçalho da requisição ASGI.
+
+    Args:
+        scope (dict): Escopo ASGI da requisição
+        name (bytes): Nome do cabeçalho em minúsculas
+
+    Returns:
+        str: Valor do cabeçalho ou None
+    """
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Compara o If-None-Match do cliente com o ETag atual (comparação fraca, RFC 7232).
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == f'"{etag}"':
+            return True
+    return False
+
+
+async def send_response(send, status, body=b'', content_type=b'application/json', headers=None):
+    response_headers = [(b'content-type', content_type), (b'content-length', str(len(body)).encode())]
+    response_headers += CORS_HEADERS + (headers or [])
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    await send_response(send, status, body)
+
+
+async def read_body(receive, limit=MAX_BODY_BYTES):
+    """
+    Lê o corpo da requisição.
+
+    Args:
+        receive (callable): Canal de recebimento ASGI
+        limit (int): Tamanho máximo em bytes (None para ilimitado)
+
+    Returns:
+        bytes: Corpo completo ou None se passar do limite
+    """
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return b''
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit is not None and size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def request_query(scope):
+    # Primeiro valor de cada parâmetro de query, como request.args.get no Flask
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    return {name: values[0] for name, values in query.items()}
+
+
+def request_game(scope):
+    """
+    Obtém a partição do jogo do parâmetro game_id da requisição.
+
+    Args:
+        scope (dict): Escopo ASGI da requisição
+
+    Returns:
+        GamePartition: Partição do jogo (a padrão sem o parâmetro) ou None se o ID não for aceito
+    """
+    return ads_app.games.get(request_query(scope).get('game_id'))
+
+
+def targeting_context(scope, use_headers=True):
+    """
+    Obtém o contexto de segmentação da requisição (ver app.targeting_context).
+
+    Args:
+        scope (dict): Escopo ASGI da requisição
+        use_headers (bool): Usa os cabeçalhos quando faltam parâmetros (False nas
+            respostas cacheáveis por URL)
+
+    Returns:
+        tuple: Contexto de services/targeting.build_context
+    """
+    def scope_header(name):
+        return get_header(scope, name.lower().encode('latin-1'))
+
+    return request_context(request_query(scope), scope_header if use_headers else None, ads_app.ADS_GEO_HEADER)
+
+
+async def send_unknown_game(send):
+    await send_json(send, 404, {"error": "Jogo inválido ou não habilitado"})
+
+
+async def ensure_inventory(send, game=None):
+    """
+    Garante um inventário carregado sem bloquear o loop.
+
+    Só a primeira carga (ou a carga após uma falha sem inventário anterior)
+    espera o datastore, em uma thread do executor; com inventário presente a
+    recarga acontece em segundo plano (stale_while_revalidate).
+
+    Args:
+        send: Callable ASGI de envio, usado para a resposta de erro
+        game (GamePartition): Partição do jogo (None para o inventário padrão)
+
+    Returns:
+        bool: False se o worker não pôde ser inicializado (a resposta 500 já foi enviada)
+    """
+    if not ads_app.lifecycle.ready:
+        # Inicialização que falhou no startup: nova tentativa respeitando o intervalo do lifecycle
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(None, ads_app.lifecycle.ensure_started):
+            await send_json(send, 500, {
+                "error": "Firebase connection failed",
+                "message": "Não foi possível conectar ao servidor de dados."
+            })
+            return False
+    cache = (game or ads_app.games.default).inventory_cache
+    if cache.is_fresh() or (cache.stale_while_revalidate and cache.version):
+        return True
+    lock = _inventory_locks.get(cache)
+    if lock is None:
+        lock = _inventory_locks[cache] = asyncio.Lock()
+    async with lock:
+        if cache.is_fresh() or (cache.stale_while_revalidate and cache.version):
+            return True
+        loop = asyncio.get_running_loop()
+        # O contexto copiado leva a medição de chamadas ao datastore para a thread
+        context = contextvars.copy_context()
+        await loop.run_in_executor(None, context.run, cache.get_versioned_ads, 'banner')
+    return True
+
+
+async def get_banner(scope, receive, send):
+    game = request_game(scope)
+    if game is None:
+        await send_unknown_game(send)
+        return
+    if not await ensure_inventory(send, game):
+        return
+    active_banner_data = ads_app.serve_banner(game, targeting_context(scope))
+    if active_banner_data:
+        logger.debug("Banner ID %s servido via ASGI e impressão registrada.", active_banner_data['id'])
+        body = json.dumps(active_banner_data, ensure_ascii=False).encode('utf-8')
+        await send_response(send, 200, body, headers=[(b'cache-control', b'no-store')])
+    else:
+        await send_json(send, 404, {"message": "Nenhum banner ativo encontrado"})
+
+
+async def send_conditional(scope, send, body, etag, cache_control, content_type=b'application/json'):
+    headers = [(b'etag', f'"{etag}"'.encode()), (b'cache-control', cache_control.encode())]
+    if etag_matches(get_header(scope, b'if-none-match'), etag):
+        await send({
+            'type': 'http.response.start',
+            'status': 304,
+            'headers': CORS_HEADERS + headers
+        })
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    await send_response(send, 200, body, content_type=content_type, headers=headers)
+
+
+async def ads_list(scope, receive, send, ad_type):
+    game = request_game(scope)
+    if game is None:
+        await send_unknown_game(send)
+        return
+    if not await ensure_inventory(send, game):
+        return
+    body, etag = game.inventory_cache.get_payload(ad_type, targeting_context(scope, use_headers=False))
+    await send_conditional(scope, send, body, etag, 'no-cache')
+
+
+async def manifest(scope, receive, send):
+    game = request_game(scope)
+    if game is None:
+        await send_unknown_game(send)
+        return
+    if not await ensure_inventory(send, game):
+        return
+    body, etag = game.inventory_cache.get_manifest(targeting_context(scope, use_headers=False))
+    await send_conditional(scope, send, body, etag, ads_app.MANIFEST_CACHE_CONTROL)
+
+
+async def asset(scope, receive, send, name):
+    # Leitura do disco em uma thread do executor para não bloquear o loop
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(None, ads_app.asset_store.read, name)
+    if result is None:
+        # Variante despejada ou perdida: o original atende enquanto ela é regenerada
+        source_url = await loop.run_in_executor(None, ads_app.asset_store.recover, name)
+        if source_url is None:
+            await send_json(send, 404, {"error": "Criativo não encontrado"})
+            return
+        await send_response(send, 302, headers=[
+            (b'location', source_url.encode('utf-8')),
+            (b'cache-control', b'no-store'),
+        ])
+        return
+    body, content_type = result
+    await send_conditional(scope, send, body, name.split('.', 1)[0], ASSET_CACHE_CONTROL, content_type.encode())
+
+
+def request_client_ip(scope):
+    return ads_app.client_ip(
+        (scope.get('client') or ('', 0))[0],
+        get_header(scope, b'x-forwarded-for'),
+        ads_app.ADS_TRUSTED_PROXY_HOPS
+    )
+
+
+async def send_rate_limited(send, retry_after):
+    body = json.dumps({"error": "Muitas requisições"}, ensure_ascii=False).encode('utf-8')
+    retry_header = str(max(1, math.ceil(retry_after))).encode()
+    await send_response(send, 429, body, headers=[(b'retry-after', retry_header)])
+
+
+async def tracking_events(scope, receive, send, field):
+    game = request_game(scope)
+    if game is None:
+        await send_unknown_game(send)
+        return
+    body = await read_body(receive)
+    if body is None:
+        await send_json(send, 413, {"error": "Corpo da requisição muito grande"})
+        return
+    try:
+        payload = json.loads(body) if body else None
+    except ValueError:
+        payload = None
+    events = ads_app.normalize_tracking_payload(payload)
+    if events is None:
+        await send_json(send, 400, {"error": "Payload inválido"})
+        return
+    if len(events) > ads_app.MAX_EVENTS_PER_REQUEST:
+        await send_json(send, 413, {"error": f"Máximo de {ads_app.MAX_EVENTS_PER_REQUEST} eventos por requisição"})
+        return
+
+    retry_after = ads_app.tracking_guard.admit(
+        request_client_ip(scope), ads_app.tracking_session_id(payload), cost=max(1, len(events))
+    )
+    if retry_after:
+        await send_rate_limited(send, retry_after)
+        return
+
+    if not await ensure_inventory(send, game):
+        return
+    accepted = ads_app.apply_tracking_events(events, field, game)
+    await send_json(send, 200, {"success": True, "accepted": accepted, "rejected": len(events) - accepted})
+
+
+async def fullscreen_next(scope, receive, send):
+    game = request_game(scope)
+    if game is None:
+        await send_unknown_game(send)
+        return
+    body = await read_body(receive)
+    if body is None:
+        await send_json(send, 413, {"error": "Corpo da requisição muito grande"})
+        return
+    try:
+        payload = json.loads(body) if body else None
+    except ValueError:
+        payload = None
+    session_id = ads_app.tracking_session_id(payload)
+    ip = request_client_ip(scope)
+    retry_after = ads_app.tracking_guard.admit(ip, session_id)
+    if retry_after:
+        await send_rate_limited(send, retry_after)
+        return
+
+    if not await ensure_inventory(send, game):
+        return
+    args = (ads_app.fullscreen_cap_key(session_id, ip, game.game_id), game, targeting_context(scope))
+    if ads_app.frequency_capper.shared is not None:
+        # Estado compartilhado: a transação no SQLite pode esperar pelo lock de outro worker
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, ads_app.next_fullscreen_ad, *args)
+    else:
+        result = ads_app.next_fullscreen_ad(*args)
+    body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+    await send_response(send, 200, body, headers=[(b'cache-control', b'no-store')])
+
+
+async def legacy_banner_click(scope, receive, send, ad_id):
+    game = request_game(scope)
+    if game is None:
+        await send_unknown_game(send)
+        return
+    retry_after = ads_app.tracking_guard.admit(request_client_ip(scope))
+    if retry_after:
+        await send_rate_limited(send, retry_after)
+        return
+    if not await ensure_inventory(send, game):
+        return
+    # Existência verificada no inventário em cache, como nas rotas de tracking
+    if ads_app.apply_tracking_events([{'adId': ad_id, 'type': 'banner'}], 'clicks', game) == 0:
+        await send_json(send, 404, {"error": "Banner não encontrado"})
+        return
+    await send_json(send, 200, {"success": True, "message": "Clique registrado"})
+
+
+# Rota legada de clique e o rótulo usado nas métricas (mesmo formato do roteador do Flask)
+LEGACY_CLICK_PREFIX = '/api/register-click/banner/'
+LEGACY_CLICK_ROUTE = '/api/register-click/banner/<string:ad_id>'
+
+# Lista de anúncios de qualquer formato registrado
+ADS_LIST_PREFIX = '/api/ads/'
+ADS_LIST_ROUTE = '/api/ads/<string:ad_type>'
+
+# Variantes de criativos (um rótulo só nas métricas, não um por arquivo)
+ASSET_ROUTE = '/assets/<string:name>'
+
+
+def match_route(method, path):
+    """
+    Encontra o handler assíncrono de uma rota do jogo.
+
+    Returns:
+        tuple: (handler, argumentos extras) ou (None, None) para rotas do Flask
+    """
+    if method == 'GET':
+        if path == '/api/get-banner':
+            return get_banner, ()
+        if path == '/api/banners':
+            return ads_list, ('banner',)
+        if path == '/api/fullscreen':
+            return ads_list, ('fullscreen',)
+        if path == '/api/manifest':
+            return manifest, ()
+        # Tipos desconhecidos seguem para o Flask, que responde 404
+        if path.startswith(ADS_LIST_PREFIX) and path[len(ADS_LIST_PREFIX):] in ads_app.AD_TYPES:
+            return ads_list, (path[len(ADS_LIST_PREFIX):],)
+        if path.startswith(ASSET_URL_PREFIX) and '/' not in path[len(ASSET_URL_PREFIX):]:
+            return asset, (path[len(ASSET_URL_PREFIX):],)
+    elif method == 'POST':
+        if path == '/api/impression':
+            return tracking_events, ('impressions',)
+        if path == '/api/click':
+            return tracking_events, ('clicks',)
+        if path == '/api/fullscreen/next':
+            return fullscreen_next, ()
+        prefix = LEGACY_CLICK_PREFIX
+        if path.startswith(prefix) and '/' not in path[len(prefix):] and path[len(prefix):]:
+            return legacy_banner_click, (path[len(prefix):],)
+    return None, None
+
+
+def build_wsgi_environ(scope, body):
+    """
+    Monta o environ WSGI de uma requisição HTTP ASGI.
+    """
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server_name),
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for key, value in scope.get('headers', []):
+        name = key.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+def run_wsgi(environ):
+    """
+    Executa o app Flask e lê a resposta (roda no wsgi_executor).
+
+    Respostas com Content-Length são lidas por completo; as demais (streaming,
+    como /export) são devolvidas com o iterador, lido em pedaços depois.
+
+    Returns:
+        tuple: (status, lista de cabeçalhos, corpo lido, iterável restante ou None)
+    """
+    response = {}
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+        return chunks.append
+
+    result = ads_app.app(environ, start_response)
+    if not any(name.lower() == 'content-length' for name, _ in response['headers']):
+        return response['status'], response['headers'], b''.join(chunks), result
+    try:
+        for chunk in result:
+            chunks.append(chunk)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], b''.join(chunks), None
+
+
+def close_wsgi_result(result):
+    if hasattr(result, 'close'):
+        result.close()
+
+
+async def flask_application(scope, receive, send):
+    body = await read_body(receive, limit=None)
+    loop = asyncio.get_running_loop()
+    status, headers, response_body, stream = await loop.run_in_executor(
+        wsgi_executor, run_wsgi, build_wsgi_environ(scope, body)
+    )
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    })
+    if stream is None:
+        await send({'type': 'http.response.body', 'body': response_body})
+        return
+
+    # Streaming: cada pedaço é produzido em uma thread do pool e enviado em seguida
+    iterator = iter(stream)
+    try:
+        if response_body:
+            await send({'type': 'http.response.body', 'body': response_body, 'more_body': True})
+        while True:
+            chunk = await loop.run_in_executor(wsgi_executor, next, iterator, None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        await loop.run_in_executor(wsgi_executor, close_wsgi_result, stream)
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            loop = asyncio.get_running_loop()
+            # Conecta o datastore, carrega o inventário e inicia o flush antes da primeira requisição;
+            # uma falha é registrada pelo lifecycle e repetida nas rotas do Flask (init_storage)
+            await loop.run_in_executor(None, ads_app.lifecycle.start)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, ads_app.counter_buffer.stop)
+            await loop.run_in_executor(None, ads_app.games.stop)
+            wsgi_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+        return
+
+    if scope['type'] == 'http':
+        handler, args = match_route(scope['method'], scope['path'])
+        if handler is None:
+            # Rotas do Flask são medidas pelos ganchos do próprio app
+            try:
+                await flask_application(scope, receive, send)
+            except Exception as e:
+                logger.error(f"Erro na rota ASGI {scope['path']}: {e}", exc_info=True)
+                await send_json(send, 500, {"error": "Erro interno"})
+            return
+
+        route = scope['path']
+        if handler is legacy_banner_click:
+            route = LEGACY_CLICK_ROUTE
+        elif route.startswith(ADS_LIST_PREFIX):
+            route = ADS_LIST_ROUTE
+        elif handler is asset:
+            route = ASSET_ROUTE
+        context = ads_app.instrumentation.start_request()
+        status = [500]
+
+        async def measured_send(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await handler(scope, receive, measured_send, *args)
+        except Exception as e:
+            logger.error(f"Erro na rota ASGI {scope['path']}: {e}", exc_info=True)
+            await send_json(measured_send, 500, {"error": "Erro interno"})
+        finally:
+            ads_app.instrumentation.finish_request(context, route, scope['method'], status[0])
@@ -0,0 +1,382 @@
+"""
+Teste de carga e latência da API de anúncios.
+
+Sobe o app em um processo separado com o backend 'memory' (substituto local
+do Firebase com latência configurável por operação), popula um inventário
+sintético e dispara requisições concorrentes contra os endpoints do jogo e o
+dashboard. Para cada cenário reporta vazão e latências p50/p95/p99.
+
+Uso:
+    python -m benchmarks.bench_api --sizes 10 1000 100000 --concurrency 1 16 64
+    python -m benchmarks.bench_api --latency-ms 40 --output resultado.json
+    python -m benchmarks.bench_api --baseline resultado.json --tolerance 0.2
+
+Dimensionamento de workers do gunicorn (servidor externo, inventário em SQLite):
+    python -m benchmarks.bench_api --seed-sqlite /tmp/bench.db --sizes 10000
+    ADS_STORAGE_BACKEND=sqlite ADS_SQLITE_PATH=/tmp/bench.db gunicorn -w 4 app:app
+    python -m benchmarks.bench_api --url http://127.0.0.1:8000 --concurrency 64 256
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from models.storage import AD_TYPES, SQLiteStorage
+
+# Cenários: (nome, método, caminho); '{ad_id}' é trocado por um banner aleatório
+SCENARIOS = {
+    'get-banner': ('GET', '/api/get-banner'),
+    'banners': ('GET', '/api/banners'),
+    'click': ('POST', '/api/register-click/banner/{ad_id}'),
+    'click-batch': ('POST', '/api/click'),
+    'dashboard': ('GET', '/'),
+}
+
+# Status considerados sucesso (304 vem da revalidação por ETag)
+OK_STATUSES = (200, 304)
+
+
+def build_inventory(ad_count, base_millis=1700000000000):
+    """
+    Gera um inventário sintético com `ad_count` anúncios de cada tipo.
+
+    Args:
+        ad_count (int): Número de anúncios por tipo
+        base_millis (int): created_at do anúncio mais antigo
+
+    Returns:
+        dict: {ad_type: {id: dados}}, no formato do MemoryStorage
+    """
+    inventory = {}
+    for ad_type in AD_TYPES:
+        inventory[ad_type] = {
+            f"{i:08d}": {
+                'title': f'{ad_type} {i}',
+                'imageUrl': f'https://i.imgur.com/{ad_type}{i}.png',
+                'targetUrl': f'https://example.com/{ad_type}/{i}',
+                'impressions': i * 10,
+                'clicks': i,
+                'created_at': base_millis + i,
+            }
+            for i in range(1, ad_count + 1)
+        }
+    return inventory
+
+
+def seed_sqlite(db_path, ad_count):
+    """
+    Grava o inventário sintético em um banco do SQLiteStorage, substituindo
+    os anúncios existentes.
+
+    Args:
+        db_path (str): Caminho do arquivo SQLite
+        ad_count (int): Número de anúncios por tipo
+    """
+    storage = SQLiteStorage(db_path)
+    if not storage.connect():
+        raise RuntimeError(f"Não foi possível abrir {db_path}")
+    conn = storage._connect()
+    with conn:
+        conn.execute('DELETE FROM ads')
+        for ad_type, ads in build_inventory(ad_count).items():
+            conn.executemany(
+                'INSERT INTO ads (ad_type, id, created_at, impressions, clicks, data) VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (ad_type, ad_id, ad['created_at'], ad['impressions'], ad['clicks'],
+                     json.dumps({k: ad[k] for k in ('title', 'imageUrl', 'targetUrl')}))
+                    for ad_id, ad in ads.items()
+                ]
+            )
+
+
+def serve(ad_count, latency_ms, data_dir, app_log, port_queue):
+    """
+    Processo do servidor: importa o app com o backend em memória, popula o
+    inventário e atende em uma porta livre (informada em `port_queue`).
+    """
+    os.environ['ADS_STORAGE_BACKEND'] = 'memory'
+    os.environ['ADS_MEMORY_LATENCY_MS'] = str(latency_ms)
+    os.environ['ADS_EVENTS_DB'] = os.path.join(data_dir, 'events.db')
+    # Todos os clientes do benchmark saem do mesmo IP: sem limite de taxa
+    os.environ['ADS_RATE_LIMIT_IP_RATE'] = '0'
+    os.environ['ADS_RATE_LIMIT_SESSION_RATE'] = '0'
+
+    from werkzeug.serving import make_server
+    import app as ads_app
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    if not app_log:
+        ads_app.app.logger.setLevel(logging.WARNING)
+
+    ads_app.storage.load(build_inventory(ad_count))
+    ads_app.inventory_cache.invalidate()
+    # Conecta, aquece o inventário e inicia o flush antes da primeira requisição medida
+    ads_app.lifecycle.start()
+
+    server = make_server('127.0.0.1', 0, ads_app.app, threaded=True)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def start_local_server(ad_count, latency_ms, data_dir, app_log):
+    """
+    Inicia o servidor local em um subprocesso.
+
+    Returns:
+        tuple: (processo, url base)
+    """
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve,
+        args=(ad_count, latency_ms, data_dir, app_log, port_queue),
+        daemon=True
+    )
+    process.start()
+    port = port_queue.get(timeout=120)
+    return process, f'http://127.0.0.1:{port}'
+
+
+def fetch_banner_ids(base_url):
+    """
+    Obtém os ids dos banners servíveis, usados nos cenários de clique.
+    """
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+    try:
+        conn.request('GET', '/api/banners')
+        response = conn.getresponse()
+        body = response.read()
+        if response.status != 200:
+            return []
+        return [ad['id'] for ad in json.loads(body)]
+    finally:
+        conn.close()
+
+
+def percentile(sorted_values, pct):
+    """Percentil por posição mais próxima sobre uma lista já ordenada."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def run_scenario(base_url, scenario, total_requests, concurrency, banner_ids, warmup=0, seed=0):
+    """
+    Executa um cenário com `concurrency` clientes simultâneos.
+
+    Args:
+        base_url (str): URL base do servidor
+        scenario (str): Chave de SCENARIOS
+        total_requests (int): Número de requisições medidas
+        concurrency (int): Número de clientes simultâneos
+        banner_ids (list): Ids de banners para os cenários de clique
+        warmup (int): Requisições iniciais descartadas
+        seed (int): Semente do sorteio de banners
+
+    Returns:
+        dict: Vazão, percentis de latência (ms) e contagem de erros
+    """
+    method, path_template = SCENARIOS[scenario]
+    parts = urlsplit(base_url)
+    issued = iter(range(warmup + total_requests))
+    issued_lock = threading.Lock()
+    latencies = []
+    errors = []
+    results_lock = threading.Lock()
+
+    def client(client_index):
+        rng = random.Random(seed * 1000003 + client_index)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+        etag = None
+        local_latencies = []
+        local_errors = 0
+        try:
+            while True:
+                with issued_lock:
+                    sequence = next(issued, None)
+                if sequence is None:
+                    break
+                ad_id = rng.choice(banner_ids) if banner_ids else 'inexistente'
+                path = path_template.format(ad_id=ad_id)
+                headers = {}
+                body = None
+                if scenario == 'click-batch':
+                    body = json.dumps({'adId': ad_id, 'type': 'banner'})
+                    headers['Content-Type'] = 'application/json'
+                elif scenario == 'banners' and etag:
+                    headers['If-None-Match'] = etag
+
+                started = time.perf_counter()
+                try:
+                    conn.request(method, path, body=body, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+                    status = response.status
+                    etag = response.getheader('ETag') or etag
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    status = None
+                elapsed = time.perf_counter() - started
+
+                if sequence < warmup:
+                    continue
+                local_latencies.append(elapsed)
+                if status not in OK_STATUSES:
+                    local_errors += 1
+        finally:
+            conn.close()
+            with results_lock:
+                latencies.extend(local_latencies)
+                errors.append(local_errors)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+
+    latencies.sort()
+    measured = len(latencies)
+    return {
+        'scenario': scenario,
+        'requests': measured,
+        'concurrency': concurrency,
+        'throughput': measured / wall_time if wall_time > 0 else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+        'errors': sum(errors),
+    }
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Compara o p95 de cada medição com a execução de referência.
+
+    Returns:
+        list: Mensagens das medições que pioraram além da tolerância
+    """
+    reference = {
+        (r['ad_count'], r['scenario'], r['concurrency']): r for r in baseline
+    }
+    regressions = []
+    for result in results:
+        previous = reference.get((result['ad_count'], result['scenario'], result['concurrency']))
+        if previous is None or previous['p95_ms'] <= 0:
+            continue
+        change = result['p95_ms'] / previous['p95_ms'] - 1
+        if change > tolerance:
+            regressions.append(
+                f"{result['scenario']} ({result['ad_count']} anúncios, c={result['concurrency']}): "
+                f"p95 {previous['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms (+{change * 100:.0f}%)"
+            )
+    return regressions
+
+
+def print_result(ad_count, result):
+    print(f"{ad_count:>10} {result['scenario']:>12} {result['concurrency']:>5} {result['requests']:>7} "
+          f"{result['throughput']:>9.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+          f"{result['p99_ms']:>8.1f} {result['max_ms']:>8.1f} {result['errors']:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 10000, 100000],
+                        help='Anúncios por tipo no inventário sintético')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS),
+                        default=['get-banner', 'banners', 'click', 'click-batch', 'dashboard'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    parser.add_argument('--requests', type=int, default=2000, help='Requisições medidas por cenário')
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=20.0,
+                        help='Latência simulada por operação do backend (substituto do Firebase)')
+    parser.add_argument('--dashboard-requests', type=int, default=50,
+                        help='Requisições medidas no cenário do dashboard')
+    parser.add_argument('--dashboard-max', type=int, default=100000,
+                        help='Maior inventário medido no cenário do dashboard')
+    parser.add_argument('--url', help='Usa um servidor já em execução em vez do servidor local')
+    parser.add_argument('--seed-sqlite', metavar='PATH',
+                        help='Apenas grava o inventário de --sizes em um banco SQLite e sai')
+    parser.add_argument('--output', help='Grava os resultados em JSON')
+    parser.add_argument('--baseline', help='Resultados JSON de referência para detectar regressões')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Piora máxima aceita do p95 em relação à referência (0.25 = 25%%)')
+    parser.add_argument('--app-log', action='store_true', help='Mantém os logs INFO do app')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.seed_sqlite:
+        seed_sqlite(args.seed_sqlite, args.sizes[0])
+        print(f"{args.sizes[0]} anúncios por tipo gravados em {args.seed_sqlite}")
+        return
+
+    sizes = [None] if args.url else args.sizes
+    results = []
+    print(f"{'anúncios':>10} {'cenário':>12} {'conc':>5} {'reqs':>7} {'req/s':>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'máx ms':>8} {'erros':>6}")
+    for ad_count in sizes:
+        process = None
+        data_dir = tempfile.mkdtemp(prefix='bench_api_')
+        try:
+            if args.url:
+                base_url = args.url.rstrip('/')
+            else:
+                process, base_url = start_local_server(ad_count, args.latency_ms, data_dir, args.app_log)
+            banner_ids = fetch_banner_ids(base_url)
+            if ad_count is None:
+                ad_count = len(banner_ids)
+
+            for scenario in args.scenarios:
+                total_requests = args.requests
+                if scenario == 'dashboard':
+                    if ad_count > args.dashboard_max:
+                        continue
+                    total_requests = args.dashboard_requests
+                for concurrency in args.concurrency:
+                    result = run_scenario(
+                        base_url, scenario, total_requests, concurrency, banner_ids,
+                        warmup=min(args.warmup, total_requests), seed=args.seed
+                    )
+                    result['ad_count'] = ad_count
+                    result['latency_ms'] = None if args.url else args.latency_ms
+                    results.append(result)
+                    print_result(ad_count, result)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.join()
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare_with_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressões de latência:")
+            for message in regressions:
+                print(f"  {message}")
+            sys.exit(1)
+        print("\nSem regressões em relação à referência.")
+
+
+if __name__ == '__main__':
+    main()
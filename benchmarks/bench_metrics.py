@@ -0,0 +1,107 @@
+"""
+Benchmark de AdModel.get_metrics em função do número de anúncios.
+
+Compara o construtor de métricas em uma passada (frio e com cache) com o
+algoritmo anterior, que relia o arquivo de estatísticas para cada anúncio.
+
+Uso:
+    python -m benchmarks.bench_metrics --sizes 100 1000 5000 --repeat 3
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.ads import AdModel
+
+
+def populate(data_dir, ad_count):
+    """
+    Cria um diretório de dados sintético com `ad_count` anúncios de cada tipo.
+
+    Args:
+        data_dir (str): Diretório de dados
+        ad_count (int): Número de anúncios por tipo
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    stats = {'impressions': {}, 'clicks': {}}
+    for file_name, ad_type in (('banners.json', 'banner'), ('fullscreen.json', 'fullscreen')):
+        ads = []
+        for i in range(1, ad_count + 1):
+            ads.append({
+                'id': str(i),
+                'title': f'{ad_type} {i}',
+                'imageUrl': f'https://i.imgur.com/{ad_type}{i}.png',
+                'targetUrl': f'https://example.com/{ad_type}/{i}',
+                'createdAt': '2024-01-01T00:00:00'
+            })
+            stats['impressions'][f'{ad_type}_{i}'] = i * 10
+            stats['clicks'][f'{ad_type}_{i}'] = i
+        with open(os.path.join(data_dir, file_name), 'w') as f:
+            json.dump(ads, f)
+    with open(os.path.join(data_dir, 'stats.json'), 'w') as f:
+        json.dump(stats, f)
+
+
+def legacy_get_metrics(model):
+    """
+    Algoritmo anterior: uma leitura completa de stats.json por anúncio.
+    """
+    result = {}
+    for ad_type, ads in (('banner', model.get_banners()), ('fullscreen', model.get_fullscreen_ads())):
+        total_impressions = 0
+        for ad in ads:
+            stats = model._load_data(model.stats_file)
+            total_impressions += stats.get('impressions', {}).get(f"{ad_type}_{ad['id']}", 0)
+        result[ad_type] = total_impressions
+    return result
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--legacy-max', type=int, default=2000,
+                        help='Maior número de anúncios medido com o algoritmo anterior (quadrático)')
+    args = parser.parse_args()
+
+    print(f"{'anúncios/tipo':>14} {'frio (ms)':>12} {'cache (ms)':>12} {'anterior (ms)':>14}")
+    for ad_count in args.sizes:
+        data_dir = tempfile.mkdtemp(prefix='bench_metrics_')
+        try:
+            populate(data_dir, ad_count)
+            model = AdModel(data_dir)
+
+            def cold():
+                model._metrics_cache = None
+                model.stats_store._totals = None
+                model.get_metrics()
+
+            cold_time = best_of(cold, args.repeat)
+            model.get_metrics()
+            warm_time = best_of(model.get_metrics, args.repeat)
+            if ad_count <= args.legacy_max:
+                legacy = f"{best_of(lambda: legacy_get_metrics(model), 1) * 1000:14.1f}"
+            else:
+                legacy = f"{'-':>14}"
+            print(f"{ad_count:>14} {cold_time * 1000:12.1f} {warm_time * 1000:12.3f} {legacy}")
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+"""
+Configuração do gunicorn (carregada automaticamente a partir do diretório atual).
+
+Uso:
+    gunicorn app:app
+"""
+
+
+def post_worker_init(worker):
+    # Executado no worker, depois do fork e da carga do app e antes de aceitar conexões:
+    # conecta o datastore e aquece o inventário para que a primeira requisição não espere
+    import app as ads_app
+    ads_app.lifecycle.start()
@@ -0,0 +1,139 @@
+"""
+Comandos de manutenção do servidor de anúncios.
+
+Usa o mesmo backend e log de eventos configurados para o app (variáveis de
+ambiente ADS_STORAGE_BACKEND, FIREBASE_DB_URL, ADS_EVENTS_DB etc.).
+
+Uso:
+    python manage.py export --report ads --format csv --output anuncios.csv
+    python manage.py export --report timeseries --granularity day --type banner --format ndjson
+    python manage.py import campanha.csv --type banner
+    python manage.py import campanha.csv --type banner --game meu-jogo
+"""
+import argparse
+import os
+import sys
+
+from models.events import GRANULARITIES
+from models.storage import AD_TYPES
+from services.bulk_import import IMPORT_FORMATS, BulkImportError, detect_format, import_ads
+from services.export import EXPORT_FORMATS, REPORT_COLUMNS, export_report
+
+
+def command_export(ads_app, args):
+    """
+    Grava um relatório de desempenho em um arquivo ou na saída padrão, em pedaços.
+    """
+    chunks = export_report(
+        ads_app.storage,
+        ads_app.event_store,
+        args.report,
+        args.format,
+        ad_type=args.type,
+        ad_id=args.ad_id,
+        granularity=args.granularity,
+        start=args.start,
+        end=args.end
+    )
+    output = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    except BrokenPipeError:
+        # Leitor da saída padrão encerrado antes do fim (ex: | head)
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+
+def command_import(ads_app, args):
+    """
+    Importa um arquivo CSV ou JSON de anúncios em uma única escrita no backend.
+    """
+    import_format = args.format or detect_format(args.file)
+    if import_format is None:
+        print("Não foi possível deduzir o formato pela extensão; use --format.", file=sys.stderr)
+        return 2
+    storage = ads_app.storage
+    if args.game:
+        if not ads_app.games.accepts(args.game):
+            print(f"Jogo inválido ou não habilitado: {args.game} (veja ADS_MULTI_GAME e ADS_GAME_IDS).",
+                  file=sys.stderr)
+            return 2
+        storage = ads_app.storage.for_game(args.game)
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    try:
+        result = import_ads(
+            storage,
+            data,
+            import_format,
+            default_type=args.type,
+            asset_processor=None if args.skip_assets else ads_app.import_asset_processor,
+            dry_run=args.dry_run,
+            wait_assets=True,
+            schedule_tz=ads_app.schedule_tz
+        )
+    except BulkImportError as e:
+        for error in e.errors:
+            field = f" ({error['field']})" if error['field'] else ''
+            print(f"Linha {error['row']}{field}: {error['message']}", file=sys.stderr)
+        print(str(e), file=sys.stderr)
+        return 2
+    if not args.dry_run and not args.game:
+        # Os workers do servidor veem a escrita pelo listener ou ao fim de ADS_CACHE_MAX_STALENESS
+        ads_app.inventory_cache.invalidate()
+    action = 'validados' if args.dry_run else 'gravados'
+    print(f"{result['created']} anúncios novos e {result['updated']} atualizações {action}.")
+    if result.get('assets'):
+        assets = result['assets']
+        print(f"Criativos: {assets['processed']} processados, {assets['failed']} recusados, "
+              f"{assets['expired']} fora do prazo (esses usam a imageUrl original).")
+    for ad_id in result['ids']:
+        print(ad_id)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Comandos de manutenção do servidor de anúncios')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Exporta o desempenho dos anúncios em CSV ou NDJSON')
+    export_parser.add_argument('--report', choices=sorted(REPORT_COLUMNS), default='ads',
+                               help="'ads': uma linha por anúncio; 'timeseries': uma linha por anúncio e bucket")
+    export_parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+    export_parser.add_argument('--type', choices=AD_TYPES, help='Filtra por tipo de anúncio')
+    export_parser.add_argument('--ad-id', help='Filtra por anúncio (timeseries)')
+    export_parser.add_argument('--granularity', choices=sorted(GRANULARITIES), default='hour')
+    export_parser.add_argument('--start', type=int, help='Timestamp Unix inicial (timeseries)')
+    export_parser.add_argument('--end', type=int, help='Timestamp Unix final, exclusivo (timeseries)')
+    export_parser.add_argument('--output', help='Arquivo de saída (padrão: saída padrão)')
+    export_parser.set_defaults(handler=command_export)
+
+    import_parser = subparsers.add_parser('import', help='Cria ou atualiza anúncios em lote a partir de CSV ou JSON')
+    import_parser.add_argument('file', help="Arquivo com as colunas type, id, title, imageUrl, targetUrl, weight")
+    import_parser.add_argument('--format', choices=IMPORT_FORMATS, help='Padrão: deduzido pela extensão')
+    import_parser.add_argument('--type', choices=AD_TYPES, help="Tipo das linhas sem a coluna 'type'")
+    import_parser.add_argument('--game', help='ID do jogo (inventário ads/<game_id>; requer ADS_MULTI_GAME)')
+    import_parser.add_argument('--dry-run', action='store_true', help='Só valida o arquivo, sem gravar')
+    import_parser.add_argument('--skip-assets', action='store_true',
+                               help='Não baixa nem redimensiona os criativos (o jogo usa a imageUrl original)')
+    import_parser.set_defaults(handler=command_import)
+
+    args = parser.parse_args(argv)
+
+    import app as ads_app
+    if not ads_app.storage.connect():
+        print(f"Armazenamento '{ads_app.storage.name}' não pôde ser inicializado.", file=sys.stderr)
+        return 1
+    try:
+        return args.handler(ads_app, args)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
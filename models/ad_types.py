@@ -0,0 +1,88 @@
+"""
+Registro dos formatos de anúncio.
+Cada formato declara aqui suas dimensões, o caminho no RTDB e a política de
+seleção; backends, cache de inventário, rotas do dashboard e exportação
+percorrem o registro, então um formato novo é uma entrada nesta lista.
+"""
+
+
+class AdType:
+    """
+    Descrição de um formato de anúncio.
+    """
+
+    def __init__(self, name, label, label_plural, noun, width, height, firebase_path,
+                 data_file=None, icon='bi-image', selection=None, scheduling=False,
+                 targeting=False):
+        """
+        Args:
+            name (str): Identificador usado nas rotas, nos eventos e no datastore
+            label (str): Nome exibido no dashboard (ex: 'Banner')
+            label_plural (str): Nome no plural (ex: 'Banners')
+            noun (str): Substantivo usado nos textos de ajuda (ex: 'banner', 'anúncio')
+            width (int): Largura recomendada da imagem em pixels
+            height (int): Altura recomendada da imagem em pixels
+            firebase_path (str): Caminho no RTDB, sempre dentro de 'ads/' (lido e
+                observado de uma vez pelo cache de inventário)
+            data_file (str): Arquivo JSON do modelo legado (models/ads.py)
+            icon (str): Ícone do Bootstrap Icons usado no dashboard
+            selection (str): Estratégia de seleção própria do formato (chave de
+                services.selection.STRATEGIES); None usa ADS_SELECTION_STRATEGY
+            scheduling (bool): Se o dashboard e a importação aceitam início, fim e
+                orçamento de impressões (services/scheduling.py) para o formato
+            targeting (bool): Se o dashboard e a importação aceitam regras de país, idioma,
+                dispositivo e versão do jogo (services/targeting.py) para o formato
+        """
+        self.name = name
+        self.label = label
+        self.label_plural = label_plural
+        self.noun = noun
+        self.width = width
+        self.height = height
+        self.firebase_path = firebase_path
+        self.data_file = data_file or f'{name}.json'
+        self.icon = icon
+        self.selection = selection
+        self.scheduling = scheduling
+        self.targeting = targeting
+
+    @property
+    def size(self):
+        """Dimensões recomendadas no formato '360x47'."""
+        return f'{self.width}x{self.height}'
+
+    def __repr__(self):
+        return f'AdType({self.name!r})'
+
+
+# Formatos suportados, na ordem em que aparecem no dashboard e no manifesto
+REGISTERED_AD_TYPES = (
+    AdType('banner', 'Banner', 'Banners', 'banner', 360, 47,
+           'ads/banners', data_file='banners.json', icon='bi-image', scheduling=True,
+           targeting=True),
+    AdType('fullscreen', 'Anúncio de Tela Cheia', 'Anúncios de Tela Cheia', 'anúncio', 360, 640,
+           'ads/fullscreen_ads', data_file='fullscreen.json', icon='bi-phone', scheduling=True,
+           targeting=True),
+    AdType('interstitial', 'Anúncio Intersticial', 'Anúncios Intersticiais', 'anúncio', 360, 640,
+           'ads/interstitial_ads', icon='bi-aspect-ratio', selection='least_impressions'),
+    AdType('rewarded', 'Anúncio com Recompensa', 'Anúncios com Recompensa', 'anúncio', 360, 640,
+           'ads/rewarded_ads', icon='bi-gift', selection='weighted'),
+)
+
+AD_TYPE_REGISTRY = {ad_type.name: ad_type for ad_type in REGISTERED_AD_TYPES}
+
+# Nomes dos tipos, na ordem do registro
+AD_TYPES = tuple(AD_TYPE_REGISTRY)
+
+
+def get_ad_type(name):
+    """
+    Obtém a descrição de um formato pelo nome.
+
+    Args:
+        name (str): Nome do tipo de anúncio
+
+    Returns:
+        AdType: Formato registrado ou None se o nome não existir
+    """
+    return AD_TYPE_REGISTRY.get(name)
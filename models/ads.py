@@ -1,29 +1,40 @@
 """
 Modelo de dados para o sistema de anúncios.
-Gerencia banners e anúncios de tela cheia.
+Gerencia os formatos do registro (models/ad_types.py), um arquivo JSON por formato.
 """
 import os
 import json
 import logging
+import tempfile
 from datetime import datetime
 
+from models.ad_types import AD_TYPE_REGISTRY, AD_TYPES
+from models.stats_store import StatsLogStore
+
 class AdModel:
     """
     Modelo para gerenciar anúncios no sistema.
-    Suporta banners (360x47px) e anúncios de tela cheia (360x640px).
+    Suporta os formatos registrados em AD_TYPE_REGISTRY (banners de 360x47px,
+    anúncios de tela cheia de 360x640px etc.).
     """
     
-    def __init__(self, data_dir='data', data_file=None):
+    def __init__(self, data_dir='data', data_file=None, fsync_interval=1.0, compact_bytes=1024 * 1024):
         """
         Inicializa o modelo com o diretório de dados especificado.
         
         Args:
             data_dir (str): Diretório onde os dados serão armazenados
             data_file (str): Arquivo de dados opcional (para compatibilidade)
+            fsync_interval (float): Intervalo mínimo entre fsyncs do log de estatísticas
+            compact_bytes (int): Tamanho do log de estatísticas que dispara a compactação
         """
         self.data_dir = data_dir
-        self.banners_file = os.path.join(data_dir, 'banners.json')
-        self.fullscreen_file = os.path.join(data_dir, 'fullscreen.json')
+        # Um arquivo JSON por formato do registro
+        self.ad_files = {
+            ad_type: os.path.join(data_dir, info.data_file) for ad_type, info in AD_TYPE_REGISTRY.items()
+        }
+        self.banners_file = self.ad_files['banner']
+        self.fullscreen_file = self.ad_files['fullscreen']
         self.stats_file = os.path.join(data_dir, 'stats.json')
         
         # Criar diretório de dados se não existir
@@ -31,9 +42,19 @@ class AdModel:
             os.makedirs(data_dir)
         
         # Inicializar arquivos se não existirem
-        self._init_file(self.banners_file, [])
-        self._init_file(self.fullscreen_file, [])
+        for file_path in self.ad_files.values():
+            self._init_file(file_path, [])
         self._init_file(self.stats_file, {'impressions': {}, 'clicks': {}})
+        
+        # Impressões e cliques vão para um log incremental com lock entre processos
+        self.stats_store = StatsLogStore(
+            self.stats_file,
+            fsync_interval=fsync_interval,
+            compact_bytes=compact_bytes
+        )
+        
+        # Cache de get_metrics: (chave de validade, métricas)
+        self._metrics_cache = None
     
     def _init_file(self, file_path, default_data):
         """
@@ -78,13 +99,28 @@ class AdModel:
             bool: True se os dados foram salvos com sucesso, False caso contrário
         """
         try:
-            with open(file_path, 'w') as f:
+            # Escrita em arquivo temporário + rename para nunca deixar o arquivo pela metade
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or '.', suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
                 json.dump(data, f, indent=2)
+            os.replace(tmp_path, file_path)
             return True
         except Exception as e:
             logging.error(f"Erro ao salvar dados em {file_path}: {str(e)}")
             return False
     
+    def get_ads(self, ad_type):
+        """
+        Obtém todos os anúncios de um formato.
+        
+        Args:
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
+            
+        Returns:
+            list: Lista de anúncios
+        """
+        return self._load_data(self.ad_files[ad_type])
+    
     def get_banners(self):
         """
         Obtém todos os banners.
@@ -92,7 +128,7 @@ class AdModel:
         Returns:
             list: Lista de banners
         """
-        return self._load_data(self.banners_file)
+        return self.get_ads('banner')
     
     def get_fullscreen_ads(self):
         """
@@ -101,47 +137,14 @@ class AdModel:
         Returns:
             list: Lista de anúncios de tela cheia
         """
-        return self._load_data(self.fullscreen_file)
+        return self.get_ads('fullscreen')
     
-    def add_banner(self, title, image_url, target_url):
+    def add_ad(self, ad_type, title, image_url, target_url):
         """
-        Adiciona um novo banner.
-        
-        Args:
-            title (str): Título do banner
-            image_url (str): URL da imagem do banner
-            target_url (str): URL de destino do banner
-            
-        Returns:
-            dict: Banner adicionado
-        """
-        banners = self.get_banners()
-        
-        # Gerar ID único
-        banner_id = str(len(banners) + 1)
-        
-        # Criar banner
-        banner = {
-            'id': banner_id,
-            'title': title,
-            'imageUrl': image_url,
-            'targetUrl': target_url,
-            'createdAt': datetime.now().isoformat()
-        }
-        
-        # Adicionar banner à lista
-        banners.append(banner)
-        
-        # Salvar lista atualizada
-        self._save_data(self.banners_file, banners)
-        
-        return banner
-    
-    def add_fullscreen_ad(self, title, image_url, target_url):
-        """
-        Adiciona um novo anúncio de tela cheia.
+        Adiciona um novo anúncio de um formato.
         
         Args:
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
             title (str): Título do anúncio
             image_url (str): URL da imagem do anúncio
             target_url (str): URL de destino do anúncio
@@ -149,7 +152,7 @@ class AdModel:
         Returns:
             dict: Anúncio adicionado
         """
-        ads = self.get_fullscreen_ads()
+        ads = self.get_ads(ad_type)
         
         # Gerar ID único
         ad_id = str(len(ads) + 1)
@@ -167,37 +170,42 @@ class AdModel:
         ads.append(ad)
         
         # Salvar lista atualizada
-        self._save_data(self.fullscreen_file, ads)
+        self._save_data(self.ad_files[ad_type], ads)
+        self._metrics_cache = None
         
         return ad
     
+    def add_banner(self, title, image_url, target_url):
+        """
+        Adiciona um novo banner.
+        
+        Returns:
+            dict: Banner adicionado
+        """
+        return self.add_ad('banner', title, image_url, target_url)
+    
+    def add_fullscreen_ad(self, title, image_url, target_url):
+        """
+        Adiciona um novo anúncio de tela cheia.
+        
+        Returns:
+            dict: Anúncio adicionado
+        """
+        return self.add_ad('fullscreen', title, image_url, target_url)
+    
     def record_impression(self, ad_id, ad_type):
         """
         Registra uma impressão de anúncio.
         
         Args:
             ad_id (str): ID do anúncio
-            ad_type (str): Tipo do anúncio ('banner' ou 'fullscreen')
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
             
         Returns:
             bool: True se a impressão foi registrada com sucesso, False caso contrário
         """
-        stats = self._load_data(self.stats_file)
-        
-        # Inicializar contadores se necessário
-        if 'impressions' not in stats:
-            stats['impressions'] = {}
-        
-        key = f"{ad_type}_{ad_id}"
-        
-        if key not in stats['impressions']:
-            stats['impressions'][key] = 0
-        
-        # Incrementar contador
-        stats['impressions'][key] += 1
-        
-        # Salvar estatísticas atualizadas
-        return self._save_data(self.stats_file, stats)
+        self._metrics_cache = None
+        return self.stats_store.increment('impressions', f"{ad_type}_{ad_id}")
     
     def record_click(self, ad_id, ad_type):
         """
@@ -205,27 +213,13 @@ class AdModel:
         
         Args:
             ad_id (str): ID do anúncio
-            ad_type (str): Tipo do anúncio ('banner' ou 'fullscreen')
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
             
         Returns:
             bool: True se o clique foi registrado com sucesso, False caso contrário
         """
-        stats = self._load_data(self.stats_file)
-        
-        # Inicializar contadores se necessário
-        if 'clicks' not in stats:
-            stats['clicks'] = {}
-        
-        key = f"{ad_type}_{ad_id}"
-        
-        if key not in stats['clicks']:
-            stats['clicks'][key] = 0
-        
-        # Incrementar contador
-        stats['clicks'][key] += 1
-        
-        # Salvar estatísticas atualizadas
-        return self._save_data(self.stats_file, stats)
+        self._metrics_cache = None
+        return self.stats_store.increment('clicks', f"{ad_type}_{ad_id}")
     
     def get_stats(self):
         """
@@ -234,7 +228,22 @@ class AdModel:
         Returns:
             dict: Estatísticas de impressões e cliques
         """
-        return self._load_data(self.stats_file)
+        return self.stats_store.get_stats()
+    
+    def get_type_stats(self, ad_type):
+        """
+        Obtém estatísticas detalhadas dos anúncios de um formato.
+        
+        Usa as métricas em cache de get_metrics, então consultar vários
+        formatos lê cada arquivo de dados uma única vez.
+        
+        Args:
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
+            
+        Returns:
+            list: Lista de anúncios com impressões, cliques e CTR (cópias)
+        """
+        return [dict(ad) for ad in self.get_metrics()[ad_type]['ads']]
     
     def get_banner_stats(self):
         """
@@ -243,23 +252,7 @@ class AdModel:
         Returns:
             list: Lista de banners com estatísticas
         """
-        banners = self.get_banners()
-        stats = self.get_stats()
-        
-        for banner in banners:
-            banner_id = banner['id']
-            key = f"banner_{banner_id}"
-            
-            banner['impressions'] = stats.get('impressions', {}).get(key, 0)
-            banner['clicks'] = stats.get('clicks', {}).get(key, 0)
-            
-            # Calcular taxa de cliques
-            if banner['impressions'] > 0:
-                banner['ctr'] = round(banner['clicks'] / banner['impressions'] * 100, 2)
-            else:
-                banner['ctr'] = 0
-        
-        return banners
+        return self.get_type_stats('banner')
     
     def get_fullscreen_stats(self):
         """
@@ -268,101 +261,95 @@ class AdModel:
         Returns:
             list: Lista de anúncios de tela cheia com estatísticas
         """
-        ads = self.get_fullscreen_ads()
-        stats = self.get_stats()
+        return self.get_type_stats('fullscreen')
+    
+    def _metrics_cache_key(self):
+        """
+        Monta a chave de validade do cache de métricas a partir dos arquivos de dados.
         
-        for ad in ads:
-            ad_id = ad['id']
-            key = f"fullscreen_{ad_id}"
-            
-            ad['impressions'] = stats.get('impressions', {}).get(key, 0)
-            ad['clicks'] = stats.get('clicks', {}).get(key, 0)
-            
-            # Calcular taxa de cliques
-            if ad['impressions'] > 0:
-                ad['ctr'] = round(ad['clicks'] / ad['impressions'] * 100, 2)
-            else:
-                ad['ctr'] = 0
+        Alterações feitas por outros processos mudam o tamanho ou o mtime de
+        algum dos arquivos e invalidam o cache.
         
-        return ads
+        Returns:
+            tuple: (mtime, tamanho) de cada arquivo de dados
+        """
+        key = []
+        for file_path in (*self.ad_files.values(), self.stats_file, self.stats_store.log_file):
+            try:
+                st = os.stat(file_path)
+                key.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                key.append(None)
+        return tuple(key)
     
-    def get_metrics(self):
+    def _build_type_metrics(self, ads, ad_type, stats):
         """
-        Obtém métricas completas para o dashboard.
+        Junta as estatísticas aos anúncios de um tipo em uma única passada.
         
+        Args:
+            ads (list): Anúncios do tipo
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
+            stats (dict): Estatísticas carregadas uma única vez
+            
         Returns:
-            dict: Métricas formatadas para o dashboard
+            dict: Métricas do tipo de anúncio para o dashboard
         """
-        # Preparar métricas para banners
-        banner_ads = []
-        total_banner_impressions = 0
-        total_banner_clicks = 0
-        
-        for banner in self.get_banners():
-            banner_id = banner['id']
-            key = f"banner_{banner_id}"
-            stats = self.get_stats()
-            impressions = stats.get('impressions', {}).get(key, 0)
-            clicks = stats.get('clicks', {}).get(key, 0)
-            
-            total_banner_impressions += impressions
-            total_banner_clicks += clicks
-            
-            banner_with_metrics = banner.copy()
-            banner_with_metrics['impressions'] = impressions
-            banner_with_metrics['clicks'] = clicks
-            banner_with_metrics['linkUrl'] = banner['targetUrl']  # Compatibilidade com o template
-            banner_with_metrics['lastShown'] = banner.get('createdAt', '')
-            
-            banner_ads.append(banner_with_metrics)
-        
-        # Calcular CTR para banners
-        banner_ctr = 0
-        if total_banner_impressions > 0:
-            banner_ctr = round((total_banner_clicks / total_banner_impressions) * 100, 2)
-        
-        # Preparar métricas para anúncios de tela cheia
-        fullscreen_ads = []
-        total_fullscreen_impressions = 0
-        total_fullscreen_clicks = 0
-        
-        for ad in self.get_fullscreen_ads():
-            ad_id = ad['id']
-            key = f"fullscreen_{ad_id}"
-            stats = self.get_stats()
-            impressions = stats.get('impressions', {}).get(key, 0)
-            clicks = stats.get('clicks', {}).get(key, 0)
+        impressions_by_key = stats.get('impressions', {})
+        clicks_by_key = stats.get('clicks', {})
+        ads_with_metrics = []
+        total_impressions = 0
+        total_clicks = 0
+        
+        for ad in ads:
+            key = f"{ad_type}_{ad['id']}"
+            impressions = impressions_by_key.get(key, 0)
+            clicks = clicks_by_key.get(key, 0)
             
-            total_fullscreen_impressions += impressions
-            total_fullscreen_clicks += clicks
+            total_impressions += impressions
+            total_clicks += clicks
             
             ad_with_metrics = ad.copy()
             ad_with_metrics['impressions'] = impressions
             ad_with_metrics['clicks'] = clicks
+            ad_with_metrics['ctr'] = round(clicks / impressions * 100, 2) if impressions > 0 else 0
             ad_with_metrics['linkUrl'] = ad['targetUrl']  # Compatibilidade com o template
             ad_with_metrics['lastShown'] = ad.get('createdAt', '')
             
-            fullscreen_ads.append(ad_with_metrics)
+            ads_with_metrics.append(ad_with_metrics)
         
-        # Calcular CTR para anúncios de tela cheia
-        fullscreen_ctr = 0
-        if total_fullscreen_impressions > 0:
-            fullscreen_ctr = round((total_fullscreen_clicks / total_fullscreen_impressions) * 100, 2)
+        # Calcular CTR do tipo de anúncio
+        ctr = 0
+        if total_impressions > 0:
+            ctr = round((total_clicks / total_impressions) * 100, 2)
         
-        # Estrutura final de métricas
         return {
-            'banner': {
-                'ads': banner_ads,
-                'ads_count': len(self.get_banners()),
-                'total_impressions': total_banner_impressions,
-                'total_clicks': total_banner_clicks,
-                'ctr': banner_ctr
-            },
-            'fullscreen': {
-                'ads': fullscreen_ads,
-                'ads_count': len(self.get_fullscreen_ads()),
-                'total_impressions': total_fullscreen_impressions,
-                'total_clicks': total_fullscreen_clicks,
-                'ctr': fullscreen_ctr
-            }
+            'ads': ads_with_metrics,
+            'ads_count': len(ads),
+            'total_impressions': total_impressions,
+            'total_clicks': total_clicks,
+            'ctr': ctr
         }
+    
+    def get_metrics(self):
+        """
+        Obtém métricas completas para o dashboard.
+        
+        Cada fonte (o arquivo de cada formato e as estatísticas) é lida uma
+        única vez, e o resultado fica em cache até que algum arquivo de dados
+        mude. O dicionário retornado é compartilhado e não deve ser modificado.
+        
+        Returns:
+            dict: Métricas formatadas para o dashboard
+        """
+        cache_key = self._metrics_cache_key()
+        if self._metrics_cache is not None and self._metrics_cache[0] == cache_key:
+            return self._metrics_cache[1]
+        
+        stats = self.get_stats()
+        metrics = {
+            ad_type: self._build_type_metrics(self.get_ads(ad_type), ad_type, stats)
+            for ad_type in AD_TYPES
+        }
+        
+        self._metrics_cache = (cache_key, metrics)
+        return metrics
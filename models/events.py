@@ -0,0 +1,293 @@
+"""
+Armazenamento de eventos de impressões e cliques.
+Log de eventos somente-anexação em SQLite (modo WAL), com tabelas de
+agregação por minuto, hora e dia atualizadas de forma incremental.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Granularidades de agregação e o tamanho de cada bucket em segundos
+GRANULARITIES = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+# Tipos de evento aceitos e a coluna de agregação correspondente
+EVENT_FIELDS = ('impressions', 'clicks')
+
+
+class EventStore:
+    """
+    Log de eventos com agregações pré-calculadas por intervalo de tempo.
+
+    Cada gravação anexa os eventos brutos e atualiza os buckets de minuto,
+    hora e dia na mesma transação, então as consultas de série temporal
+    leem apenas as tabelas agregadas. Com `retention`, os eventos brutos mais
+    antigos que a retenção são removidos periodicamente pela própria thread
+    que grava (as agregações são mantidas).
+    """
+
+    def __init__(self, db_path='data/events.db', retention=None, prune_interval=3600.0):
+        """
+        Inicializa o armazenamento e cria as tabelas se necessário.
+
+        Args:
+            db_path (str): Caminho do arquivo SQLite
+            retention (float): Retenção dos eventos brutos em segundos (None mantém tudo)
+            prune_interval (float): Intervalo mínimo entre remoções em segundos
+        """
+        self.db_path = db_path
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.pruned_events = 0
+        self._next_prune_at = 0.0
+        self._local = threading.local()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+
+        self._init_schema()
+
+    def reset_after_fork(self):
+        """
+        Descarta as conexões abertas pelo processo pai antes de um fork.
+        """
+        self._local = threading.local()
+
+    def _connect(self):
+        """
+        Obtém a conexão SQLite da thread atual.
+
+        Returns:
+            sqlite3.Connection: Conexão aberta
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS events ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+                ' ts INTEGER NOT NULL,'
+                ' ad_type TEXT NOT NULL,'
+                ' ad_id TEXT NOT NULL,'
+                ' field TEXT NOT NULL,'
+                ' count INTEGER NOT NULL,'
+                ' game_id TEXT)'
+            )
+            # Bancos criados antes da coluna game_id
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(events)')}
+            if 'game_id' not in columns:
+                conn.execute('ALTER TABLE events ADD COLUMN game_id TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS events_ts ON events (ts)')
+            for granularity in GRANULARITIES:
+                conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS rollup_{granularity} ('
+                    ' bucket INTEGER NOT NULL,'
+                    ' ad_type TEXT NOT NULL,'
+                    ' ad_id TEXT NOT NULL,'
+                    ' impressions INTEGER NOT NULL DEFAULT 0,'
+                    ' clicks INTEGER NOT NULL DEFAULT 0,'
+                    ' PRIMARY KEY (bucket, ad_type, ad_id)) WITHOUT ROWID'
+                )
+                conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS rollup_{granularity}_type_bucket'
+                    f' ON rollup_{granularity} (ad_type, bucket)'
+                )
+
+    def record_increments(self, increments, ts=None, game_id=None, event_times=None):
+        """
+        Anexa um lote de incrementos ao log e atualiza as agregações.
+
+        Args:
+            increments (dict): {(ad_type, ad_id, field): n}, como no CounterBuffer
+            ts (float): Timestamp Unix dos eventos sem horário em `event_times` (padrão: agora)
+            game_id (str): Jogo dos eventos (None para o inventário padrão)
+            event_times (dict): {(ad_type, ad_id, field): {timestamp Unix: n}} com o
+                horário em que cada evento chegou; cada timestamp vira uma linha
+
+        Returns:
+            int: Número de eventos gravados
+        """
+        now = time.time()
+        ts = int(ts if ts is not None else now)
+        event_times = event_times or {}
+        rows = []
+        for key, count in increments.items():
+            ad_type, ad_id, field = key
+            if field not in EVENT_FIELDS or not count:
+                continue
+            times = event_times.get(key)
+            if not times or sum(times.values()) != count:
+                times = {ts: count}
+            rows.extend(
+                (int(event_ts), ad_type, ad_id, field, event_count, game_id)
+                for event_ts, event_count in sorted(times.items())
+                if event_count
+            )
+        if not rows:
+            return 0
+
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'INSERT INTO events (ts, ad_type, ad_id, field, count, game_id) VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            for granularity, size in GRANULARITIES.items():
+                conn.executemany(
+                    f'INSERT INTO rollup_{granularity} (bucket, ad_type, ad_id, impressions, clicks)'
+                    ' VALUES (?, ?, ?, ?, ?)'
+                    ' ON CONFLICT (bucket, ad_type, ad_id) DO UPDATE SET'
+                    ' impressions = impressions + excluded.impressions,'
+                    ' clicks = clicks + excluded.clicks',
+                    [
+                        (row_ts - row_ts % size, ad_type, ad_id,
+                         count if field == 'impressions' else 0,
+                         count if field == 'clicks' else 0)
+                        for row_ts, ad_type, ad_id, field, count, _ in rows
+                    ]
+                )
+        self._maybe_prune(now)
+        return sum(row[4] for row in rows)
+
+    def _maybe_prune(self, now):
+        """
+        Remove os eventos fora da retenção, no máximo uma vez por `prune_interval`.
+
+        Roda na thread que grava os lotes (a de flush do CounterBuffer); uma
+        falha aqui é registrada e não afeta o lote já gravado.
+        """
+        if not self.retention or now < self._next_prune_at:
+            return
+        self._next_prune_at = now + self.prune_interval
+        try:
+            removed = self.prune_events(now - self.retention)
+        except Exception as e:
+            logger.error(f"Erro ao remover eventos antigos do log: {e}", exc_info=True)
+            return
+        self.pruned_events += removed
+        if removed:
+            logger.info(f"{removed} eventos com mais de {self.retention:.0f}s removidos do log")
+
+    def get_series(self, granularity='hour', ad_type=None, ad_id=None, start=None, end=None):
+        """
+        Obtém a série temporal de impressões, cliques e CTR.
+
+        Args:
+            granularity (str): 'minute', 'hour' ou 'day'
+            ad_type (str): Filtra por tipo de anúncio (opcional)
+            ad_id (str): Filtra por anúncio (opcional)
+            start (int): Timestamp Unix inicial, inclusivo (opcional)
+            end (int): Timestamp Unix final, exclusivo (opcional)
+
+        Returns:
+            list: Buckets em ordem cronológica com impressões, cliques e CTR
+        """
+        where, params = self._rollup_filters(granularity, ad_type, ad_id, start, end)
+
+        rows = self._connect().execute(
+            f'SELECT bucket, SUM(impressions), SUM(clicks) FROM rollup_{granularity}{where}'
+            ' GROUP BY bucket ORDER BY bucket',
+            params
+        ).fetchall()
+
+        return [
+            {
+                'bucket': bucket,
+                'impressions': impressions,
+                'clicks': clicks,
+                'ctr': round(clicks / impressions * 100, 2) if impressions else 0.0,
+            }
+            for bucket, impressions, clicks in rows
+        ]
+
+    def _rollup_filters(self, granularity, ad_type, ad_id, start, end):
+        """
+        Monta o WHERE das consultas nas tabelas de agregação.
+
+        Returns:
+            tuple: (cláusula WHERE ou '', parâmetros)
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Granularidade inválida: {granularity}")
+
+        conditions = []
+        params = []
+        if ad_type:
+            conditions.append('ad_type = ?')
+            params.append(ad_type)
+        if ad_id:
+            conditions.append('ad_id = ?')
+            params.append(ad_id)
+        if start is not None:
+            conditions.append('bucket >= ?')
+            params.append(int(start) - int(start) % GRANULARITIES[granularity])
+        if end is not None:
+            conditions.append('bucket < ?')
+            params.append(int(end))
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        return where, params
+
+    def iter_rollup(self, granularity='hour', ad_type=None, ad_id=None, start=None, end=None, batch_size=1000):
+        """
+        Percorre as agregações por anúncio e bucket, em blocos, sem materializar o resultado.
+
+        Usa uma conexão própria (fechada ao fim da iteração), então o gerador
+        pode ser consumido por threads diferentes da que o criou.
+
+        Args:
+            granularity (str): 'minute', 'hour' ou 'day'
+            ad_type (str): Filtra por tipo de anúncio (opcional)
+            ad_id (str): Filtra por anúncio (opcional)
+            start (int): Timestamp Unix inicial, inclusivo (opcional)
+            end (int): Timestamp Unix final, exclusivo (opcional)
+            batch_size (int): Linhas lidas do SQLite por vez
+
+        Yields:
+            tuple: (bucket, ad_type, ad_id, impressions, clicks) em ordem cronológica
+        """
+        where, params = self._rollup_filters(granularity, ad_type, ad_id, start, end)
+        conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        try:
+            cursor = conn.execute(
+                f'SELECT bucket, ad_type, ad_id, impressions, clicks FROM rollup_{granularity}{where}'
+                ' ORDER BY bucket, ad_type, ad_id',
+                params
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            conn.close()
+
+    def prune_events(self, before_ts):
+        """
+        Remove eventos brutos antigos; as agregações são mantidas.
+
+        Args:
+            before_ts (int): Remove eventos com timestamp menor que este
+
+        Returns:
+            int: Número de linhas removidas
+        """
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute('DELETE FROM events WHERE ts < ?', (int(before_ts),))
+        return cursor.rowcount
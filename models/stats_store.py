@@ -0,0 +1,244 @@
+"""
+Armazenamento incremental de estatísticas para o AdModel.
+Cada impressão/clique é anexado a um log em disco (custo constante por
+evento); o log é compactado periodicamente em um snapshot JSON. Um lock de
+arquivo garante a consistência entre processos (workers do gunicorn).
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: apenas o lock entre threads fica disponível
+    fcntl = None
+
+# Cabeçalho da primeira linha do log, com o número da geração
+LOG_HEADER_PREFIX = '#gen '
+
+
+class FileLock:
+    """
+    Lock entre processos baseado em flock, combinado com um lock entre threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def __call__(self, shared=False):
+        with self._thread_lock:
+            with open(self.path, 'a') as fd:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                try:
+                    yield self
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class StatsLogStore:
+    """
+    Contadores de impressões e cliques em snapshot + log de deltas.
+
+    Formato do snapshot (compatível com o antigo stats.json):
+        {"impressions": {chave: n}, "clicks": {chave: n}, "log_generation": g}
+    Formato do log: cabeçalho "#gen <g>" seguido de linhas "<campo>\\t<chave>\\t<n>".
+    Um log cuja geração já está incluída no snapshot é ignorado, o que torna a
+    compactação segura mesmo se o processo cair no meio dela.
+    """
+
+    def __init__(self, stats_file, fsync_interval=1.0, compact_bytes=1024 * 1024):
+        """
+        Inicializa o armazenamento.
+
+        Args:
+            stats_file (str): Caminho do snapshot (ex: data/stats.json)
+            fsync_interval (float): Intervalo mínimo entre fsyncs do log em segundos
+                (0 faz fsync a cada evento)
+            compact_bytes (int): Tamanho do log que dispara a compactação
+        """
+        self.stats_file = stats_file
+        self.log_file = stats_file + '.log'
+        self.fsync_interval = fsync_interval
+        self.compact_bytes = compact_bytes
+        self.lock = FileLock(stats_file + '.lock')
+
+        self._totals = None
+        self._log_generation = None
+        self._log_offset = 0
+        self._last_fsync = 0.0
+        self._unsynced = False
+
+        with self.lock():
+            self._ensure_log()
+
+    def _ensure_log(self):
+        if not os.path.exists(self.log_file):
+            snapshot = self._load_snapshot()
+            self._write_log_header(self.log_file, snapshot.get('log_generation', 0) + 1)
+
+    def _write_log_header(self, path, generation):
+        with open(path, 'w') as f:
+            f.write(f"{LOG_HEADER_PREFIX}{generation}\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _load_snapshot(self):
+        try:
+            with open(self.stats_file, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except Exception as e:
+            logging.error(f"Erro ao carregar snapshot de estatísticas {self.stats_file}: {str(e)}")
+            data = {}
+        data.setdefault('impressions', {})
+        data.setdefault('clicks', {})
+        data.setdefault('log_generation', 0)
+        return data
+
+    def _apply_log(self, totals, start_offset):
+        """
+        Aplica as linhas do log a partir de um offset.
+
+        Returns:
+            int: Offset final lido (última linha completa)
+        """
+        with open(self.log_file, 'r') as f:
+            f.seek(start_offset)
+            offset = start_offset
+            for line in f:
+                if not line.endswith('\n'):
+                    # Linha incompleta (escrita em andamento ou interrompida)
+                    break
+                offset += len(line.encode('utf-8'))
+                if line.startswith(LOG_HEADER_PREFIX):
+                    if int(line[len(LOG_HEADER_PREFIX):]) <= totals['log_generation']:
+                        # Log já incluído no snapshot (compactação interrompida)
+                        return os.path.getsize(self.log_file)
+                    continue
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 3 or parts[0] not in ('impressions', 'clicks'):
+                    continue
+                counters = totals[parts[0]]
+                counters[parts[1]] = counters.get(parts[1], 0) + int(parts[2])
+        return offset
+
+    def _refresh(self):
+        """
+        Atualiza os totais em memória lendo apenas o trecho novo do log.
+        Deve ser chamado com o lock (compartilhado ou exclusivo) adquirido.
+        """
+        generation = self._current_generation()
+        if self._totals is None or generation != self._log_generation:
+            # Primeira leitura ou log compactado por outro processo
+            self._totals = self._load_snapshot()
+            self._log_generation = generation
+            self._log_offset = 0
+        self._log_offset = self._apply_log(self._totals, self._log_offset)
+
+    def increment(self, field, key, amount=1):
+        """
+        Anexa um incremento ao log.
+
+        Args:
+            field (str): 'impressions' ou 'clicks'
+            key (str): Chave do anúncio (ex: 'banner_1')
+            amount (int): Valor do incremento
+
+        Returns:
+            bool: True se o incremento foi gravado, False caso contrário
+        """
+        if '\t' in key or '\n' in key:
+            logging.error(f"Chave de estatística inválida: {key!r}")
+            return False
+        try:
+            with self.lock():
+                with open(self.log_file, 'a') as f:
+                    f.write(f"{field}\t{key}\t{int(amount)}\n")
+                    f.flush()
+                    now = time.monotonic()
+                    if now - self._last_fsync >= self.fsync_interval:
+                        os.fsync(f.fileno())
+                        self._last_fsync = now
+                        self._unsynced = False
+                    else:
+                        self._unsynced = True
+                    log_size = f.tell()
+                if log_size >= self.compact_bytes:
+                    self._compact_locked()
+            return True
+        except Exception as e:
+            logging.error(f"Erro ao gravar incremento em {self.log_file}: {str(e)}")
+            return False
+
+    def sync(self):
+        """
+        Força o fsync do log se houver escritas pendentes.
+        """
+        if not self._unsynced:
+            return
+        with self.lock():
+            with open(self.log_file, 'a') as f:
+                os.fsync(f.fileno())
+            self._last_fsync = time.monotonic()
+            self._unsynced = False
+
+    def get_stats(self):
+        """
+        Obtém os totais de impressões e cliques.
+
+        Returns:
+            dict: {'impressions': {chave: n}, 'clicks': {chave: n}}
+        """
+        with self.lock(shared=True):
+            self._refresh()
+            return {
+                'impressions': dict(self._totals['impressions']),
+                'clicks': dict(self._totals['clicks']),
+            }
+
+    def compact(self):
+        """
+        Incorpora o log ao snapshot e inicia um novo log vazio.
+        """
+        with self.lock():
+            self._compact_locked()
+
+    def _compact_locked(self):
+        self._refresh()
+        generation = self._current_generation()
+
+        snapshot = {
+            'impressions': self._totals['impressions'],
+            'clicks': self._totals['clicks'],
+            'log_generation': generation,
+        }
+        tmp_snapshot = self.stats_file + '.tmp'
+        with open(tmp_snapshot, 'w') as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_snapshot, self.stats_file)
+
+        tmp_log = self.log_file + '.tmp'
+        self._write_log_header(tmp_log, generation + 1)
+        os.replace(tmp_log, self.log_file)
+
+        self._totals['log_generation'] = generation
+        self._log_generation = generation + 1
+        self._log_offset = 0
+        self._unsynced = False
+
+    def _current_generation(self):
+        with open(self.log_file, 'r') as f:
+            header = f.readline()
+        if header.startswith(LOG_HEADER_PREFIX):
+            return int(header[len(LOG_HEADER_PREFIX):])
+        return None
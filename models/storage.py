@@ -0,0 +1,1314 @@
+"""
+Backends de armazenamento de anúncios.
+Todas as rotas acessam os dados por esta interface, o que permite rodar o
+servidor contra o Firebase RTDB, um arquivo SQLite local ou a memória
+(testes de carga sem rede).
+"""
+import bisect
+import itertools
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from models.ad_types import AD_TYPE_REGISTRY, AD_TYPES
+
+logger = logging.getLogger(__name__)
+
+# Raiz no RTDB dos anúncios de todos os tipos (lida de uma vez pelo cache e observada pelo listener)
+FIREBASE_ADS_ROOT = 'ads'
+
+# Caminho no RTDB de cada tipo de anúncio (ver models/ad_types.py)
+FIREBASE_AD_PATHS = {name: ad_type.firebase_path for name, ad_type in AD_TYPE_REGISTRY.items()}
+
+# Caminho no RTDB dos totais agregados por tipo (fora de ads/, não dispara o listener do cache)
+FIREBASE_TOTALS_PATH = 'ad_totals'
+
+# Totais dos inventários de cada jogo (game_totals/<game_id>/<tipo>), fora de ad_totals/
+# para que a leitura dos totais do inventário padrão continue sendo um único nó pequeno
+FIREBASE_GAME_TOTALS_PATH = 'game_totals'
+
+# Trava da criação das visões por jogo (AdStorage.for_game)
+_GAMES_LOCK = threading.Lock()
+
+# Campos de contadores mantidos pelo próprio backend
+COUNTER_FIELDS = ('impressions', 'clicks')
+
+# Nó dos shards de contadores dentro de cada anúncio e de cada ad_totals/<tipo>
+# (modo de contadores fragmentados do Firebase, ver FirebaseStorage)
+COUNTER_SHARDS_KEY = 'counter_shards'
+
+# Nó no RTDB com o processo que compacta os shards de contadores ({holder, expires_at}):
+# só o detentor da concessão lê o inventário para compactar, não cada worker
+FIREBASE_COMPACTION_LEASE_PATH = 'counter_compaction_lease'
+
+# Marcador gravado em ad_totals/<tipo> quando os totais foram calculados a partir dos
+# anúncios existentes; sem ele o nó só tem os incrementos gravados desde então
+TOTALS_INITIALIZED_KEY = '_initialized'
+
+
+def now_millis():
+    """Timestamp atual em milissegundos, como o ServerValue.TIMESTAMP do Firebase."""
+    return int(time.time() * 1000)
+
+
+# Alfabeto das chaves geradas por push() no RTDB (ordem lexicográfica = ordem ASCII)
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+
+class PushIdGenerator:
+    """
+    Gera localmente chaves no formato do push() do RTDB.
+
+    As chaves têm 8 caracteres do timestamp em milissegundos e 12 aleatórios;
+    dentro do mesmo milissegundo a parte aleatória é incrementada, então as
+    chaves geradas por um processo ficam em ordem de criação, como as do servidor.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_time = 0
+        self._last_random = [0] * 12
+
+    def __call__(self):
+        timestamp = now_millis()
+        with self._lock:
+            if timestamp == self._last_time:
+                position = 11
+                while position >= 0 and self._last_random[position] == 63:
+                    self._last_random[position] = 0
+                    position -= 1
+                if position >= 0:
+                    self._last_random[position] += 1
+            else:
+                self._last_time = timestamp
+                self._last_random = [random.randrange(64) for _ in range(12)]
+            random_chars = ''.join(PUSH_CHARS[value] for value in self._last_random)
+        time_chars = []
+        for _ in range(8):
+            time_chars.append(PUSH_CHARS[timestamp % 64])
+            timestamp //= 64
+        return ''.join(reversed(time_chars)) + random_chars
+
+
+def fold_counter_shards(data):
+    """
+    Soma os shards de contadores nos campos principais e remove o nó de shards.
+
+    Args:
+        data (dict): Dados de um anúncio ou dos totais de um tipo (alterados no lugar)
+
+    Returns:
+        dict: Os mesmos dados, com impressions/clicks já somados
+    """
+    if not isinstance(data, dict):
+        return data
+    shards = data.pop(COUNTER_SHARDS_KEY, None)
+    if isinstance(shards, dict):
+        for shard in shards.values():
+            if not isinstance(shard, dict):
+                continue
+            for field in COUNTER_FIELDS:
+                if field in shard:
+                    data[field] = int(data.get(field, 0) or 0) + int(shard[field] or 0)
+    return data
+
+
+def fold_shard_updates(updates, path, data):
+    """
+    Acrescenta a um update multi-caminho a compactação dos shards lidos de um nó.
+
+    Cada valor lido em `<path>/counter_shards/<shard>/<campo>` vira um
+    incremento de +n no campo principal e de -n no shard: a soma que as
+    leituras devolvem não muda, mesmo com incrementos concorrentes no shard.
+
+    Args:
+        updates (dict): Update multi-caminho (alterado no lugar)
+        path (str): Caminho do anúncio ou de ad_totals/<tipo>
+        data (dict): Conteúdo atual do nó
+
+    Returns:
+        int: Número de contadores com valor a compactar
+    """
+    shards = data.get(COUNTER_SHARDS_KEY) if isinstance(data, dict) else None
+    if not isinstance(shards, dict):
+        return 0
+    folded = {}
+    for shard_key, shard in shards.items():
+        if not isinstance(shard, dict):
+            continue
+        for field in COUNTER_FIELDS:
+            amount = int(shard.get(field) or 0)
+            if amount:
+                updates[f'{path}/{COUNTER_SHARDS_KEY}/{shard_key}/{field}'] = {".sv": {"increment": -amount}}
+                folded[field] = folded.get(field, 0) + amount
+    for field, amount in folded.items():
+        updates[f'{path}/{field}'] = {".sv": {"increment": amount}}
+    return len(folded)
+
+
+def is_counter_only(data):
+    """
+    Indica se um nó de anúncio só tem contadores (e shards de contadores).
+
+    No Firebase, um incremento gravado depois que o anúncio foi removido
+    recria o nó apenas com os contadores; as leituras ignoram esses nós.
+    """
+    return isinstance(data, dict) and all(key in COUNTER_FIELDS or key == COUNTER_SHARDS_KEY for key in data)
+
+
+def fold_ads(ads):
+    """Aplica fold_counter_shards a um dict {id: dados}, sem os nós que só têm contadores."""
+    return {
+        ad_id: fold_counter_shards(data) for ad_id, data in ads.items()
+        if not is_counter_only(data)
+    }
+
+
+def empty_totals():
+    """Totais agregados de um tipo de anúncio sem anúncios."""
+    return {'ads_count': 0, 'impressions': 0, 'clicks': 0}
+
+
+def totals_from_ads(ads):
+    """
+    Calcula os totais agregados percorrendo os anúncios (O(n)).
+
+    Args:
+        ads (iterable): Dados dos anúncios
+
+    Returns:
+        dict: {'ads_count': n, 'impressions': n, 'clicks': n}
+    """
+    totals = empty_totals()
+    for ad in ads:
+        if not isinstance(ad, dict):
+            continue
+        totals['ads_count'] += 1
+        totals['impressions'] += int(ad.get('impressions', 0) or 0)
+        totals['clicks'] += int(ad.get('clicks', 0) or 0)
+    return totals
+
+
+def encode_cursor(created_at, ad_id):
+    """Cursor de paginação a partir do último anúncio de uma página."""
+    return f"{int(created_at)}_{ad_id}"
+
+
+def decode_cursor(cursor):
+    """
+    Decodifica um cursor de paginação.
+
+    Args:
+        cursor (str): Cursor gerado por encode_cursor
+
+    Returns:
+        tuple: (created_at, id)
+
+    Raises:
+        ValueError: Se o cursor é inválido
+    """
+    created_at, separator, ad_id = str(cursor).partition('_')
+    if not separator or not ad_id:
+        raise ValueError(f"Cursor inválido: {cursor}")
+    return int(created_at), ad_id
+
+
+def page_from_ads(items, limit, cursor=None):
+    """
+    Monta uma página, mais recentes primeiro, a partir de pares (id, dados).
+
+    Args:
+        items (iterable): Pares (id, dados) em qualquer ordem
+        limit (int): Tamanho da página
+        cursor (str): Cursor da página anterior (None para a primeira)
+
+    Returns:
+        tuple: (lista de anúncios com 'id', cursor da próxima página ou None)
+    """
+    position = decode_cursor(cursor) if cursor else None
+    rows = []
+    for ad_id, data in items:
+        if not isinstance(data, dict):
+            continue
+        key = (int(data.get('created_at', 0) or 0), ad_id)
+        if position is None or key < position:
+            rows.append((key, ad_id, data))
+    rows.sort(key=lambda row: row[0], reverse=True)
+
+    page = [{**data, 'id': ad_id} for _, ad_id, data in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last_key = rows[limit - 1][0]
+        next_cursor = encode_cursor(*last_key)
+    return page, next_cursor
+
+
+class AdStorage:
+    """
+    Interface comum dos backends de armazenamento.
+
+    Os anúncios são dicionários com 'title', 'imageUrl', 'targetUrl',
+    'impressions', 'clicks' e 'created_at' (milissegundos), identificados
+    por um id gerado pelo backend.
+    """
+
+    name = 'base'
+
+    # ID do jogo do inventário (None para o inventário padrão, fora de qualquer jogo)
+    game_id = None
+    _games = None
+
+    def for_game(self, game_id):
+        """
+        Obtém o backend restrito ao inventário de um jogo (multi-tenant).
+
+        A visão de cada jogo é criada uma vez e reaproveitada: ela guarda o
+        estado que precisa sobreviver ao despejo da partição do jogo no
+        servidor (ex: os dados do backend em memória).
+
+        Args:
+            game_id (str): ID do jogo (None devolve o próprio backend)
+
+        Returns:
+            AdStorage: Backend do inventário do jogo
+        """
+        if game_id is None or game_id == self.game_id:
+            return self
+        with _GAMES_LOCK:
+            if self._games is None:
+                self._games = {}
+            storage = self._games.get(game_id)
+            if storage is None:
+                storage = self._games[game_id] = self._create_game_storage(game_id)
+        return storage
+
+    def _create_game_storage(self, game_id):
+        raise NotImplementedError(f"O backend '{self.name}' não suporta inventários por jogo")
+
+    def game_storages(self):
+        """
+        Lista as visões por jogo já criadas.
+
+        Returns:
+            list: Backends dos jogos
+        """
+        with _GAMES_LOCK:
+            return list((self._games or {}).values())
+
+    def connect(self):
+        """
+        Prepara o backend para uso.
+
+        Returns:
+            bool: True se o backend está pronto, False caso contrário
+        """
+        return True
+
+    def list_ads(self, ad_type):
+        """
+        Lista todos os anúncios de um tipo.
+
+        Args:
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
+
+        Returns:
+            dict: {id: dados}, ordenado por created_at crescente
+        """
+        raise NotImplementedError
+
+    def list_all_ads(self):
+        """
+        Lista os anúncios de todos os tipos, em uma única leitura quando o backend permite.
+
+        Returns:
+            dict: {ad_type: {id: dados}} com todas as chaves de AD_TYPES
+        """
+        return {ad_type: self.list_ads(ad_type) for ad_type in AD_TYPES}
+
+    def get_ad(self, ad_type, ad_id):
+        """
+        Obtém um anúncio.
+
+        Args:
+            ad_type (str): Tipo do anúncio
+            ad_id (str): ID do anúncio
+
+        Returns:
+            dict: Dados do anúncio ou None se não existir
+        """
+        raise NotImplementedError
+
+    def add_ad(self, ad_type, fields):
+        """
+        Cria um anúncio com contadores zerados e created_at do servidor.
+
+        Args:
+            ad_type (str): Tipo do anúncio
+            fields (dict): Campos do anúncio (title, imageUrl, targetUrl, ...)
+
+        Returns:
+            str: ID do anúncio criado
+        """
+        raise NotImplementedError
+
+    def update_ad(self, ad_type, ad_id, fields):
+        """
+        Atualiza campos de um anúncio existente.
+
+        Args:
+            ad_type (str): Tipo do anúncio
+            ad_id (str): ID do anúncio
+            fields (dict): Campos a atualizar
+        """
+        raise NotImplementedError
+
+    def delete_ad(self, ad_type, ad_id):
+        """
+        Remove um anúncio.
+
+        Args:
+            ad_type (str): Tipo do anúncio
+            ad_id (str): ID do anúncio
+        """
+        raise NotImplementedError
+
+    def bulk_write(self, creates, updates):
+        """
+        Cria e atualiza vários anúncios de uma vez.
+
+        A implementação padrão faz uma chamada por anúncio; os backends gravam
+        o lote inteiro em uma única operação atômica.
+
+        Args:
+            creates (list): [(ad_type, campos)] de anúncios novos
+            updates (list): [(ad_type, ad_id, campos)] de anúncios existentes
+
+        Returns:
+            list: IDs dos anúncios criados, na ordem de `creates`
+        """
+        ids = [self.add_ad(ad_type, fields) for ad_type, fields in creates]
+        for ad_type, ad_id, fields in updates:
+            self.update_ad(ad_type, ad_id, fields)
+        return ids
+
+    def increment_counters(self, increments):
+        """
+        Aplica um lote de incrementos de contadores em uma única operação.
+
+        Args:
+            increments (dict): {(ad_type, ad_id, field): n}
+        """
+        raise NotImplementedError
+
+    def compact_counters(self):
+        """
+        Incorpora aos contadores principais os incrementos gravados em shards.
+
+        Só o Firebase com contadores fragmentados grava em shards; nos demais
+        backends não há nada a compactar.
+
+        Returns:
+            int: Número de contadores compactados
+        """
+        return 0
+
+    def acquire_compaction_lease(self, holder, ttl):
+        """
+        Obtém ou renova a concessão de compactação dos contadores.
+
+        Só o detentor da concessão chama compact_counters, então o custo da
+        compactação não cresce com o número de workers. Nos backends sem shards
+        não há o que disputar e a concessão é sempre concedida.
+
+        Args:
+            holder (str): Identificador do processo (host:pid)
+            ttl (float): Validade da concessão em segundos
+
+        Returns:
+            bool: True se `holder` detém a concessão
+        """
+        return True
+
+    def release_compaction_lease(self, holder):
+        """
+        Libera a concessão de compactação, se `holder` a detém (encerramento do worker).
+
+        Args:
+            holder (str): Identificador usado em acquire_compaction_lease
+        """
+
+    def list_ads_page(self, ad_type, limit, cursor=None):
+        """
+        Lista uma página de anúncios por created_at, mais recentes primeiro.
+
+        Args:
+            ad_type (str): Tipo do anúncio
+            limit (int): Tamanho da página
+            cursor (str): Cursor devolvido pela página anterior (None para a primeira)
+
+        Returns:
+            tuple: (lista de anúncios com 'id', cursor da próxima página ou None)
+        """
+        return page_from_ads(self.list_ads(ad_type).items(), limit, cursor)
+
+    def iter_ads(self, ad_type, chunk_size=500):
+        """
+        Percorre todos os anúncios de um tipo em blocos, sem carregar a árvore inteira.
+
+        A implementação padrão segue as páginas de list_ads_page (mais recentes
+        primeiro); backends podem usar outra ordem estável.
+
+        Args:
+            ad_type (str): Tipo do anúncio
+            chunk_size (int): Número de anúncios lidos por chamada ao datastore
+
+        Yields:
+            dict: Dados do anúncio com 'id'
+        """
+        cursor = None
+        while True:
+            ads, cursor = self.list_ads_page(ad_type, chunk_size, cursor)
+            yield from ads
+            if not cursor:
+                return
+
+    def get_totals(self, ad_type):
+        """
+        Obtém os totais agregados de um tipo (quantidade, impressões e cliques).
+        Os backends mantêm os totais a cada escrita, então a leitura é O(1).
+
+        Args:
+            ad_type (str): Tipo do anúncio
+
+        Returns:
+            dict: {'ads_count': n, 'impressions': n, 'clicks': n}
+        """
+        return totals_from_ads(self.list_ads(ad_type).values())
+
+    def get_all_totals(self):
+        """
+        Obtém os totais agregados de todos os tipos, em uma única leitura quando o backend permite.
+
+        Returns:
+            dict: {ad_type: {'ads_count': n, 'impressions': n, 'clicks': n}}
+        """
+        return {ad_type: self.get_totals(ad_type) for ad_type in AD_TYPES}
+
+    def listen(self, callback):
+        """
+        Registra um callback para alterações no inventário, se suportado.
+
+        Args:
+            callback (callable): Função chamada com o evento de alteração
+
+        Returns:
+            object: Objeto com close() ou None se o backend não suporta
+        """
+        return None
+
+    def reset_after_fork(self):
+        """
+        Descarta o estado de conexão herdado do processo pai após um fork.
+        A próxima chamada a connect() abre conexões próprias do processo.
+        """
+
+
+class ListenerGroup:
+    """
+    Vários listeners do RTDB encerrados juntos, com a mesma interface close().
+    """
+
+    def __init__(self, listeners):
+        self.listeners = listeners
+
+    def close(self):
+        for listener in self.listeners:
+            listener.close()
+
+
+class FirebaseStorage(AdStorage):
+    """
+    Backend Firebase Realtime Database (firebase-admin).
+    """
+
+    name = 'firebase'
+
+    def __init__(self, cred_file_path, db_url, counter_shards=0, multi_game=False, game_id=None):
+        """
+        Args:
+            cred_file_path (str): Caminho do arquivo de credenciais da conta de serviço
+            db_url (str): URL do Realtime Database
+            counter_shards (int): Número de shards dos contadores (0 desativa). Com
+                shards, cada processo incrementa `counter_shards/s<pid % n>` dentro
+                do anúncio e dos totais em vez do mesmo nó; as leituras somam os
+                shards e compact_counters os incorpora periodicamente ao total
+            multi_game (bool): Se existem inventários por jogo em ads/<game_id>/. O
+                inventário padrão deixa de ler ads/ inteiro (que inclui os jogos) e
+                lê cada tipo no seu caminho
+            game_id (str): Jogo do inventário (use for_game); os anúncios ficam em
+                ads/<game_id>/... e os totais em game_totals/<game_id>
+        """
+        self.cred_file_path = cred_file_path
+        self.db_url = db_url
+        self.counter_shards = counter_shards
+        self.multi_game = multi_game
+        self.game_id = game_id
+        if game_id is None:
+            self.ads_root = FIREBASE_ADS_ROOT
+            self.ad_paths = FIREBASE_AD_PATHS
+            self.totals_path = FIREBASE_TOTALS_PATH
+        else:
+            self.ads_root = f'{FIREBASE_ADS_ROOT}/{game_id}'
+            self.ad_paths = {
+                ad_type: f'{self.ads_root}/{path.partition("/")[2]}' for ad_type, path in FIREBASE_AD_PATHS.items()
+            }
+            self.totals_path = f'{FIREBASE_GAME_TOTALS_PATH}/{game_id}'
+        self.initialized = False
+        self._inherited_app = False
+        self._push_id = PushIdGenerator()
+
+    def connect(self):
+        if self.initialized:
+            return True
+
+        import firebase_admin
+        from firebase_admin import credentials
+
+        if not self.db_url:
+            logger.error("🔥 ERRO Firebase: FIREBASE_DB_URL não configurada nas variáveis de ambiente.")
+            return False
+
+        if not os.path.exists(self.cred_file_path):
+            logger.error(f"🔥 ERRO Firebase: Arquivo de credenciais não encontrado em {self.cred_file_path}.")
+            return False
+
+        if firebase_admin._apps and self._inherited_app:
+            # App criado antes do fork: a sessão HTTP e o token são do processo pai
+            try:
+                firebase_admin.delete_app(firebase_admin.get_app())
+            except Exception as e:
+                logger.warning(f"Erro ao descartar o app Firebase herdado do processo pai: {e}")
+        self._inherited_app = False
+
+        if not firebase_admin._apps:
+            try:
+                cred = credentials.Certificate(self.cred_file_path)
+                firebase_admin.initialize_app(cred, {
+                    'databaseURL': self.db_url
+                })
+                logger.info("✅ Firebase Admin SDK inicializado com sucesso usando Secret File!")
+            except Exception as e:
+                logger.error(f"🔥 ERRO Firebase ao inicializar com Secret File: {str(e)}", exc_info=True)
+                return False
+        else:
+            logger.info("✅ Firebase Admin SDK já estava inicializado (app default existente).")
+
+        self.initialized = True
+        return True
+
+    def _create_game_storage(self, game_id):
+        return FirebaseStorage(self.cred_file_path, self.db_url, counter_shards=self.counter_shards, game_id=game_id)
+
+    def reset_after_fork(self):
+        if self.initialized:
+            self._inherited_app = True
+        self.initialized = False
+        self._push_id = PushIdGenerator()
+
+    def _reference(self, path):
+        from firebase_admin import db as firebase_rtdb
+        return firebase_rtdb.reference(path)
+
+    def _counter_shard(self):
+        # Prefixo evita que o RTDB devolva os shards como lista (chaves numéricas)
+        return f's{os.getpid() % self.counter_shards}'
+
+    def list_ads(self, ad_type):
+        ads = self._reference(self.ad_paths[ad_type]).order_by_child('created_at').get() or {}
+        return fold_ads(ads)
+
+    def list_all_ads(self):
+        if self.multi_game and self.game_id is None:
+            # ads/ inclui os inventários de todos os jogos: um get por tipo, não pelo número de jogos
+            return super().list_all_ads()
+        # Uma leitura da raiz do inventário com todos os tipos: uma ida ao RTDB por recarga,
+        # qualquer que seja o número de formatos
+        tree = self._reference(self.ads_root).get() or {}
+        result = {}
+        for ad_type, path in self.ad_paths.items():
+            if not path.startswith(f'{self.ads_root}/'):
+                result[ad_type] = self.list_ads(ad_type)
+                continue
+            node = tree
+            for key in path[len(self.ads_root) + 1:].split('/'):
+                node = node.get(key) if isinstance(node, dict) else None
+            result[ad_type] = fold_ads(node) if isinstance(node, dict) else {}
+        return result
+
+    def get_ad(self, ad_type, ad_id):
+        data = self._reference(f'{self.ad_paths[ad_type]}/{ad_id}').get()
+        if not isinstance(data, dict) or is_counter_only(data):
+            return None
+        return fold_counter_shards(data)
+
+    def list_ads_page(self, ad_type, limit, cursor=None):
+        query = self._reference(self.ad_paths[ad_type]).order_by_child('created_at')
+        if cursor:
+            query = query.end_at(decode_cursor(cursor)[0])
+        # end_at é inclusivo: anúncios com o mesmo created_at do cursor são
+        # descartados em page_from_ads; se sobrar pouco, a janela é ampliada
+        fetch = limit + 1
+        while True:
+            fetched = query.limit_to_last(fetch).get() or {}
+            page, next_cursor = page_from_ads(fold_ads(fetched).items(), limit, cursor)
+            if next_cursor or len(fetched) < fetch:
+                return page, next_cursor
+            fetch *= 2
+
+    def iter_ads(self, ad_type, chunk_size=500):
+        # Blocos em ordem de chave (ids do push(), aproximadamente cronológicos) com
+        # start_at na última chave lida: cada bloco é uma leitura limitada, sem índice
+        reference = self._reference(self.ad_paths[ad_type])
+        last_key = None
+        while True:
+            query = reference.order_by_key()
+            if last_key is None:
+                fetch = chunk_size
+            else:
+                # start_at é inclusivo: a última chave lida volta no início do bloco
+                query = query.start_at(last_key)
+                fetch = chunk_size + 1
+            items = query.limit_to_first(fetch).get() or {}
+            keys = sorted(items)
+            for ad_id in keys:
+                if ad_id != last_key and isinstance(items[ad_id], dict) and not is_counter_only(items[ad_id]):
+                    yield {**fold_counter_shards(items[ad_id]), 'id': ad_id}
+            if len(items) < fetch:
+                return
+            last_key = keys[-1]
+
+    def _backfill_totals(self, ad_type):
+        # Uma única vez por tipo: o nó pode já existir só com os incrementos gravados
+        # por add_ad e pelo flush dos contadores desde a implantação, que os anúncios
+        # lidos aqui já incluem (os shards dos anúncios também são somados por list_ads).
+        # O nó é lido logo antes dos anúncios e a transação soma ao valor atual só a
+        # diferença (anúncios - nó lido): incrementos gravados depois da leitura e os
+        # shards dos totais são mantidos, em vez de o nó ser substituído
+        totals_ref = self._reference(f'{self.totals_path}/{ad_type}')
+        baseline = totals_ref.get()
+        baseline = fold_counter_shards(dict(baseline)) if isinstance(baseline, dict) else {}
+        computed = totals_from_ads(self.list_ads(ad_type).values())
+
+        def backfill(current):
+            if isinstance(current, dict) and current.get(TOTALS_INITIALIZED_KEY):
+                # Outro processo calculou antes
+                return current
+            merged = dict(current) if isinstance(current, dict) else {}
+            for key, value in computed.items():
+                merged[key] = int(merged.get(key, 0) or 0) + value - int(baseline.get(key, 0) or 0)
+            merged[TOTALS_INITIALIZED_KEY] = True
+            return merged
+
+        return totals_ref.transaction(backfill)
+
+    def _read_totals(self, ad_type, totals):
+        if not isinstance(totals, dict) or not totals.get(TOTALS_INITIALIZED_KEY):
+            totals = self._backfill_totals(ad_type)
+        fold_counter_shards(totals)
+        return {key: int(totals.get(key, 0) or 0) for key in empty_totals()}
+
+    def get_totals(self, ad_type):
+        return self._read_totals(ad_type, self._reference(f'{self.totals_path}/{ad_type}').get())
+
+    def get_all_totals(self):
+        # Uma leitura de ad_totals/ para todos os tipos; só os tipos ainda sem o marcador são calculados
+        all_totals = self._reference(self.totals_path).get() or {}
+        if not isinstance(all_totals, dict):
+            all_totals = {}
+        return {ad_type: self._read_totals(ad_type, all_totals.get(ad_type)) for ad_type in AD_TYPES}
+
+    def add_ad(self, ad_type, fields):
+        # Chave gerada localmente: o anúncio e a contagem nos totais vão no mesmo
+        # update multi-caminho (atômico no RTDB), como em bulk_write
+        ad_id = self._push_id()
+        self._reference('/').update({
+            f'{self.ad_paths[ad_type]}/{ad_id}': {
+                **fields,
+                'impressions': 0,
+                'clicks': 0,
+                'created_at': {".sv": "timestamp"}
+            },
+            f'{self.totals_path}/{ad_type}/ads_count': {".sv": {"increment": 1}},
+        })
+        return ad_id
+
+    def update_ad(self, ad_type, ad_id, fields):
+        self._reference(f'{self.ad_paths[ad_type]}/{ad_id}').update(fields)
+
+    def delete_ad(self, ad_type, ad_id):
+        ad_path = f'{self.ad_paths[ad_type]}/{ad_id}'
+        data = self._reference(ad_path).get()
+        if not isinstance(data, dict):
+            self._reference(ad_path).delete()
+            return
+        # Os shards do anúncio também foram somados aos totais
+        fold_counter_shards(data)
+        # Remoção e desconto nos totais no mesmo update multi-caminho
+        totals_path = f'{self.totals_path}/{ad_type}'
+        self._reference('/').update({
+            ad_path: None,
+            f'{totals_path}/ads_count': {".sv": {"increment": -1}},
+            f'{totals_path}/impressions': {".sv": {"increment": -int(data.get('impressions', 0) or 0)}},
+            f'{totals_path}/clicks': {".sv": {"increment": -int(data.get('clicks', 0) or 0)}},
+        })
+
+    def bulk_write(self, creates, updates):
+        # Chaves geradas localmente: anúncios novos, campos alterados e contagem nos
+        # totais vão no mesmo update multi-caminho (atômico no RTDB)
+        paths = {}
+        ids = []
+        created_per_type = {}
+        for ad_type, fields in creates:
+            ad_id = self._push_id()
+            paths[f'{self.ad_paths[ad_type]}/{ad_id}'] = {
+                **fields,
+                'impressions': 0,
+                'clicks': 0,
+                'created_at': {".sv": "timestamp"}
+            }
+            created_per_type[ad_type] = created_per_type.get(ad_type, 0) + 1
+            ids.append(ad_id)
+        for ad_type, ad_id, fields in updates:
+            for field, value in fields.items():
+                paths[f'{self.ad_paths[ad_type]}/{ad_id}/{field}'] = value
+        for ad_type, count in created_per_type.items():
+            paths[f'{self.totals_path}/{ad_type}/ads_count'] = {".sv": {"increment": count}}
+        if paths:
+            self._reference('/').update(paths)
+        return ids
+
+    def increment_counters(self, increments):
+        # O incremento não confere se o anúncio ainda existe: quem chama descarta os anúncios
+        # que saíram do inventário (InventoryCache.known_increments) e as leituras ignoram
+        # os nós recriados só com contadores por um flush concorrente com a remoção
+        # Um único update multi-caminho, usando incremento no servidor (sem transações);
+        # os totais por tipo são incrementados na mesma operação. Com shards, cada
+        # processo incrementa o próprio shard e o nó principal deixa de ser disputado
+        shard = f'{COUNTER_SHARDS_KEY}/{self._counter_shard()}/' if self.counter_shards else ''
+        updates = {}
+        totals = {}
+        for (ad_type, ad_id, field), amount in increments.items():
+            updates[f"{self.ad_paths[ad_type]}/{ad_id}/{shard}{field}"] = {".sv": {"increment": amount}}
+            totals[(ad_type, field)] = totals.get((ad_type, field), 0) + amount
+        for (ad_type, field), amount in totals.items():
+            updates[f"{self.totals_path}/{ad_type}/{shard}{field}"] = {".sv": {"increment": amount}}
+        self._reference('/').update(updates)
+
+    def compact_counters(self):
+        # Lê os shards gravados no datastore (por qualquer processo, inclusive workers
+        # que já morreram) e move os valores lidos para o nó principal com incrementos
+        # (+n no campo, -n no shard) em um único update: incrementos concorrentes no
+        # shard e compactações simultâneas de outros workers não alteram a soma
+        # campo + shards, que é o que as leituras devolvem
+        # Os inventários dos jogos são compactados junto, cada um no seu caminho.
+        # Lê o inventário inteiro: só o detentor da concessão (acquire_compaction_lease) chama
+        compacted = sum(storage.compact_counters() for storage in self.game_storages())
+        if not self.counter_shards:
+            return compacted
+        updates = {}
+        for ad_type, path in self.ad_paths.items():
+            ads = self._reference(path).get() or {}
+            for ad_id, data in ads.items():
+                compacted += fold_shard_updates(updates, f'{path}/{ad_id}', data)
+        all_totals = self._reference(self.totals_path).get() or {}
+        for ad_type in self.ad_paths:
+            fold_shard_updates(updates, f'{self.totals_path}/{ad_type}', all_totals.get(ad_type))
+        if updates:
+            self._reference('/').update(updates)
+        return compacted
+
+    def acquire_compaction_lease(self, holder, ttl):
+        if not self.counter_shards:
+            return True
+        now = now_millis()
+
+        def claim(current):
+            if isinstance(current, dict) and current.get('holder') != holder \
+                    and int(current.get('expires_at', 0) or 0) > now:
+                # Outro processo detém uma concessão válida
+                return current
+            return {'holder': holder, 'expires_at': now + int(ttl * 1000)}
+
+        lease = self._reference(FIREBASE_COMPACTION_LEASE_PATH).transaction(claim)
+        return isinstance(lease, dict) and lease.get('holder') == holder
+
+    def release_compaction_lease(self, holder):
+        if not self.counter_shards:
+            return
+
+        def release(current):
+            if isinstance(current, dict) and current.get('holder') == holder:
+                return None
+            return current
+
+        self._reference(FIREBASE_COMPACTION_LEASE_PATH).transaction(release)
+
+    def listen(self, callback):
+        if self.multi_game and self.game_id is None:
+            # Com inventários por jogo, ads/ também contém ads/<game_id>/...: um listener por
+            # caminho de tipo, para que as escritas dos jogos não invalidem o inventário padrão
+            return ListenerGroup([self._reference(path).listen(callback) for path in sorted(set(self.ad_paths.values()))])
+        return self._reference(self.ads_root).listen(callback)
+
+
+class MemoryStorage(AdStorage):
+    """
+    Backend em memória do processo, para testes de carga e desenvolvimento.
+    Os dados não são compartilhados entre workers nem sobrevivem a reinícios.
+    """
+
+    name = 'memory'
+
+    def __init__(self, initial_data=None, latency=0.0):
+        """
+        Args:
+            initial_data (dict): {ad_type: {id: dados}} para popular o backend
+            latency (float): Atraso simulado por operação em segundos, para
+                aproximar o tempo de ida e volta até o Firebase
+        """
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.load(initial_data or {})
+
+    def load(self, data):
+        """
+        Substitui todo o conteúdo do backend e recalcula os totais e o índice.
+
+        Args:
+            data (dict): {ad_type: {id: dados}}
+        """
+        with self._lock:
+            self._ads = {ad_type: {} for ad_type in AD_TYPES}
+            for ad_type, ads in data.items():
+                self._ads[ad_type].update({ad_id: dict(ad) for ad_id, ad in ads.items()})
+            self._totals = {ad_type: totals_from_ads(ads.values()) for ad_type, ads in self._ads.items()}
+            # Índice (created_at, id) ordenado, como o order_by_child('created_at') do RTDB
+            self._order = {
+                ad_type: sorted((int(ad.get('created_at', 0) or 0), ad_id) for ad_id, ad in ads.items())
+                for ad_type, ads in self._ads.items()
+            }
+
+    def _create_game_storage(self, game_id):
+        storage = MemoryStorage(latency=self.latency)
+        storage.game_id = game_id
+        # Contador de ids compartilhado: os ids continuam únicos entre os jogos (log de eventos)
+        storage._ids = self._ids
+        return storage
+
+    def reset_after_fork(self):
+        # O lock pode ter sido copiado adquirido por outra thread do processo pai
+        self._lock = threading.Lock()
+
+    def _new_id(self):
+        # Ids crescentes no tempo, como as chaves geradas por push() no Firebase
+        return f"{now_millis():013d}{next(self._ids):06d}"
+
+    def _simulate_latency(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def list_ads(self, ad_type):
+        self._simulate_latency()
+        with self._lock:
+            items = [(ad_id, dict(data)) for ad_id, data in self._ads[ad_type].items()]
+        items.sort(key=lambda item: (item[1].get('created_at', 0), item[0]))
+        return dict(items)
+
+    def list_all_ads(self):
+        self._simulate_latency()
+        with self._lock:
+            snapshot = {
+                ad_type: [(ad_id, dict(data)) for ad_id, data in ads.items()]
+                for ad_type, ads in self._ads.items()
+            }
+        result = {}
+        for ad_type, items in snapshot.items():
+            items.sort(key=lambda item: (item[1].get('created_at', 0), item[0]))
+            result[ad_type] = dict(items)
+        return result
+
+    def get_ad(self, ad_type, ad_id):
+        self._simulate_latency()
+        with self._lock:
+            data = self._ads[ad_type].get(ad_id)
+            return dict(data) if data is not None else None
+
+    def add_ad(self, ad_type, fields):
+        self._simulate_latency()
+        ad_id = self._new_id()
+        created_at = now_millis()
+        with self._lock:
+            self._ads[ad_type][ad_id] = {
+                **fields,
+                'impressions': 0,
+                'clicks': 0,
+                'created_at': created_at
+            }
+            self._totals[ad_type]['ads_count'] += 1
+            bisect.insort(self._order[ad_type], (created_at, ad_id))
+        return ad_id
+
+    def update_ad(self, ad_type, ad_id, fields):
+        self._simulate_latency()
+        with self._lock:
+            data = self._ads[ad_type].get(ad_id)
+            if data is None:
+                data = self._ads[ad_type][ad_id] = {}
+                bisect.insort(self._order[ad_type], (0, ad_id))
+            data.update(fields)
+
+    def delete_ad(self, ad_type, ad_id):
+        self._simulate_latency()
+        with self._lock:
+            data = self._ads[ad_type].pop(ad_id, None)
+            if data is not None:
+                order = self._order[ad_type]
+                key = (int(data.get('created_at', 0) or 0), ad_id)
+                position = bisect.bisect_left(order, key)
+                if position < len(order) and order[position] == key:
+                    del order[position]
+                totals = self._totals[ad_type]
+                totals['ads_count'] -= 1
+                for field in COUNTER_FIELDS:
+                    totals[field] -= int(data.get(field, 0) or 0)
+
+    def bulk_write(self, creates, updates):
+        self._simulate_latency()
+        ids = [self._new_id() for _ in creates]
+        created_at = now_millis()
+        with self._lock:
+            for ad_id, (ad_type, fields) in zip(ids, creates):
+                self._ads[ad_type][ad_id] = {**fields, 'impressions': 0, 'clicks': 0, 'created_at': created_at}
+                self._totals[ad_type]['ads_count'] += 1
+                bisect.insort(self._order[ad_type], (created_at, ad_id))
+            for ad_type, ad_id, fields in updates:
+                data = self._ads[ad_type].get(ad_id)
+                if data is not None:
+                    data.update(fields)
+        return ids
+
+    def increment_counters(self, increments):
+        self._simulate_latency()
+        with self._lock:
+            for (ad_type, ad_id, field), amount in increments.items():
+                data = self._ads[ad_type].get(ad_id)
+                if data is not None:
+                    data[field] = data.get(field, 0) + amount
+                    if field in COUNTER_FIELDS:
+                        self._totals[ad_type][field] += amount
+
+    def list_ads_page(self, ad_type, limit, cursor=None):
+        self._simulate_latency()
+        with self._lock:
+            order = self._order[ad_type]
+            end = bisect.bisect_left(order, decode_cursor(cursor)) if cursor else len(order)
+            keys = order[max(end - limit, 0):end]
+            page = [{**self._ads[ad_type][ad_id], 'id': ad_id} for _, ad_id in reversed(keys)]
+        next_cursor = encode_cursor(*keys[0]) if end > limit else None
+        return page, next_cursor
+
+    def get_totals(self, ad_type):
+        self._simulate_latency()
+        with self._lock:
+            return dict(self._totals[ad_type])
+
+    def get_all_totals(self):
+        self._simulate_latency()
+        with self._lock:
+            return {ad_type: dict(totals) for ad_type, totals in self._totals.items()}
+
+
+class SQLiteStorage(AdStorage):
+    """
+    Backend em arquivo SQLite local (modo WAL), compartilhável entre workers
+    da mesma máquina.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db_path='data/ads.db', game_id=None):
+        """
+        Args:
+            db_path (str): Caminho do arquivo SQLite
+            game_id (str): Jogo do inventário (use for_game); as linhas do jogo ficam
+                na mesma tabela, com a coluna ad_type no formato '<game_id>/<tipo>'
+        """
+        self.db_path = db_path
+        self.game_id = game_id
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+        self._schema_ready = False
+        self._keys = {ad_type: ad_type if game_id is None else f'{game_id}/{ad_type}' for ad_type in AD_TYPES}
+        self._types = {key: ad_type for ad_type, key in self._keys.items()}
+
+    def _create_game_storage(self, game_id):
+        storage = SQLiteStorage(self.db_path, game_id=game_id)
+        # Contador de ids compartilhado: os ids continuam únicos entre os jogos (log de eventos)
+        storage._ids = self._ids
+        return storage
+
+    def reset_after_fork(self):
+        # Conexões SQLite não podem ser usadas em um processo diferente do que as abriu
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def connect(self):
+        if self._schema_ready:
+            return True
+        try:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir, exist_ok=True)
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS ads ('
+                    ' ad_type TEXT NOT NULL,'
+                    ' id TEXT NOT NULL,'
+                    ' created_at INTEGER NOT NULL,'
+                    ' impressions INTEGER NOT NULL DEFAULT 0,'
+                    ' clicks INTEGER NOT NULL DEFAULT 0,'
+                    ' data TEXT NOT NULL,'
+                    ' PRIMARY KEY (ad_type, id))'
+                )
+                conn.execute('CREATE INDEX IF NOT EXISTS ads_type_created ON ads (ad_type, created_at)')
+                self._init_totals(conn)
+        except Exception as e:
+            logger.error(f"Erro ao abrir o banco SQLite {self.db_path}: {e}", exc_info=True)
+            return False
+        self._schema_ready = True
+        return True
+
+    def _init_totals(self, conn):
+        # Totais por tipo mantidos por triggers na mesma transação de cada escrita
+        has_totals = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ad_totals'"
+        ).fetchone()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS ad_totals ('
+            ' ad_type TEXT PRIMARY KEY,'
+            ' ads_count INTEGER NOT NULL DEFAULT 0,'
+            ' impressions INTEGER NOT NULL DEFAULT 0,'
+            ' clicks INTEGER NOT NULL DEFAULT 0)'
+        )
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS ads_totals_insert AFTER INSERT ON ads BEGIN'
+            ' INSERT INTO ad_totals (ad_type, ads_count, impressions, clicks)'
+            ' VALUES (NEW.ad_type, 1, NEW.impressions, NEW.clicks)'
+            ' ON CONFLICT (ad_type) DO UPDATE SET'
+            ' ads_count = ads_count + 1,'
+            ' impressions = impressions + excluded.impressions,'
+            ' clicks = clicks + excluded.clicks;'
+            ' END'
+        )
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS ads_totals_delete AFTER DELETE ON ads BEGIN'
+            ' UPDATE ad_totals SET'
+            ' ads_count = ads_count - 1,'
+            ' impressions = impressions - OLD.impressions,'
+            ' clicks = clicks - OLD.clicks'
+            ' WHERE ad_type = OLD.ad_type;'
+            ' END'
+        )
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS ads_totals_update AFTER UPDATE OF impressions, clicks ON ads BEGIN'
+            ' UPDATE ad_totals SET'
+            ' impressions = impressions + NEW.impressions - OLD.impressions,'
+            ' clicks = clicks + NEW.clicks - OLD.clicks'
+            ' WHERE ad_type = NEW.ad_type;'
+            ' END'
+        )
+        if not has_totals:
+            # Banco criado antes dos totais: calcula uma vez a partir dos anúncios
+            conn.execute(
+                'INSERT INTO ad_totals (ad_type, ads_count, impressions, clicks)'
+                ' SELECT ad_type, COUNT(*), SUM(impressions), SUM(clicks) FROM ads GROUP BY ad_type'
+            )
+
+    def _row_to_ad(self, row):
+        created_at, impressions, clicks, data = row
+        ad = json.loads(data)
+        ad['created_at'] = created_at
+        ad['impressions'] = impressions
+        ad['clicks'] = clicks
+        return ad
+
+    def list_ads(self, ad_type):
+        rows = self._connect().execute(
+            'SELECT id, created_at, impressions, clicks, data FROM ads'
+            ' WHERE ad_type = ? ORDER BY created_at, id',
+            (self._keys[ad_type],)
+        ).fetchall()
+        return {row[0]: self._row_to_ad(row[1:]) for row in rows}
+
+    def list_all_ads(self):
+        result = {ad_type: {} for ad_type in AD_TYPES}
+        placeholders = ', '.join('?' * len(self._types))
+        rows = self._connect().execute(
+            'SELECT ad_type, id, created_at, impressions, clicks, data FROM ads'
+            f' WHERE ad_type IN ({placeholders}) ORDER BY created_at, id',
+            list(self._types)
+        )
+        for row in rows:
+            result[self._types[row[0]]][row[1]] = self._row_to_ad(row[2:])
+        return result
+
+    def list_ads_page(self, ad_type, limit, cursor=None):
+        sql = 'SELECT id, created_at, impressions, clicks, data FROM ads WHERE ad_type = ?'
+        params = [self._keys[ad_type]]
+        if cursor:
+            created_at, ad_id = decode_cursor(cursor)
+            sql += ' AND (created_at < ? OR (created_at = ? AND id < ?))'
+            params += [created_at, created_at, ad_id]
+        sql += ' ORDER BY created_at DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+        rows = self._connect().execute(sql, params).fetchall()
+
+        page = [{**self._row_to_ad(row[1:]), 'id': row[0]} for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(page[-1]['created_at'], page[-1]['id'])
+        return page, next_cursor
+
+    def get_totals(self, ad_type):
+        row = self._connect().execute(
+            'SELECT ads_count, impressions, clicks FROM ad_totals WHERE ad_type = ?', (self._keys[ad_type],)
+        ).fetchone()
+        if row is None:
+            return empty_totals()
+        return {'ads_count': row[0], 'impressions': row[1] or 0, 'clicks': row[2] or 0}
+
+    def get_all_totals(self):
+        result = {ad_type: empty_totals() for ad_type in AD_TYPES}
+        placeholders = ', '.join('?' * len(self._types))
+        rows = self._connect().execute(
+            f'SELECT ad_type, ads_count, impressions, clicks FROM ad_totals WHERE ad_type IN ({placeholders})',
+            list(self._types)
+        )
+        for key, ads_count, impressions, clicks in rows:
+            result[self._types[key]] = {'ads_count': ads_count, 'impressions': impressions or 0, 'clicks': clicks or 0}
+        return result
+
+    def get_ad(self, ad_type, ad_id):
+        row = self._connect().execute(
+            'SELECT created_at, impressions, clicks, data FROM ads WHERE ad_type = ? AND id = ?',
+            (self._keys[ad_type], ad_id)
+        ).fetchone()
+        return self._row_to_ad(row) if row else None
+
+    def add_ad(self, ad_type, fields):
+        ad_id = f"{now_millis():013d}{os.getpid() % 100000:05d}{next(self._ids):06d}"
+        data = {k: v for k, v in fields.items() if k not in COUNTER_FIELDS and k != 'created_at'}
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO ads (ad_type, id, created_at, data) VALUES (?, ?, ?, ?)',
+                (self._keys[ad_type], ad_id, now_millis(), json.dumps(data))
+            )
+        return ad_id
+
+    def update_ad(self, ad_type, ad_id, fields):
+        conn = self._connect()
+        with conn:
+            row = conn.execute(
+                'SELECT data FROM ads WHERE ad_type = ? AND id = ?', (self._keys[ad_type], ad_id)
+            ).fetchone()
+            if row is None:
+                return
+            data = json.loads(row[0])
+            data.update({k: v for k, v in fields.items() if k not in COUNTER_FIELDS and k != 'created_at'})
+            conn.execute(
+                'UPDATE ads SET data = ? WHERE ad_type = ? AND id = ?',
+                (json.dumps(data), self._keys[ad_type], ad_id)
+            )
+
+    def delete_ad(self, ad_type, ad_id):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM ads WHERE ad_type = ? AND id = ?', (self._keys[ad_type], ad_id))
+
+    def bulk_write(self, creates, updates):
+        created_at = now_millis()
+        ids = [f"{created_at:013d}{os.getpid() % 100000:05d}{next(self._ids):06d}" for _ in creates]
+        conn = self._connect()
+        # Uma transação para o lote inteiro (os triggers mantêm os totais)
+        with conn:
+            conn.executemany(
+                'INSERT INTO ads (ad_type, id, created_at, data) VALUES (?, ?, ?, ?)',
+                [
+                    (self._keys[ad_type], ad_id, created_at, json.dumps(
+                        {k: v for k, v in fields.items() if k not in COUNTER_FIELDS and k != 'created_at'}
+                    ))
+                    for ad_id, (ad_type, fields) in zip(ids, creates)
+                ]
+            )
+            for ad_type, ad_id, fields in updates:
+                row = conn.execute(
+                    'SELECT data FROM ads WHERE ad_type = ? AND id = ?', (self._keys[ad_type], ad_id)
+                ).fetchone()
+                if row is None:
+                    continue
+                data = json.loads(row[0])
+                data.update({k: v for k, v in fields.items() if k not in COUNTER_FIELDS and k != 'created_at'})
+                conn.execute(
+                    'UPDATE ads SET data = ? WHERE ad_type = ? AND id = ?',
+                    (json.dumps(data), self._keys[ad_type], ad_id)
+                )
+        return ids
+
+    def increment_counters(self, increments):
+        conn = self._connect()
+        with conn:
+            for (ad_type, ad_id, field), amount in increments.items():
+                if field not in COUNTER_FIELDS:
+                    continue
+                conn.execute(
+                    f'UPDATE ads SET {field} = {field} + ? WHERE ad_type = ? AND id = ?',
+                    (amount, self._keys[ad_type], ad_id)
+                )
+
+
+def create_storage(backend, **options):
+    """
+    Cria o backend de armazenamento configurado.
+
+    Args:
+        backend (str): 'firebase', 'sqlite' ou 'memory'
+        **options: cred_file_path/db_url/counter_shards/multi_game (firebase), db_path (sqlite)
+            ou latency (memory)
+
+    Returns:
+        AdStorage: Backend de armazenamento
+    """
+    if backend == 'firebase':
+        return FirebaseStorage(options.get('cred_file_path'), options.get('db_url'),
+                               counter_shards=options.get('counter_shards', 0),
+                               multi_game=options.get('multi_game', False))
+    if backend == 'sqlite':
+        return SQLiteStorage(options.get('db_path', 'data/ads.db'))
+    if backend == 'memory':
+        return MemoryStorage(latency=options.get('latency', 0.0))
+    raise ValueError(f"Backend de armazenamento desconhecido: {backend}")
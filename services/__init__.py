@@ -0,0 +1,4 @@
+"""
+Pacote de serviços de runtime do sistema de anúncios.
+"""
+# Componentes usados pelo caminho de serviço da API (cache, contadores, seleção)
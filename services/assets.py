@@ -0,0 +1,652 @@
+"""
+Pipeline de criativos dos anúncios.
+A imagem de um anúncio é baixada uma única vez, quando o anúncio é criado ou
+editado: o arquivo é validado, redimensionado e recomprimido para cada tamanho
+de slot e gravado em um cache local endereçado por conteúdo (nome = SHA-256
+dos bytes), com despejo LRU pelo tamanho total. O jogo baixa as variantes em
+/assets/<nome>, servidas com cabeçalhos imutáveis, em vez do original do Imgur.
+
+O download só segue para endereços públicos: o host (e cada redirecionamento)
+é resolvido e recusado se cair em faixas privadas, de loopback, link-local
+(incluindo o serviço de metadados da nuvem) ou reservadas, e a conexão é
+aberta no endereço validado, sem nova resolução (DNS rebinding).
+"""
+import hashlib
+import ipaddress
+import io
+import json
+import logging
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util import connection as urllib3_connection
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Sem Pillow o pipeline fica desativado e o jogo usa a imageUrl original
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# Escalas geradas para cada formato: 1x (360x47, 360x640) e 3x para telas de alta densidade (1080x141, 1080x1920)
+ASSET_SCALES = (1, 3)
+
+# Formatos de origem aceitos
+SOURCE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+# Formatos de saída: extensão -> (formato do Pillow, content type)
+OUTPUT_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+ASSET_URL_PREFIX = '/assets/'
+
+# Nomes endereçados por conteúdo nunca mudam de bytes: o cliente pode guardar para sempre
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+ASSET_NAME_RE = re.compile(r'^[0-9a-f]{64}\.(?:' + '|'.join(OUTPUT_FORMATS) + r')$')
+
+# Arquivo ao lado de cada variante com a origem (URL e slot), para regenerá-la após um despejo
+SOURCE_SUFFIX = '.src'
+
+# Redirecionamentos seguidos no download do original (cada destino é validado)
+MAX_REDIRECTS = 3
+
+# Mensagem devolvida para qualquer falha de download: os detalhes ficam só no log
+FETCH_ERROR = "Não foi possível baixar a imagem"
+
+
+class AssetError(ValueError):
+    """
+    Criativo que não pôde ser baixado ou não é uma imagem válida.
+    """
+
+
+def is_public_address(address):
+    """
+    Indica se um endereço IP pode ser acessado pelo download de criativos.
+
+    Args:
+        address (str): Endereço IPv4 ou IPv6
+
+    Returns:
+        bool: False para faixas privadas, de loopback, link-local, reservadas e multicast
+    """
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_source_url(url):
+    """
+    Valida a URL de um original antes do download.
+
+    Args:
+        url (str): URL da imagem (ou de um redirecionamento)
+
+    Returns:
+        str: Endereço IP validado, no qual a conexão deve ser aberta
+
+    Raises:
+        AssetError: Se a URL for inválida ou o host resolver para um endereço não público
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError as e:
+        raise AssetError(f"URL de imagem inválida: {url}") from e
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise AssetError(f"URL de imagem inválida: {url}")
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)]
+    except (OSError, UnicodeError) as e:
+        logger.warning(f"Criativo: falha ao resolver {parts.hostname}: {e}")
+        raise AssetError(FETCH_ERROR) from e
+    blocked = sorted({address for address in addresses if not is_public_address(address)})
+    if blocked or not addresses:
+        logger.warning(f"Criativo: {parts.hostname} resolve para endereços não públicos {blocked}")
+        raise AssetError(FETCH_ERROR)
+    return addresses[0]
+
+
+def same_address(first, second):
+    """Compara dois endereços IP em qualquer notação (ex: IPv6 abreviado ou com zona)."""
+    return ipaddress.ip_address(first.split('%', 1)[0]) == ipaddress.ip_address(second.split('%', 1)[0])
+
+
+class PinnedConnectionMixin:
+    """
+    Conexão do urllib3 aberta em um endereço já validado, sem resolver o host.
+
+    O host continua sendo usado no cabeçalho Host, no SNI e na verificação
+    do certificado. Se o endereço conectado não puder ser conferido, ou não
+    for o validado, a conexão é recusada antes de enviar a requisição.
+    """
+
+    pinned_address = None
+
+    def _new_conn(self):
+        extra_kw = {}
+        if self.source_address:
+            extra_kw['source_address'] = self.source_address
+        if self.socket_options:
+            extra_kw['socket_options'] = self.socket_options
+        try:
+            sock = urllib3_connection.create_connection((self.pinned_address, self.port), self.timeout, **extra_kw)
+        except socket.timeout:
+            raise ConnectTimeoutError(self, f"Conexão com {self.host} expirou (timeout={self.timeout})")
+        except OSError as e:
+            raise NewConnectionError(self, f"Falha ao conectar em {self.host}: {e}")
+        try:
+            peer = sock.getpeername()[0]
+            allowed = same_address(peer, self.pinned_address) and is_public_address(peer)
+        except (OSError, ValueError, TypeError, IndexError):
+            allowed = False
+        if not allowed:
+            sock.close()
+            raise NewConnectionError(self, f"Conexão com {self.host} recusada: endereço não conferido")
+        return sock
+
+
+class PinnedAdapter(HTTPAdapter):
+    """
+    Adaptador do requests cujas conexões vão sempre para `address` (ver PinnedConnectionMixin).
+    """
+
+    def __init__(self, address, **kwargs):
+        self.address = address
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        pinned = {'pinned_address': self.address}
+        http_connection = type('PinnedHTTPConnection', (PinnedConnectionMixin, HTTPConnection), pinned)
+        https_connection = type('PinnedHTTPSConnection', (PinnedConnectionMixin, HTTPSConnection), pinned)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('PinnedHTTPConnectionPool', (HTTPConnectionPool,), {'ConnectionCls': http_connection}),
+            'https': type('PinnedHTTPSConnectionPool', (HTTPSConnectionPool,), {'ConnectionCls': https_connection}),
+        }
+
+
+def pinned_session(address):
+    """
+    Sessão HTTP que conecta em `address` qualquer que seja o host da URL.
+
+    Proxies do ambiente são ignorados: o pedido não pode sair por outro caminho.
+
+    Args:
+        address (str): Endereço validado por check_source_url
+
+    Returns:
+        requests.Session: Sessão a ser fechada pelo chamador
+    """
+    session = requests.Session()
+    session.trust_env = False
+    adapter = PinnedAdapter(address)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def asset_url(name):
+    """
+    Caminho público de uma variante.
+
+    Args:
+        name (str): Nome da variante no cache ('<sha256>.<ext>')
+
+    Returns:
+        str: Caminho relativo ao servidor (ex: '/assets/ab12....webp')
+    """
+    return f'{ASSET_URL_PREFIX}{name}'
+
+
+class AssetStore:
+    """
+    Cache local de variantes de criativos, compartilhado pelos workers da máquina.
+
+    A ordem LRU é o mtime dos arquivos: cada leitura atualiza o mtime (no
+    máximo uma vez por `touch_interval`) e o despejo, feito após cada
+    ingestão, remove os arquivos mais antigos até o total ficar abaixo de
+    `max_bytes`. Cada variante tem um arquivo de origem (SOURCE_SUFFIX) que
+    sobrevive ao despejo: uma variante ausente redireciona para a imageUrl
+    original enquanto é regenerada em segundo plano (recover).
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024, fetch_timeout=10.0,
+                 max_source_bytes=10 * 1024 * 1024, max_source_pixels=40000000,
+                 output_format='webp', quality=80, touch_interval=3600.0, max_regenerations=4):
+        """
+        Inicializa o cache.
+
+        Args:
+            cache_dir (str): Diretório do cache (None desativa o pipeline)
+            max_bytes (int): Tamanho total máximo das variantes em bytes
+            fetch_timeout (float): Timeout do download do original em segundos
+            max_source_bytes (int): Tamanho máximo do arquivo original
+            max_source_pixels (int): Número máximo de pixels do original
+            output_format (str): Formato das variantes (chave de OUTPUT_FORMATS)
+            quality (int): Qualidade da recompressão (1-100)
+            touch_interval (float): Intervalo mínimo entre atualizações do mtime de uma variante
+            max_regenerations (int): Regenerações simultâneas de variantes ausentes por worker
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Formato de criativo inválido: {output_format}. Use um de {sorted(OUTPUT_FORMATS)}")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fetch_timeout = fetch_timeout
+        self.max_source_bytes = max_source_bytes
+        self.max_source_pixels = max_source_pixels
+        self.output_format = output_format
+        self.quality = quality
+        self.touch_interval = touch_interval
+        self.max_regenerations = max_regenerations
+        self.ingested = 0
+        self.ingest_failures = 0
+        self.source_bytes = 0
+        self.variant_bytes = 0
+        self.served = 0
+        self.misses = 0
+        self.evicted = 0
+        self.regenerated = 0
+        self.regenerate_failures = 0
+        self._evict_lock = threading.Lock()
+        self._regenerate_lock = threading.Lock()
+        self._regenerating = set()
+
+    @property
+    def enabled(self):
+        """True se o cache está configurado e o Pillow está instalado."""
+        return bool(self.cache_dir) and Image is not None
+
+    def _path(self, name):
+        # Um nível de subdiretórios pelos dois primeiros caracteres do hash
+        return os.path.join(self.cache_dir, name[:2], name)
+
+    def fetch(self, url):
+        """
+        Baixa o arquivo original, interrompendo acima de max_source_bytes.
+
+        Os redirecionamentos são seguidos manualmente (até MAX_REDIRECTS) para
+        que cada destino passe por check_source_url, e cada requisição é
+        enviada ao endereço validado (pinned_session), sem nova resolução.
+
+        Args:
+            url (str): URL da imagem
+
+        Returns:
+            bytes: Conteúdo do arquivo
+
+        Raises:
+            AssetError: Se o download falhar ou o arquivo for grande demais
+        """
+        if not url or not url.lower().startswith(('http://', 'https://')):
+            raise AssetError(f"URL de imagem inválida: {url}")
+        session = None
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                session = pinned_session(check_source_url(url))
+                response = session.get(url, timeout=self.fetch_timeout, stream=True, allow_redirects=False)
+                if not response.is_redirect:
+                    break
+                url = urljoin(url, response.headers['Location'])
+                response.close()
+                session.close()
+            else:
+                logger.warning(f"Criativo: mais de {MAX_REDIRECTS} redirecionamentos a partir de {url}")
+                raise AssetError(FETCH_ERROR)
+            with response:
+                response.raise_for_status()
+                declared = response.headers.get('Content-Length')
+                if declared and declared.isdigit() and int(declared) > self.max_source_bytes:
+                    raise AssetError(f"Imagem maior que o limite de {self.max_source_bytes} bytes")
+                chunks = []
+                size = 0
+                for chunk in response.iter_content(64 * 1024):
+                    size += len(chunk)
+                    if size > self.max_source_bytes:
+                        raise AssetError(f"Imagem maior que o limite de {self.max_source_bytes} bytes")
+                    chunks.append(chunk)
+        except requests.RequestException as e:
+            logger.warning(f"Criativo: falha ao baixar {url}: {e}")
+            raise AssetError(FETCH_ERROR) from e
+        finally:
+            if session is not None:
+                session.close()
+        return b''.join(chunks)
+
+    def decode(self, data):
+        """
+        Valida e decodifica o arquivo original.
+
+        Args:
+            data (bytes): Conteúdo do arquivo
+
+        Returns:
+            PIL.Image.Image: Primeiro quadro da imagem, já orientado pelo EXIF
+
+        Raises:
+            AssetError: Se o arquivo não for uma imagem aceita
+        """
+        try:
+            image = Image.open(io.BytesIO(data))
+            if image.format not in SOURCE_FORMATS:
+                raise AssetError(f"Formato de imagem não suportado: {image.format}")
+            if image.width * image.height > self.max_source_pixels:
+                raise AssetError(f"Imagem com resolução acima do limite ({image.width}x{image.height})")
+            # verify() invalida o objeto: a imagem é reaberta para a decodificação
+            image.verify()
+            image = Image.open(io.BytesIO(data))
+            image.seek(0)
+            image.load()
+            return ImageOps.exif_transpose(image)
+        except AssetError:
+            raise
+        except Exception as e:
+            raise AssetError(f"Arquivo de imagem inválido: {e}") from e
+
+    def render(self, image, width, height):
+        """
+        Gera uma variante recortada para o slot e recomprimida.
+
+        A imagem cobre o slot (recorte centralizado, como object-fit: cover)
+        e nunca é ampliada: com um original menor que o slot, a variante
+        mantém a proporção do slot no maior tamanho possível.
+
+        Args:
+            image (PIL.Image.Image): Imagem decodificada
+            width (int): Largura do slot
+            height (int): Altura do slot
+
+        Returns:
+            bytes: Variante codificada no formato de saída
+        """
+        factor = min(1.0, image.width / width, image.height / height)
+        size = (max(1, round(width * factor)), max(1, round(height * factor)))
+        pil_format = OUTPUT_FORMATS[self.output_format][0]
+
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        if has_alpha and pil_format == 'WEBP':
+            image = image.convert('RGBA')
+        elif has_alpha:
+            # JPEG não tem transparência: compõe sobre fundo branco
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        else:
+            image = image.convert('RGB')
+
+        variant = ImageOps.fit(image, size, method=Image.LANCZOS)
+        buffer = io.BytesIO()
+        if pil_format == 'WEBP':
+            variant.save(buffer, pil_format, quality=self.quality, method=6)
+        else:
+            variant.save(buffer, pil_format, quality=self.quality, optimize=True, progressive=True)
+        return buffer.getvalue()
+
+    def _write(self, path, data):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def store(self, data, source=None):
+        """
+        Grava uma variante no cache pelo hash do conteúdo.
+
+        Args:
+            data (bytes): Variante codificada
+            source (dict): Origem da variante ({'url', 'width', 'height'}), gravada
+                ao lado dela para a regeneração após um despejo
+
+        Returns:
+            str: Nome da variante ('<sha256>.<ext>')
+        """
+        name = f"{hashlib.sha256(data).hexdigest()}.{self.output_format}"
+        path = self._path(name)
+        if source is not None and not os.path.exists(path + SOURCE_SUFFIX):
+            self._write(path + SOURCE_SUFFIX, json.dumps(source).encode('utf-8'))
+        if os.path.exists(path):
+            # Mesmo conteúdo já gravado (outro anúncio ou outro worker): só renova a posição LRU
+            os.utime(path)
+            return name
+        self._write(path, data)
+        return name
+
+    def ingest(self, ad_type, image_url):
+        """
+        Baixa o criativo de um anúncio e gera as variantes do formato.
+
+        Args:
+            ad_type (AdType): Formato do anúncio (dimensões do slot)
+            image_url (str): URL da imagem original
+
+        Returns:
+            dict: {escala: caminho público} (ex: {'1x': '/assets/...', '3x': ...})
+                ou None se o pipeline estiver desativado
+
+        Raises:
+            AssetError: Se o criativo não puder ser baixado ou validado
+        """
+        if not self.enabled:
+            return None
+        try:
+            data = self.fetch(image_url)
+            image = self.decode(data)
+            assets = {}
+            variant_bytes = 0
+            for scale in ASSET_SCALES:
+                width, height = ad_type.width * scale, ad_type.height * scale
+                variant = self.render(image, width, height)
+                variant_bytes += len(variant)
+                source = {'url': image_url, 'width': width, 'height': height}
+                assets[f'{scale}x'] = asset_url(self.store(variant, source))
+        except AssetError:
+            self.ingest_failures += 1
+            raise
+        self.ingested += 1
+        self.source_bytes += len(data)
+        self.variant_bytes += variant_bytes
+        logger.info(f"Criativo de '{ad_type.name}' processado: {len(data)} bytes no original, "
+                    f"{variant_bytes} bytes em {len(assets)} variantes")
+        self.evict()
+        return assets
+
+    def read(self, name):
+        """
+        Lê uma variante do cache.
+
+        Args:
+            name (str): Nome da variante ('<sha256>.<ext>')
+
+        Returns:
+            tuple: (conteúdo, content type) ou None se a variante não existir
+        """
+        if not self.cache_dir or not ASSET_NAME_RE.match(name):
+            self.misses += 1
+            return None
+        path = self._path(name)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+                mtime = os.fstat(f.fileno()).st_mtime
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        now = time.time()
+        if now - mtime > self.touch_interval:
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+        self.served += 1
+        return data, OUTPUT_FORMATS[name.rsplit('.', 1)[1]][1]
+
+    def source(self, name):
+        """
+        Origem gravada de uma variante.
+
+        Args:
+            name (str): Nome da variante ('<sha256>.<ext>')
+
+        Returns:
+            dict: {'url', 'width', 'height'} ou None se a origem não for conhecida
+        """
+        if not self.cache_dir or not ASSET_NAME_RE.match(name):
+            return None
+        try:
+            with open(self._path(name) + SOURCE_SUFFIX, 'rb') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def regenerate(self, name, source):
+        """
+        Gera de novo uma variante ausente a partir do original.
+
+        Args:
+            name (str): Nome da variante esperada
+            source (dict): Origem da variante (ver source())
+
+        Returns:
+            bool: True se a variante gerada tem o mesmo nome (mesmo conteúdo)
+        """
+        try:
+            image = self.decode(self.fetch(source['url']))
+            variant = self.render(image, source['width'], source['height'])
+            if f"{hashlib.sha256(variant).hexdigest()}.{self.output_format}" != name:
+                # Original alterado ou outro formato de saída: o cliente continua na imageUrl
+                logger.warning(f"Criativo {name}: a regeneração produziu outro conteúdo")
+                self.regenerate_failures += 1
+                return False
+            self.store(variant, source)
+        except Exception as e:
+            logger.warning(f"Criativo {name}: falha na regeneração: {e}")
+            self.regenerate_failures += 1
+            return False
+        self.regenerated += 1
+        self.evict()
+        return True
+
+    def _regenerate_in_background(self, name, source):
+        try:
+            self.regenerate(name, source)
+        finally:
+            with self._regenerate_lock:
+                self._regenerating.discard(name)
+
+    def recover(self, name):
+        """
+        Trata uma variante ausente: agenda a regeneração e indica o original.
+
+        A regeneração roda em uma thread (no máximo max_regenerations por
+        worker, uma por variante); até ela terminar, a requisição é
+        redirecionada para a imageUrl original.
+
+        Args:
+            name (str): Nome da variante ('<sha256>.<ext>')
+
+        Returns:
+            str: URL do original ou None se a origem não for conhecida
+        """
+        source = self.source(name)
+        if source is None or not self.enabled:
+            return None
+        with self._regenerate_lock:
+            start = name not in self._regenerating and len(self._regenerating) < self.max_regenerations
+            if start:
+                self._regenerating.add(name)
+        if start:
+            threading.Thread(
+                target=self._regenerate_in_background, args=(name, source),
+                name='asset-regenerate', daemon=True
+            ).start()
+        return source['url']
+
+    def reset_after_fork(self):
+        """
+        Recria os locks no processo filho após um fork; regenerações em andamento ficam no pai.
+        """
+        self._evict_lock = threading.Lock()
+        self._regenerate_lock = threading.Lock()
+        self._regenerating = set()
+
+    def evict(self):
+        """
+        Remove as variantes usadas há mais tempo até o cache caber em max_bytes.
+
+        Returns:
+            int: Número de arquivos removidos
+        """
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return 0
+        with self._evict_lock:
+            entries = []
+            total = 0
+            for shard in os.scandir(self.cache_dir):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if not ASSET_NAME_RE.match(entry.name):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return 0
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            self.evicted += removed
+            logger.info(f"Cache de criativos: {removed} variantes despejadas ({total} bytes restantes)")
+            return removed
+
+    def stats(self):
+        """
+        Obtém as métricas do pipeline de criativos.
+
+        Returns:
+            dict: Ingestões, bytes de origem e das variantes, leituras, despejos e regenerações
+        """
+        return {
+            'enabled': self.enabled,
+            'ingested': self.ingested,
+            'ingest_failures': self.ingest_failures,
+            'source_bytes': self.source_bytes,
+            'variant_bytes': self.variant_bytes,
+            'served': self.served,
+            'misses': self.misses,
+            'evicted': self.evicted,
+            'regenerated': self.regenerated,
+            'regenerate_failures': self.regenerate_failures,
+        }
@@ -0,0 +1,457 @@
+"""
+Importação em lote de anúncios a partir de CSV ou JSON.
+Todas as linhas são validadas localmente antes de qualquer escrita; o lote
+válido é gravado com uma única chamada ao backend (bulk_write: um update
+multi-caminho no Firebase, uma transação no SQLite), com os IDs dos anúncios
+novos gerados no próprio servidor. Uma linha inválida recusa o lote inteiro.
+
+Os criativos das linhas com imagem nova são processados depois da escrita
+(ImportAssetProcessor), em um pool limitado de threads e com prazo total; até
+lá o jogo usa a imageUrl original.
+"""
+import csv
+import io
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from datetime import timezone
+
+from models.ad_types import AD_TYPE_REGISTRY
+from services.scheduling import SCHEDULE_FIELDS, parse_schedule
+from services.targeting import TARGETING_FIELDS, parse_targeting
+
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('csv', 'json')
+
+# Colunas reconhecidas; as demais (ex: impressions e clicks de um export) são ignoradas
+IMPORT_COLUMNS = ('type', 'id', 'title', 'imageUrl', 'targetUrl', 'weight') + SCHEDULE_FIELDS + TARGETING_FIELDS
+
+# Campos obrigatórios de um anúncio novo
+REQUIRED_FIELDS = ('title', 'imageUrl', 'targetUrl')
+
+URL_FIELDS = ('imageUrl', 'targetUrl')
+
+MAX_TITLE_LENGTH = 200
+
+
+class BulkImportError(ValueError):
+    """
+    Lote recusado, com a lista de erros por linha.
+    """
+
+    def __init__(self, errors):
+        """
+        Args:
+            errors (list): [{'row': n, 'field': nome ou None, 'message': texto}]
+        """
+        super().__init__(f"{len(errors)} erro(s) na importação")
+        self.errors = errors
+
+
+def detect_format(filename=None, content_type=None):
+    """
+    Deduz o formato do arquivo pela extensão ou pelo content type.
+
+    Args:
+        filename (str): Nome do arquivo enviado (opcional)
+        content_type (str): Content type da requisição (opcional)
+
+    Returns:
+        str: 'csv', 'json' ou None se não for possível deduzir
+    """
+    if filename:
+        extension = filename.rsplit('.', 1)[-1].lower()
+        if extension in IMPORT_FORMATS:
+            return extension
+    if content_type:
+        if 'csv' in content_type:
+            return 'csv'
+        if 'json' in content_type:
+            return 'json'
+    return None
+
+
+def parse_rows(data, import_format):
+    """
+    Lê as linhas do arquivo de importação.
+
+    JSON aceita uma lista de objetos ou {"ads": [...]}; CSV usa a primeira
+    linha como cabeçalho (mesmos nomes de IMPORT_COLUMNS).
+
+    Args:
+        data (str | bytes): Conteúdo do arquivo
+        import_format (str): 'csv' ou 'json'
+
+    Returns:
+        list: Linhas como dicts
+
+    Raises:
+        ValueError: Se o formato for desconhecido ou o arquivo não puder ser lido
+    """
+    if import_format not in IMPORT_FORMATS:
+        raise ValueError(f"Formato de importação inválido: {import_format}. Use um de {list(IMPORT_FORMATS)}")
+    if isinstance(data, bytes):
+        # utf-8-sig aceita o BOM que planilhas costumam gravar
+        data = data.decode('utf-8-sig')
+    if import_format == 'json':
+        try:
+            rows = json.loads(data)
+        except ValueError as e:
+            raise ValueError(f"JSON inválido: {e}") from e
+        if isinstance(rows, dict):
+            rows = rows.get('ads')
+        if not isinstance(rows, list):
+            raise ValueError("O JSON deve ser uma lista de anúncios ou {\"ads\": [...]}")
+        return rows
+    return list(csv.DictReader(io.StringIO(data)))
+
+
+def clean_value(value):
+    if isinstance(value, str):
+        value = value.strip()
+    return None if value in (None, '') else value
+
+
+def validate_rows(rows, existing_ids, default_type=None, schedule_tz=timezone.utc):
+    """
+    Valida as linhas e separa anúncios novos (sem id) de atualizações (com id).
+
+    Args:
+        rows (list): Linhas lidas por parse_rows
+        existing_ids (dict): {ad_type: conjunto de IDs existentes}
+        default_type (str): Tipo usado nas linhas sem a coluna 'type'
+        schedule_tz (tzinfo): Fuso de startAt/endAt em ISO 8601 sem deslocamento
+
+    Returns:
+        tuple: (creates [(linha, ad_type, campos)], updates [(linha, ad_type, ad_id, campos)])
+
+    Raises:
+        BulkImportError: Se alguma linha for inválida
+    """
+    creates = []
+    updates = []
+    errors = []
+    seen_ids = set()
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({'row': number, 'field': None, 'message': "Linha deve ser um objeto"})
+            continue
+        values = {column: clean_value(row.get(column)) for column in IMPORT_COLUMNS}
+        row_errors = []
+
+        ad_type = values['type'] or default_type
+        if ad_type is None:
+            row_errors.append(('type', "Campo obrigatório (ou informe o tipo padrão do arquivo)"))
+        elif ad_type not in AD_TYPE_REGISTRY:
+            row_errors.append(('type', f"Tipo de anúncio inválido: {ad_type}"))
+
+        ad_id = values['id']
+        if ad_id is not None:
+            ad_id = str(ad_id)
+            if ad_type in AD_TYPE_REGISTRY and ad_id not in existing_ids.get(ad_type, ()):
+                row_errors.append(('id', f"Anúncio '{ad_type}' com ID {ad_id} não encontrado"))
+            elif (ad_type, ad_id) in seen_ids:
+                row_errors.append(('id', f"ID {ad_id} repetido no arquivo"))
+            seen_ids.add((ad_type, ad_id))
+        else:
+            for field in REQUIRED_FIELDS:
+                if values[field] is None:
+                    row_errors.append((field, "Campo obrigatório"))
+
+        fields = {}
+        if values['title'] is not None:
+            title = str(values['title'])
+            if len(title) > MAX_TITLE_LENGTH:
+                row_errors.append(('title', f"Título com mais de {MAX_TITLE_LENGTH} caracteres"))
+            fields['title'] = title
+        for field in URL_FIELDS:
+            if values[field] is None:
+                continue
+            url = str(values[field])
+            if not url.lower().startswith(('http://', 'https://')):
+                row_errors.append((field, "URL deve começar com http:// ou https://"))
+            fields[field] = url
+        if values['weight'] is not None:
+            try:
+                weight = float(values['weight'])
+            except (TypeError, ValueError):
+                weight = -1.0
+            if weight < 0:
+                row_errors.append(('weight', "Peso deve ser um número não negativo"))
+            fields['weight'] = weight
+        schedule = {field: values[field] for field in SCHEDULE_FIELDS if values[field] is not None}
+        if schedule:
+            if ad_type in AD_TYPE_REGISTRY and not AD_TYPE_REGISTRY[ad_type].scheduling:
+                row_errors.append((None, f"O tipo '{ad_type}' não aceita agendamento"))
+            else:
+                try:
+                    parsed = parse_schedule(schedule, schedule_tz)
+                except ValueError as e:
+                    row_errors.append((None, str(e)))
+                else:
+                    fields.update((field, parsed[field]) for field in schedule)
+        targeting = {field: values[field] for field in TARGETING_FIELDS if values[field] is not None}
+        if targeting:
+            if ad_type in AD_TYPE_REGISTRY and not AD_TYPE_REGISTRY[ad_type].targeting:
+                row_errors.append((None, f"O tipo '{ad_type}' não aceita segmentação"))
+            else:
+                try:
+                    parsed = parse_targeting(targeting)
+                except ValueError as e:
+                    row_errors.append((None, str(e)))
+                else:
+                    fields.update((field, parsed[field]) for field in targeting)
+
+        if ad_id is not None and not fields:
+            row_errors.append((None, "Nenhum campo para atualizar"))
+
+        if row_errors:
+            errors.extend({'row': number, 'field': field, 'message': message} for field, message in row_errors)
+        elif ad_id is None:
+            creates.append((number, ad_type, fields))
+        else:
+            updates.append((number, ad_type, ad_id, fields))
+
+    if errors:
+        raise BulkImportError(errors)
+    return creates, updates
+
+
+def import_asset_jobs(creates, updates, ids, existing_ads):
+    """
+    Lista os criativos a processar depois da escrita de um lote.
+
+    Deve ser chamada antes de bulk_write: nas atualizações com imagem nova,
+    as variantes da imagem anterior são descartadas na mesma escrita.
+
+    Args:
+        creates (list): Anúncios novos de validate_rows
+        updates (list): Atualizações de validate_rows
+        ids (list): IDs dos anúncios novos, na ordem de `creates` (None antes da escrita)
+        existing_ads (dict): {ad_type: {id: dados}} dos anúncios atuais
+
+    Returns:
+        list: [(ad_type, ad_id, image_url)] dos anúncios com imagem nova
+    """
+    jobs = []
+    for index, (_, ad_type, fields) in enumerate(creates):
+        if ids is not None:
+            jobs.append((ad_type, ids[index], fields['imageUrl']))
+    for _, ad_type, ad_id, fields in updates:
+        if 'imageUrl' not in fields:
+            continue
+        previous = existing_ads.get(ad_type, {}).get(ad_id) or {}
+        if previous.get('imageUrl') == fields['imageUrl'] and previous.get('assets'):
+            continue
+        if previous.get('assets'):
+            fields['assets'] = None
+        jobs.append((ad_type, ad_id, fields['imageUrl']))
+    return jobs
+
+
+class ImportAssetProcessor:
+    """
+    Processa os criativos de importações já gravadas.
+
+    Cada URL é baixada uma vez por importação, em um pool de `max_workers`
+    threads compartilhado pelas importações do worker, com `deadline`
+    segundos para a importação inteira; as imagens que falham ou não terminam
+    no prazo ficam sem variantes (o jogo usa a imageUrl original). As
+    variantes prontas são gravadas em um único bulk_write, só nos anúncios
+    que ainda têm a mesma imageUrl.
+    """
+
+    def __init__(self, asset_store, max_workers=4, deadline=600.0):
+        """
+        Inicializa o processador.
+
+        Args:
+            asset_store (AssetStore): Pipeline de criativos
+            max_workers (int): Downloads simultâneos por worker
+            deadline (float): Prazo total em segundos para os criativos de uma importação
+        """
+        self.asset_store = asset_store
+        self.max_workers = max_workers
+        self.deadline = deadline
+        self.processed = 0
+        self.failed = 0
+        self.expired = 0
+        self.running = 0
+        self._lock = threading.Lock()
+        self._pool = None
+
+    @property
+    def enabled(self):
+        """True se o pipeline de criativos está ativo."""
+        return self.asset_store is not None and self.asset_store.enabled
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='import-assets')
+            return self._pool
+
+    def process(self, storage, jobs, on_done=None):
+        """
+        Processa os criativos de uma importação e grava as variantes.
+
+        Args:
+            storage (AdStorage): Backend em que o lote foi gravado
+            jobs (list): [(ad_type, ad_id, image_url)] de import_asset_jobs
+            on_done (callable): Chamada após a escrita das variantes (ex: invalidar o cache)
+
+        Returns:
+            dict: {'processed': n, 'failed': n, 'expired': n} por URL
+        """
+        result = {'processed': 0, 'failed': 0, 'expired': 0}
+        if not jobs or not self.enabled:
+            return result
+        with self._lock:
+            self.running += 1
+        try:
+            executor = self._executor()
+            futures = {}
+            for key in dict.fromkeys((ad_type, image_url) for ad_type, _, image_url in jobs):
+                futures[executor.submit(self.asset_store.ingest, AD_TYPE_REGISTRY[key[0]], key[1])] = key
+            assets = {}
+            try:
+                for future in as_completed(futures, timeout=self.deadline):
+                    key = futures[future]
+                    try:
+                        assets[key] = future.result()
+                        result['processed'] += 1
+                    except Exception as e:
+                        logger.warning(f"Importação: criativo recusado ({key[1]}): {e}")
+                        result['failed'] += 1
+            except FutureTimeoutError:
+                for future in futures:
+                    if not future.done():
+                        future.cancel()
+                result['expired'] = len(futures) - result['processed'] - result['failed']
+                logger.warning(f"Importação: {result['expired']} criativos fora do prazo de {self.deadline}s")
+
+            if assets:
+                # Uma leitura para não sobrescrever anúncios editados ou removidos nesse meio-tempo
+                current = storage.list_all_ads()
+                updates = [
+                    (ad_type, ad_id, {'assets': assets[(ad_type, image_url)]})
+                    for ad_type, ad_id, image_url in jobs
+                    if assets.get((ad_type, image_url)) is not None
+                    and (current.get(ad_type, {}).get(ad_id) or {}).get('imageUrl') == image_url
+                ]
+                if updates:
+                    storage.bulk_write([], updates)
+                    if on_done is not None:
+                        on_done()
+        except Exception as e:
+            logger.error(f"Importação: erro ao gravar os criativos processados: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.processed += result['processed']
+                self.failed += result['failed']
+                self.expired += result['expired']
+        logger.info(f"Importação: criativos processados={result['processed']} recusados={result['failed']} "
+                    f"fora do prazo={result['expired']}")
+        return result
+
+    def submit(self, storage, jobs, on_done=None):
+        """
+        Processa os criativos em uma thread, sem bloquear a requisição da importação.
+
+        Args:
+            storage (AdStorage): Backend em que o lote foi gravado
+            jobs (list): [(ad_type, ad_id, image_url)] de import_asset_jobs
+            on_done (callable): Chamada após a escrita das variantes
+        """
+        if not jobs or not self.enabled:
+            return
+        threading.Thread(
+            target=self.process, args=(storage, jobs, on_done),
+            name='import-assets-batch', daemon=True
+        ).start()
+
+    def reset_after_fork(self):
+        """
+        Descarta o pool e o lock copiados do processo pai; o pool é recriado no primeiro uso.
+        """
+        self._lock = threading.Lock()
+        self._pool = None
+        self.running = 0
+
+    def stats(self):
+        """
+        Obtém as métricas do processamento de criativos das importações.
+
+        Returns:
+            dict: Criativos processados, recusados e fora do prazo; importações em andamento
+        """
+        return {
+            'enabled': self.enabled,
+            'running': self.running,
+            'processed': self.processed,
+            'failed': self.failed,
+            'expired': self.expired,
+        }
+
+
+def import_ads(storage, data, import_format, default_type=None, asset_processor=None, dry_run=False, max_rows=None,
+               wait_assets=False, on_assets=None, schedule_tz=timezone.utc):
+    """
+    Valida e grava um arquivo de anúncios em uma única escrita no backend.
+
+    Args:
+        storage (AdStorage): Backend de armazenamento
+        data (str | bytes): Conteúdo do arquivo
+        import_format (str): 'csv' ou 'json'
+        default_type (str): Tipo usado nas linhas sem a coluna 'type'
+        asset_processor (ImportAssetProcessor): Processamento dos criativos (None não processa as imagens)
+        dry_run (bool): Só valida, sem gravar
+        max_rows (int): Número máximo de linhas do arquivo (None para ilimitado)
+        wait_assets (bool): Processa os criativos antes de retornar (linha de comando)
+            em vez de em segundo plano
+        on_assets (callable): Chamada após a gravação das variantes
+        schedule_tz (tzinfo): Fuso de startAt/endAt em ISO 8601 sem deslocamento
+
+    Returns:
+        dict: {'created': n, 'updated': n, 'ids': [IDs criados], 'dry_run': bool,
+            'assets_pending': criativos a processar, 'assets': resultado (com wait_assets)}
+
+    Raises:
+        ValueError: Se o arquivo não puder ser lido
+        BulkImportError: Se alguma linha for inválida (nada é gravado)
+    """
+    rows = parse_rows(data, import_format)
+    if not rows:
+        raise ValueError("Arquivo sem anúncios")
+    if max_rows is not None and len(rows) > max_rows:
+        raise ValueError(f"Arquivo com {len(rows)} linhas; o limite é {max_rows}")
+    existing_ads = {}
+    if any(isinstance(row, dict) and clean_value(row.get('id')) is not None for row in rows):
+        # Uma leitura de ads/ para conferir os IDs das atualizações
+        existing_ads = storage.list_all_ads()
+    existing_ids = {ad_type: set(ads) for ad_type, ads in existing_ads.items()}
+    creates, updates = validate_rows(rows, existing_ids, default_type, schedule_tz)
+
+    if dry_run:
+        return {'created': len(creates), 'updated': len(updates), 'ids': [], 'dry_run': True}
+    process_assets = asset_processor is not None and asset_processor.enabled
+    if process_assets:
+        # Descarta as variantes das imagens trocadas na mesma escrita do lote
+        import_asset_jobs([], updates, None, existing_ads)
+
+    ids = storage.bulk_write(
+        [(ad_type, fields) for _, ad_type, fields in creates],
+        [(ad_type, ad_id, fields) for _, ad_type, ad_id, fields in updates]
+    )
+    result = {'created': len(ids), 'updated': len(updates), 'ids': ids, 'dry_run': False, 'assets_pending': 0}
+    if process_assets:
+        jobs = import_asset_jobs(creates, updates, ids, existing_ads)
+        result['assets_pending'] = len(jobs)
+        if wait_assets:
+            result['assets'] = asset_processor.process(storage, jobs, on_assets)
+        else:
+            asset_processor.submit(storage, jobs, on_assets)
+    return result
@@ -0,0 +1,263 @@
+"""
+Agregador de contadores de impressões e cliques em memória.
+Acumula incrementos por (tipo, id, campo) e os grava periodicamente em uma
+única escrita em lote, tirando as transações do RTDB do caminho da requisição.
+"""
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Agrupamentos (segundos) usados quando os horários de uma chave passam do limite; os
+# inícios de minuto, hora e dia caem nos mesmos buckets das agregações do log de eventos
+EVENT_TIME_STEPS = (60, 3600, 86400)
+
+
+def add_event_time(times, second, amount, max_entries):
+    """
+    Soma eventos ao mapa {timestamp: n} de uma chave, mantendo-o limitado.
+
+    Passando de `max_entries` horários, o mapa é reagrupado no primeiro passo
+    de EVENT_TIME_STEPS que o reduz à metade do limite (ou no maior deles).
+
+    Args:
+        times (dict): {timestamp Unix em segundos: n}, alterado no lugar
+        second (int): Horário dos eventos
+        amount (int): Número de eventos
+        max_entries (int): Número máximo de horários no mapa
+    """
+    times[second] = times.get(second, 0) + amount
+    if len(times) <= max_entries:
+        return
+    for step in EVENT_TIME_STEPS:
+        merged = {}
+        for ts, count in times.items():
+            bucket = ts - ts % step
+            merged[bucket] = merged.get(bucket, 0) + count
+        if len(merged) <= max_entries // 2:
+            break
+    times.clear()
+    times.update(merged)
+
+
+class CounterBuffer:
+    """
+    Buffer de incrementos de contadores com flush periódico.
+
+    Os incrementos ficam em um dicionário limitado a `max_pending` chaves,
+    com a contagem por segundo em que cada evento chegou (para o log de
+    eventos, que registra o horário do evento e não o do flush). Cada chave
+    guarda até `max_event_times` horários; acima disso eles são agrupados por
+    minuto, hora ou dia (ver add_event_time), o que só perde precisão abaixo
+    do bucket e mantém as agregações corretas quando o flush fica parado.
+    Um flush que falha devolve os incrementos ao buffer para a próxima
+    tentativa, e o buffer é esvaziado uma última vez no encerramento do worker.
+    Depois de stop() o buffer fica fechado: incrementos tardios (requisições
+    que já tinham o buffer em mãos) vão para `forward`, se informado, ou são
+    descartados e contados em `dropped_events`, em vez de ficarem em um buffer
+    que ninguém esvazia. Nenhum dos caminhos acessa o datastore na requisição.
+    """
+
+    def __init__(self, writer, flush_interval=2.0, max_pending=10000, max_event_times=120):
+        """
+        Inicializa o buffer.
+
+        Args:
+            writer (callable): Função que recebe {(ad_type, ad_id, field): n} e
+                {(ad_type, ad_id, field): {timestamp Unix em segundos: n}} e grava
+                todos os incrementos em uma única operação
+            flush_interval (float): Intervalo entre flushes em segundos
+            max_pending (int): Número máximo de chaves pendentes no buffer
+            max_event_times (int): Número máximo de horários guardados por chave
+        """
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_event_times = max(int(max_event_times), 2)
+        self.flushed_events = 0
+        self.flush_count = 0
+        self.flush_failures = 0
+        self.dropped_events = 0
+        self.last_flush_at = None
+        self.last_flush_duration = 0.0
+        self.last_flush_lag = 0.0
+        self.forwarded_events = 0
+        self._pending = {}
+        self._event_times = {}
+        self._oldest_pending_at = None
+        self._closed = False
+        self._forward = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def increment(self, ad_type, ad_id, field, amount=1):
+        """
+        Acumula um incremento sem acessar o datastore.
+
+        Args:
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
+            ad_id (str): ID do anúncio
+            field (str): Campo do contador ('impressions' ou 'clicks')
+            amount (int): Valor do incremento
+
+        Returns:
+            bool: True se o incremento foi aceito, False se o buffer está cheio
+                ou fechado sem destino para os incrementos tardios
+        """
+        key = (ad_type, ad_id, field)
+        second = int(time.time())
+        with self._lock:
+            closed = self._closed
+            if closed:
+                forward = self._forward
+                if forward is None:
+                    self.dropped_events += amount
+                    return False
+            elif key not in self._pending and len(self._pending) >= self.max_pending:
+                self.dropped_events += amount
+                self._wake_event.set()
+                return False
+            else:
+                if not self._pending:
+                    self._oldest_pending_at = time.monotonic()
+                self._pending[key] = self._pending.get(key, 0) + amount
+                add_event_time(self._event_times.setdefault(key, {}), second, amount, self.max_event_times)
+                if len(self._pending) >= self.max_pending:
+                    self._wake_event.set()
+        if closed:
+            self.forwarded_events += amount
+            return forward(*key, amount)
+        return True
+
+    def reset_after_fork(self):
+        """
+        Prepara o buffer no processo filho após um fork.
+
+        A thread de flush não existe no filho e as pendências pertencem ao
+        processo pai (que as grava); o filho começa com o buffer vazio.
+        """
+        self._pending = {}
+        self._event_times = {}
+        self._oldest_pending_at = None
+        self._closed = False
+        self._forward = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _requeue(self, increments, event_times):
+        with self._lock:
+            if not self._pending:
+                self._oldest_pending_at = time.monotonic()
+            for key, amount in increments.items():
+                if key not in self._pending and len(self._pending) >= self.max_pending:
+                    self.dropped_events += amount
+                    continue
+                self._pending[key] = self._pending.get(key, 0) + amount
+                times = self._event_times.setdefault(key, {})
+                for second, count in event_times.get(key, {}).items():
+                    add_event_time(times, second, count, self.max_event_times)
+
+    def flush(self):
+        """
+        Grava todos os incrementos pendentes em uma única escrita.
+
+        Returns:
+            bool: True se não havia pendências ou a escrita teve sucesso
+        """
+        with self._flush_lock:
+            with self._lock:
+                increments = self._pending
+                event_times = self._event_times
+                oldest = self._oldest_pending_at
+                self._pending = {}
+                self._event_times = {}
+                self._oldest_pending_at = None
+            if not increments:
+                return True
+
+            started = time.monotonic()
+            # Atraso entre o incremento mais antigo do lote e o início da gravação
+            lag = started - oldest if oldest is not None else 0.0
+            try:
+                self.writer(increments, event_times)
+            except Exception as e:
+                self.flush_failures += 1
+                logger.error(f"Erro ao gravar {len(increments)} contadores em lote, reenfileirando: {e}", exc_info=True)
+                self._requeue(increments, event_times)
+                return False
+
+            self.last_flush_duration = time.monotonic() - started
+            self.last_flush_lag = lag
+            self.last_flush_at = time.time()
+            self.flush_count += 1
+            self.flushed_events += sum(increments.values())
+            return True
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self.flush_interval)
+            self._wake_event.clear()
+            self.flush()
+
+    def start(self):
+        """
+        Inicia a thread de flush periódico e registra o flush de encerramento.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='counter-buffer-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, forward=None):
+        """
+        Para a thread de flush, fecha o buffer e grava as pendências restantes.
+
+        Args:
+            forward (callable): Recebe (ad_type, ad_id, field, amount) dos incrementos
+                que chegarem depois do fechamento e devolve se foram aceitos; deve só
+                enfileirar, sem acessar o datastore (None descarta esses incrementos)
+        """
+        with self._lock:
+            # Incrementos anteriores já estão nas pendências e entram no flush abaixo
+            self._closed = True
+            self._forward = forward
+        self._stop_event.set()
+        self._wake_event.set()
+        if not self.flush():
+            with self._lock:
+                lost = sum(self._pending.values())
+            logger.error(f"{lost} incrementos de contadores não puderam ser gravados no encerramento.")
+
+    def stats(self):
+        """
+        Obtém contadores do próprio buffer.
+
+        Returns:
+            dict: Pendências, eventos gravados/descartados, falhas, duração e atraso do flush
+        """
+        with self._lock:
+            pending_keys = len(self._pending)
+            pending_events = sum(self._pending.values())
+            oldest = self._oldest_pending_at
+        return {
+            'pending_keys': pending_keys,
+            'pending_events': pending_events,
+            'pending_age_seconds': round(time.monotonic() - oldest, 3) if oldest is not None else 0.0,
+            'flushed_events': self.flushed_events,
+            'flush_count': self.flush_count,
+            'flush_failures': self.flush_failures,
+            'dropped_events': self.dropped_events,
+            'forwarded_events': self.forwarded_events,
+            'last_flush_at': self.last_flush_at,
+            'last_flush_duration': round(self.last_flush_duration, 4),
+            'last_flush_lag': round(self.last_flush_lag, 4),
+        }
@@ -0,0 +1,137 @@
+"""
+Compactação periódica dos contadores fragmentados (shards).
+Com ADS_COUNTER_SHARDS, cada worker incrementa o próprio shard dentro do
+anúncio em vez do nó principal; esta thread incorpora periodicamente ao
+total o que os workers gravaram nos shards, em uma escrita em lote. A
+compactação lê o inventário inteiro, então só um processo por vez a executa:
+o que detém a concessão gravada no datastore (renovada a cada compactação).
+"""
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CounterCompactor:
+    """
+    Thread que chama storage.compact_counters a cada `interval` segundos.
+
+    A compactação não altera as leituras (que já somam os shards); ela só
+    mantém os shards pequenos. Cada tentativa disputa a concessão de
+    compactação (AdStorage.acquire_compaction_lease, válida por três
+    intervalos): os demais workers só pulam a vez, e se o detentor morre outro
+    assume quando a concessão vence. No encerramento, o detentor compacta uma
+    última vez, depois do flush final do buffer de contadores, e libera a
+    concessão.
+    """
+
+    def __init__(self, storage, interval=60.0):
+        """
+        Inicializa o compactador.
+
+        Args:
+            storage (AdStorage): Backend de armazenamento
+            interval (float): Intervalo entre compactações em segundos
+        """
+        self.storage = storage
+        self.interval = interval
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.leader = False
+        self.skipped_compactions = 0
+        self.compaction_count = 0
+        self.compacted_counters = 0
+        self.compaction_failures = 0
+        self.last_compaction_at = None
+        self.last_compaction_duration = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def compact(self):
+        """
+        Compacta os contadores gravados nos shards, se este processo detém a concessão.
+
+        Returns:
+            bool: True se a compactação teve sucesso (ou não havia nada a compactar
+                ou outro processo detém a concessão)
+        """
+        started = time.monotonic()
+        try:
+            self.leader = self.storage.acquire_compaction_lease(self.holder, 3 * self.interval)
+            if not self.leader:
+                self.skipped_compactions += 1
+                return True
+            compacted = self.storage.compact_counters()
+        except Exception as e:
+            self.compaction_failures += 1
+            logger.error(f"Erro ao compactar os shards de contadores: {e}", exc_info=True)
+            return False
+        if compacted:
+            self.compaction_count += 1
+            self.compacted_counters += compacted
+            self.last_compaction_at = time.time()
+            self.last_compaction_duration = time.monotonic() - started
+        return True
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.compact()
+
+    def start(self):
+        """
+        Inicia a compactação periódica e registra a compactação de encerramento.
+
+        Deve ser chamado antes de CounterBuffer.start(): o atexit executa na
+        ordem inversa do registro, então o flush final do buffer acontece antes.
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='counter-compactor', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Para a thread, compacta uma última vez e libera a concessão.
+        """
+        self._stop_event.set()
+        if not self.leader:
+            return
+        self.compact()
+        try:
+            self.storage.release_compaction_lease(self.holder)
+        except Exception as e:
+            logger.error(f"Erro ao liberar a concessão de compactação: {e}", exc_info=True)
+        self.leader = False
+
+    def reset_after_fork(self):
+        """
+        Prepara o compactador no processo filho após um fork.
+
+        A thread não existe no filho e é recriada por start(); o filho disputa
+        a concessão com o próprio identificador.
+        """
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.leader = False
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def stats(self):
+        """
+        Obtém as métricas do compactador.
+
+        Returns:
+            dict: Compactações, contadores compactados, falhas e duração da última
+        """
+        return {
+            'leader': self.leader,
+            'skipped_compactions': self.skipped_compactions,
+            'compaction_count': self.compaction_count,
+            'compacted_counters': self.compacted_counters,
+            'compaction_failures': self.compaction_failures,
+            'last_compaction_at': self.last_compaction_at,
+            'last_compaction_duration': self.last_compaction_duration,
+        }
@@ -0,0 +1,173 @@
+"""
+Exportação de desempenho dos anúncios em CSV ou NDJSON.
+Os relatórios são geradores: os anúncios são lidos do datastore em blocos e
+as agregações por bucket direto do cursor do SQLite, e a saída é produzida em
+pedaços, então o uso de memória não depende do tamanho do relatório.
+"""
+import csv
+import io
+import json
+
+from models.events import GRANULARITIES
+from models.storage import AD_TYPES, now_millis
+from services.scheduling import ad_is_active
+
+# Formatos suportados e o content-type de cada um
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+# Colunas de cada relatório
+REPORT_COLUMNS = {
+    'ads': ('type', 'id', 'title', 'created_at', 'active', 'impressions', 'clicks', 'ctr'),
+    'timeseries': ('bucket', 'type', 'ad_id', 'impressions', 'clicks', 'ctr'),
+}
+
+# Linhas agrupadas em cada pedaço da resposta
+ROWS_PER_CHUNK = 200
+
+
+def row_ctr(clicks, impressions):
+    return round(clicks / impressions * 100, 2) if impressions else 0.0
+
+
+def iter_ad_rows(storage, ad_types=AD_TYPES, chunk_size=500):
+    """
+    Gera uma linha de desempenho por anúncio.
+
+    A coluna `active` segue o agendamento (período e orçamento de impressões)
+    no momento em que a exportação começa.
+
+    Args:
+        storage (AdStorage): Backend de armazenamento
+        ad_types (iterable): Tipos de anúncio exportados
+        chunk_size (int): Anúncios lidos por chamada ao datastore
+
+    Yields:
+        dict: Linha com as colunas de REPORT_COLUMNS['ads']
+    """
+    now = now_millis()
+    for ad_type in ad_types:
+        for ad in storage.iter_ads(ad_type, chunk_size=chunk_size):
+            impressions = int(ad.get('impressions', 0) or 0)
+            clicks = int(ad.get('clicks', 0) or 0)
+            yield {
+                'type': ad_type,
+                'id': ad['id'],
+                'title': ad.get('title', ''),
+                'created_at': ad.get('created_at'),
+                'active': ad_is_active(ad, now),
+                'impressions': impressions,
+                'clicks': clicks,
+                'ctr': row_ctr(clicks, impressions),
+            }
+
+
+def iter_timeseries_rows(event_store, granularity='hour', ad_type=None, ad_id=None, start=None, end=None):
+    """
+    Gera uma linha por anúncio e bucket a partir das agregações do log de eventos.
+
+    Args:
+        event_store (EventStore): Log de eventos
+        granularity (str): 'minute', 'hour' ou 'day'
+        ad_type (str): Filtra por tipo de anúncio (opcional)
+        ad_id (str): Filtra por anúncio (opcional)
+        start (int): Timestamp Unix inicial, inclusivo (opcional)
+        end (int): Timestamp Unix final, exclusivo (opcional)
+
+    Yields:
+        dict: Linha com as colunas de REPORT_COLUMNS['timeseries']
+    """
+    rows = event_store.iter_rollup(granularity, ad_type=ad_type, ad_id=ad_id, start=start, end=end)
+    for bucket, row_type, row_ad_id, impressions, clicks in rows:
+        yield {
+            'bucket': bucket,
+            'type': row_type,
+            'ad_id': row_ad_id,
+            'impressions': impressions,
+            'clicks': clicks,
+            'ctr': row_ctr(clicks, impressions),
+        }
+
+
+def encode_rows(rows, export_format, columns, rows_per_chunk=ROWS_PER_CHUNK):
+    """
+    Serializa linhas em pedaços de texto.
+
+    Args:
+        rows (iterable): Linhas (dicts) do relatório
+        export_format (str): 'csv' ou 'ndjson'
+        columns (tuple): Colunas, na ordem do cabeçalho do CSV
+        rows_per_chunk (int): Linhas por pedaço
+
+    Yields:
+        str: Pedaço da saída (no CSV, o primeiro é o cabeçalho)
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportação inválido: {export_format}")
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n') if export_format == 'csv' else None
+    if writer is not None:
+        writer.writerow(columns)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    pending = 0
+    for row in rows:
+        if writer is not None:
+            writer.writerow([row[column] for column in columns])
+        else:
+            buffer.write(json.dumps(row, ensure_ascii=False))
+            buffer.write('\n')
+        pending += 1
+        if pending >= rows_per_chunk:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue()
+
+
+def export_report(storage, event_store, report, export_format, ad_type=None, ad_id=None,
+                  granularity='hour', start=None, end=None):
+    """
+    Monta o gerador de saída de um relatório, validando os parâmetros antes de iniciar.
+
+    Args:
+        storage (AdStorage): Backend de armazenamento (relatório 'ads')
+        event_store (EventStore): Log de eventos (relatório 'timeseries')
+        report (str): 'ads' (uma linha por anúncio) ou 'timeseries' (anúncio e bucket)
+        export_format (str): 'csv' ou 'ndjson'
+        ad_type (str): Filtra por tipo de anúncio (opcional)
+        ad_id (str): Filtra por anúncio, apenas em 'timeseries' (opcional)
+        granularity (str): Granularidade dos buckets em 'timeseries'
+        start (int): Timestamp Unix inicial em 'timeseries' (opcional)
+        end (int): Timestamp Unix final em 'timeseries' (opcional)
+
+    Returns:
+        generator: Pedaços de texto da saída
+
+    Raises:
+        ValueError: Se algum parâmetro for inválido ou o log de eventos estiver desativado
+    """
+    if report not in REPORT_COLUMNS:
+        raise ValueError(f"Relatório inválido: {report}")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportação inválido: {export_format}")
+    if ad_type is not None and ad_type not in AD_TYPES:
+        raise ValueError(f"Tipo de anúncio inválido: {ad_type}")
+
+    if report == 'ads':
+        rows = iter_ad_rows(storage, (ad_type,) if ad_type else AD_TYPES)
+    else:
+        if event_store is None:
+            raise ValueError("Log de eventos desativado")
+        # Validada já aqui: o gerador só executaria a consulta na primeira leitura
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Granularidade inválida: {granularity}")
+        rows = iter_timeseries_rows(event_store, granularity, ad_type=ad_type, ad_id=ad_id, start=start, end=end)
+    return encode_rows(rows, export_format, REPORT_COLUMNS[report])
@@ -0,0 +1,558 @@
+"""
+Limite de frequência dos anúncios de tela cheia, decidido no servidor.
+Cada sessão tem um registro compacto (game overs desde a última exibição,
+contador de janela deslizante e horários), indexado por um hash de 8 bytes do
+ID da sessão e descartado após um TTL de inatividade. A decisão "exibir ou
+pular" é O(1) e não lê o datastore.
+
+Com vários workers, o registro fica em uma tabela SQLite compartilhada
+(SharedCapState), e a decisão e a exibição (next_show) são gravadas na mesma
+transação: os limites valem para a sessão, qualquer que seja o worker que a
+atende, mesmo com game overs simultâneos. Sem ela, o registro
+fica na memória do worker e é gravado periodicamente em um snapshot para
+sobreviver a reinícios; nesse modo os limites só valem com um único worker
+ou com roteamento fixo da sessão para o mesmo worker (sticky).
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from models.stats_store import FileLock
+
+logger = logging.getLogger(__name__)
+
+# Posições do registro de cada sessão
+GAME_OVERS = 0      # game overs desde a última exibição
+WINDOW_START = 1    # início (timestamp Unix) da janela atual
+WINDOW_COUNT = 2    # exibições na janela atual
+PREVIOUS_COUNT = 3  # exibições na janela anterior
+LAST_SHOWN = 4      # timestamp Unix da última exibição (0 se nunca)
+LAST_SEEN = 5       # timestamp Unix do último game over
+
+# Motivos devolvidos quando o anúncio não deve ser exibido
+SKIP_INTERVAL = 'interval'
+SKIP_CAP = 'cap'
+SKIP_MIN_INTERVAL = 'min_interval'
+SKIP_NO_AD = 'no_ad'
+
+
+def merge_entries(first, second):
+    """
+    Mescla campo a campo dois registros da mesma sessão gravados por workers diferentes.
+
+    Cada campo fica com o maior valor (os contadores da janela só quando as
+    janelas começam no mesmo instante; senão prevalece a janela mais recente,
+    com a anterior levando a maior contagem conhecida). A mescla é idempotente,
+    então um snapshot relido e regravado não conta a mesma exibição duas vezes;
+    com vários workers atendendo a mesma sessão os contadores são aproximados
+    (por baixo), o que o estado compartilhado evita.
+
+    Args:
+        first (list): Registro de uma sessão
+        second (list): Outro registro da mesma sessão
+
+    Returns:
+        list: Registro mesclado
+    """
+    if first[WINDOW_START] == second[WINDOW_START]:
+        window = [
+            first[WINDOW_START],
+            max(first[WINDOW_COUNT], second[WINDOW_COUNT]),
+            max(first[PREVIOUS_COUNT], second[PREVIOUS_COUNT]),
+        ]
+    else:
+        newer, older = (first, second) if first[WINDOW_START] > second[WINDOW_START] else (second, first)
+        window = [
+            newer[WINDOW_START],
+            newer[WINDOW_COUNT],
+            max(newer[PREVIOUS_COUNT], older[WINDOW_COUNT]),
+        ]
+    return [
+        max(first[GAME_OVERS], second[GAME_OVERS]),
+        *window,
+        max(first[LAST_SHOWN], second[LAST_SHOWN]),
+        max(first[LAST_SEEN], second[LAST_SEEN]),
+    ]
+
+
+class SharedCapState:
+    """
+    Registros das sessões em uma tabela SQLite (modo WAL) compartilhada pelos workers.
+
+    Cada decisão lê e grava o registro da sessão em uma transação
+    BEGIN IMMEDIATE, então dois workers nunca decidem sobre a mesma versão
+    do registro. Uma conexão por thread, como em models/events.py.
+    """
+
+    def __init__(self, db_path, timeout=2.0):
+        """
+        Abre (e cria, se necessário) a tabela de registros.
+
+        Args:
+            db_path (str): Caminho do arquivo SQLite (pode ser o log de eventos)
+            timeout (float): Espera máxima pelo lock de escrita em segundos
+        """
+        self.db_path = db_path
+        self.timeout = timeout
+        self._local = threading.local()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS frequency_caps ('
+                ' session TEXT PRIMARY KEY,'
+                ' game_overs REAL NOT NULL,'
+                ' window_start REAL NOT NULL,'
+                ' window_count REAL NOT NULL,'
+                ' previous_count REAL NOT NULL,'
+                ' last_shown REAL NOT NULL,'
+                ' last_seen REAL NOT NULL) WITHOUT ROWID'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS frequency_caps_last_seen ON frequency_caps (last_seen)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def update(self, key, now, ttl, apply):
+        """
+        Aplica uma função ao registro de uma sessão dentro de uma transação.
+
+        Args:
+            key (str): Chave da sessão (session_key)
+            now (float): Timestamp Unix atual
+            ttl (float): Inatividade após a qual o registro gravado é descartado
+            apply (callable): Recebe o registro (lista alterada no lugar) e devolve o resultado
+
+        Returns:
+            any: O resultado de `apply`
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT game_overs, window_start, window_count, previous_count, last_shown, last_seen'
+                ' FROM frequency_caps WHERE session = ?',
+                (key,)
+            ).fetchone()
+            entry = list(row) if row is not None and row[LAST_SEEN] + ttl > now else [0, now, 0, 0, 0.0, now]
+            entry[LAST_SEEN] = now
+            result = apply(entry)
+            conn.execute(
+                'INSERT OR REPLACE INTO frequency_caps VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, *entry)
+            )
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        return result
+
+    def expire(self, before):
+        """
+        Remove os registros das sessões sem game over desde `before`.
+
+        Returns:
+            int: Número de registros removidos
+        """
+        with self._connect() as conn:
+            cursor = conn.execute('DELETE FROM frequency_caps WHERE last_seen < ?', (before,))
+        return cursor.rowcount
+
+    def count(self):
+        """Número de sessões registradas."""
+        return self._connect().execute('SELECT COUNT(*) FROM frequency_caps').fetchone()[0]
+
+    def reset_after_fork(self):
+        """
+        Descarta as conexões abertas pelo processo pai antes de um fork.
+        """
+        self._local = threading.local()
+
+
+def session_key(session_id):
+    """
+    Chave compacta de uma sessão (o ID original não fica em memória nem no snapshot).
+
+    Args:
+        session_id (str): ID da sessão ou outro identificador do cliente
+
+    Returns:
+        str: Hash BLAKE2b de 8 bytes em hexadecimal
+    """
+    return hashlib.blake2b(session_id.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class FrequencyCapper:
+    """
+    Decide a cada game over se a sessão deve ver um anúncio de tela cheia.
+
+    O anúncio é liberado a cada `every` game overs, desde que a sessão não
+    tenha passado de `max_per_window` exibições na janela deslizante de
+    `window` segundos e que a última exibição tenha sido há pelo menos
+    `min_interval` segundos. A janela deslizante é aproximada por dois
+    contadores (janela atual e anterior, ponderada pelo tempo restante).
+
+    Com `shared_db`, os registros ficam em SharedCapState e as sessões
+    inativas há mais de `ttl` segundos são removidas a cada
+    `snapshot_interval` segundos. Sem ele, as sessões ficam em um OrderedDict
+    em ordem de uso: as inativas há mais de `ttl` segundos (e as mais
+    antigas, acima de `max_sessions`) saem pelo início. Esse estado é por
+    processo e exige um único worker ou roteamento fixo das sessões; o
+    snapshot é mesclado campo a campo entre os workers (merge_entries).
+    """
+
+    def __init__(self, every=5, max_per_window=10, window=3600.0, min_interval=30.0,
+                 ttl=86400.0, max_sessions=100000, snapshot_path=None, snapshot_interval=30.0,
+                 shared_db=None):
+        """
+        Inicializa o limitador.
+
+        Args:
+            every (int): Game overs entre duas exibições
+            max_per_window (int): Exibições máximas por sessão na janela (0 desativa)
+            window (float): Tamanho da janela deslizante em segundos
+            min_interval (float): Intervalo mínimo entre duas exibições em segundos
+            ttl (float): Tempo de inatividade após o qual a sessão é esquecida
+            max_sessions (int): Número máximo de sessões mantidas em memória
+            snapshot_path (str): Arquivo JSON do snapshot (None desativa a persistência;
+                ignorado com `shared_db`)
+            snapshot_interval (float): Intervalo entre gravações do snapshot (ou entre
+                limpezas do estado compartilhado) em segundos
+            shared_db (str): Arquivo SQLite do estado compartilhado entre os workers
+                (None mantém o estado na memória do processo)
+        """
+        self.every = max(int(every), 1)
+        self.max_per_window = max_per_window
+        self.window = window
+        self.min_interval = min_interval
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.shared = SharedCapState(shared_db) if shared_db else None
+        self.snapshot_path = snapshot_path if self.shared is None else None
+        self.snapshot_interval = snapshot_interval
+        self.shown = 0
+        self.skipped = {SKIP_INTERVAL: 0, SKIP_CAP: 0, SKIP_MIN_INTERVAL: 0, SKIP_NO_AD: 0}
+        self.evicted = 0
+        self.snapshot_count = 0
+        self.snapshot_failures = 0
+        self.last_snapshot_at = None
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(self.snapshot_path + '.lock') if self.snapshot_path else None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _expire(self, now):
+        sessions = self._sessions
+        while sessions:
+            entry = next(iter(sessions.values()))
+            if entry[LAST_SEEN] + self.ttl > now:
+                break
+            sessions.popitem(last=False)
+
+    def _window_estimate(self, entry, now):
+        # Avança a janela (no máximo duas trocas) e pondera a anterior pelo tempo restante
+        elapsed = now - entry[WINDOW_START]
+        if elapsed >= 2 * self.window:
+            entry[PREVIOUS_COUNT] = 0
+            entry[WINDOW_COUNT] = 0
+            entry[WINDOW_START] = now - elapsed % self.window
+        elif elapsed >= self.window:
+            entry[PREVIOUS_COUNT] = entry[WINDOW_COUNT]
+            entry[WINDOW_COUNT] = 0
+            entry[WINDOW_START] += self.window
+        remaining = min(max(1.0 - (now - entry[WINDOW_START]) / self.window, 0.0), 1.0)
+        return entry[PREVIOUS_COUNT] * remaining + entry[WINDOW_COUNT]
+
+    def _entry(self, key, now):
+        entry = self._sessions.pop(key, None)
+        if entry is None:
+            entry = [0, now, 0, 0, 0.0, now]
+            if len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+        entry[LAST_SEEN] = now
+        # Reinserida no fim: o OrderedDict fica em ordem de último uso
+        self._sessions[key] = entry
+        return entry
+
+    def _decide(self, entry, now):
+        entry[GAME_OVERS] += 1
+        if entry[GAME_OVERS] < self.every:
+            return SKIP_INTERVAL
+        if self.max_per_window and self._window_estimate(entry, now) >= self.max_per_window:
+            return SKIP_CAP
+        if entry[LAST_SHOWN] and now - entry[LAST_SHOWN] < self.min_interval:
+            return SKIP_MIN_INTERVAL
+        return None
+
+    def _show(self, entry, now):
+        self._window_estimate(entry, now)
+        entry[WINDOW_COUNT] += 1
+        entry[LAST_SHOWN] = now
+        entry[GAME_OVERS] = 0
+
+    def _update(self, session_id, now, apply):
+        # Uma transação no estado compartilhado, ou o lock do processo no estado em memória
+        key = session_key(session_id)
+        if self.shared is not None:
+            return self.shared.update(key, now, self.ttl, apply)
+        with self._lock:
+            self._expire(now)
+            return apply(self._entry(key, now))
+
+    def next_show(self, session_id, pick, now=None):
+        """
+        Registra um game over e, se os limites permitirem, escolhe e registra a exibição.
+
+        A decisão, a escolha e a exibição acontecem na mesma atualização do
+        registro (uma transação no estado compartilhado), então game overs
+        simultâneos da mesma sessão em workers diferentes não passam juntos
+        pelo limite. `pick` roda dentro dessa atualização e não deve ler o
+        datastore (ex: AdSelector.pick sobre o inventário em cache).
+
+        Args:
+            session_id (str): ID da sessão (ou o IP do cliente, sem sessão)
+            pick (callable): Função sem argumentos que devolve o anúncio ou None
+            now (float): Timestamp Unix atual (testes)
+
+        Returns:
+            tuple: (anúncio ou None, motivo do bloqueio ou None, game overs desde a última exibição)
+        """
+        now = time.time() if now is None else now
+
+        def decide_and_show(entry):
+            reason = self._decide(entry, now)
+            ad = None
+            if reason is None:
+                ad = pick()
+                if ad is None:
+                    reason = SKIP_NO_AD
+                else:
+                    game_overs = int(entry[GAME_OVERS])
+                    self._show(entry, now)
+                    return ad, None, game_overs
+            return ad, reason, int(entry[GAME_OVERS])
+
+        ad, reason, game_overs = self._update(session_id, now, decide_and_show)
+        if reason is not None:
+            self.skipped[reason] += 1
+        else:
+            self.shown += 1
+        return ad, reason, game_overs
+
+    def check_game_over(self, session_id, now=None):
+        """
+        Registra um game over e decide se a sessão pode ver um anúncio agora.
+
+        Uma resposta positiva não conta como exibição: chame record_show
+        quando houver de fato um anúncio para servir. Com vários workers, use
+        next_show, que decide e registra a exibição de forma atômica.
+
+        Args:
+            session_id (str): ID da sessão (ou o IP do cliente, sem sessão)
+            now (float): Timestamp Unix atual (testes)
+
+        Returns:
+            tuple: (pode exibir, motivo do bloqueio ou None, game overs desde a última exibição)
+        """
+        now = time.time() if now is None else now
+        reason, game_overs = self._update(
+            session_id, now, lambda entry: (self._decide(entry, now), int(entry[GAME_OVERS]))
+        )
+        if reason is not None:
+            self.skipped[reason] += 1
+        return reason is None, reason, game_overs
+
+    def record_show(self, session_id, now=None):
+        """
+        Registra a exibição de um anúncio para a sessão e zera o intervalo.
+
+        Args:
+            session_id (str): ID da sessão usado em check_game_over
+            now (float): Timestamp Unix atual (testes)
+        """
+        now = time.time() if now is None else now
+        self._update(session_id, now, lambda entry: self._show(entry, now))
+        self.shown += 1
+
+    def load_snapshot(self):
+        """
+        Carrega o snapshot gravado, descartando sessões expiradas.
+
+        Returns:
+            int: Número de sessões carregadas
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return 0
+        try:
+            with self._file_lock(shared=True):
+                sessions = self._read_snapshot()
+        except Exception as e:
+            logger.error(f"Erro ao carregar o snapshot de frequência {self.snapshot_path}: {e}", exc_info=True)
+            return 0
+
+        now = time.time()
+        entries = sorted(
+            (entry[LAST_SEEN], key, entry) for key, entry in sessions.items()
+            if entry[LAST_SEEN] + self.ttl > now
+        )[-self.max_sessions:]
+        with self._lock:
+            for _, key, entry in entries:
+                current = self._sessions.get(key)
+                self._sessions[key] = entry if current is None else merge_entries(current, entry)
+                self._sessions.move_to_end(key)
+        logger.info(f"Snapshot de frequência carregado: {len(entries)} sessões")
+        return len(entries)
+
+    def _read_snapshot(self):
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        sessions = data.get('sessions', {}) if isinstance(data, dict) else {}
+        return {
+            key: [float(value) for value in entry] for key, entry in sessions.items()
+            if isinstance(entry, list) and len(entry) == LAST_SEEN + 1
+        }
+
+    def save_snapshot(self):
+        """
+        Grava o estado atual no snapshot, mesclado com o que outros workers gravaram.
+
+        Os registros da mesma sessão são mesclados campo a campo (merge_entries);
+        a escrita usa arquivo temporário + rename e um lock de arquivo entre processos.
+
+        Returns:
+            bool: True se o snapshot foi gravado (ou a persistência está desativada)
+        """
+        if not self.snapshot_path:
+            return True
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            sessions = {key: list(entry) for key, entry in self._sessions.items()}
+        try:
+            directory = os.path.dirname(self.snapshot_path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            with self._file_lock():
+                for key, entry in self._read_snapshot().items():
+                    if entry[LAST_SEEN] + self.ttl <= now:
+                        continue
+                    current = sessions.get(key)
+                    sessions[key] = entry if current is None else merge_entries(current, entry)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'saved_at': now, 'sessions': sessions}, f, separators=(',', ':'))
+                os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            self.snapshot_failures += 1
+            logger.error(f"Erro ao gravar o snapshot de frequência {self.snapshot_path}: {e}", exc_info=True)
+            return False
+        self.snapshot_count += 1
+        self.last_snapshot_at = now
+        return True
+
+    def expire_shared(self):
+        """
+        Remove do estado compartilhado as sessões inativas há mais de `ttl` segundos.
+
+        Returns:
+            bool: True se a limpeza teve sucesso
+        """
+        try:
+            self.evicted += self.shared.expire(time.time() - self.ttl)
+        except Exception as e:
+            logger.error(f"Erro ao limpar o estado compartilhado de frequência: {e}", exc_info=True)
+            return False
+        return True
+
+    def _run(self):
+        while not self._stop_event.wait(self.snapshot_interval):
+            if self.shared is not None:
+                self.expire_shared()
+            else:
+                self.save_snapshot()
+
+    def start(self):
+        """
+        Carrega o snapshot e inicia a gravação periódica, com uma última gravação no encerramento.
+
+        Com o estado compartilhado, inicia só a limpeza periódica das sessões expiradas.
+        """
+        if self._thread is not None:
+            return
+        if self.shared is not None:
+            if self.snapshot_interval > 0:
+                self._thread = threading.Thread(target=self._run, name='frequency-cap-expire', daemon=True)
+                self._thread.start()
+            return
+        if not self.snapshot_path:
+            return
+        self.load_snapshot()
+        if self.snapshot_interval > 0:
+            self._thread = threading.Thread(target=self._run, name='frequency-cap-snapshot', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Para a gravação periódica e grava o snapshot uma última vez.
+        """
+        self._stop_event.set()
+        self.save_snapshot()
+
+    def reset_after_fork(self):
+        """
+        Prepara o limitador no processo filho após um fork.
+
+        O estado copiado do pai é mantido; a thread de snapshot não existe no
+        filho e é recriada por start().
+        """
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(self.snapshot_path + '.lock') if self.snapshot_path else None
+        if self.shared is not None:
+            self.shared.reset_after_fork()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def stats(self):
+        """
+        Obtém as métricas do limitador.
+
+        Returns:
+            dict: Sessões acompanhadas, exibições, pulos por motivo e estado do snapshot
+        """
+        if self.shared is not None:
+            sessions = self.shared.count()
+        else:
+            with self._lock:
+                sessions = len(self._sessions)
+        return {
+            'sessions': sessions,
+            'shared': self.shared is not None,
+            'shown': self.shown,
+            'skipped_interval': self.skipped[SKIP_INTERVAL],
+            'skipped_cap': self.skipped[SKIP_CAP],
+            'skipped_min_interval': self.skipped[SKIP_MIN_INTERVAL],
+            'skipped_no_ad': self.skipped[SKIP_NO_AD],
+            'evicted_sessions': self.evicted,
+            'snapshot_count': self.snapshot_count,
+            'snapshot_failures': self.snapshot_failures,
+            'last_snapshot_at': self.last_snapshot_at,
+        }
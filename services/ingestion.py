@@ -0,0 +1,272 @@
+"""
+Camada de ingestão de impressões e cliques.
+Deduplica eventos pelo ID enviado pelo cliente (conjunto limitado com TTL) e
+aplica limites de taxa por IP e por sessão (token bucket em memória), para
+que retentativas e rajadas automatizadas sejam descartadas antes de chegar
+ao buffer de contadores ou ao datastore.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Tamanho máximo aceito para IDs de evento e de sessão enviados pelo cliente
+MAX_CLIENT_ID_LENGTH = 64
+
+
+def valid_client_id(value):
+    """
+    Verifica se um ID enviado pelo cliente (evento ou sessão) é utilizável.
+
+    Returns:
+        bool: True para strings não vazias de até MAX_CLIENT_ID_LENGTH caracteres
+    """
+    return isinstance(value, str) and 0 < len(value) <= MAX_CLIENT_ID_LENGTH
+
+
+def client_ip(remote_addr, forwarded_for=None, trusted_hops=0):
+    """
+    Obtém o IP do cliente para o limite de taxa.
+
+    Cada proxy anexa ao X-Forwarded-For o endereço de quem o chamou, então
+    só as últimas `trusted_hops` entradas foram escritas por proxies
+    confiáveis; as anteriores vêm do cliente e podem ser forjadas.
+
+    Args:
+        remote_addr (str): Endereço da conexão
+        forwarded_for (str): Cabeçalho X-Forwarded-For, se houver
+        trusted_hops (int): Proxies confiáveis na frente do servidor (0 ignora
+            o cabeçalho; 1 no Render)
+
+    Returns:
+        str: IP do cliente
+    """
+    if trusted_hops > 0 and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+        if hops:
+            # Entrada anexada pelo proxy confiável mais externo
+            return hops[-min(trusted_hops, len(hops))]
+    return remote_addr or 'unknown'
+
+
+class TTLSet:
+    """
+    Conjunto de chaves que expiram após `ttl` segundos, limitado a `max_size`.
+
+    As chaves ficam em ordem de inserção; como o TTL é o mesmo para todas, as
+    expiradas (e as mais antigas, quando o conjunto enche) saem pelo início.
+    """
+
+    def __init__(self, ttl=600.0, max_size=100000):
+        """
+        Inicializa o conjunto.
+
+        Args:
+            ttl (float): Tempo de vida de cada chave em segundos
+            max_size (int): Número máximo de chaves mantidas
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.evicted = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        items = self._items
+        while items:
+            key, expires_at = next(iter(items.items()))
+            if expires_at > now:
+                break
+            items.popitem(last=False)
+
+    def add(self, key):
+        """
+        Adiciona uma chave de forma atômica.
+
+        Returns:
+            bool: True se a chave era nova, False se já estava no conjunto
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            if key in self._items:
+                return False
+            if len(self._items) >= self.max_size:
+                self._items.popitem(last=False)
+                self.evicted += 1
+            self._items[key] = now + self.ttl
+            return True
+
+    def discard(self, key):
+        """
+        Remove uma chave (ex: o evento não pôde ser registrado e pode ser reenviado).
+        """
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._items)
+
+
+class TokenBucketLimiter:
+    """
+    Limite de taxa por chave (IP, sessão) com token bucket.
+
+    Cada chave recebe `rate` tokens por segundo até o máximo de `burst`. Os
+    buckets ficam em um OrderedDict limitado a `max_keys` chaves, em ordem de
+    uso; as menos usadas são descartadas (e voltam com o bucket cheio).
+    """
+
+    def __init__(self, rate, burst, max_keys=50000):
+        """
+        Inicializa o limitador.
+
+        Args:
+            rate (float): Tokens repostos por segundo (0 desativa o limite)
+            burst (float): Capacidade máxima de cada bucket
+            max_keys (int): Número máximo de chaves acompanhadas
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def consume(self, key, cost=1):
+        """
+        Consome tokens do bucket de uma chave.
+
+        Args:
+            key (str): Chave do cliente
+            cost (float): Tokens necessários (ex: número de eventos da requisição)
+
+        Returns:
+            float: 0 se a requisição foi liberada, ou os segundos até haver tokens suficientes
+        """
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                tokens = self.burst
+                if len(self._buckets) >= self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                tokens, updated_at = bucket
+                tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+
+            # Uma requisição maior que o burst passa com o bucket cheio e o esvazia
+            cost = min(cost, self.burst)
+            if cost <= tokens:
+                tokens -= cost
+                retry_after = 0.0
+            else:
+                retry_after = (cost - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            return retry_after
+
+    def __len__(self):
+        with self._lock:
+            return len(self._buckets)
+
+
+class TrackingGuard:
+    """
+    Filtros baratos aplicados antes de registrar eventos de tracking.
+
+    `admit` rejeita a requisição inteira quando o IP ou a sessão passaram do
+    limite, sem olhar os eventos; `claim_event` descarta eventos cujo ID já foi
+    visto dentro do TTL. A deduplicação e os limites são por processo (worker).
+    Eventos sem ID são aceitos sem deduplicação (entrega ao menos uma vez: cada
+    reenvio conta de novo), para manter os clientes que não enviam o ID.
+    """
+
+    def __init__(self, dedup_ttl=600.0, dedup_max=100000,
+                 ip_rate=50.0, ip_burst=500.0,
+                 session_rate=10.0, session_burst=200.0,
+                 max_clients=50000):
+        """
+        Inicializa os filtros.
+
+        Args:
+            dedup_ttl (float): Tempo (segundos) em que um ID de evento é lembrado
+            dedup_max (int): Número máximo de IDs de evento lembrados
+            ip_rate (float): Eventos por segundo por IP (0 desativa)
+            ip_burst (float): Rajada máxima de eventos por IP
+            session_rate (float): Eventos por segundo por sessão (0 desativa)
+            session_burst (float): Rajada máxima de eventos por sessão
+            max_clients (int): Número máximo de IPs/sessões acompanhados
+        """
+        self.seen_events = TTLSet(ttl=dedup_ttl, max_size=dedup_max)
+        self.ip_limiter = TokenBucketLimiter(ip_rate, ip_burst, max_keys=max_clients)
+        self.session_limiter = TokenBucketLimiter(session_rate, session_burst, max_keys=max_clients)
+        self.rate_limited_requests = 0
+        self.duplicate_events = 0
+
+    def admit(self, ip, session_id=None, cost=1):
+        """
+        Aplica os limites de taxa a uma requisição.
+
+        Args:
+            ip (str): IP do cliente
+            session_id (str): Sessão informada pelo cliente (opcional)
+            cost (int): Número de eventos da requisição
+
+        Returns:
+            float: 0 se liberada, ou o Retry-After sugerido em segundos
+        """
+        retry_after = self.ip_limiter.consume(ip, cost)
+        if not retry_after and valid_client_id(session_id):
+            retry_after = self.session_limiter.consume(session_id, cost)
+        if retry_after:
+            self.rate_limited_requests += 1
+        return retry_after
+
+    def claim_event(self, field, event_id):
+        """
+        Reserva o ID de um evento.
+
+        Args:
+            field (str): 'impressions' ou 'clicks'
+            event_id (str): ID gerado pelo cliente (eventos sem ID não são deduplicados)
+
+        Returns:
+            bool: False se o evento é uma repetição e deve ser descartado
+        """
+        if event_id is None:
+            return True
+        if not valid_client_id(event_id):
+            return False
+        if self.seen_events.add((field, event_id)):
+            return True
+        self.duplicate_events += 1
+        return False
+
+    def release_event(self, field, event_id):
+        """
+        Libera o ID de um evento que não chegou a ser registrado.
+        """
+        if event_id is not None:
+            self.seen_events.discard((field, event_id))
+
+    def stats(self):
+        """
+        Obtém as métricas da ingestão.
+
+        Returns:
+            dict: Contadores de rejeição e tamanho das estruturas em memória
+        """
+        return {
+            "rate_limited_requests": self.rate_limited_requests,
+            "duplicate_events": self.duplicate_events,
+            "tracked_event_ids": len(self.seen_events),
+            "evicted_event_ids": self.seen_events.evicted,
+            "tracked_ips": len(self.ip_limiter),
+            "tracked_sessions": len(self.session_limiter),
+        }
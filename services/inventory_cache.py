@@ -0,0 +1,544 @@
+"""
+Cache de inventário de anúncios em memória (um por worker).
+Mantém os anúncios de todos os formatos registrados já filtrados e ordenados,
+evitando uma leitura completa do Firebase RTDB a cada requisição da API.
+O agendamento e o orçamento das campanhas são aplicados por um índice de
+elegibilidade por tipo (services/scheduling.py) e a segmentação por um índice
+de bitmaps (services/targeting.py), ambos montados junto com o inventário.
+"""
+import hashlib
+import json
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from models.storage import AD_TYPES, COUNTER_SHARDS_KEY
+from services.scheduling import EligibilityIndex
+from services.targeting import MAX_SEGMENTS, TargetingIndex
+
+logger = logging.getLogger(__name__)
+
+# Campos que mudam a cada impressão/clique e não alteram o inventário
+COUNTER_FIELDS = ('impressions', 'clicks')
+
+# Campos expostos ao cliente do jogo ('assets': variantes redimensionadas por escala, ver services/assets.py)
+PUBLIC_FIELDS = ('id', 'title', 'imageUrl', 'targetUrl', 'assets')
+
+
+def is_counter_path(path):
+    """
+    Indica se um caminho do RTDB (relativo a ads/) é de um contador ou de um shard de contadores.
+    """
+    parts = path.split('/')
+    return parts[-1] in COUNTER_FIELDS or COUNTER_SHARDS_KEY in parts
+
+
+def ad_weight(ad_data):
+    """
+    Peso de rotação de um anúncio (campo `weight`, padrão 1).
+
+    Args:
+        ad_data (dict): Dados do anúncio
+
+    Returns:
+        float: Peso não negativo e finito (1 se o campo for inválido)
+    """
+    try:
+        weight = float(ad_data.get('weight', 1))
+    except (TypeError, ValueError):
+        return 1.0
+    if not math.isfinite(weight):
+        return 1.0
+    return max(weight, 0.0)
+
+
+def is_servable(ad_data):
+    """
+    Indica se um anúncio pode ser servido para o jogo.
+
+    Args:
+        ad_data (any): Dados do anúncio vindos do datastore
+
+    Returns:
+        bool: True se o anúncio tem imageUrl e targetUrl válidos
+    """
+    return (
+        isinstance(ad_data, dict)
+        and bool(ad_data.get('imageUrl'))
+        and bool(ad_data.get('targetUrl'))
+    )
+
+
+class InventoryCache:
+    """
+    Cache do inventário de anúncios com limite de obsolescência.
+
+    O inventário é recarregado quando passa de `max_staleness` segundos,
+    quando é invalidado explicitamente (rotas de escrita do dashboard) ou
+    quando o listener do RTDB recebe uma alteração em `ads/`.
+    """
+
+    def __init__(self, loader, max_staleness=30, stale_while_revalidate=False):
+        """
+        Inicializa o cache.
+
+        Args:
+            loader (callable): Função sem argumentos que retorna {tipo: {id: dados}}
+                de todos os tipos (uma única leitura do backend por recarga)
+            max_staleness (float): Idade máxima do inventário em segundos
+            stale_while_revalidate (bool): Se True, uma leitura de inventário
+                obsoleto devolve o inventário atual e recarrega em segundo
+                plano, sem bloquear a requisição (apenas a primeira carga bloqueia)
+        """
+        self.loader = loader
+        self.max_staleness = max_staleness
+        self.stale_while_revalidate = stale_while_revalidate
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.refresh_errors = 0
+        self._lock = threading.Lock()
+        # (versão, anúncios por tipo, índice por tipo e id, elegibilidade por tipo,
+        # segmentação por tipo), trocado atomicamente
+        self._snapshot = None
+        # Corpos serializados por tipo e segmento, e manifestos por segmentos (LRU)
+        self._payloads = OrderedDict()
+        self._manifests = OrderedDict()
+        self._serialized_lock = threading.Lock()
+        self._loaded_at = 0.0
+        self._last_revalidation = 0.0
+        self._stale = True
+        self._invalidations = 0
+        self._stop_event = threading.Event()
+        self._refresh_thread = None
+        self._listener = None
+        self.dropped_increments = 0
+
+    def _is_fresh(self):
+        return (
+            self._snapshot is not None
+            and not self._stale
+            and time.monotonic() - self._loaded_at <= self.max_staleness
+        )
+
+    def _build(self):
+        """
+        Carrega todos os tipos de anúncio do datastore e monta o inventário.
+
+        Returns:
+            tuple: (anúncios por tipo, índice por tipo e id, elegibilidade por tipo,
+                segmentação por tipo)
+        """
+        ads = {}
+        index = {}
+        schedules = {}
+        targeting = {}
+        all_ads = self.loader() or {}
+        for ad_type in AD_TYPES:
+            raw_data = all_ads.get(ad_type) or {}
+            valid_ads = [
+                {**data, 'id': ad_id} for ad_id, data in raw_data.items()
+                if is_servable(data)
+            ]
+            # Mais recentes primeiro, ordenados uma única vez por recarga
+            valid_ads.sort(key=lambda ad: ad.get('created_at', 0), reverse=True)
+            ads[ad_type] = valid_ads
+            index[ad_type] = {ad['id']: ad for ad in valid_ads}
+            schedules[ad_type] = EligibilityIndex(valid_ads)
+            targeting[ad_type] = TargetingIndex(valid_ads)
+        return ads, index, schedules, targeting
+
+    def refresh(self):
+        """
+        Recarrega o inventário imediatamente.
+
+        Returns:
+            bool: True se a recarga teve sucesso, False caso contrário
+        """
+        invalidations = self._invalidations
+        try:
+            ads, index, schedules, targeting = self._build()
+        except Exception as e:
+            self.refresh_errors += 1
+            logger.error(f"Erro ao recarregar inventário de anúncios: {e}", exc_info=True)
+            return False
+
+        version = self._snapshot[0] + 1 if self._snapshot is not None else 1
+        self._snapshot = (version, ads, index, schedules, targeting)
+        self._loaded_at = time.monotonic()
+        # Uma invalidação durante a carga pode ter chegado depois da leitura
+        self._stale = invalidations != self._invalidations
+        return True
+
+    def is_fresh(self):
+        """
+        Indica se o inventário pode ser lido sem recarga.
+
+        Returns:
+            bool: True se existe inventário carregado dentro do limite de obsolescência
+        """
+        return self._is_fresh()
+
+    def _revalidate_in_background(self):
+        # Uma recarga por vez e no máximo uma tentativa por segundo se o datastore falhar
+        now = time.monotonic()
+        if now - self._last_revalidation < 1.0 or not self._lock.acquire(blocking=False):
+            return
+        self._last_revalidation = now
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._lock.release()
+
+        threading.Thread(target=run, name='inventory-cache-revalidate', daemon=True).start()
+
+    def _get_snapshot(self):
+        if self._is_fresh():
+            self.hits += 1
+            return self._snapshot
+
+        if self.stale_while_revalidate and self._snapshot is not None:
+            self.stale_hits += 1
+            self._revalidate_in_background()
+            return self._snapshot
+
+        return self._get_blocking_snapshot()
+
+    def _get_blocking_snapshot(self):
+        with self._lock:
+            # Outra thread pode ter recarregado enquanto esperávamos o lock
+            if self._is_fresh():
+                self.hits += 1
+                return self._snapshot
+            self.misses += 1
+            if not self.refresh() and self._snapshot is None:
+                raise RuntimeError("Inventário de anúncios indisponível")
+            # Se a recarga falhou mas existe um inventário anterior, ele
+            # continua sendo servido até a próxima tentativa
+            return self._snapshot
+
+    def warm(self):
+        """
+        Carrega o inventário de forma bloqueante, se ainda não estiver fresco.
+
+        Returns:
+            int: Versão do inventário carregado
+
+        Raises:
+            RuntimeError: Se não foi possível carregar nenhum inventário
+        """
+        return self._get_blocking_snapshot()[0]
+
+    def get_ads(self, ad_type, context=None):
+        """
+        Obtém os anúncios elegíveis de um tipo, mais recentes primeiro.
+
+        Args:
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
+            context (tuple): Contexto de segmentação (None ignora as regras de segmentação)
+
+        Returns:
+            list: Lista de anúncios (não deve ser modificada pelo chamador)
+        """
+        return self.get_versioned_ads(ad_type, context)[1]
+
+    def get_versioned_ads(self, ad_type, context=None):
+        """
+        Obtém os anúncios elegíveis de um tipo junto com a versão do inventário.
+
+        Só entram os anúncios dentro do período agendado e com orçamento de
+        impressões; a versão muda a cada recarga e a cada início, fim ou
+        esgotamento de campanha. Com um contexto, a lista é restrita aos
+        anúncios cujas regras de segmentação aceitam a requisição.
+
+        Args:
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
+            context (tuple): Contexto de segmentação (services/targeting.build_context);
+                None ignora as regras de segmentação
+
+        Returns:
+            tuple: ((versão do inventário, época da elegibilidade, segmento), lista de anúncios);
+                o segmento é None quando a lista não foi restringida
+        """
+        version, _, _, schedules, targeting = self._get_snapshot()
+        schedule = schedules.get(ad_type)
+        if schedule is None:
+            return (version, 0, None), []
+        epoch, ads = schedule.get()
+        segment = None
+        if context is not None:
+            segment, ads = targeting[ad_type].select(epoch, ads, context)
+        return (version, epoch, segment), ads
+
+    def _remember(self, cache, key, value, limit):
+        with self._serialized_lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > limit:
+                cache.popitem(last=False)
+
+    def get_ad(self, ad_type, ad_id):
+        """
+        Obtém um anúncio servível pelo id, sem acessar o datastore.
+
+        Inclui anúncios fora do período ou sem orçamento: um clique em um
+        anúncio que acabou de sair da rotação continua sendo contado.
+
+        Args:
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
+            ad_id (str): ID do anúncio
+
+        Returns:
+            dict: Anúncio encontrado ou None
+        """
+        return self._get_snapshot()[2].get(ad_type, {}).get(ad_id)
+
+    def known_increments(self, increments):
+        """
+        Descarta incrementos de anúncios que não estão mais no inventário.
+
+        Chamado pelo flush dos contadores (fora do caminho da requisição): um
+        inventário invalidado por uma remoção é recarregado antes do filtro,
+        para que o flush não recrie no datastore um anúncio já removido. Sem
+        inventário disponível os incrementos seguem sem filtro.
+
+        Args:
+            increments (dict): {(ad_type, ad_id, field): n}, como no CounterBuffer
+
+        Returns:
+            dict: Os incrementos dos anúncios conhecidos
+        """
+        try:
+            index = self._get_blocking_snapshot()[2]
+        except RuntimeError:
+            return increments
+        known = {
+            key: amount for key, amount in increments.items()
+            if key[1] in index.get(key[0], {})
+        }
+        self.dropped_increments += len(increments) - len(known)
+        return known
+
+    def record_impression(self, ad_type, ad_id, amount=1):
+        """
+        Desconta impressões servidas por este worker do orçamento do anúncio.
+
+        Um anúncio com o orçamento esgotado sai da rotação deste worker na
+        hora; nos demais, quando o contador gravado pelo buffer chega a eles
+        na próxima recarga do inventário.
+
+        Args:
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
+            ad_id (str): ID do anúncio
+            amount (int): Impressões servidas
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+        schedule = snapshot[3].get(ad_type)
+        if schedule is not None and schedule.record_impression(ad_id, amount):
+            logger.info(f"Orçamento de impressões esgotado: anúncio '{ad_type}' ID {ad_id} saiu da rotação")
+
+    def get_payload(self, ad_type, context=None):
+        """
+        Obtém a lista pública de anúncios de um tipo já serializada em JSON.
+
+        A serialização e o ETag são calculados uma vez por versão do inventário
+        e segmento.
+
+        Args:
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
+            context (tuple): Contexto de segmentação (None ignora as regras de segmentação)
+
+        Returns:
+            tuple: (corpo JSON em bytes, ETag forte)
+        """
+        version, ads = self.get_versioned_ads(ad_type, context)
+        key = (ad_type, version[2])
+        cached = self._payloads.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+
+        public_ads = [{field: ad.get(field) for field in PUBLIC_FIELDS} for ad in ads]
+        body = json.dumps(public_ads, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        etag = hashlib.sha1(body).hexdigest()
+        self._remember(self._payloads, key, (version, body, etag), MAX_SEGMENTS * len(AD_TYPES))
+        return body, etag
+
+    def get_manifest(self, context=None):
+        """
+        Obtém o manifesto de rotação de todos os tipos já serializado em JSON.
+
+        O manifesto tem os ids, títulos, URLs e pesos dos anúncios elegíveis e é
+        montado uma vez por versão do inventário, da elegibilidade e segmento.
+        A versão publicada é derivada do conteúdo, então é a mesma em todos os
+        workers e só muda quando o inventário muda de fato.
+
+        Args:
+            context (tuple): Contexto de segmentação (None ignora as regras de segmentação)
+
+        Returns:
+            tuple: (corpo JSON em bytes, ETag forte)
+        """
+        version, _, _, schedules, targeting = self._get_snapshot()
+        ads = {}
+        epochs = []
+        segments = []
+        for ad_type in AD_TYPES:
+            epoch, ads[ad_type] = schedules[ad_type].get()
+            segment = None
+            if context is not None:
+                segment, ads[ad_type] = targeting[ad_type].select(epoch, ads[ad_type], context)
+            epochs.append(epoch)
+            segments.append(segment)
+        version = (version, tuple(epochs))
+        key = tuple(segments)
+        cached = self._manifests.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+
+        content = {
+            ad_type: [
+                {**{field: ad.get(field) for field in PUBLIC_FIELDS}, 'weight': ad_weight(ad)}
+                for ad in ads.get(ad_type, [])
+            ]
+            for ad_type in AD_TYPES
+        }
+        etag = hashlib.sha1(
+            json.dumps(content, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        manifest = {'version': etag[:16], **content}
+        body = json.dumps(manifest, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        self._remember(self._manifests, key, (version, body, etag), MAX_SEGMENTS)
+        return body, etag
+
+    @property
+    def version(self):
+        """Número da versão do inventário, incrementado a cada recarga."""
+        return self._snapshot[0] if self._snapshot is not None else 0
+
+    def invalidate(self):
+        """
+        Marca o inventário como obsoleto; a próxima leitura recarrega.
+        """
+        self._invalidations += 1
+        self._stale = True
+
+    def start_background_refresh(self, interval):
+        """
+        Inicia uma thread que recarrega o inventário periodicamente.
+
+        Args:
+            interval (float): Intervalo entre recargas em segundos
+        """
+        if self._refresh_thread is not None or interval <= 0:
+            return
+
+        def run():
+            while not self._stop_event.wait(interval):
+                with self._lock:
+                    self.refresh()
+
+        self._refresh_thread = threading.Thread(
+            target=run, name='inventory-cache-refresh', daemon=True
+        )
+        self._refresh_thread.start()
+
+    def handle_change_event(self, event):
+        """
+        Callback do listener do RTDB para alterações em `ads/`.
+
+        Incrementos de impressões/cliques (nos campos ou nos shards de
+        contadores) são ignorados para não invalidar o cache a cada evento de
+        tracking ou compactação.
+
+        Args:
+            event (firebase_admin.db.Event): Evento recebido do listener
+        """
+        path = (event.path or '').strip('/')
+        if is_counter_path(path):
+            return
+        # Updates multi-caminho chegam como 'patch' com os caminhos nas chaves; os
+        # aninhados (ex: {'counter_shards': {...}}) chegam com o nó pai no caminho do evento
+        if event.event_type == 'patch' and isinstance(event.data, dict) and event.data:
+            if all(is_counter_path(f"{path}/{key.strip('/')}") for key in event.data):
+                return
+        self.invalidate()
+
+    def start_listener(self, storage):
+        """
+        Registra um listener de alterações no backend de armazenamento.
+
+        Args:
+            storage (AdStorage): Backend com suporte a listen()
+        """
+        if self._listener is not None:
+            return
+        try:
+            self._listener = storage.listen(self.handle_change_event)
+        except Exception as e:
+            logger.error(f"Erro ao registrar listener do inventário: {e}", exc_info=True)
+
+    def reset_after_fork(self):
+        """
+        Prepara o cache no processo filho após um fork.
+
+        O inventário copiado do pai continua válido; a thread de recarga e o
+        listener não existem no filho e são recriados por quem os iniciou.
+        Os saldos de orçamento copiados passam a ser descontados só pelo filho.
+        """
+        self._lock = threading.Lock()
+        self._serialized_lock = threading.Lock()
+        if self._snapshot is not None:
+            for schedule in self._snapshot[3].values():
+                schedule.reset_after_fork()
+            for targeting in self._snapshot[4].values():
+                targeting.reset_after_fork()
+        self._stop_event = threading.Event()
+        self._refresh_thread = None
+        self._listener = None
+
+    def stop(self):
+        """
+        Encerra a thread de recarga e o listener, se existirem.
+        """
+        self._stop_event.set()
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+    def stats(self):
+        """
+        Obtém contadores de uso do cache.
+
+        Returns:
+            dict: Acertos, faltas, erros de recarga, idade e versão do inventário
+                e o estado dos índices de elegibilidade e de segmentação
+        """
+        total = self.hits + self.misses
+        snapshot = self._snapshot
+        schedules = [schedule.stats() for schedule in snapshot[3].values()] if snapshot is not None else []
+        targeting = [index.stats() for index in snapshot[4].values()] if snapshot is not None else []
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale_hits': self.stale_hits,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            'refresh_errors': self.refresh_errors,
+            'dropped_increments': self.dropped_increments,
+            'age_seconds': round(time.monotonic() - self._loaded_at, 3) if self._snapshot is not None else None,
+            'version': self.version,
+            'max_staleness': self.max_staleness,
+            'eligible_ads': sum(schedule['eligible'] for schedule in schedules),
+            'scheduled_events': sum(schedule['pending_events'] for schedule in schedules),
+            'budgeted_ads': sum(schedule['budgeted'] for schedule in schedules),
+            'exhausted_ads': sum(schedule['exhausted'] for schedule in schedules),
+            'targeted_ads': sum(index['targeted'] for index in targeting),
+            'invalid_targeting_ads': sum(index['invalid'] for index in targeting),
+            'targeting_values': sum(index['values'] for index in targeting),
+            'targeting_segments': sum(index['segments'] for index in targeting),
+        }
@@ -0,0 +1,134 @@
+"""
+Ciclo de vida do worker: inicialização preguiçosa e segura após fork.
+O datastore é conectado, o inventário aquecido e os serviços em segundo plano
+iniciados uma vez por processo, depois do fork do gunicorn; o teste feito a
+cada requisição é a leitura de um atributo, sem acesso a arquivos.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerLifecycle:
+    """
+    Inicialização do worker em três etapas: connect() do backend, aquecimento
+    do inventário e início dos serviços em segundo plano.
+
+    Estados: 'idle' (nada iniciado neste processo), 'starting', 'ready' e
+    'failed' (nova tentativa só depois de `retry_interval` segundos). Um fork
+    volta o estado para 'idle' e descarta conexões, threads e locks herdados.
+    """
+
+    def __init__(self, storage, warmup=None, start_services=None, fork_resets=(), retry_interval=5.0):
+        """
+        Inicializa o ciclo de vida e registra o gancho pós-fork.
+
+        Args:
+            storage (AdStorage): Backend de armazenamento
+            warmup (callable): Carrega o inventário antes da primeira requisição
+            start_services (callable): Inicia threads de recarga, listener e flush
+            fork_resets (iterable): Funções chamadas no processo filho após um fork
+            retry_interval (float): Intervalo mínimo entre tentativas após uma falha
+        """
+        self.storage = storage
+        self.warmup = warmup
+        self.start_services = start_services
+        self.fork_resets = list(fork_resets)
+        self.retry_interval = retry_interval
+        self.ready = False
+        self.state = 'idle'
+        self.error = None
+        self.pid = None
+        self.started_at = None
+        self.startup_duration = None
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.post_fork)
+
+    def ensure_started(self):
+        """
+        Garante o worker inicializado; chamado no início das rotas.
+
+        Returns:
+            bool: True se o worker está pronto
+        """
+        if self.ready:
+            return True
+        if time.monotonic() < self._retry_at:
+            return False
+        return self.start()
+
+    def start(self):
+        """
+        Executa a inicialização do worker, se ainda não foi feita neste processo.
+
+        Returns:
+            bool: True se o worker ficou pronto, False se alguma etapa falhou
+        """
+        with self._lock:
+            if self.ready:
+                return True
+            self.state = 'starting'
+            started = time.monotonic()
+            try:
+                if not self.storage.connect():
+                    raise RuntimeError(f"armazenamento '{self.storage.name}' não pôde ser inicializado")
+                if self.warmup is not None:
+                    self.warmup()
+                if self.start_services is not None:
+                    self.start_services()
+            except Exception as e:
+                self.state = 'failed'
+                self.error = str(e)
+                self._retry_at = time.monotonic() + self.retry_interval
+                logger.error(f"❌ Inicialização do worker {os.getpid()} falhou: {e}")
+                return False
+
+            self.startup_duration = time.monotonic() - started
+            self.started_at = time.time()
+            self.pid = os.getpid()
+            self.error = None
+            self.state = 'ready'
+            self.ready = True
+            logger.info(f"✅ Worker {self.pid} pronto em {self.startup_duration:.3f}s")
+            return True
+
+    def post_fork(self):
+        """
+        Gancho executado no processo filho logo após o fork.
+
+        Não faz I/O: apenas descarta o estado herdado para que a próxima
+        chamada a start() abra conexões e threads próprias do worker.
+        """
+        self._lock = threading.Lock()
+        self.ready = False
+        self.state = 'idle'
+        self.error = None
+        self.pid = None
+        self.started_at = None
+        self.startup_duration = None
+        self._retry_at = 0.0
+        self.storage.reset_after_fork()
+        for reset in self.fork_resets:
+            reset()
+
+    def status(self):
+        """
+        Obtém o estado do worker para o endpoint de prontidão.
+
+        Returns:
+            dict: Estado, pid, erro da última tentativa e tempo de inicialização
+        """
+        return {
+            'status': self.state,
+            'pid': os.getpid(),
+            'storage': self.storage.name,
+            'error': self.error,
+            'started_at': self.started_at,
+            'startup_seconds': round(self.startup_duration, 4) if self.startup_duration is not None else None,
+        }
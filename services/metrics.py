@@ -0,0 +1,352 @@
+"""
+Instrumentação do caminho quente da API.
+Histogramas de latência por rota, duração e número de chamadas ao datastore
+por requisição e métricas dos caches/buffers, expostos no formato de texto do
+Prometheus, além de um profiler cProfile amostrado (1 a cada N requisições).
+"""
+import contextvars
+import cProfile
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Limites (segundos) dos buckets dos histogramas de duração
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Limites dos buckets do número de chamadas ao datastore por requisição
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50)
+
+# Operações do backend de armazenamento medidas (connect é cacheado e fica de fora)
+STORAGE_OPERATIONS = (
+    'list_ads', 'get_ad', 'add_ad', 'update_ad', 'delete_ad',
+    'increment_counters', 'list_ads_page', 'get_totals',
+    'list_all_ads', 'get_all_totals', 'bulk_write', 'compact_counters',
+)
+
+# Chamadas ao datastore da requisição atual: [número de chamadas, segundos]
+_request_storage = contextvars.ContextVar('ads_request_storage', default=None)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Contador monotônico com rótulos.
+    """
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """
+    Histograma com buckets cumulativos e rótulos.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items())
+        for labelvalues, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, labelvalues, ('le', '+Inf'))
+            lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class SamplingProfiler:
+    """
+    Executa o cProfile em 1 a cada `every` requisições e grava o resultado em `directory`.
+
+    Só uma requisição é perfilada por vez no processo; uma amostra que cai
+    enquanto outra está em andamento é ignorada.
+    """
+
+    def __init__(self, every=0, directory='data/profiles'):
+        """
+        Inicializa o profiler.
+
+        Args:
+            every (int): Perfila 1 a cada `every` requisições (0 desativa)
+            directory (str): Diretório dos arquivos .prof (abrir com pstats ou snakeviz)
+        """
+        self.every = every
+        self.directory = directory
+        self.dumped = 0
+        self._counter = itertools.count()
+        self._busy = threading.Lock()
+
+    def start(self):
+        """
+        Inicia o profiler se esta requisição foi sorteada.
+
+        Returns:
+            cProfile.Profile: Profiler ativo ou None
+        """
+        if self.every <= 0 or next(self._counter) % self.every:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Outro profiler já ativo na thread
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile, label):
+        """
+        Para o profiler e grava as estatísticas em <directory>/<ms>_<rótulo>.prof.
+        """
+        try:
+            profile.disable()
+            os.makedirs(self.directory, exist_ok=True)
+            name = re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_') or 'request'
+            path = os.path.join(self.directory, f'{int(time.time() * 1000)}_{name}.prof')
+            profile.dump_stats(path)
+            self.dumped += 1
+        except Exception as e:
+            logger.error(f"Erro ao gravar o perfil da requisição {label}: {e}", exc_info=True)
+        finally:
+            self._busy.release()
+
+
+class RequestContext:
+    """
+    Estado de medição de uma requisição em andamento.
+    """
+
+    __slots__ = ('started', 'storage', 'token', 'profile')
+
+    def __init__(self, started, storage, token, profile):
+        self.started = started
+        self.storage = storage
+        self.token = token
+        self.profile = profile
+
+
+class Instrumentation:
+    """
+    Registro das métricas do servidor e dos ganchos de medição.
+
+    `start_request`/`finish_request` envolvem cada requisição; as chamadas ao
+    datastore feitas no mesmo contexto (thread do Flask ou task do asyncio)
+    são somadas à requisição. Métricas de outros componentes entram como
+    gauges lidos de seus métodos stats() no momento da coleta.
+    """
+
+    def __init__(self, profile_every=0, profile_dir='data/profiles'):
+        """
+        Inicializa as métricas.
+
+        Args:
+            profile_every (int): Perfila 1 a cada N requisições (0 desativa)
+            profile_dir (str): Diretório dos perfis gravados
+        """
+        self.request_duration = Histogram(
+            'ads_http_request_duration_seconds', 'Latência das requisições por rota.',
+            ('route', 'method', 'status')
+        )
+        self.request_storage_calls = Histogram(
+            'ads_http_request_storage_calls', 'Chamadas ao datastore por requisição.',
+            ('route',), buckets=COUNT_BUCKETS
+        )
+        self.request_storage_duration = Histogram(
+            'ads_http_request_storage_seconds', 'Tempo gasto no datastore por requisição.',
+            ('route',)
+        )
+        self.storage_duration = Histogram(
+            'ads_storage_call_duration_seconds', 'Duração de cada chamada ao datastore.',
+            ('backend', 'operation')
+        )
+        self.storage_errors = Counter(
+            'ads_storage_call_errors_total', 'Chamadas ao datastore que lançaram exceção.',
+            ('backend', 'operation')
+        )
+        self.profiler = SamplingProfiler(profile_every, profile_dir)
+        self._gauge_sources = []
+
+    def add_gauges(self, prefix, documentation, stats_fn):
+        """
+        Registra um stats() cujos valores numéricos são exportados como gauges.
+
+        Args:
+            prefix (str): Prefixo dos nomes (ex: 'ads_inventory_cache')
+            documentation (str): Descrição usada no HELP de cada gauge
+            stats_fn (callable): Função sem argumentos que retorna um dict
+        """
+        self._gauge_sources.append((prefix, documentation, stats_fn))
+
+    def instrument_storage(self, storage):
+        """
+        Envolve as operações do backend para medir cada chamada ao datastore.
+
+        Os métodos são substituídos na própria instância, então referências
+        obtidas depois (ex: storage.list_all_ads no InventoryCache) já são medidas.
+        Um backend já instrumentado (ex: a visão de um jogo recriada após um
+        despejo) não é envolvido de novo.
+
+        Args:
+            storage (AdStorage): Backend de armazenamento
+
+        Returns:
+            AdStorage: O mesmo backend
+        """
+        if getattr(storage, '_instrumented', False):
+            return storage
+        storage._instrumented = True
+        for operation in STORAGE_OPERATIONS:
+            method = getattr(storage, operation, None)
+            if method is not None:
+                setattr(storage, operation, self._wrap_storage_call(storage.name, operation, method))
+        return storage
+
+    def _wrap_storage_call(self, backend, operation, method):
+        def measured(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception:
+                self.storage_errors.inc(backend, operation)
+                raise
+            finally:
+                elapsed = time.perf_counter() - started
+                self.storage_duration.observe(elapsed, backend, operation)
+                current = _request_storage.get()
+                if current is not None:
+                    current[0] += 1
+                    current[1] += elapsed
+        measured.__wrapped__ = method
+        return measured
+
+    def start_request(self):
+        """
+        Marca o início de uma requisição.
+
+        Returns:
+            RequestContext: Estado a ser passado para finish_request
+        """
+        storage = [0, 0.0]
+        token = _request_storage.set(storage)
+        return RequestContext(time.perf_counter(), storage, token, self.profiler.start())
+
+    def finish_request(self, context, route, method, status):
+        """
+        Registra a latência e as chamadas ao datastore de uma requisição.
+
+        Args:
+            context (RequestContext): Retorno de start_request
+            route (str): Rota no formato do roteador (ex: '/edit-banner/<string:ad_id>')
+            method (str): Método HTTP
+            status (int): Código de status da resposta
+        """
+        elapsed = time.perf_counter() - context.started
+        if context.profile is not None:
+            self.profiler.stop(context.profile, f'{method}_{route}')
+        try:
+            _request_storage.reset(context.token)
+        except ValueError:
+            # Contexto diferente do início (ex: resposta em streaming)
+            _request_storage.set(None)
+        self.request_duration.observe(elapsed, route, method, str(status))
+        self.request_storage_calls.observe(context.storage[0], route)
+        self.request_storage_duration.observe(context.storage[1], route)
+
+    def render(self):
+        """
+        Gera o texto de exposição do Prometheus.
+
+        Returns:
+            str: Métricas no formato text/plain; version=0.0.4
+        """
+        lines = []
+        for metric in (self.request_duration, self.request_storage_calls, self.request_storage_duration,
+                       self.storage_duration, self.storage_errors):
+            lines.extend(metric.render())
+
+        for prefix, documentation, stats_fn in self._gauge_sources:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                logger.error(f"Erro ao coletar métricas de {prefix}: {e}", exc_info=True)
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f'{prefix}_{key}'
+                lines.append(f'# HELP {name} {documentation} ({key})')
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {_format_value(value)}')
+
+        lines.append('# HELP ads_profiles_dumped Perfis cProfile gravados pelo profiler amostrado.')
+        lines.append('# TYPE ads_profiles_dumped gauge')
+        lines.append(f'ads_profiles_dumped {self.profiler.dumped}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,303 @@
+"""
+Agendamento e orçamento de impressões das campanhas.
+Cada anúncio pode ter início (startAt), fim (endAt) e um orçamento de
+impressões (impressionBudget). Em vez de refiltrar o inventário a cada
+requisição, o cache monta por recarga um índice com os limites das campanhas
+em uma lista de eventos ordenada por tempo; o conjunto elegível só muda
+quando o relógio passa do próximo limite ou quando um orçamento se esgota.
+"""
+import bisect
+import threading
+from datetime import datetime, timezone
+
+from models.storage import now_millis
+
+# Campos de agendamento gravados no anúncio (timestamps Unix em milissegundos e inteiro)
+SCHEDULE_FIELDS = ('startAt', 'endAt', 'impressionBudget')
+
+# Tipos de evento; no mesmo instante o fim é aplicado antes do início
+EVENT_END = 0
+EVENT_START = 1
+
+
+def parse_timestamp(value, tz=timezone.utc):
+    """
+    Converte um horário de agendamento para timestamp Unix em milissegundos.
+
+    Aceita números (milissegundos) e datas ISO 8601; datas sem fuso são
+    interpretadas no fuso `tz`.
+
+    Args:
+        value (int | float | str): Horário informado
+        tz (tzinfo): Fuso das datas sem deslocamento (padrão UTC)
+
+    Returns:
+        int: Timestamp em milissegundos ou None se o valor estiver vazio
+
+    Raises:
+        ValueError: Se o valor não for um horário válido
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"Horário inválido: {value}")
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip()
+    if not text:
+        return None
+    if text.lstrip('-').isdigit():
+        return int(text)
+    try:
+        moment = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Horário inválido: {text}. Use ISO 8601 (ex: 2024-05-01T08:00) ou milissegundos") from None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=tz)
+    return int(moment.timestamp() * 1000)
+
+
+def parse_budget(value):
+    """
+    Converte o orçamento de impressões informado.
+
+    Args:
+        value (int | str): Orçamento (vazio para ilimitado)
+
+    Returns:
+        int: Orçamento ou None se ilimitado
+
+    Raises:
+        ValueError: Se o orçamento não for um inteiro positivo
+    """
+    if value is None or value == '':
+        return None
+    try:
+        budget = int(str(value).strip())
+    except ValueError:
+        budget = 0
+    if budget <= 0:
+        raise ValueError(f"Orçamento de impressões deve ser um inteiro positivo: {value}")
+    return budget
+
+
+def parse_schedule(values, tz=timezone.utc):
+    """
+    Valida os campos de agendamento de um anúncio.
+
+    Args:
+        values (dict): startAt, endAt e impressionBudget como vieram do formulário ou do arquivo
+        tz (tzinfo): Fuso das datas ISO 8601 sem deslocamento (ver parse_timestamp)
+
+    Returns:
+        dict: Os três campos normalizados (None onde não houver valor)
+
+    Raises:
+        ValueError: Se algum campo for inválido ou o fim não vier depois do início
+    """
+    schedule = {
+        'startAt': parse_timestamp(values.get('startAt'), tz),
+        'endAt': parse_timestamp(values.get('endAt'), tz),
+        'impressionBudget': parse_budget(values.get('impressionBudget')),
+    }
+    if schedule['startAt'] is not None and schedule['endAt'] is not None \
+            and schedule['endAt'] <= schedule['startAt']:
+        raise ValueError("O fim da campanha deve ser depois do início")
+    return schedule
+
+
+def ad_schedule(ad_data):
+    """
+    Lê o agendamento gravado em um anúncio, tolerando valores inválidos.
+
+    Args:
+        ad_data (dict): Dados do anúncio
+
+    Returns:
+        tuple: (início, fim, orçamento), com None onde não houver limite
+    """
+    try:
+        schedule = parse_schedule(ad_data)
+    except ValueError:
+        # Dado inconsistente no datastore: o anúncio não é servido
+        return None, 0, None
+    return schedule['startAt'], schedule['endAt'], schedule['impressionBudget']
+
+
+def ad_is_active(ad_data, now=None):
+    """
+    Indica se o anúncio está na rotação: dentro do período da campanha e com orçamento.
+
+    Mesmo critério do EligibilityIndex, aplicado a um anúncio avulso (ex: exportação),
+    com as impressões já gravadas no anúncio.
+
+    Args:
+        ad_data (dict): Dados do anúncio
+        now (int): Timestamp atual em milissegundos (testes)
+
+    Returns:
+        bool: True se o anúncio está ativo agora
+    """
+    now = now_millis() if now is None else now
+    start, end, budget = ad_schedule(ad_data)
+    if start is not None and start > now:
+        return False
+    if end is not None and end <= now:
+        return False
+    return budget is None or int(ad_data.get('impressions', 0) or 0) < budget
+
+
+class EligibilityIndex:
+    """
+    Conjunto de anúncios elegíveis de um tipo, para uma versão do inventário.
+
+    Os limites futuros (início e fim) ficam em uma lista ordenada consumida
+    por um cursor: uma leitura fora de limite é O(1) e devolve a lista já
+    montada; ao passar de um limite só os eventos vencidos são aplicados.
+    Anúncios com orçamento têm um saldo decrementado pelas impressões deste
+    worker e saem da rotação quando o saldo chega a zero. Cada mudança do
+    conjunto incrementa `epoch`, que compõe a versão vista pelos seletores.
+
+    O saldo é por worker: cada um parte das impressões gravadas na última
+    recarga e só enxerga as próprias. Com N workers, um anúncio pode receber
+    até N vezes o saldo restante antes que as impressões gravadas cheguem a
+    todos na recarga seguinte (o orçamento é um limite aproximado, não exato).
+    """
+
+    def __init__(self, ads, now=None):
+        """
+        Monta o índice.
+
+        Args:
+            ads (list): Anúncios servíveis, mais recentes primeiro
+            now (int): Timestamp atual em milissegundos (testes)
+        """
+        now = now_millis() if now is None else now
+        self.ads = ads
+        self.epoch = 0
+        self.exhausted = 0
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._remaining = {}
+        self._active = []
+        events = []
+        for position, ad in enumerate(ads):
+            start, end, budget = ad_schedule(ad)
+            if end is not None and end <= now:
+                continue
+            if budget is not None:
+                remaining = budget - int(ad.get('impressions', 0) or 0)
+                if remaining <= 0:
+                    self.exhausted += 1
+                    continue
+                self._remaining[ad['id']] = remaining
+            self._positions[ad['id']] = position
+            if start is not None and start > now:
+                events.append((start, EVENT_START, position))
+            else:
+                self._active.append(position)
+            if end is not None:
+                events.append((end, EVENT_END, position))
+        events.sort()
+        self._events = events
+        self._cursor = 0
+        self._next_boundary = events[0][0] if events else None
+        self._state = (0, [ads[position] for position in self._active])
+
+    @property
+    def next_boundary(self):
+        """Timestamp (ms) do próximo início ou fim de campanha, ou None."""
+        return self._next_boundary
+
+    def get(self, now=None):
+        """
+        Obtém os anúncios elegíveis agora.
+
+        Args:
+            now (int): Timestamp atual em milissegundos (testes)
+
+        Returns:
+            tuple: (epoch, lista de anúncios mais recentes primeiro)
+        """
+        boundary = self._next_boundary
+        if boundary is not None:
+            now = now_millis() if now is None else now
+            if now >= boundary:
+                self._advance(now)
+        return self._state
+
+    def _advance(self, now):
+        with self._lock:
+            events = self._events
+            changed = False
+            while self._cursor < len(events) and events[self._cursor][0] <= now:
+                _, kind, position = events[self._cursor]
+                self._cursor += 1
+                slot = bisect.bisect_left(self._active, position)
+                present = slot < len(self._active) and self._active[slot] == position
+                if kind == EVENT_START and not present and self.ads[position]['id'] in self._positions:
+                    self._active.insert(slot, position)
+                    changed = True
+                elif kind == EVENT_END and present:
+                    del self._active[slot]
+                    changed = True
+            self._next_boundary = events[self._cursor][0] if self._cursor < len(events) else None
+            if changed:
+                self._publish()
+
+    def _publish(self):
+        # (epoch, lista) é trocado inteiro: leitores sem lock veem o par antigo ou o novo
+        self.epoch += 1
+        self._state = (self.epoch, [self.ads[position] for position in self._active])
+
+    def record_impression(self, ad_id, amount=1):
+        """
+        Desconta impressões do orçamento do anúncio.
+
+        Args:
+            ad_id (str): ID do anúncio
+            amount (int): Impressões servidas
+
+        Returns:
+            bool: True se o orçamento se esgotou com estas impressões
+        """
+        if ad_id not in self._remaining:
+            return False
+        with self._lock:
+            remaining = self._remaining.get(ad_id)
+            if remaining is None:
+                return False
+            remaining -= amount
+            if remaining > 0:
+                self._remaining[ad_id] = remaining
+                return False
+            # Orçamento esgotado: sai do índice (um início futuro também deixa de valer)
+            del self._remaining[ad_id]
+            position = self._positions.pop(ad_id)
+            self.exhausted += 1
+            slot = bisect.bisect_left(self._active, position)
+            if slot < len(self._active) and self._active[slot] == position:
+                del self._active[slot]
+                self._publish()
+            return True
+
+    def reset_after_fork(self):
+        """
+        Recria o lock no processo filho após um fork.
+        """
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """
+        Obtém o estado do índice.
+
+        Returns:
+            dict: Anúncios elegíveis, agendados, com orçamento, esgotados e próximo limite
+        """
+        return {
+            'eligible': len(self._state[1]),
+            'pending_events': len(self._events) - self._cursor,
+            'budgeted': len(self._remaining),
+            'exhausted': self.exhausted,
+            'next_boundary': self._next_boundary,
+        }
@@ -0,0 +1,334 @@
+"""
+Motor de seleção de anúncios.
+Cada estratégia é reconstruída uma vez por versão do inventário em cache e
+escolhe um anúncio em tempo constante ou logarítmico por requisição.
+"""
+import heapq
+import itertools
+import random
+import threading
+from collections import OrderedDict
+
+from services.inventory_cache import ad_weight
+from services.targeting import MAX_SEGMENTS
+
+
+class SelectionStrategy:
+    """
+    Estratégia base de seleção.
+
+    Subclasses implementam `rebuild` (O(n), uma vez por versão do inventário)
+    e `pick` (O(1) ou O(log n) por requisição).
+    """
+
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random()
+        self.ads = []
+
+    def rebuild(self, ads):
+        """
+        Reconstrói as estruturas da estratégia para um novo inventário.
+
+        Args:
+            ads (list): Anúncios servíveis, mais recentes primeiro
+        """
+        self.ads = ads
+
+    def pick(self):
+        """
+        Escolhe um anúncio.
+
+        Returns:
+            dict: Anúncio escolhido ou None se não houver anúncios
+        """
+        raise NotImplementedError
+
+    def record_impression(self, ad_id, amount=1):
+        """Registra impressões servidas (usado pelas estratégias adaptativas)."""
+
+    def record_click(self, ad_id, amount=1):
+        """Registra cliques recebidos (usado pelas estratégias adaptativas)."""
+
+
+class NewestStrategy(SelectionStrategy):
+    """
+    Sempre o anúncio mais recente (comportamento original da API).
+    """
+
+    def pick(self):
+        return self.ads[0] if self.ads else None
+
+
+class RoundRobinStrategy(SelectionStrategy):
+    """
+    Rotação circular pelo inventário, O(1) por escolha.
+    """
+
+    def rebuild(self, ads):
+        self.ads = ads
+        self._counter = itertools.count()
+
+    def pick(self):
+        if not self.ads:
+            return None
+        # next() em itertools.count é atômico sob o GIL
+        return self.ads[next(self._counter) % len(self.ads)]
+
+
+class WeightedRandomStrategy(SelectionStrategy):
+    """
+    Sorteio ponderado pelo campo `weight` do anúncio (padrão 1),
+    usando o método de alias de Vose: O(n) na reconstrução e O(1) por escolha.
+    """
+
+    def rebuild(self, ads):
+        self.ads = ads
+        n = len(ads)
+        self._prob = [0.0] * n
+        self._alias = [0] * n
+        if n == 0:
+            return
+
+        # Mesma interpretação do peso publicada no manifesto
+        weights = [ad_weight(ad) for ad in ads]
+        total = sum(weights)
+        if total <= 0:
+            weights = [1.0] * n
+            total = float(n)
+
+        scaled = [w * n / total for w in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            g = large.pop()
+            self._prob[s] = scaled[s]
+            self._alias[s] = g
+            scaled[g] = scaled[g] + scaled[s] - 1.0
+            (small if scaled[g] < 1.0 else large).append(g)
+        for i in large + small:
+            self._prob[i] = 1.0
+
+    def pick(self):
+        if not self.ads:
+            return None
+        i = self.rng.randrange(len(self.ads))
+        if self.rng.random() < self._prob[i]:
+            return self.ads[i]
+        return self.ads[self._alias[i]]
+
+
+class LeastImpressionsStrategy(SelectionStrategy):
+    """
+    Anúncio com menos impressões, mantido em um heap: O(log n) por escolha.
+
+    Cada impressão registrada empurra uma nova entrada com a contagem
+    atualizada; as entradas antigas do anúncio ficam no heap e são
+    descartadas quando chegam ao topo (a contagem não bate mais).
+    """
+
+    def rebuild(self, ads):
+        self.ads = ads
+        self._lock = threading.Lock()
+        self._by_id = {ad['id']: ad for ad in ads}
+        self._positions = {ad['id']: position for position, ad in enumerate(ads)}
+        self._impressions = {ad['id']: int(ad.get('impressions', 0) or 0) for ad in ads}
+        self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        # (impressões, posição no inventário, id): empate favorece o mais recente
+        self._heap = [
+            (self._impressions[ad_id], position, ad_id)
+            for ad_id, position in self._positions.items()
+        ]
+        heapq.heapify(self._heap)
+
+    def pick(self):
+        with self._lock:
+            heap = self._heap
+            while heap:
+                impressions, _, ad_id = heap[0]
+                if impressions == self._impressions[ad_id]:
+                    return self._by_id[ad_id]
+                heapq.heappop(heap)
+            return None
+
+    def record_impression(self, ad_id, amount=1):
+        if ad_id not in self._impressions:
+            return
+        with self._lock:
+            impressions = self._impressions[ad_id] + amount
+            self._impressions[ad_id] = impressions
+            # Entradas obsoletas acumuladas sem escolhas no meio: recria o heap só com as atuais
+            if len(self._heap) >= 2 * len(self._impressions) + 64:
+                self._rebuild_heap()
+            else:
+                heapq.heappush(self._heap, (impressions, self._positions[ad_id], ad_id))
+
+
+class ThompsonSamplingStrategy(SelectionStrategy):
+    """
+    Otimização de CTR por amostragem de Thompson (posteriores Beta).
+
+    Para manter o custo por escolha constante, as amostras são sorteadas só
+    entre os `candidates` anúncios de maior CTR posterior, recalculados a cada
+    `refresh_every` escolhas; com probabilidade `explore` um anúncio qualquer
+    é servido. O prior Beta(1, 1) coloca anúncios novos entre os candidatos.
+    """
+
+    def __init__(self, rng=None, candidates=16, refresh_every=1000, explore=0.05):
+        super().__init__(rng)
+        self.candidates = candidates
+        self.refresh_every = refresh_every
+        self.explore = explore
+
+    def rebuild(self, ads):
+        self.ads = ads
+        self._lock = threading.Lock()
+        self._by_id = {ad['id']: ad for ad in ads}
+        self._impressions = {ad['id']: int(ad.get('impressions', 0) or 0) for ad in ads}
+        self._clicks = {ad['id']: int(ad.get('clicks', 0) or 0) for ad in ads}
+        self._refresh_candidates()
+
+    def _posterior(self, ad_id):
+        clicks = self._clicks.get(ad_id, 0)
+        failures = max(self._impressions.get(ad_id, 0) - clicks, 0)
+        return clicks + 1, failures + 1
+
+    def _refresh_candidates(self):
+        def mean(ad_id):
+            alpha, beta = self._posterior(ad_id)
+            return alpha / (alpha + beta)
+        self._candidate_ids = heapq.nlargest(self.candidates, self._by_id, key=mean)
+        self._picks_since_refresh = 0
+
+    def pick(self):
+        if not self.ads:
+            return None
+        if self.rng.random() < self.explore:
+            return self.ads[self.rng.randrange(len(self.ads))]
+
+        with self._lock:
+            self._picks_since_refresh += 1
+            if self._picks_since_refresh >= self.refresh_every:
+                self._refresh_candidates()
+            candidate_ids = self._candidate_ids
+
+        best_id = max(candidate_ids, key=lambda ad_id: self.rng.betavariate(*self._posterior(ad_id)))
+        return self._by_id[best_id]
+
+    def record_impression(self, ad_id, amount=1):
+        if ad_id in self._impressions:
+            self._impressions[ad_id] += amount
+
+    def record_click(self, ad_id, amount=1):
+        if ad_id in self._clicks:
+            self._clicks[ad_id] += amount
+
+
+STRATEGIES = {
+    'newest': NewestStrategy,
+    'round_robin': RoundRobinStrategy,
+    'weighted': WeightedRandomStrategy,
+    'least_impressions': LeastImpressionsStrategy,
+    'thompson': ThompsonSamplingStrategy,
+}
+
+
+class AdSelector:
+    """
+    Seleciona anúncios do inventário em cache com a estratégia configurada.
+
+    A estratégia de cada tipo de anúncio é reconstruída apenas quando a
+    versão do inventário muda (recarga, ou início, fim ou esgotamento de uma
+    campanha agendada). Requisições cujo contexto de segmentação restringe o
+    inventário usam uma estratégia própria por segmento, mantida em um
+    OrderedDict limitado a `MAX_SEGMENTS` segmentos por tipo.
+    """
+
+    def __init__(self, inventory_cache, strategy='round_robin', type_strategies=None):
+        """
+        Inicializa o seletor.
+
+        Args:
+            inventory_cache (InventoryCache): Cache do inventário de anúncios
+            strategy (str): Nome da estratégia padrão (chave de STRATEGIES)
+            type_strategies (dict): Estratégia própria de alguns tipos, {ad_type: nome}
+        """
+        type_strategies = dict(type_strategies or {})
+        for name in (strategy, *type_strategies.values()):
+            if name not in STRATEGIES:
+                raise ValueError(f"Estratégia de seleção desconhecida: {name}")
+        self.inventory_cache = inventory_cache
+        self.strategy_name = strategy
+        self.type_strategies = type_strategies
+        self._strategies = {}
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    def _get_strategy(self, ad_type, context=None):
+        version, ads = self.inventory_cache.get_versioned_ads(ad_type, context)
+        segment = version[2]
+        if segment is None:
+            strategies = self._strategies
+            key = ad_type
+        else:
+            strategies = self._segments.get(ad_type)
+            key = segment
+        current = strategies.get(key) if strategies is not None else None
+        if current is not None and current[0] == version:
+            return current[1]
+
+        with self._lock:
+            if segment is not None:
+                strategies = self._segments.setdefault(ad_type, OrderedDict())
+            current = strategies.get(key)
+            if current is not None and current[0] == version:
+                return current[1]
+            strategy = STRATEGIES[self.strategy_for(ad_type)]()
+            strategy.rebuild(ads)
+            strategies[key] = (version, strategy)
+            if segment is not None:
+                strategies.move_to_end(key)
+                while len(strategies) > MAX_SEGMENTS:
+                    strategies.popitem(last=False)
+            return strategy
+
+    def _strategies_for(self, ad_type):
+        # Estratégia geral e as dos segmentos do tipo, para repassar impressões e cliques
+        current = self._strategies.get(ad_type)
+        strategies = [current[1]] if current is not None else []
+        segments = self._segments.get(ad_type)
+        if segments:
+            with self._lock:
+                strategies.extend(entry[1] for entry in segments.values())
+        return strategies
+
+    def strategy_for(self, ad_type):
+        """Nome da estratégia usada por um tipo de anúncio."""
+        return self.type_strategies.get(ad_type, self.strategy_name)
+
+    def pick(self, ad_type, context=None):
+        """
+        Escolhe um anúncio do tipo informado.
+
+        Args:
+            ad_type (str): Tipo do anúncio (chave de AD_TYPES)
+            context (tuple): Contexto de segmentação da requisição
+                (services/targeting.build_context; None ignora as regras de segmentação)
+
+        Returns:
+            dict: Anúncio escolhido ou None se não houver anúncios
+        """
+        return self._get_strategy(ad_type, context).pick()
+
+    def record_impression(self, ad_type, ad_id, amount=1):
+        """Repassa impressões para as estratégias do tipo e para o orçamento do anúncio no inventário."""
+        for strategy in self._strategies_for(ad_type):
+            strategy.record_impression(ad_id, amount)
+        self.inventory_cache.record_impression(ad_type, ad_id, amount)
+
+    def record_click(self, ad_type, ad_id, amount=1):
+        """Repassa cliques para as estratégias do tipo de anúncio."""
+        for strategy in self._strategies_for(ad_type):
+            strategy.record_click(ad_id, amount)
@@ -0,0 +1,404 @@
+"""
+Segmentação de anúncios por país, idioma, classe de dispositivo e versão do jogo.
+As regras ficam no próprio anúncio (listas de valores aceitos, normalizadas
+na escrita) e são compiladas a cada recarga do inventário em um índice de
+bitmaps: para cada dimensão, um inteiro por valor com um bit por posição do
+anúncio no inventário, mais o bitmap dos anúncios sem regra naquela dimensão.
+O conjunto elegível de uma requisição é um punhado de OR/AND entre inteiros,
+sem percorrer o inventário.
+"""
+import re
+import threading
+from collections import OrderedDict
+
+# Dimensões do contexto da requisição, na ordem das tuplas de contexto
+TARGETING_DIMENSIONS = ('country', 'language', 'device', 'gameVersion')
+
+# Campos gravados no anúncio, na mesma ordem (valores separados por vírgula; vazio aceita qualquer valor)
+TARGETING_FIELDS = ('targetCountries', 'targetLanguages', 'targetDevices', 'targetGameVersions')
+
+DEVICE_CLASSES = ('mobile', 'tablet', 'desktop')
+
+# Parâmetros de query das rotas do jogo, na mesma ordem
+CONTEXT_PARAMS = ('country', 'lang', 'device', 'version')
+
+# Cabeçalho com a versão do jogo enviado pelo cliente (alternativa ao parâmetro version)
+GAME_VERSION_HEADER = 'X-Game-Version'
+
+# Listas de anúncios por segmento (conjunto de bits) mantidas por índice
+MAX_SEGMENTS = 64
+
+COUNTRY_PATTERN = re.compile(r'^[A-Z]{2}$')
+LANGUAGE_PATTERN = re.compile(r'^[a-z]{2,3}$')
+GAME_VERSION_PATTERN = re.compile(r'^[0-9A-Za-z][0-9A-Za-z._-]{0,31}$')
+
+TABLET_PATTERN = re.compile(r'iPad|Tablet|PlayBook|Silk|Android(?!.*Mobile)', re.IGNORECASE)
+MOBILE_PATTERN = re.compile(r'Mobi|iPhone|iPod|Android|Windows Phone', re.IGNORECASE)
+
+
+def normalize_value(dimension, value):
+    """
+    Normaliza um valor de uma dimensão de segmentação.
+
+    Países usam o código ISO 3166-1 alfa-2 (BR), idiomas o subtag principal
+    (pt-BR vira pt), dispositivos uma de DEVICE_CLASSES e versões do jogo um
+    prefixo separado por pontos (1.2 ou 1.2.* valem para 1.2.x).
+
+    Args:
+        dimension (str): Dimensão (chave de TARGETING_DIMENSIONS)
+        value (str): Valor informado
+
+    Returns:
+        str: Valor normalizado ou None se estiver vazio
+
+    Raises:
+        ValueError: Se o valor não for válido para a dimensão
+    """
+    text = str(value).strip() if value is not None else ''
+    if not text:
+        return None
+    if dimension == 'country':
+        text = text.upper()
+        valid = COUNTRY_PATTERN.match(text)
+    elif dimension == 'language':
+        text = re.split(r'[-_]', text.lower(), maxsplit=1)[0]
+        valid = LANGUAGE_PATTERN.match(text)
+    elif dimension == 'device':
+        text = text.lower()
+        valid = text in DEVICE_CLASSES
+    elif dimension == 'gameVersion':
+        text = text.rstrip('*').rstrip('.')
+        valid = GAME_VERSION_PATTERN.match(text)
+    else:
+        raise ValueError(f"Dimensão de segmentação desconhecida: {dimension}")
+    if not valid:
+        raise ValueError(f"Valor inválido para '{dimension}': {value}")
+    return text
+
+
+def parse_rule(dimension, value):
+    """
+    Converte a regra de uma dimensão para a forma gravada no anúncio.
+
+    Args:
+        dimension (str): Dimensão (chave de TARGETING_DIMENSIONS)
+        value (str | list): Valores separados por vírgula ou lista de valores
+
+    Returns:
+        str: Valores normalizados separados por vírgula ou None se não houver regra
+
+    Raises:
+        ValueError: Se algum valor for inválido
+    """
+    if value is None:
+        return None
+    items = value if isinstance(value, (list, tuple)) else str(value).split(',')
+    normalized = []
+    for item in items:
+        item = normalize_value(dimension, item)
+        if item is not None and item not in normalized:
+            normalized.append(item)
+    return ','.join(normalized) or None
+
+
+def parse_targeting(values):
+    """
+    Valida os campos de segmentação de um anúncio.
+
+    Args:
+        values (dict): Campos de TARGETING_FIELDS como vieram do formulário ou do arquivo
+
+    Returns:
+        dict: Os campos normalizados (None onde não houver regra)
+
+    Raises:
+        ValueError: Se algum valor for inválido
+    """
+    return {
+        field: parse_rule(dimension, values.get(field))
+        for dimension, field in zip(TARGETING_DIMENSIONS, TARGETING_FIELDS)
+    }
+
+
+def ad_rules(ad_data):
+    """
+    Lê as regras gravadas em um anúncio, tolerando valores inválidos.
+
+    Args:
+        ad_data (dict): Dados do anúncio
+
+    Returns:
+        tuple: Um frozenset de valores por dimensão (None sem regra), ou None
+            se alguma regra for inválida
+    """
+    try:
+        targeting = parse_targeting(ad_data)
+    except ValueError:
+        # Dado inconsistente no datastore: o anúncio não é servido
+        return None
+    return tuple(
+        frozenset(targeting[field].split(',')) if targeting[field] else None
+        for field in TARGETING_FIELDS
+    )
+
+
+def request_value(dimension, value):
+    """
+    Normaliza um valor vindo da requisição, descartando valores inválidos.
+
+    Args:
+        dimension (str): Dimensão (chave de TARGETING_DIMENSIONS)
+        value (str): Valor recebido
+
+    Returns:
+        str: Valor normalizado ou None
+    """
+    try:
+        return normalize_value(dimension, value)
+    except ValueError:
+        return None
+
+
+def build_context(country=None, language=None, device=None, game_version=None):
+    """
+    Monta o contexto de segmentação de uma requisição.
+
+    Args:
+        country (str): País (ISO 3166-1 alfa-2)
+        language (str): Idioma (tag BCP 47 ou subtag principal)
+        device (str): Classe de dispositivo (DEVICE_CLASSES)
+        game_version (str): Versão do jogo
+
+    Returns:
+        tuple: Valores normalizados na ordem de TARGETING_DIMENSIONS (None onde desconhecido)
+    """
+    return tuple(
+        request_value(dimension, value)
+        for dimension, value in zip(TARGETING_DIMENSIONS, (country, language, device, game_version))
+    )
+
+
+def language_from_header(accept_language):
+    """
+    Idioma preferido de um cabeçalho Accept-Language.
+
+    Args:
+        accept_language (str): Valor do cabeçalho (ex: 'pt-BR,pt;q=0.9,en;q=0.8')
+
+    Returns:
+        str: Primeira tag da lista ou None
+    """
+    if not accept_language:
+        return None
+    tag = accept_language.split(',', 1)[0].split(';', 1)[0].strip()
+    return tag if tag != '*' else None
+
+
+def device_from_user_agent(user_agent):
+    """
+    Classe de dispositivo deduzida do User-Agent.
+
+    Args:
+        user_agent (str): Valor do cabeçalho User-Agent
+
+    Returns:
+        str: 'tablet', 'mobile', 'desktop' ou None sem User-Agent
+    """
+    if not user_agent:
+        return None
+    if TABLET_PATTERN.search(user_agent):
+        return 'tablet'
+    if MOBILE_PATTERN.search(user_agent):
+        return 'mobile'
+    return 'desktop'
+
+
+def request_context(params, header=None, geo_header=None):
+    """
+    Monta o contexto de segmentação a partir dos parâmetros e cabeçalhos da requisição.
+
+    Os parâmetros de CONTEXT_PARAMS têm precedência. Sem `header` só os
+    parâmetros contam (respostas que podem ficar em cache por URL, como o
+    manifesto); com ele, o país vem de `geo_header`, o idioma do
+    Accept-Language, o dispositivo do User-Agent e a versão de X-Game-Version.
+
+    Args:
+        params (dict): Parâmetros de query (qualquer objeto com get)
+        header (callable): Função que recebe o nome de um cabeçalho e devolve o valor ou None
+        geo_header (str): Cabeçalho com o país do cliente definido pelo proxy ou CDN
+
+    Returns:
+        tuple: Contexto de build_context
+    """
+    values = [params.get(name) for name in CONTEXT_PARAMS]
+    if header is not None:
+        fallbacks = (
+            header(geo_header) if geo_header else None,
+            language_from_header(header('Accept-Language')),
+            device_from_user_agent(header('User-Agent')),
+            header(GAME_VERSION_HEADER),
+        )
+        values = [value or fallback for value, fallback in zip(values, fallbacks)]
+    return build_context(*values)
+
+
+def version_prefixes(version):
+    """
+    Prefixos de uma versão do jogo que uma regra pode citar.
+
+    Args:
+        version (str): Versão normalizada (ex: '1.2.3')
+
+    Returns:
+        list: A versão e seus prefixos (['1.2.3', '1.2', '1'])
+    """
+    parts = version.split('.')
+    return ['.'.join(parts[:length]) for length in range(len(parts), 0, -1)]
+
+
+class TargetingIndex:
+    """
+    Índice de bitmaps das regras de segmentação de um tipo, por versão do inventário.
+
+    O bit i de cada bitmap corresponde ao anúncio na posição i do inventário
+    (mais recentes primeiro). A máscara de uma requisição é o AND, por
+    dimensão, do bitmap dos anúncios sem regra com o OR dos bitmaps dos
+    valores da requisição; a interseção com os anúncios elegíveis no momento
+    (agendamento e orçamento) é decodificada uma vez por segmento e guardada
+    em um OrderedDict limitado a `MAX_SEGMENTS` entradas.
+    """
+
+    def __init__(self, ads):
+        """
+        Compila as regras dos anúncios.
+
+        Args:
+            ads (list): Anúncios servíveis, mais recentes primeiro
+        """
+        self.ads = ads
+        self.targeted = 0
+        self.invalid = 0
+        self._positions = {}
+        self._any = [0] * len(TARGETING_DIMENSIONS)
+        self._values = [{} for _ in TARGETING_DIMENSIONS]
+        valid = 0
+        for position, ad in enumerate(ads):
+            self._positions[ad['id']] = position
+            rules = ad_rules(ad)
+            if rules is None:
+                self.invalid += 1
+                continue
+            bit = 1 << position
+            valid |= bit
+            if any(rules):
+                self.targeted += 1
+            for dimension, values in enumerate(rules):
+                if values is None:
+                    self._any[dimension] |= bit
+                    continue
+                bitmaps = self._values[dimension]
+                for value in values:
+                    bitmaps[value] = bitmaps.get(value, 0) | bit
+        self._valid = valid
+        self._active = (None, 0)
+        self._segments = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """Indica se alguma regra do inventário restringe os anúncios."""
+        return bool(self.targeted or self.invalid)
+
+    def mask(self, context):
+        """
+        Calcula o bitmap dos anúncios cujas regras aceitam o contexto.
+
+        Args:
+            context (tuple): Contexto de build_context
+
+        Returns:
+            int: Bitmap por posição no inventário
+        """
+        mask = self._valid
+        for dimension, value in enumerate(context):
+            bitmaps = self._values[dimension]
+            if not bitmaps:
+                # Nenhum anúncio tem regra nesta dimensão
+                continue
+            allowed = self._any[dimension]
+            if value is not None:
+                if TARGETING_DIMENSIONS[dimension] == 'gameVersion':
+                    for prefix in version_prefixes(value):
+                        allowed |= bitmaps.get(prefix, 0)
+                else:
+                    allowed |= bitmaps.get(value, 0)
+            mask &= allowed
+        return mask
+
+    def _active_mask(self, epoch, eligible):
+        # Bitmap dos elegíveis, recalculado só quando a elegibilidade muda de época
+        active_epoch, mask = self._active
+        if active_epoch != epoch:
+            mask = 0
+            for ad in eligible:
+                mask |= 1 << self._positions[ad['id']]
+            self._active = (epoch, mask)
+        return mask
+
+    def select(self, epoch, eligible, context):
+        """
+        Restringe os anúncios elegíveis ao contexto da requisição.
+
+        Args:
+            epoch (int): Época da elegibilidade (EligibilityIndex)
+            eligible (list): Anúncios elegíveis nesta época, mais recentes primeiro
+            context (tuple): Contexto de build_context
+
+        Returns:
+            tuple: (segmento, lista de anúncios); o segmento é None quando o
+                contexto aceita todos os elegíveis (a lista é a própria `eligible`)
+        """
+        if not self.enabled:
+            return None, eligible
+        active = self._active_mask(epoch, eligible)
+        segment = active & self.mask(context)
+        if segment == active:
+            return None, eligible
+
+        key = (epoch, segment)
+        with self._lock:
+            ads = self._segments.get(key)
+            if ads is not None:
+                self._segments.move_to_end(key)
+                return segment, ads
+        ads = []
+        bits = segment
+        while bits:
+            low = bits & -bits
+            ads.append(self.ads[low.bit_length() - 1])
+            bits ^= low
+        with self._lock:
+            self._segments[key] = ads
+            while len(self._segments) > MAX_SEGMENTS:
+                self._segments.popitem(last=False)
+        return segment, ads
+
+    def reset_after_fork(self):
+        """
+        Recria o lock no processo filho após um fork.
+        """
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """
+        Obtém o estado do índice.
+
+        Returns:
+            dict: Anúncios com regras, com regras inválidas, valores indexados e segmentos em cache
+        """
+        return {
+            'targeted': self.targeted,
+            'invalid': self.invalid,
+            'values': sum(len(bitmaps) for bitmaps in self._values),
+            'segments': len(self._segments),
+        }
@@ -0,0 +1,272 @@
+"""
+Inventários por jogo (multi-tenant).
+Cada jogo tem o próprio inventário no datastore (ads/<game_id>/...) e, em cada
+worker, uma partição própria com cache de inventário, seletor e buffer de
+contadores: o tráfego de um jogo não recarrega, não despeja e não atrasa o
+inventário de outro. As partições dos jogos inativos são despejadas (LRU).
+"""
+import atexit
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from models.ad_types import REGISTERED_AD_TYPES
+
+logger = logging.getLogger(__name__)
+
+# IDs de jogo aceitos: minúsculas, dígitos, '_' e '-' (também usados nos caminhos do RTDB)
+GAME_ID_PATTERN = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+
+# Nomes que colidiriam com os nós dos tipos dentro de ads/ (ex: ads/banners)
+RESERVED_GAME_IDS = frozenset(ad_type.firebase_path.split('/')[1] for ad_type in REGISTERED_AD_TYPES)
+
+
+def valid_game_id(game_id):
+    """
+    Indica se um ID de jogo pode ser usado como inventário.
+
+    Args:
+        game_id (any): Valor recebido na requisição
+
+    Returns:
+        bool: True se o ID tem o formato aceito e não é reservado
+    """
+    return (
+        isinstance(game_id, str)
+        and GAME_ID_PATTERN.match(game_id) is not None
+        and game_id not in RESERVED_GAME_IDS
+    )
+
+
+class GamePartition:
+    """
+    Componentes de um inventário no worker: backend, cache, seletor e buffer.
+    """
+
+    def __init__(self, game_id, storage, inventory_cache, ad_selector, counter_buffer,
+                 refresh_interval=0, listen=False):
+        """
+        Args:
+            game_id (str): ID do jogo (None para o inventário padrão)
+            storage (AdStorage): Backend restrito ao jogo
+            inventory_cache (InventoryCache): Cache de inventário do jogo
+            ad_selector (AdSelector): Seletor sobre o cache do jogo
+            counter_buffer (CounterBuffer): Buffer de contadores do jogo
+            refresh_interval (float): Intervalo da recarga em segundo plano do cache (0 desativa)
+            listen (bool): Registra o listener de alterações do inventário do jogo
+        """
+        self.game_id = game_id
+        self.storage = storage
+        self.inventory_cache = inventory_cache
+        self.ad_selector = ad_selector
+        self.counter_buffer = counter_buffer
+        self.refresh_interval = refresh_interval
+        self.listen = listen
+        self.last_used = time.monotonic()
+
+    def start(self):
+        """
+        Inicia o flush dos contadores e, se configurados, a recarga e o listener do cache.
+        """
+        self.inventory_cache.start_background_refresh(self.refresh_interval)
+        if self.listen:
+            self.inventory_cache.start_listener(self.storage)
+        self.counter_buffer.start()
+
+    def stop(self, forward=None):
+        """
+        Grava os contadores pendentes e encerra as threads da partição.
+
+        Args:
+            forward (callable): Destino dos incrementos que chegarem depois do
+                encerramento (ver CounterBuffer.stop)
+        """
+        self.counter_buffer.stop(forward)
+        # O flush de encerramento já aconteceu: a partição pode ser liberada
+        atexit.unregister(self.counter_buffer.stop)
+        self.inventory_cache.stop()
+
+
+class GameRegistry:
+    """
+    Partições dos jogos deste worker, criadas sob demanda e despejadas por LRU.
+
+    A partição padrão (requisições sem game_id) nunca é despejada. As demais
+    ficam em um OrderedDict em ordem de uso: ao criar uma partição, as
+    inativas há mais de `idle_ttl` segundos e as mais antigas acima de
+    `max_games` são despejadas, com o flush dos contadores em segundo plano.
+    Requisições que obtiveram a partição antes do despejo ainda podem contar
+    impressões nela: esses incrementos tardios são enfileirados no buffer da
+    partição atual do jogo, se houver uma; sem partição ativa eles são
+    descartados e contados em `late_dropped`, sem escrita no datastore nem
+    criação de partição no caminho da requisição.
+    """
+
+    def __init__(self, default, factory, enabled=True, max_games=32, idle_ttl=900.0, allowed=None):
+        """
+        Inicializa o registro.
+
+        Args:
+            default (GamePartition): Partição do inventário padrão
+            factory (callable): Função que recebe o game_id e devolve uma GamePartition
+                (iniciada depois por start(), fora do lock do registro)
+            enabled (bool): Se False, só o inventário padrão é aceito
+            max_games (int): Número máximo de partições de jogos por worker
+            idle_ttl (float): Inatividade (segundos) após a qual a partição é despejada
+            allowed (iterable): IDs de jogo aceitos (None aceita qualquer ID válido)
+        """
+        self.default = default
+        self.factory = factory
+        self.enabled = enabled
+        self.max_games = max(int(max_games), 1)
+        self.idle_ttl = idle_ttl
+        self.allowed = frozenset(allowed) if allowed else None
+        self.created = 0
+        self.evicted = 0
+        self.rejected = 0
+        self.late_dropped = 0
+        self._partitions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def accepts(self, game_id):
+        """
+        Indica se o ID de jogo é válido e permitido.
+
+        Args:
+            game_id (str): ID do jogo
+
+        Returns:
+            bool: True se a partição do jogo pode ser criada
+        """
+        return (
+            self.enabled
+            and valid_game_id(game_id)
+            and (self.allowed is None or game_id in self.allowed)
+        )
+
+    def get(self, game_id):
+        """
+        Obtém a partição de um jogo, criando-a se necessário.
+
+        Args:
+            game_id (str): ID do jogo (None ou vazio para o inventário padrão)
+
+        Returns:
+            GamePartition: Partição do jogo ou None se o ID não for aceito
+        """
+        if not game_id:
+            return self.default
+        now = time.monotonic()
+        with self._lock:
+            partition = self._partitions.get(game_id)
+            if partition is not None:
+                partition.last_used = now
+                self._partitions.move_to_end(game_id)
+                return partition
+        if not self.accepts(game_id):
+            self.rejected += 1
+            return None
+
+        created = False
+        with self._lock:
+            partition = self._partitions.get(game_id)
+            if partition is None:
+                partition = self.factory(game_id)
+                self._partitions[game_id] = partition
+                self.created += 1
+                created = True
+                evicted = self._evict(now)
+            else:
+                evicted = []
+            partition.last_used = now
+            self._partitions.move_to_end(game_id)
+        if created:
+            # O listener do RTDB abre uma conexão: nunca dentro do lock
+            partition.start()
+        for old in evicted:
+            # Flush final fora da requisição: pode esperar pelo datastore
+            threading.Thread(
+                target=old.stop, args=(self._forwarder(old),),
+                name='game-partition-evict', daemon=True
+            ).start()
+        return partition
+
+    def _forwarder(self, old):
+        def forward(ad_type, ad_id, field, amount):
+            with self._lock:
+                partition = self._partitions.get(old.game_id)
+                if partition is None or partition is old:
+                    self.late_dropped += amount
+                    return False
+            return partition.counter_buffer.increment(ad_type, ad_id, field, amount)
+        return forward
+
+    def _evict(self, now):
+        evicted = []
+        partitions = self._partitions
+        while partitions:
+            game_id, partition = next(iter(partitions.items()))
+            if len(partitions) <= self.max_games and partition.last_used + self.idle_ttl > now:
+                break
+            partitions.popitem(last=False)
+            evicted.append(partition)
+            self.evicted += 1
+            logger.info(f"Partição do jogo '{game_id}' despejada")
+        return evicted
+
+    def partitions(self):
+        """
+        Lista as partições ativas, incluindo a padrão.
+
+        Returns:
+            list: Partições do worker
+        """
+        with self._lock:
+            return [self.default, *self._partitions.values()]
+
+    def stop(self):
+        """
+        Encerra as partições dos jogos, gravando os contadores pendentes.
+        """
+        with self._lock:
+            partitions = list(self._partitions.values())
+            self._partitions.clear()
+        for partition in partitions:
+            partition.stop()
+
+    def reset_after_fork(self):
+        """
+        Prepara o registro no processo filho após um fork.
+
+        As partições copiadas do pai são descartadas (as pendências são do pai,
+        que as grava) e recriadas sob demanda no filho.
+        """
+        for partition in self._partitions.values():
+            # Sem as pendências copiadas do pai, o flush registrado no atexit não grava nada em dobro
+            partition.counter_buffer.reset_after_fork()
+            atexit.unregister(partition.counter_buffer.stop)
+        self._lock = threading.Lock()
+        self._partitions = OrderedDict()
+        for storage in self.default.storage.game_storages():
+            storage.reset_after_fork()
+
+    def stats(self):
+        """
+        Obtém as métricas do registro.
+
+        Returns:
+            dict: Partições ativas, criadas, despejadas, IDs recusados e
+                incrementos tardios descartados
+        """
+        with self._lock:
+            games = len(self._partitions)
+        return {
+            'games': games,
+            'max_games': self.max_games,
+            'created': self.created,
+            'evicted': self.evicted,
+            'rejected': self.rejected,
+            'late_dropped': self.late_dropped,
+        }
@@ -1,6 +1,6 @@
 /**
  * Sistema de Anúncios para jogos Unity WebGL
- * Versão: 2.1.0
+ * Versão: 2.6.0
  * Autor: Manus AI
  * 
  * Este script gerencia a exibição de banners e anúncios de tela cheia
@@ -11,23 +11,42 @@
 const ADS_CONFIG = {
   // URLs da API
   API_URL: 'https://ads-system-backend.onrender.com',
-  BANNERS_ENDPOINT: '/api/banners',
-  FULLSCREEN_ENDPOINT: '/api/fullscreen',
+  MANIFEST_ENDPOINT: '/api/manifest',
   IMPRESSION_ENDPOINT: '/api/impression',
   CLICK_ENDPOINT: '/api/click',
+  // Decisão de tela cheia no servidor (limite de frequência por sessão)
+  FULLSCREEN_NEXT_ENDPOINT: '/api/fullscreen/next',
+  // Inventário do jogo (servidor com ADS_MULTI_GAME); null usa o inventário padrão.
+  // Defina window.ADS_GAME_ID antes de carregar este script.
+  GAME_ID: window.ADS_GAME_ID || null,
+  // Segmentação: versão do jogo e país (opcionais); idioma e dispositivo vêm do navegador
+  GAME_VERSION: window.ADS_GAME_VERSION || null,
+  COUNTRY: window.ADS_COUNTRY || null,
   
   // Configurações de banner
   BANNER_WIDTH: 360,
   BANNER_HEIGHT: 47,
   BANNER_ROTATION_INTERVAL: 5000, // 5 segundos
   
+  // Revalidação do manifesto de rotação (o cache HTTP do navegador evita
+  // requisições dentro do max-age e revalida com If-None-Match depois dele)
+  MANIFEST_REFRESH_INTERVAL: 60000, // 1 minuto
+  
   // Configurações de debug
   DEBUG: true,
   LOG_PREFIX: '[AdSystem]',
   
   // Configurações de retry
   MAX_RETRIES: 3,
-  RETRY_DELAY: 2000 // 2 segundos
+  RETRY_DELAY: 2000, // 2 segundos
+  
+  // Configurações do envio em lote de impressões e cliques
+  EVENT_FLUSH_INTERVAL: 15000, // 15 segundos
+  EVENT_BATCH_SIZE: 20, // Envia antes do intervalo ao atingir este número de eventos
+  EVENT_MAX_BATCH: 100, // Limite de eventos por requisição (igual ao servidor)
+  EVENT_QUEUE_MAX: 500, // Eventos mais antigos são descartados acima deste limite
+  EVENT_BACKOFF_BASE: 2000, // 2 segundos
+  EVENT_BACKOFF_MAX: 120000 // 2 minutos
 };
 
 // Sistema de anúncios
@@ -37,6 +56,8 @@ class AdSystem {
     this.banners = [];
     this.fullscreenAds = [];
     this.currentBannerIndex = 0;
+    this.manifestVersion = null;
+    this.bannerRotationWeights = [];
     this.bannerContainer = null;
     this.fullscreenContainer = null;
     this.bannerRotationInterval = null;
@@ -45,6 +66,15 @@ class AdSystem {
     this.retryCount = 0;
     this.isInitialized = false;
     
+    // Fila de eventos de tracking aguardando envio
+    this.pendingEvents = { impression: [], click: [] };
+    // Sessão e IDs de evento permitem ao servidor descartar reenvios e limitar abusos
+    this.sessionId = this.generateId();
+    this.eventFlushInterval = null;
+    this.isFlushingEvents = false;
+    this.eventFailures = 0;
+    this.eventBackoffUntil = 0;
+    
     // Inicializar quando o DOM estiver pronto
     if (document.readyState === 'loading') {
       document.addEventListener('DOMContentLoaded', () => this.init());
@@ -62,9 +92,9 @@ class AdSystem {
     // Criar containers para os anúncios
     this.createAdContainers();
     
-    // Carregar anúncios
-    this.loadBanners();
-    this.loadFullscreenAds();
+    // Carregar anúncios e revalidar o manifesto periodicamente
+    this.loadManifest();
+    setInterval(() => this.loadManifest(), ADS_CONFIG.MANIFEST_REFRESH_INTERVAL);
     
     // Configurar detecção do Unity
     this.setupUnityDetection();
@@ -75,6 +105,17 @@ class AdSystem {
     // Verificar visibilidade periodicamente
     setInterval(() => this.checkVisibility(), 5000);
     
+    // Enviar eventos de tracking em lote periodicamente
+    this.eventFlushInterval = setInterval(() => this.flushEvents(), ADS_CONFIG.EVENT_FLUSH_INTERVAL);
+    
+    // Garantir o envio dos eventos pendentes quando a página for escondida ou fechada
+    document.addEventListener('visibilitychange', () => {
+      if (document.visibilityState === 'hidden') {
+        this.flushEventsWithBeacon();
+      }
+    });
+    window.addEventListener('pagehide', () => this.flushEventsWithBeacon());
+    
     this.isInitialized = true;
     this.log('Sistema de anúncios inicializado');
   }
@@ -144,68 +185,114 @@ class AdSystem {
   }
   
   /**
-   * Carrega os banners da API
+   * Carrega o manifesto de rotação (banners e anúncios de tela cheia)
    */
-  loadBanners() {
-    this.log('Carregando banners...');
-    
-    fetch(`${ADS_CONFIG.API_URL}${ADS_CONFIG.BANNERS_ENDPOINT}`)
+  loadManifest() {
+    fetch(this.getApiUrl(ADS_CONFIG.MANIFEST_ENDPOINT, this.getTargetingParams()))
       .then(response => {
         if (!response.ok) {
           throw new Error(`HTTP error! Status: ${response.status}`);
         }
         return response.json();
       })
-      .then(data => {
-        this.banners = data;
-        this.log(`${this.banners.length} banners carregados`);
-        
-        if (this.banners.length > 0) {
-          this.showBanner(this.currentBannerIndex);
-          this.startBannerRotation();
+      .then(manifest => {
+        this.retryCount = 0;
+        if (manifest.version === this.manifestVersion) {
+          return;
         }
+        this.applyManifest(manifest);
       })
       .catch(error => {
-        this.error(`Erro ao carregar banners: ${error.message}`);
+        this.error(`Erro ao carregar manifesto de anúncios: ${error.message}`);
         
         // Retry
         if (this.retryCount < ADS_CONFIG.MAX_RETRIES) {
           this.retryCount++;
           this.log(`Tentando novamente em ${ADS_CONFIG.RETRY_DELAY / 1000} segundos... (${this.retryCount}/${ADS_CONFIG.MAX_RETRIES})`);
           
-          setTimeout(() => this.loadBanners(), ADS_CONFIG.RETRY_DELAY);
+          setTimeout(() => this.loadManifest(), ADS_CONFIG.RETRY_DELAY);
         }
       });
   }
   
   /**
-   * Carrega os anúncios de tela cheia da API
+   * Aplica uma nova versão do manifesto
+   * @param {Object} manifest - Manifesto {version, banner: [...], fullscreen: [...]}
    */
-  loadFullscreenAds() {
-    this.log('Carregando anúncios de tela cheia...');
-    
-    fetch(`${ADS_CONFIG.API_URL}${ADS_CONFIG.FULLSCREEN_ENDPOINT}`)
-      .then(response => {
-        if (!response.ok) {
-          throw new Error(`HTTP error! Status: ${response.status}`);
-        }
-        return response.json();
-      })
-      .then(data => {
-        this.fullscreenAds = data;
-        this.log(`${this.fullscreenAds.length} anúncios de tela cheia carregados`);
-      })
-      .catch(error => {
-        this.error(`Erro ao carregar anúncios de tela cheia: ${error.message}`);
-        
-        // Retry
-        if (this.retryCount < ADS_CONFIG.MAX_RETRIES) {
-          this.retryCount++;
-          this.log(`Tentando novamente em ${ADS_CONFIG.RETRY_DELAY / 1000} segundos... (${this.retryCount}/${ADS_CONFIG.MAX_RETRIES})`);
-          
-          setTimeout(() => this.loadFullscreenAds(), ADS_CONFIG.RETRY_DELAY);
-        }
-      });
+  applyManifest(manifest) {
+    const hadBanners = this.banners.length > 0;
+    this.manifestVersion = manifest.version;
+    this.banners = Array.isArray(manifest.banner) ? manifest.banner : [];
+    this.fullscreenAds = Array.isArray(manifest.fullscreen) ? manifest.fullscreen : [];
+    this.bannerRotationWeights = this.banners.map(() => 0);
+    this.log(`Manifesto ${manifest.version}: ${this.banners.length} banners, ${this.fullscreenAds.length} anúncios de tela cheia`);
+    
+    if (this.banners.length === 0) {
+      this.stopBannerRotation();
+      return;
+    }
+    if (!hadBanners || this.currentBannerIndex >= this.banners.length) {
+      this.showBanner(this.nextBannerIndex());
+    }
+    if (!this.bannerRotationInterval) {
+      this.startBannerRotation();
+    }
+  }
+  
+  /**
+   * Escolhe o próximo banner por round-robin ponderado suave (campo weight),
+   * intercalando os anúncios na proporção dos pesos
+   * @returns {number} Índice do próximo banner
+   */
+  nextBannerIndex() {
+    let total = 0;
+    let best = 0;
+    this.banners.forEach((banner, index) => {
+      const weight = typeof banner.weight === 'number' && banner.weight >= 0 ? banner.weight : 1;
+      total += weight;
+      this.bannerRotationWeights[index] += weight;
+      if (this.bannerRotationWeights[index] > this.bannerRotationWeights[best]) {
+        best = index;
+      }
+    });
+    if (total === 0) {
+      return (this.currentBannerIndex + 1) % this.banners.length;
+    }
+    this.bannerRotationWeights[best] -= total;
+    return best;
+  }
+  
+  /**
+   * Atributos src/srcset da imagem de um anúncio: as variantes redimensionadas
+   * pelo servidor (1x e 3x) quando existem, senão a imagem original
+   * @param {Object} ad - Anúncio com imageUrl e, opcionalmente, assets
+   * @returns {string} Atributos HTML
+   */
+  creativeAttributes(ad) {
+    const assets = ad.assets;
+    if (!assets || !assets['1x']) {
+      return `src="${ad.imageUrl}"`;
+    }
+    const srcset = Object.keys(assets)
+      .map(scale => `${ADS_CONFIG.API_URL}${assets[scale]} ${scale}`)
+      .join(', ');
+    return `src="${ADS_CONFIG.API_URL}${assets['1x']}" srcset="${srcset}"`;
+  }
+  
+  /**
+   * Volta para a imagem original se a variante não puder ser carregada
+   * (ex: removida do cache do servidor)
+   * @param {HTMLImageElement} img - Elemento da imagem
+   * @param {Object} ad - Anúncio exibido
+   */
+  attachCreativeFallback(img, ad) {
+    if (!img || !ad.assets) {
+      return;
+    }
+    img.addEventListener('error', () => {
+      img.removeAttribute('srcset');
+      img.src = ad.imageUrl;
+    }, { once: true });
   }
   
   /**
@@ -228,7 +315,7 @@ class AdSystem {
     // Criar HTML do banner
     const bannerHTML = `
       <a href="${banner.targetUrl || banner.linkUrl}" target="_blank" id="ad-banner-link">
-        <img src="${banner.imageUrl}" alt="${banner.title}" style="width:${ADS_CONFIG.BANNER_WIDTH}px;height:${ADS_CONFIG.BANNER_HEIGHT}px;">
+        <img ${this.creativeAttributes(banner)} alt="${banner.title}" style="width:${ADS_CONFIG.BANNER_WIDTH}px;height:${ADS_CONFIG.BANNER_HEIGHT}px;">
       </a>
     `;
     
@@ -244,6 +331,8 @@ class AdSystem {
       // Posicionar o banner
       this.repositionBanner();
       
+      this.attachCreativeFallback(this.bannerContainer.querySelector('img'), banner);
+      
       // Registrar impressão
       this.recordImpression(banner.id, 'banner');
       
@@ -275,13 +364,50 @@ class AdSystem {
     
     // Selecionar um anúncio aleatório
     const randomIndex = Math.floor(Math.random() * this.fullscreenAds.length);
-    const ad = this.fullscreenAds[randomIndex];
-    
+    this.renderFullscreenAd(this.fullscreenAds[randomIndex], true);
+  }
+  
+  /**
+   * Informa um game over ao servidor, que decide se um anúncio de tela cheia
+   * deve ser exibido (a cada N game overs, com limite por sessão)
+   */
+  gameOver() {
+    fetch(this.getApiUrl(ADS_CONFIG.FULLSCREEN_NEXT_ENDPOINT, this.getTargetingParams()), {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ sessionId: this.sessionId })
+    })
+      .then(response => {
+        if (!response.ok) {
+          throw new Error(`HTTP ${response.status}`);
+        }
+        return response.json();
+      })
+      .then(decision => {
+        if (!decision.show || !decision.ad) {
+          this.log(`Game over ${decision.gameOvers}: anúncio de tela cheia pulado (${decision.reason})`);
+          return;
+        }
+        this.pauseGame();
+        // A impressão já foi contada pelo servidor ao decidir a exibição
+        this.renderFullscreenAd(decision.ad, false);
+      })
+      .catch(error => {
+        this.error(`Erro ao consultar o anúncio de tela cheia: ${error.message}`);
+      });
+  }
+  
+  /**
+   * Renderiza um anúncio de tela cheia no container
+   * @param {Object} ad - Anúncio {id, title, imageUrl, targetUrl}
+   * @param {boolean} countImpression - Se a impressão deve ser enviada pelo cliente
+   */
+  renderFullscreenAd(ad, countImpression) {
     // Criar HTML do anúncio
     const adHTML = `
       <div style="position:relative;width:360px;height:640px;background-color:white;border-radius:10px;overflow:hidden;">
         <a href="${ad.targetUrl || ad.linkUrl}" target="_blank" id="ad-fullscreen-link">
-          <img src="${ad.imageUrl}" alt="${ad.title}" style="width:100%;height:100%;object-fit:cover;">
+          <img ${this.creativeAttributes(ad)} alt="${ad.title}" style="width:100%;height:100%;object-fit:cover;">
         </a>
         <button id="ad-close-button" style="position:absolute;top:10px;right:10px;width:30px;height:30px;background-color:rgba(0,0,0,0.5);color:white;border:none;border-radius:15px;font-size:16px;cursor:pointer;">X</button>
       </div>
@@ -291,9 +417,12 @@ class AdSystem {
     if (this.fullscreenContainer) {
       this.fullscreenContainer.innerHTML = adHTML;
       this.fullscreenContainer.style.display = 'flex';
+      this.attachCreativeFallback(this.fullscreenContainer.querySelector('img'), ad);
       
       // Registrar impressão
-      this.recordImpression(ad.id, 'fullscreen');
+      if (countImpression) {
+        this.recordImpression(ad.id, 'fullscreen');
+      }
       
       // Adicionar evento de clique no anúncio
       const adLink = document.getElementById('ad-fullscreen-link');
@@ -342,8 +471,7 @@ class AdSystem {
     }
     
     this.bannerRotationInterval = setInterval(() => {
-      this.currentBannerIndex = (this.currentBannerIndex + 1) % this.banners.length;
-      this.showBanner(this.currentBannerIndex);
+      this.showBanner(this.nextBannerIndex());
     }, ADS_CONFIG.BANNER_ROTATION_INTERVAL);
     
     this.log('Rotação de banners iniciada');
@@ -366,28 +494,7 @@ class AdSystem {
    * @param {string} type - Tipo do anúncio ('banner' ou 'fullscreen')
    */
   recordImpression(adId, type) {
-    fetch(`${ADS_CONFIG.API_URL}${ADS_CONFIG.IMPRESSION_ENDPOINT}`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json'
-      },
-      body: JSON.stringify({
-        adId: adId,
-        type: type
-      })
-    })
-      .then(response => {
-        if (!response.ok) {
-          throw new Error(`HTTP error! Status: ${response.status}`);
-        }
-        return response.json();
-      })
-      .then(data => {
-        this.log(`Impressão registrada: ${type} ${adId}`);
-      })
-      .catch(error => {
-        this.error(`Erro ao registrar impressão: ${error.message}`);
-      });
+    this.queueEvent('impression', adId, type);
   }
   
   /**
@@ -396,30 +503,199 @@ class AdSystem {
    * @param {string} type - Tipo do anúncio ('banner' ou 'fullscreen')
    */
   recordClick(adId, type) {
-    fetch(`${ADS_CONFIG.API_URL}${ADS_CONFIG.CLICK_ENDPOINT}`, {
+    this.queueEvent('click', adId, type);
+  }
+  
+  /**
+   * Adiciona um evento à fila de envio em lote
+   * @param {string} kind - Tipo do evento ('impression' ou 'click')
+   * @param {string} adId - ID do anúncio
+   * @param {string} type - Tipo do anúncio ('banner' ou 'fullscreen')
+   */
+  queueEvent(kind, adId, type) {
+    const queue = this.pendingEvents[kind];
+    // O eventId acompanha o evento em todas as tentativas de envio
+    queue.push({ eventId: this.generateId(), adId: adId, type: type });
+    
+    // Descartar os eventos mais antigos se a fila crescer demais (ex: servidor fora do ar)
+    if (queue.length > ADS_CONFIG.EVENT_QUEUE_MAX) {
+      queue.splice(0, queue.length - ADS_CONFIG.EVENT_QUEUE_MAX);
+    }
+    
+    // Cliques são raros e importantes: enviar logo; impressões esperam o lote
+    if (kind === 'click' || this.countPendingEvents() >= ADS_CONFIG.EVENT_BATCH_SIZE) {
+      this.flushEvents();
+    }
+  }
+  
+  /**
+   * Gera um ID aleatório para sessões e eventos
+   * @returns {string} ID de até 36 caracteres
+   */
+  generateId() {
+    if (window.crypto && typeof window.crypto.randomUUID === 'function') {
+      return window.crypto.randomUUID();
+    }
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}-${Math.random().toString(36).slice(2, 12)}`;
+  }
+  
+  /**
+   * Conta os eventos aguardando envio
+   * @returns {number} Número de eventos na fila
+   */
+  countPendingEvents() {
+    return this.pendingEvents.impression.length + this.pendingEvents.click.length;
+  }
+  
+  /**
+   * Retorna o endpoint da API para um tipo de evento
+   * @param {string} kind - Tipo do evento ('impression' ou 'click')
+   * @returns {string} URL do endpoint
+   */
+  getEventEndpoint(kind) {
+    const endpoint = kind === 'click' ? ADS_CONFIG.CLICK_ENDPOINT : ADS_CONFIG.IMPRESSION_ENDPOINT;
+    return this.getApiUrl(endpoint);
+  }
+  
+  /**
+   * Monta a URL de um endpoint da API, com o jogo configurado
+   * @param {string} endpoint - Caminho do endpoint
+   * @param {Object} params - Parâmetros de query adicionais (opcional)
+   * @returns {string} URL completa
+   */
+  getApiUrl(endpoint, params) {
+    const query = new URLSearchParams(params || {});
+    if (ADS_CONFIG.GAME_ID) {
+      query.set('game_id', ADS_CONFIG.GAME_ID);
+    }
+    const queryString = query.toString();
+    return `${ADS_CONFIG.API_URL}${endpoint}${queryString ? `?${queryString}` : ''}`;
+  }
+  
+  /**
+   * Retorna o contexto de segmentação enviado ao servidor (país, idioma,
+   * dispositivo e versão do jogo)
+   * @returns {Object} Parâmetros de query
+   */
+  getTargetingParams() {
+    const userAgent = navigator.userAgent || '';
+    let device = 'desktop';
+    if (/iPad|Tablet|Android(?!.*Mobile)/i.test(userAgent)) {
+      device = 'tablet';
+    } else if (/Mobi|iPhone|iPod|Android/i.test(userAgent)) {
+      device = 'mobile';
+    }
+    const params = { device: device };
+    if (navigator.language) {
+      params.lang = navigator.language;
+    }
+    if (ADS_CONFIG.COUNTRY) {
+      params.country = ADS_CONFIG.COUNTRY;
+    }
+    if (ADS_CONFIG.GAME_VERSION) {
+      params.version = ADS_CONFIG.GAME_VERSION;
+    }
+    return params;
+  }
+  
+  /**
+   * Envia os eventos pendentes em lote, um POST por tipo de evento
+   */
+  flushEvents() {
+    if (this.isFlushingEvents || Date.now() < this.eventBackoffUntil) {
+      return;
+    }
+    
+    const requests = [];
+    for (const kind of ['click', 'impression']) {
+      const queue = this.pendingEvents[kind];
+      if (queue.length === 0) {
+        continue;
+      }
+      const batch = queue.splice(0, ADS_CONFIG.EVENT_MAX_BATCH);
+      requests.push(this.sendEventBatch(kind, batch));
+    }
+    
+    if (requests.length === 0) {
+      return;
+    }
+    
+    this.isFlushingEvents = true;
+    Promise.all(requests).then(() => {
+      this.isFlushingEvents = false;
+    });
+  }
+  
+  /**
+   * Envia um lote de eventos e trata falhas com backoff exponencial e jitter
+   * @param {string} kind - Tipo do evento ('impression' ou 'click')
+   * @param {Array} batch - Eventos a enviar
+   * @returns {Promise} Promise resolvida quando o envio terminar
+   */
+  sendEventBatch(kind, batch) {
+    return fetch(this.getEventEndpoint(kind), {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json'
       },
-      body: JSON.stringify({
-        adId: adId,
-        type: type
-      })
+      body: JSON.stringify({ sessionId: this.sessionId, events: batch })
     })
       .then(response => {
-        if (!response.ok) {
+        // Erros 4xx (exceto 429) não melhoram com nova tentativa: o lote é descartado
+        if (!response.ok && (response.status >= 500 || response.status === 429)) {
           throw new Error(`HTTP error! Status: ${response.status}`);
         }
-        return response.json();
-      })
-      .then(data => {
-        this.log(`Clique registrado: ${type} ${adId}`);
+        if (!response.ok) {
+          this.error(`Lote de ${batch.length} eventos (${kind}) rejeitado: HTTP ${response.status}`);
+        } else {
+          this.log(`Lote de ${batch.length} eventos registrado: ${kind}`);
+        }
+        this.eventFailures = 0;
+        this.eventBackoffUntil = 0;
       })
       .catch(error => {
-        this.error(`Erro ao registrar clique: ${error.message}`);
+        // Devolver o lote ao início da fila para a próxima tentativa
+        const queue = this.pendingEvents[kind];
+        queue.unshift(...batch);
+        if (queue.length > ADS_CONFIG.EVENT_QUEUE_MAX) {
+          queue.splice(0, queue.length - ADS_CONFIG.EVENT_QUEUE_MAX);
+        }
+        
+        this.eventFailures++;
+        const maxDelay = Math.min(
+          ADS_CONFIG.EVENT_BACKOFF_MAX,
+          ADS_CONFIG.EVENT_BACKOFF_BASE * Math.pow(2, this.eventFailures - 1)
+        );
+        // Jitter para que os jogadores não reenviem todos ao mesmo tempo
+        const delay = Math.round(maxDelay / 2 + Math.random() * maxDelay / 2);
+        this.eventBackoffUntil = Date.now() + delay;
+        this.error(`Erro ao registrar eventos (${kind}): ${error.message}. Nova tentativa em ${delay / 1000} segundos`);
       });
   }
   
+  /**
+   * Envia os eventos pendentes com navigator.sendBeacon ao esconder/fechar a página
+   */
+  flushEventsWithBeacon() {
+    for (const kind of ['click', 'impression']) {
+      const queue = this.pendingEvents[kind];
+      while (queue.length > 0) {
+        const batch = queue.splice(0, ADS_CONFIG.EVENT_MAX_BATCH);
+        // text/plain evita o preflight de CORS; o servidor aceita JSON com qualquer Content-Type
+        const body = JSON.stringify({ sessionId: this.sessionId, events: batch });
+        const url = this.getEventEndpoint(kind);
+        
+        let sent = false;
+        if (navigator.sendBeacon) {
+          sent = navigator.sendBeacon(url, new Blob([body], { type: 'text/plain' }));
+        }
+        if (!sent) {
+          fetch(url, { method: 'POST', body: body, keepalive: true }).catch(() => {});
+        }
+      }
+    }
+  }
+  
   /**
    * Pausa o jogo
    */
@@ -606,6 +882,7 @@ class AdSystem {
     this.log(`- Banner container existe: ${!!this.bannerContainer}`);
     this.log(`- Fullscreen container existe: ${!!this.fullscreenContainer}`);
     this.log(`- Unity detectado: ${!!this.unityInstance}`);
+    this.log(`- Eventos pendentes: ${this.countPendingEvents()} (falhas seguidas: ${this.eventFailures})`);
     
     if (this.bannerContainer) {
       const style = window.getComputedStyle(this.bannerContainer);
@@ -651,6 +928,14 @@ window.showFullscreenAd = () => {
   return false;
 };
 
+window.gameOver = () => {
+  if (adSystem) {
+    adSystem.gameOver();
+    return true;
+  }
+  return false;
+};
+
 window.diagnoseAds = () => {
   if (adSystem) {
     adSystem.diagnose();
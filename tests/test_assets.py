@@ -0,0 +1,122 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import services.assets as assets
+from services.assets import AssetError, AssetStore, check_source_url, is_public_address, pinned_session
+
+
+@pytest.mark.parametrize('address', [
+    '10.0.0.1', '192.168.1.10', '127.0.0.1', '::1', '169.254.169.254',
+    '::ffff:127.0.0.1', '::ffff:10.0.0.1', '0.0.0.0',
+])
+def test_non_public_addresses_are_rejected(address):
+    assert not is_public_address(address)
+
+
+@pytest.mark.parametrize('address', ['8.8.8.8', '2001:4860:4860::8888', '::ffff:8.8.8.8'])
+def test_public_addresses_are_allowed(address):
+    assert is_public_address(address)
+
+
+def resolve_to(monkeypatch, *addresses):
+    calls = []
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        calls.append(host)
+        return [(socket.AF_INET6 if ':' in a else socket.AF_INET, socket.SOCK_STREAM, 6, '', (a, port))
+                for a in addresses]
+    monkeypatch.setattr(assets.socket, 'getaddrinfo', getaddrinfo)
+    return calls
+
+
+@pytest.mark.parametrize('addresses', [('10.1.2.3',), ('127.0.0.1',), ('::ffff:127.0.0.1',), ('8.8.8.8', '192.168.0.1')])
+def test_check_source_url_rejects_hosts_resolving_to_private_addresses(monkeypatch, addresses):
+    resolve_to(monkeypatch, *addresses)
+
+    with pytest.raises(AssetError):
+        check_source_url('http://images.example.com/a.png')
+
+
+def test_check_source_url_returns_the_validated_address(monkeypatch):
+    resolve_to(monkeypatch, '8.8.8.8')
+
+    assert check_source_url('https://images.example.com/a.png') == '8.8.8.8'
+
+
+@pytest.mark.parametrize('url', ['ftp://images.example.com/a.png', 'file:///etc/passwd', 'http:///a.png'])
+def test_check_source_url_rejects_bad_urls(url):
+    with pytest.raises(AssetError):
+        check_source_url(url)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hosts.append(self.headers['Host'])
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', 'http://169.254.169.254/latest/meta-data/')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = b'image'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), Handler)
+    httpd.hosts = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return AssetStore(str(tmp_path), fetch_timeout=2.0)
+
+
+def allow_loopback(monkeypatch):
+    real = is_public_address
+    monkeypatch.setattr(assets, 'is_public_address', lambda address: address == '127.0.0.1' or real(address))
+
+
+def test_fetch_connects_to_the_validated_address_and_keeps_the_host(monkeypatch, server, store):
+    allow_loopback(monkeypatch)
+    calls = resolve_to(monkeypatch, '127.0.0.1')
+    host = f'images.example.com:{server.server_port}'
+
+    assert store.fetch(f'http://{host}/a.png') == b'image'
+    # O host é resolvido uma única vez; a conexão usa o endereço validado
+    assert [host for host in calls if host != '127.0.0.1'] == ['images.example.com']
+    assert server.hosts == [host]
+
+
+def test_fetch_rejects_redirect_to_private_address(monkeypatch, server, store):
+    allow_loopback(monkeypatch)
+    resolve_to(monkeypatch, '127.0.0.1')
+
+    with pytest.raises(AssetError):
+        store.fetch(f'http://images.example.com:{server.server_port}/redirect')
+    assert len(server.hosts) == 1
+
+
+def test_pinned_connection_fails_closed_on_non_public_peer(server):
+    session = pinned_session('127.0.0.1')
+    try:
+        with pytest.raises(Exception):
+            session.get(f'http://images.example.com:{server.server_port}/a.png', timeout=2.0)
+    finally:
+        session.close()
+    assert server.hosts == []
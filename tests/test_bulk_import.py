@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+from models.storage import MemoryStorage
+from services.bulk_import import BulkImportError, detect_format, import_ads, parse_rows, validate_rows
+
+CSV = (
+    "type,title,imageUrl,targetUrl,weight\n"
+    "banner,Primeiro,https://img/1.png,https://site/1,2\n"
+    "fullscreen,Segundo,https://img/2.png,https://site/2,\n"
+)
+
+
+def errors_of(excinfo):
+    return [(error['row'], error['field']) for error in excinfo.value.errors]
+
+
+@pytest.mark.parametrize('filename, content_type, expected', [
+    ('ads.csv', None, 'csv'),
+    ('ADS.JSON', None, 'json'),
+    ('ads.txt', 'text/csv; charset=utf-8', 'csv'),
+    (None, 'application/json', 'json'),
+    ('ads.xlsx', 'application/octet-stream', None),
+    (None, None, None),
+])
+def test_detect_format(filename, content_type, expected):
+    assert detect_format(filename, content_type) == expected
+
+
+def test_parse_rows_reads_csv_with_bom_and_json_wrappers():
+    assert parse_rows(('\ufeff' + CSV).encode('utf-8'), 'csv')[0]['type'] == 'banner'
+    assert parse_rows(json.dumps({'ads': [{'title': 'a'}]}), 'json') == [{'title': 'a'}]
+    with pytest.raises(ValueError):
+        parse_rows('{"ads": 1}', 'json')
+    with pytest.raises(ValueError):
+        parse_rows('[]', 'xml')
+
+
+def test_validate_rows_reports_every_invalid_row():
+    rows = [
+        {'type': 'banner', 'title': 'Ok', 'imageUrl': 'https://i', 'targetUrl': 'https://t'},
+        {'type': 'nope', 'title': 'T', 'imageUrl': 'https://i', 'targetUrl': 'https://t'},
+        {'type': 'banner', 'title': 'T', 'imageUrl': 'ftp://i', 'targetUrl': 'https://t', 'weight': '-1'},
+        {'type': 'banner', 'imageUrl': 'https://i'},
+        {'type': 'banner', 'id': 'missing', 'title': 'T'},
+        'texto',
+    ]
+
+    with pytest.raises(BulkImportError) as excinfo:
+        validate_rows(rows, {'banner': set()})
+
+    assert errors_of(excinfo) == [
+        (2, 'type'), (3, 'imageUrl'), (3, 'weight'),
+        (4, 'title'), (4, 'targetUrl'), (5, 'id'), (6, None),
+    ]
+
+
+def test_validate_rows_splits_creates_and_updates():
+    rows = [
+        {'title': 'Novo', 'imageUrl': 'https://i', 'targetUrl': 'https://t'},
+        {'id': '7', 'weight': '3'},
+    ]
+
+    creates, updates = validate_rows(rows, {'banner': {'7'}}, default_type='banner')
+
+    assert creates == [(1, 'banner', {'title': 'Novo', 'imageUrl': 'https://i', 'targetUrl': 'https://t'})]
+    assert updates == [(2, 'banner', '7', {'weight': 3.0})]
+
+
+def test_validate_rows_rejects_repeated_ids_and_empty_updates():
+    rows = [{'id': '7', 'title': 'A'}, {'id': '7', 'title': 'B'}, {'id': '8'}]
+
+    with pytest.raises(BulkImportError) as excinfo:
+        validate_rows(rows, {'banner': {'7', '8'}}, default_type='banner')
+
+    assert errors_of(excinfo) == [(2, 'id'), (3, None)]
+
+
+def test_import_ads_writes_all_rows():
+    storage = MemoryStorage()
+
+    result = import_ads(storage, CSV, 'csv')
+
+    assert result['created'] == 2 and result['updated'] == 0 and not result['dry_run']
+    banners = storage.list_all_ads()['banner']
+    assert [ad['title'] for ad in banners.values()] == ['Primeiro']
+    assert next(iter(banners.values()))['weight'] == 2.0
+    assert len(storage.list_all_ads()['fullscreen']) == 1
+
+
+def test_import_ads_dry_run_does_not_write():
+    storage = MemoryStorage()
+
+    result = import_ads(storage, CSV, 'csv', dry_run=True)
+
+    assert result == {'created': 2, 'updated': 0, 'ids': [], 'dry_run': True}
+    assert not any(storage.list_all_ads().values())
+
+
+def test_import_ads_enforces_max_rows():
+    storage = MemoryStorage()
+
+    with pytest.raises(ValueError, match='limite'):
+        import_ads(storage, CSV, 'csv', max_rows=1)
+    assert not any(storage.list_all_ads().values())
+
+
+def test_import_ads_writes_nothing_when_a_row_is_invalid():
+    storage = MemoryStorage()
+    data = CSV + "banner,,https://img/3.png,https://site/3,\n"
+
+    with pytest.raises(BulkImportError) as excinfo:
+        import_ads(storage, data, 'csv')
+
+    assert errors_of(excinfo) == [(3, 'title')]
+    assert not any(storage.list_all_ads().values())
+
+
+def test_import_ads_rejects_empty_files():
+    with pytest.raises(ValueError):
+        import_ads(MemoryStorage(), 'type,title\n', 'csv')
@@ -0,0 +1,46 @@
+from services import counter_buffer
+from services.counter_buffer import CounterBuffer, add_event_time
+
+KEY = ('banner', 'a', 'impressions')
+BASE = 1_700_000_040  # início de um minuto
+
+
+def test_event_times_are_kept_per_second_below_the_limit():
+    times = {}
+    for offset in range(10):
+        add_event_time(times, BASE + offset, 1, max_entries=10)
+
+    assert times == {BASE + offset: 1 for offset in range(10)}
+
+
+def test_event_times_merge_into_minutes_past_the_limit():
+    times = {}
+    for offset in range(121):
+        add_event_time(times, BASE + offset, 1, max_entries=120)
+
+    assert times == {BASE: 60, BASE + 60: 60, BASE + 120: 1}
+
+
+def test_event_times_merge_into_hours_when_minutes_are_not_enough():
+    times = {}
+    for minute in range(11):
+        add_event_time(times, BASE + minute * 60, 2, max_entries=10)
+
+    assert sum(times.values()) == 22
+    assert all(ts % 3600 == 0 for ts in times)
+
+
+def test_buffer_bounds_event_times_and_keeps_totals(monkeypatch):
+    clock = [BASE]
+    monkeypatch.setattr(counter_buffer.time, 'time', lambda: clock[0])
+    written = []
+    buffer = CounterBuffer(lambda increments, event_times: written.append((increments, event_times)),
+                           max_event_times=4)
+    for second in range(BASE, BASE + 300, 7):
+        clock[0] = second
+        buffer.increment(*KEY)
+        assert len(buffer._event_times[KEY]) <= 4
+
+    assert buffer.flush()
+    increments, event_times = written[0]
+    assert increments[KEY] == sum(event_times[KEY].values()) == 43
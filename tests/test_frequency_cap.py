@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+from services.frequency_cap import (
+    SKIP_CAP, SKIP_INTERVAL, SKIP_MIN_INTERVAL, SKIP_NO_AD, FrequencyCapper
+)
+
+AD = {'id': 'ad'}
+
+
+@pytest.fixture(params=['memory', 'shared'])
+def make_capper(request, tmp_path):
+    def make(**kwargs):
+        shared_db = str(tmp_path / 'caps.db') if request.param == 'shared' else None
+        return FrequencyCapper(shared_db=shared_db, **kwargs)
+    return make
+
+
+def test_shows_every_n_game_overs(make_capper):
+    capper = make_capper(every=3, max_per_window=0, min_interval=0)
+
+    results = [capper.next_show('s', lambda: AD, now=1000 + n) for n in range(6)]
+    assert [reason for _, reason, _ in results] == [
+        SKIP_INTERVAL, SKIP_INTERVAL, None, SKIP_INTERVAL, SKIP_INTERVAL, None
+    ]
+    assert [game_overs for _, _, game_overs in results] == [1, 2, 3, 1, 2, 3]
+    assert results[2][0] is AD
+
+
+def test_sessions_are_independent(make_capper):
+    capper = make_capper(every=2, max_per_window=0, min_interval=0)
+
+    capper.next_show('a', lambda: AD, now=1000)
+    assert capper.next_show('b', lambda: AD, now=1001)[1] == SKIP_INTERVAL
+    assert capper.next_show('a', lambda: AD, now=1002)[1] is None
+
+
+def test_min_interval_between_shows(make_capper):
+    capper = make_capper(every=1, max_per_window=0, min_interval=30)
+
+    assert capper.next_show('s', lambda: AD, now=1000)[1] is None
+    assert capper.next_show('s', lambda: AD, now=1029)[1] == SKIP_MIN_INTERVAL
+    assert capper.next_show('s', lambda: AD, now=1030)[1] is None
+
+
+def test_cap_per_window(make_capper):
+    capper = make_capper(every=1, max_per_window=2, window=100, min_interval=0)
+
+    reasons = [capper.next_show('s', lambda: AD, now=1000 + n)[1] for n in range(4)]
+    assert reasons == [None, None, SKIP_CAP, SKIP_CAP]
+    # Duas janelas depois a contagem anterior já não pesa
+    assert capper.next_show('s', lambda: AD, now=1200)[1] is None
+
+
+def test_no_ad_does_not_count_as_show(make_capper):
+    capper = make_capper(every=1, max_per_window=1, min_interval=0)
+
+    assert capper.next_show('s', lambda: None, now=1000) == (None, SKIP_NO_AD, 1)
+    assert capper.next_show('s', lambda: AD, now=1001)[1] is None
+    assert capper.stats()['shown'] == 1
+    assert capper.stats()['skipped_no_ad'] == 1
+
+
+def test_expired_session_starts_over(make_capper):
+    capper = make_capper(every=2, max_per_window=0, min_interval=0, ttl=60)
+
+    capper.next_show('s', lambda: AD, now=1000)
+    assert capper.next_show('s', lambda: AD, now=1100)[2] == 1
+
+
+def test_concurrent_callers_share_the_cap(tmp_path):
+    # Cada thread tem a própria conexão SQLite, como workers diferentes
+    path = str(tmp_path / 'caps.db')
+    cappers = [FrequencyCapper(every=1, max_per_window=3, min_interval=0, shared_db=path) for _ in range(8)]
+    barrier = threading.Barrier(len(cappers))
+    shows = []
+
+    def worker(capper):
+        barrier.wait()
+        for _ in range(10):
+            ad, _, _ = capper.next_show('s', lambda: AD)
+            if ad is not None:
+                shows.append(ad)
+
+    threads = [threading.Thread(target=worker, args=(capper,)) for capper in cappers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(shows) == 3
+
+
+def test_concurrent_callers_in_memory():
+    capper = FrequencyCapper(every=1, max_per_window=5, min_interval=0)
+    barrier = threading.Barrier(8)
+    shows = []
+
+    def worker():
+        barrier.wait()
+        for _ in range(10):
+            if capper.next_show('s', lambda: AD)[0] is not None:
+                shows.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(shows) == 5
@@ -0,0 +1,108 @@
+import pytest
+
+from services import ingestion
+from services.ingestion import TokenBucketLimiter, TrackingGuard, TTLSet, client_ip
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ingestion.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_ttl_set_rejects_repeats_until_the_ttl(clock):
+    seen = TTLSet(ttl=10.0)
+
+    assert seen.add('a')
+    assert not seen.add('a')
+    clock[0] += 9.9
+    assert not seen.add('a')
+    clock[0] += 0.2
+    assert seen.add('a')
+
+
+def test_ttl_set_evicts_the_oldest_when_full(clock):
+    seen = TTLSet(ttl=10.0, max_size=2)
+    seen.add('a')
+    seen.add('b')
+    seen.add('c')
+
+    assert seen.evicted == 1
+    assert len(seen) == 2
+    assert seen.add('a')
+
+
+def test_claim_event_deduplicates_by_field_and_id(clock):
+    guard = TrackingGuard(dedup_ttl=10.0)
+
+    assert guard.claim_event('clicks', 'e1')
+    assert not guard.claim_event('clicks', 'e1')
+    assert guard.claim_event('impressions', 'e1')
+    assert guard.duplicate_events == 1
+
+    guard.release_event('clicks', 'e1')
+    assert guard.claim_event('clicks', 'e1')
+
+
+def test_events_without_id_are_not_deduplicated():
+    guard = TrackingGuard()
+
+    assert guard.claim_event('clicks', None)
+    assert guard.claim_event('clicks', None)
+    assert not guard.claim_event('clicks', '')
+    assert not guard.claim_event('clicks', 'x' * 65)
+
+
+def test_token_bucket_allows_burst_then_refills(clock):
+    limiter = TokenBucketLimiter(rate=2.0, burst=4.0)
+
+    assert [limiter.consume('ip') for _ in range(4)] == [0.0] * 4
+    assert limiter.consume('ip') == pytest.approx(0.5)
+    assert limiter.consume('other') == 0.0
+    clock[0] += 0.5
+    assert limiter.consume('ip') == 0.0
+
+
+def test_token_bucket_caps_cost_at_burst_and_can_be_disabled(clock):
+    limiter = TokenBucketLimiter(rate=1.0, burst=3.0)
+
+    assert limiter.consume('ip', cost=10) == 0.0
+    assert limiter.consume('ip') == pytest.approx(1.0)
+    assert TokenBucketLimiter(rate=0, burst=1).consume('ip', cost=100) == 0.0
+
+
+def test_token_bucket_forgets_least_recent_keys(clock):
+    limiter = TokenBucketLimiter(rate=1.0, burst=1.0, max_keys=2)
+    limiter.consume('a')
+    limiter.consume('b')
+    limiter.consume('c')
+
+    assert len(limiter) == 2
+    assert limiter.consume('a') == 0.0
+
+
+def test_guard_admit_checks_ip_and_session(clock):
+    guard = TrackingGuard(ip_rate=100.0, ip_burst=100.0, session_rate=1.0, session_burst=2.0)
+
+    assert guard.admit('1.2.3.4', 'session', cost=2) == 0.0
+    assert guard.admit('1.2.3.4', 'session') > 0
+    assert guard.admit('1.2.3.4') == 0.0
+    assert guard.rate_limited_requests == 1
+
+
+@pytest.mark.parametrize('forwarded_for, hops, expected', [
+    ('1.1.1.1', 0, '10.0.0.1'),
+    ('1.1.1.1', 1, '1.1.1.1'),
+    ('6.6.6.6, 1.1.1.1', 1, '1.1.1.1'),
+    ('6.6.6.6, 1.1.1.1, 2.2.2.2', 2, '1.1.1.1'),
+    ('1.1.1.1', 3, '1.1.1.1'),
+    (' , ', 1, '10.0.0.1'),
+    (None, 1, '10.0.0.1'),
+])
+def test_client_ip_trusts_only_the_configured_hops(forwarded_for, hops, expected):
+    assert client_ip('10.0.0.1', forwarded_for, hops) == expected
+
+
+def test_client_ip_without_address():
+    assert client_ip(None) == 'unknown'
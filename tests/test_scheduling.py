@@ -0,0 +1,109 @@
+from zoneinfo import ZoneInfo
+
+from services.scheduling import EligibilityIndex, ad_is_active, parse_schedule, parse_timestamp
+
+NOW = 1_700_000_000_000
+
+
+def ids(state):
+    return [ad['id'] for ad in state[1]]
+
+
+def test_ads_without_schedule_are_always_eligible():
+    index = EligibilityIndex([{'id': 'a'}, {'id': 'b'}], now=NOW)
+
+    assert ids(index.get(now=NOW)) == ['a', 'b']
+    assert index.next_boundary is None
+
+
+def test_ad_enters_rotation_at_start():
+    index = EligibilityIndex([{'id': 'a'}, {'id': 'b', 'startAt': NOW + 1000}], now=NOW)
+
+    epoch, _ = index.get(now=NOW)
+    assert ids(index.get(now=NOW)) == ['a']
+    assert index.next_boundary == NOW + 1000
+
+    state = index.get(now=NOW + 1000)
+    assert ids(state) == ['a', 'b']
+    assert state[0] > epoch
+    assert index.next_boundary is None
+
+
+def test_ad_leaves_rotation_at_end():
+    index = EligibilityIndex([{'id': 'a', 'endAt': NOW + 500}, {'id': 'b'}], now=NOW)
+
+    assert ids(index.get(now=NOW + 499)) == ['a', 'b']
+    assert ids(index.get(now=NOW + 500)) == ['b']
+
+
+def test_expired_and_inverted_schedules_are_skipped():
+    ads = [
+        {'id': 'ended', 'endAt': NOW - 1},
+        {'id': 'inverted', 'startAt': NOW + 10, 'endAt': NOW},
+        {'id': 'live'},
+    ]
+    index = EligibilityIndex(ads, now=NOW)
+
+    assert ids(index.get(now=NOW)) == ['live']
+
+
+def test_window_opens_and_closes_in_order():
+    index = EligibilityIndex([{'id': 'a', 'startAt': NOW + 100, 'endAt': NOW + 200}], now=NOW)
+
+    assert ids(index.get(now=NOW)) == []
+    assert ids(index.get(now=NOW + 150)) == ['a']
+    assert ids(index.get(now=NOW + 200)) == []
+
+
+def test_budget_exhaustion_removes_ad():
+    index = EligibilityIndex([{'id': 'a', 'impressionBudget': 5, 'impressions': 3}, {'id': 'b'}], now=NOW)
+
+    assert index.record_impression('a') is False
+    assert ids(index.get(now=NOW)) == ['a', 'b']
+    assert index.record_impression('a') is True
+    assert ids(index.get(now=NOW)) == ['b']
+    assert index.exhausted == 1
+    # Impressões posteriores (outras réplicas do anúncio) não mudam mais nada
+    assert index.record_impression('a') is False
+
+
+def test_budget_already_spent_at_rebuild():
+    index = EligibilityIndex([{'id': 'a', 'impressionBudget': 5, 'impressions': 5}], now=NOW)
+
+    assert ids(index.get(now=NOW)) == []
+    assert index.exhausted == 1
+
+
+def test_exhausted_ad_does_not_start_later():
+    index = EligibilityIndex([{'id': 'a', 'startAt': NOW + 100, 'impressionBudget': 1}], now=NOW)
+
+    assert index.record_impression('a') is True
+    assert ids(index.get(now=NOW + 100)) == []
+
+
+def test_ad_is_active_matches_index():
+    assert ad_is_active({}, NOW)
+    assert not ad_is_active({'startAt': NOW + 1}, NOW)
+    assert not ad_is_active({'endAt': NOW}, NOW)
+    assert not ad_is_active({'impressionBudget': 2, 'impressions': 2}, NOW)
+    assert ad_is_active({'impressionBudget': 2, 'impressions': 1}, NOW)
+
+
+def test_naive_iso_dates_use_the_given_timezone():
+    assert parse_timestamp('2024-05-01T08:00') == 1714550400000
+    assert parse_timestamp('2024-05-01T08:00', ZoneInfo('America/Sao_Paulo')) == 1714561200000
+
+
+def test_iso_dates_with_offset_ignore_the_timezone():
+    tz = ZoneInfo('America/Sao_Paulo')
+
+    assert parse_timestamp('2024-05-01T08:00Z', tz) == 1714550400000
+    assert parse_timestamp('2024-05-01T08:00+02:00', tz) == 1714543200000
+    assert parse_timestamp('1714550400000', tz) == 1714550400000
+
+
+def test_parse_schedule_passes_the_timezone():
+    schedule = parse_schedule({'startAt': '2024-05-01T08:00', 'endAt': '2024-05-01T09:00'},
+                              ZoneInfo('America/Sao_Paulo'))
+
+    assert schedule == {'startAt': 1714561200000, 'endAt': 1714564800000, 'impressionBudget': None}
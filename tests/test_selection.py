@@ -0,0 +1,85 @@
+import random
+from collections import Counter
+
+from services.selection import LeastImpressionsStrategy, WeightedRandomStrategy
+
+
+def test_weighted_alias_table_is_consistent():
+    strategy = WeightedRandomStrategy()
+    strategy.rebuild([{'id': 'a', 'weight': 1}, {'id': 'b', 'weight': 3}, {'id': 'c', 'weight': 0}])
+
+    # A probabilidade de cada anúncio é a soma, por coluna, da parte própria e das colunas que o apontam
+    n = len(strategy.ads)
+    mass = [0.0] * n
+    for column in range(n):
+        mass[column] += strategy._prob[column] / n
+        mass[strategy._alias[column]] += (1.0 - strategy._prob[column]) / n
+    assert [round(value, 6) for value in mass] == [0.25, 0.75, 0.0]
+
+
+def test_weighted_pick_follows_weights():
+    strategy = WeightedRandomStrategy(rng=random.Random(7))
+    strategy.rebuild([{'id': 'a', 'weight': 1}, {'id': 'b', 'weight': 3}, {'id': 'c', 'weight': 0}])
+
+    counts = Counter(strategy.pick()['id'] for _ in range(20000))
+    assert counts['c'] == 0
+    assert 0.72 < counts['b'] / 20000 < 0.78
+
+
+def test_weighted_without_positive_weights_is_uniform():
+    strategy = WeightedRandomStrategy(rng=random.Random(1))
+    strategy.rebuild([{'id': 'a', 'weight': 0}, {'id': 'b', 'weight': -2}])
+
+    assert strategy._prob == [1.0, 1.0]
+    assert WeightedRandomStrategy().pick() is None
+
+
+def test_weighted_invalid_weights_default_to_one():
+    strategy = WeightedRandomStrategy()
+    strategy.rebuild([
+        {'id': 'a', 'weight': 'abc'}, {'id': 'b', 'weight': None},
+        {'id': 'c', 'weight': float('nan')}, {'id': 'd', 'weight': 'inf'}, {'id': 'e'},
+    ])
+
+    assert strategy._prob == [1.0] * 5
+
+
+def test_least_impressions_picks_minimum_and_newest_on_tie():
+    strategy = LeastImpressionsStrategy()
+    strategy.rebuild([{'id': 'a', 'impressions': 3}, {'id': 'b', 'impressions': 1}, {'id': 'c', 'impressions': 1}])
+
+    assert strategy.pick()['id'] == 'b'
+    # Sem impressão registrada a escolha não muda
+    assert strategy.pick()['id'] == 'b'
+
+
+def test_least_impressions_rotates_with_recorded_impressions():
+    strategy = LeastImpressionsStrategy()
+    strategy.rebuild([{'id': 'a', 'impressions': 3}, {'id': 'b', 'impressions': 1}, {'id': 'c', 'impressions': 1}])
+
+    picks = []
+    for _ in range(7):
+        ad = strategy.pick()
+        picks.append(ad['id'])
+        strategy.record_impression(ad['id'])
+    assert picks == ['b', 'c', 'b', 'c', 'a', 'b', 'c']
+
+
+def test_least_impressions_skips_stale_entries_and_bounds_heap():
+    strategy = LeastImpressionsStrategy()
+    strategy.rebuild([{'id': 'a'}, {'id': 'b'}])
+
+    for _ in range(1000):
+        strategy.record_impression('a')
+    assert len(strategy._heap) < 2 * 2 + 64
+    assert strategy.pick()['id'] == 'b'
+    strategy.record_impression('b', 1000)
+    strategy.record_impression('missing')
+    assert strategy.pick()['id'] == 'a'
+
+
+def test_least_impressions_empty_inventory():
+    strategy = LeastImpressionsStrategy()
+    strategy.rebuild([])
+
+    assert strategy.pick() is None
@@ -0,0 +1,78 @@
+import pytest
+
+from services.targeting import TargetingIndex, build_context, parse_targeting
+
+ADS = [
+    {'id': 'br', 'targetCountries': 'BR'},
+    {'id': 'pt-mobile', 'targetLanguages': 'pt', 'targetDevices': 'mobile'},
+    {'id': 'v1.2', 'targetGameVersions': '1.2'},
+    {'id': 'any'},
+]
+
+
+def select_ids(index, context, eligible=ADS, epoch=0):
+    _, ads = index.select(epoch, eligible, context)
+    return [ad['id'] for ad in ads]
+
+
+def test_without_rules_index_is_disabled():
+    index = TargetingIndex([{'id': 'a'}, {'id': 'b'}])
+
+    assert not index.enabled
+    assert index.select(0, index.ads, build_context(country='US')) == (None, index.ads)
+
+
+def test_country_rule():
+    index = TargetingIndex(ADS)
+
+    assert select_ids(index, build_context(country='br')) == ['br', 'any']
+    assert select_ids(index, build_context(country='US')) == ['any']
+
+
+def test_unknown_context_only_matches_unrestricted_ads():
+    index = TargetingIndex(ADS)
+
+    assert select_ids(index, build_context()) == ['any']
+
+
+def test_rules_in_several_dimensions_must_all_match():
+    index = TargetingIndex(ADS)
+
+    assert select_ids(index, build_context(language='pt-BR', device='mobile')) == ['pt-mobile', 'any']
+    assert select_ids(index, build_context(language='pt', device='desktop')) == ['any']
+
+
+def test_game_version_matches_by_prefix():
+    index = TargetingIndex(ADS)
+
+    assert select_ids(index, build_context(game_version='1.2.7')) == ['v1.2', 'any']
+    assert select_ids(index, build_context(game_version='1.20')) == ['any']
+
+
+def test_selection_is_limited_to_eligible_ads():
+    index = TargetingIndex(ADS)
+    eligible = [ADS[1], ADS[3]]
+
+    assert select_ids(index, build_context(country='BR'), eligible=eligible, epoch=1) == ['any']
+
+
+def test_context_matching_all_eligible_returns_same_list():
+    index = TargetingIndex(ADS)
+    context = build_context(country='BR', language='pt', device='mobile', game_version='1.2')
+
+    segment, ads = index.select(0, ADS, context)
+    assert segment is None
+    assert ads is ADS
+
+
+def test_invalid_rule_in_datastore_is_never_served():
+    index = TargetingIndex([{'id': 'bad', 'targetCountries': 'Brasil'}, {'id': 'ok'}])
+
+    assert index.invalid == 1
+    assert select_ids(index, build_context(), eligible=index.ads) == ['ok']
+
+
+def test_parse_targeting_normalizes_and_rejects():
+    assert parse_targeting({'targetCountries': 'br, pt', 'targetLanguages': 'PT-br'})['targetCountries'] == 'BR,PT'
+    with pytest.raises(ValueError):
+        parse_targeting({'targetDevices': 'watch'})